@@ -3,6 +3,8 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from pathlib import Path
 
+from middleware.metrics import mongo_command_metrics
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -30,7 +32,7 @@ def get_motor_client():
     """Retorna o cliente Motor (criado on-demand)."""
     global _client
     if _client is None:
-        _client = AsyncIOMotorClient(mongo_url)
+        _client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_command_metrics])
     return _client
 
 
@@ -0,0 +1,221 @@
+"""
+====================================================================
+WATCHDOG DO EVENT LOOP - CREDITOIMO
+====================================================================
+Detecta código síncrono que bloqueia o event loop (I/O bloqueante,
+CPU em pandas/PyMuPDF/PIL, boto3 fora do executor, ...).
+
+- Uma coroutine de heartbeat acorda a cada LOOP_WATCHDOG_INTERVAL s e
+  mede o atraso do loop (métricas `app_event_loop_lag_*`).
+- Uma thread sidecar verifica o heartbeat; se o loop não responde há
+  mais de LOOP_WATCHDOG_THRESHOLD_MS, captura a stack da thread do
+  loop (`sys._current_frames`) enquanto o bloqueio ainda decorre.
+- Quando o loop volta a responder, o tempo bloqueado é atribuído ao
+  local do código da aplicação mais profundo da stack capturada e
+  agregado (contagem, tempo total e máximo, última stack).
+
+Os agregados são por processo e ficam em memória; ver
+`GET /api/admin/loop-watchdog`.
+====================================================================
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from middleware.metrics import LOOP_LAG, LOOP_LAG_LAST
+
+logger = logging.getLogger(__name__)
+
+LOOP_WATCHDOG_ENABLED = os.environ.get("LOOP_WATCHDOG_ENABLED", "true").lower() == "true"
+LOOP_WATCHDOG_INTERVAL = float(os.environ.get("LOOP_WATCHDOG_INTERVAL", "0.1"))
+LOOP_WATCHDOG_THRESHOLD_MS = float(os.environ.get("LOOP_WATCHDOG_THRESHOLD_MS", "250"))
+LOOP_WATCHDOG_LOG_MS = float(os.environ.get("LOOP_WATCHDOG_LOG_MS", "1000"))
+MAX_LOCATIONS = 500
+MAX_STACK_FRAMES = 20
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _is_app_frame(filename: str, root: str) -> bool:
+    return filename.startswith(root) and "site-packages" not in filename
+
+
+def offender_location(frames: List[traceback.FrameSummary], root: str = APP_ROOT) -> Tuple[str, str]:
+    """
+    Local responsável por um bloqueio: (frame mais profundo do código da
+    aplicação, frame mais profundo da stack, ex.: a chamada bloqueante).
+    """
+    if not frames:
+        return "<desconhecido>", "<desconhecido>"
+
+    def describe(frame: traceback.FrameSummary) -> str:
+        filename = frame.filename
+        if filename.startswith(root):
+            filename = os.path.relpath(filename, root)
+        return f"{filename}:{frame.lineno} in {frame.name}"
+
+    innermost = describe(frames[-1])
+    for frame in reversed(frames):
+        if _is_app_frame(frame.filename, root):
+            return describe(frame), innermost
+    return innermost, innermost
+
+
+class StallAggregator:
+    """Bloqueios agregados por local do código."""
+
+    def __init__(self, max_locations: int = MAX_LOCATIONS):
+        self.max_locations = max_locations
+        self._lock = threading.Lock()
+        self._offenders: Dict[str, dict] = {}
+        self.total_stalls = 0
+        self.total_blocked = 0.0
+
+    def record(self, location: str, blocking_call: str, blocked: float, stack: List[str], when: str):
+        with self._lock:
+            self.total_stalls += 1
+            self.total_blocked += blocked
+            offender = self._offenders.get(location)
+            if offender is None:
+                if len(self._offenders) >= self.max_locations:
+                    location = "<outros>"
+                    offender = self._offenders.get(location)
+                if offender is None:
+                    offender = self._offenders[location] = {
+                        "location": location,
+                        "count": 0,
+                        "total_blocked_ms": 0.0,
+                        "max_blocked_ms": 0.0,
+                        "first_seen": when,
+                    }
+            blocked_ms = blocked * 1000
+            offender["count"] += 1
+            offender["total_blocked_ms"] += blocked_ms
+            offender["max_blocked_ms"] = max(offender["max_blocked_ms"], blocked_ms)
+            offender["last_seen"] = when
+            offender["blocking_call"] = blocking_call
+            offender["stack"] = stack
+
+    def snapshot(self) -> List[dict]:
+        """Locais ordenados por tempo total bloqueado."""
+        with self._lock:
+            offenders = [dict(o) for o in self._offenders.values()]
+        for offender in offenders:
+            offender["total_blocked_ms"] = round(offender["total_blocked_ms"], 1)
+            offender["max_blocked_ms"] = round(offender["max_blocked_ms"], 1)
+            offender["avg_blocked_ms"] = round(offender["total_blocked_ms"] / offender["count"], 1)
+        return sorted(offenders, key=lambda o: o["total_blocked_ms"], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._offenders.clear()
+            self.total_stalls = 0
+            self.total_blocked = 0.0
+
+
+class LoopWatchdog:
+    """Heartbeat no event loop + thread sidecar que captura a stack dos bloqueios."""
+
+    def __init__(self, interval: float = LOOP_WATCHDOG_INTERVAL,
+                 threshold_ms: float = LOOP_WATCHDOG_THRESHOLD_MS):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.stalls = StallAggregator()
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._pending: Optional[dict] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Arrancar no event loop actual (idempotente)."""
+        if not LOOP_WATCHDOG_ENABLED or self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Watchdog do event loop activo (limiar {self.threshold * 1000:.0f} ms)")
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - scheduled - self.interval)
+            self._beat = time.monotonic()
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+
+    def _watch(self):
+        """Thread sidecar: detectar bloqueios e fechá-los quando o loop responde."""
+        check_every = min(self.interval, self.threshold) / 2
+        while not self._stop.wait(check_every):
+            beat = self._beat
+            pending = self._pending
+            if pending is not None and beat != pending["beat"]:
+                self._pending = None
+                self._close_stall(pending, beat)
+            elif pending is None and time.monotonic() - beat > self.interval + self.threshold:
+                self._pending = self._capture(beat)
+
+    def _capture(self, beat: float) -> Optional[dict]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        frames = traceback.extract_stack(frame)
+        location, blocking_call = offender_location(frames)
+        return {
+            "beat": beat,
+            "location": location,
+            "blocking_call": blocking_call,
+            "stack": [line.rstrip() for line in traceback.format_list(frames[-MAX_STACK_FRAMES:])],
+            "when": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def _close_stall(self, pending: dict, beat: float):
+        blocked = max(0.0, beat - pending["beat"] - self.interval)
+        self.stalls.record(
+            pending["location"], pending["blocking_call"], blocked, pending["stack"], pending["when"]
+        )
+        if blocked * 1000 >= LOOP_WATCHDOG_LOG_MS:
+            logger.warning(
+                f"Event loop bloqueado {blocked * 1000:.0f} ms em {pending['location']} "
+                f"({pending['blocking_call']})"
+            )
+
+    def report(self) -> dict:
+        """Estado e locais que bloquearam o loop (endpoint de admin)."""
+        return {
+            "enabled": LOOP_WATCHDOG_ENABLED,
+            "running": self.running,
+            "pid": os.getpid(),
+            "threshold_ms": self.threshold * 1000,
+            "interval_ms": self.interval * 1000,
+            "current_lag_ms": round(max(0.0, time.monotonic() - self._beat - self.interval) * 1000, 1),
+            "total_stalls": self.stalls.total_stalls,
+            "total_blocked_ms": round(self.stalls.total_blocked * 1000, 1),
+            "offenders": self.stalls.snapshot(),
+        }
+
+
+loop_watchdog = LoopWatchdog()
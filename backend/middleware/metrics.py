@@ -0,0 +1,410 @@
+"""
+====================================================================
+MÉTRICAS DE INSTRUMENTAÇÃO - CREDITOIMO
+====================================================================
+Métricas internas expostas em formato Prometheus em `/metrics`,
+sem dependência de APM externo.
+
+- HTTP: latência por rota (template, não o path concreto), contagem
+  por estado e pedidos em curso por router.
+- MongoDB: duração de cada comando (`CommandListener` registado no
+  cliente Motor em database.py).
+- Event loop: atraso do loop (medido pelo heartbeat de
+  middleware/loop_watchdog.py).
+- Executores: profundidade da fila e threads dos ThreadPoolExecutor
+  registados (`register_executor`) e do executor por omissão do loop.
+- Chamadas externas (LLM, scraper): `track_call(kind, name)`.
+
+Com METRICS_SERVER_TIMING=true cada resposta inclui o header
+`Server-Timing` (app, mongo e chamadas externas do pedido).
+`/metrics` exige METRICS_TOKEN (`Authorization: Bearer`); sem token
+configurado o endpoint não é exposto (404).
+
+Este módulo só depende da biblioteca standard e de pymongo, para poder
+ser importado por database.py sem ciclos.
+====================================================================
+"""
+import os
+import hmac
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+METRICS_SERVER_TIMING = os.environ.get("METRICS_SERVER_TIMING", "false").lower() == "true"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+EXTERNAL_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+# ====================================================================
+# PRIMITIVAS
+# ====================================================================
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base das métricas; os valores são protegidos por lock (o listener Mongo corre em threads)."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"
+            for values, value in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *label_values: str):
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"
+            for values, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # valores: [contagem por bucket (não cumulativa)..., soma, total]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((values, list(series)) for values, series in self._values.items())
+        lines = self.header()
+        for values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Conjunto de métricas e callbacks que actualizam gauges no momento da recolha."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.debug(f"Erro num colector de métricas: {e}")
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.register(Counter(
+    "app_http_requests_total", "Pedidos HTTP por rota e estado.", ("method", "route", "status")))
+HTTP_LATENCY = registry.register(Histogram(
+    "app_http_request_duration_seconds", "Latência dos pedidos HTTP por rota.", ("method", "route")))
+HTTP_IN_FLIGHT = registry.register(Gauge(
+    "app_http_requests_in_flight", "Pedidos HTTP em curso por router.", ("router",)))
+MONGO_LATENCY = registry.register(Histogram(
+    "app_mongodb_command_duration_seconds", "Duração dos comandos MongoDB.",
+    ("command", "collection"), buckets=DB_BUCKETS))
+MONGO_FAILURES = registry.register(Counter(
+    "app_mongodb_command_failures_total", "Comandos MongoDB falhados.", ("command", "collection")))
+LOOP_LAG = registry.register(Histogram(
+    "app_event_loop_lag_seconds", "Atraso do event loop face ao agendado.", buckets=LAG_BUCKETS))
+LOOP_LAG_LAST = registry.register(Gauge(
+    "app_event_loop_lag_last_seconds", "Último atraso medido do event loop."))
+EXECUTOR_QUEUE = registry.register(Gauge(
+    "app_executor_queue_depth", "Tarefas em espera em cada ThreadPoolExecutor.", ("executor",)))
+EXECUTOR_THREADS = registry.register(Gauge(
+    "app_executor_threads", "Threads activas em cada ThreadPoolExecutor.", ("executor",)))
+EXTERNAL_CALLS = registry.register(Histogram(
+    "app_external_call_duration_seconds", "Duração de chamadas externas (LLM, scraper).",
+    ("kind", "name", "outcome"), buckets=EXTERNAL_BUCKETS))
+
+
+# ====================================================================
+# TEMPOS POR PEDIDO (Server-Timing)
+# ====================================================================
+_request_timing: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_timing", default=None)
+
+
+def _add_request_timing(key: str, seconds: float):
+    """Acumular tempo no pedido actual (o dict é partilhado com as threads do Motor)."""
+    timing = _request_timing.get()
+    if timing is not None:
+        entry = timing.setdefault(key, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+
+def server_timing_header(total_seconds: float, timing: Dict[str, List[float]]) -> str:
+    """Valor do header Server-Timing (durações em ms)."""
+    parts = [f"app;dur={total_seconds * 1000:.1f}"]
+    for key, (seconds, count) in sorted(timing.items()):
+        parts.append(f'{key};dur={seconds * 1000:.1f};desc="{key} x{count}"')
+    return ", ".join(parts)
+
+
+# ====================================================================
+# HTTP
+# ====================================================================
+_router_prefixes: Optional[frozenset] = None
+
+
+def router_prefix(path: str) -> str:
+    """Prefixo de router de um path ("/api/processes/123" -> "/api/processes")."""
+    segments = [s for s in path.split("/") if s]
+    if segments and segments[0] == "api":
+        segments = segments[:2]
+    else:
+        segments = segments[:1]
+    return "/" + "/".join(segments)
+
+
+def _router_label(app, path: str) -> str:
+    """Router do pedido, limitado aos prefixos das rotas registadas (cardinalidade fixa)."""
+    global _router_prefixes
+    if _router_prefixes is None:
+        _router_prefixes = frozenset(
+            router_prefix(route.path) for route in app.routes if getattr(route, "path", None)
+        )
+    prefix = router_prefix(path)
+    return prefix if prefix in _router_prefixes else "other"
+
+
+async def metrics_middleware(request, call_next):
+    """Latência por rota, pedidos em curso e (opcional) Server-Timing."""
+    router = _router_label(request.app, request.url.path)
+    timing: Dict[str, List[float]] = {}
+    token = _request_timing.set(timing)
+    HTTP_IN_FLIGHT.inc(router)
+    start = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+    finally:
+        elapsed = time.perf_counter() - start
+        HTTP_IN_FLIGHT.dec(router)
+        _request_timing.reset(token)
+        # Template da rota ("/api/processes/{process_id}"), nunca o path concreto
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", None) or "<unmatched>"
+        HTTP_REQUESTS.inc(request.method, route_path, status)
+        HTTP_LATENCY.observe(elapsed, request.method, route_path)
+
+    if METRICS_SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing_header(elapsed, timing)
+    return response
+
+
+def metrics_enabled() -> bool:
+    """`/metrics` só é exposto com METRICS_TOKEN configurado."""
+    return bool(METRICS_TOKEN)
+
+
+def metrics_authorized(authorization: Optional[str], token: Optional[str] = None) -> bool:
+    """Verificar o token de `/metrics` (sem token configurado, nunca autorizado)."""
+    token = METRICS_TOKEN if token is None else token
+    if not token or not authorization:
+        return False
+    return hmac.compare_digest(authorization, f"Bearer {token}")
+
+
+def render_metrics() -> str:
+    """Texto no formato de exposição Prometheus."""
+    return registry.render()
+
+
+# ====================================================================
+# MONGODB
+# ====================================================================
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Duração de cada comando MongoDB por comando e colecção."""
+
+    MAX_PENDING = 10000
+
+    def __init__(self):
+        self._pending: Dict[Tuple[int, int], str] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        with self._lock:
+            if len(self._pending) < self.MAX_PENDING:
+                self._pending[(event.request_id, event.operation_id or 0)] = collection
+
+    def _finish(self, event) -> str:
+        with self._lock:
+            return self._pending.pop((event.request_id, event.operation_id or 0), "")
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1_000_000
+        MONGO_LATENCY.observe(seconds, event.command_name, self._finish(event))
+        _add_request_timing("mongo", seconds)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1_000_000
+        collection = self._finish(event)
+        MONGO_LATENCY.observe(seconds, event.command_name, collection)
+        MONGO_FAILURES.inc(event.command_name, collection)
+        _add_request_timing("mongo", seconds)
+
+
+mongo_command_metrics = MongoCommandMetrics()
+
+
+# ====================================================================
+# EXECUTORES
+# ====================================================================
+_executors: Dict[str, object] = {}
+
+
+def register_executor(name: str, executor) -> None:
+    """Expor a fila e as threads de um ThreadPoolExecutor."""
+    _executors[name] = executor
+
+
+def _collect_executors():
+    executors = dict(_executors)
+    try:
+        default = getattr(asyncio.get_running_loop(), "_default_executor", None)
+        if default is not None:
+            executors.setdefault("default", default)
+    except RuntimeError:
+        pass
+    for name, executor in executors.items():
+        queue = getattr(executor, "_work_queue", None)
+        EXECUTOR_QUEUE.set(queue.qsize() if queue is not None else 0, name)
+        EXECUTOR_THREADS.set(len(getattr(executor, "_threads", ())), name)
+
+
+registry.add_collector(_collect_executors)
+
+
+# ====================================================================
+# CHAMADAS EXTERNAS
+# ====================================================================
+class _CallOutcome:
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "ok"
+
+
+@contextmanager
+def track_call(kind: str, name: str) -> Iterator[_CallOutcome]:
+    """
+    Medir uma chamada externa (ex.: `kind="llm"`, `name="document_categorization"`).
+    Excepções contam como "error"; o chamador pode definir `call.outcome`.
+    """
+    call = _CallOutcome()
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        EXTERNAL_CALLS.observe(elapsed, kind, name, call.outcome)
+        _add_request_timing(kind, elapsed)
@@ -140,6 +140,12 @@ class DocumentSearchRequest(BaseModel):
     limit: int = Field(default=20, ge=1, le=100)
 
 
+class PresignBatchRequest(BaseModel):
+    """Request para links de download de vários ficheiros."""
+    paths: List[str] = Field(..., min_length=1, max_length=200)
+    expiration: int = Field(default=3600, ge=60, le=86400)  # Segundos
+
+
 class DocumentSearchResult(BaseModel):
     """Resultado de pesquisa de documento."""
     id: str
@@ -150,4 +156,6 @@ class DocumentSearchResult(BaseModel):
     ai_category: Optional[str] = None
     ai_summary: Optional[str] = None
     relevance_score: float = 0.0
+    bm25_score: float = 0.0
     matched_text: Optional[str] = None  # Trecho do texto que corresponde à pesquisa
+    highlights: List[List[int]] = []  # Intervalos [início, fim] a realçar em matched_text
@@ -2,11 +2,14 @@ import uuid
 from datetime import datetime, timezone, timedelta
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
+from pymongo import UpdateOne
 
 from database import db
 from models.auth import UserRole, UserCreate, UserUpdate, UserResponse
 from models.workflow import WorkflowStatusCreate, WorkflowStatusUpdate, WorkflowStatusResponse
 from services.auth import hash_password, require_roles
+from services.enrichment import user_name_cache
+from services.sequences import sequences, PROCESS_NUMBER
 
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
@@ -199,6 +202,7 @@ async def update_user(user_id: str, data: UserUpdate, user: dict = Depends(requi
     
     if update_data:
         await db.users.update_one({"id": user_id}, {"$set": update_data})
+        user_name_cache.invalidate(user_id)
     
     updated = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
     return UserResponse(**updated)
@@ -332,32 +336,67 @@ async def migrate_process_numbers(user: dict = Depends(require_roles([UserRole.A
     if not processes_without_number:
         return {"message": "Todos os processos já têm número atribuído", "updated": 0}
     
-    # Obter o maior número existente
-    max_result = await db.processes.find_one(
-        {"process_number": {"$exists": True, "$ne": None}},
-        {"process_number": 1},
-        sort=[("process_number", -1)]
-    )
-    
-    next_number = (max_result["process_number"] + 1) if max_result and max_result.get("process_number") else 1
+    # Reservar um bloco contíguo de números numa única operação atómica
+    numbers = await sequences.reserve(PROCESS_NUMBER, len(processes_without_number))
     
-    updated_count = 0
-    for process in processes_without_number:
-        await db.processes.update_one(
-            {"id": process["id"]},
-            {"$set": {"process_number": next_number}}
-        )
-        next_number += 1
-        updated_count += 1
+    await db.processes.bulk_write([
+        UpdateOne({"id": process["id"]}, {"$set": {"process_number": number}})
+        for process, number in zip(processes_without_number, numbers)
+    ], ordered=False)
+    updated_count = len(numbers)
     
     return {
         "message": f"Números atribuídos a {updated_count} processos",
         "updated": updated_count,
-        "first_number": next_number - updated_count,
-        "last_number": next_number - 1
+        "first_number": numbers[0],
+        "last_number": numbers[-1]
     }
 
 
+# ============== SCHEDULER STATUS ==============
+
+@router.get("/scheduler/jobs")
+async def get_scheduler_jobs(user: dict = Depends(require_roles([UserRole.ADMIN]))):
+    """
+    Estado dos jobs agendados do worker (última/próxima execução,
+    duração, resultado) e as últimas execuções registadas.
+    """
+    from services.cron_scheduler import cron_scheduler
+    return await cron_scheduler.get_status()
+
+
+@router.get("/queue/stats")
+async def get_task_queue_stats(user: dict = Depends(require_roles([UserRole.ADMIN]))):
+    """Profundidade, tarefas em execução, dead-letter e latência por tipo de tarefa."""
+    from services.task_queue import task_queue
+    return await task_queue.get_queue_stats()
+
+
+# ============== EVENT LOOP WATCHDOG ==============
+
+@router.get("/loop-watchdog")
+async def get_loop_watchdog(
+    limit: int = Query(50, ge=1, le=500),
+    user: dict = Depends(require_roles([UserRole.ADMIN]))
+):
+    """
+    Locais do código que bloquearam o event loop deste processo
+    (contagem, tempo bloqueado total/máximo e última stack capturada).
+    """
+    from middleware.loop_watchdog import loop_watchdog
+    report = loop_watchdog.report()
+    report["offenders"] = report["offenders"][:limit]
+    return report
+
+
+@router.delete("/loop-watchdog")
+async def reset_loop_watchdog(user: dict = Depends(require_roles([UserRole.ADMIN]))):
+    """Limpar os agregados do watchdog (ex.: depois de corrigir um bloqueio)."""
+    from middleware.loop_watchdog import loop_watchdog
+    loop_watchdog.stalls.reset()
+    return {"success": True}
+
+
 
 
 # ============== AI CONFIGURATION ROUTES (Admin Only) ==============
@@ -880,6 +919,12 @@ async def get_ai_weekly_report(
     doc_variation = ((total_this_week - total_prev_week) / total_prev_week * 100) if total_prev_week > 0 else 0
     success_variation = success_rate_this_week - success_rate_prev_week
     
+    # Chamadas à IA, custos e tempos de resposta (rollups pré-calculados)
+    from services.ai_usage_tracker import ai_usage_tracker
+    usage_this_week = await ai_usage_tracker.get_usage_between(week_start, now)
+    usage_prev_week = await ai_usage_tracker.get_usage_between(prev_week_start, week_start)
+    usage_prev_week.pop("by_task")
+    
     return {
         "report_date": now.isoformat(),
         "period": {
@@ -915,6 +960,10 @@ async def get_ai_weekly_report(
             }
             for field, count in top_fields
         ],
+        "ai_usage": {
+            **usage_this_week,
+            "prev_week": usage_prev_week
+        },
         "insights": _generate_ai_insights(total_this_week, success_rate_this_week, doc_variation, success_variation)
     }
 
@@ -2141,9 +2141,6 @@ async def log_import_error(
     
     # Também registar nos logs do sistema para visualização unificada
     try:
-        error_id = str(uuid.uuid4())
-        timestamp = datetime.now(timezone.utc).isoformat()
-        
         error_details = {
             "client_name": client_name,
             "process_id": process_id,
@@ -2162,22 +2159,14 @@ async def log_import_error(
                 "extracted_names": list(extracted_names)[:5] if extracted_names else []
             }
         
-        system_log = {
-            "id": error_id,
-            "timestamp": timestamp,
-            "severity": "warning",
-            "component": "import",
-            "error_type": "import_error",
-            "message": f"Erro de importação: {error}",
-            "details": error_details,
-            "resolved": False,
-            "context": {
-                "filename": filename,
-                "client": client_name,
-                "user": user_email
-            }
-        }
-        await db.system_error_logs.insert_one(system_log)
+        from services.system_error_logger import system_error_logger
+        await system_error_logger.log_error(
+            error_type="import_error",
+            message=f"Erro de importação: {error}",
+            component="import",
+            details=error_details,
+            severity="warning"
+        )
         
     except Exception as e:
         logger.error(f"Falha ao registar erro no system_error_logs: {e}")
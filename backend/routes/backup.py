@@ -13,6 +13,7 @@ Endpoints:
 - POST /api/backup/verify         - Verificar integridade
 ====================================================================
 """
+import uuid
 import logging
 from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
@@ -35,6 +36,7 @@ class BackupRequest(BaseModel):
     """Request para backup manual."""
     upload_to_cloud: bool = True
     cleanup_after: bool = True
+    incremental: bool = False  # Apenas alterações desde o último backup
 
 
 # ====================================================================
@@ -79,10 +81,13 @@ async def trigger_backup(
     logger.info(f"[BACKUP] Backup manual triggered por {current_user.get('email')}")
     
     # Registar início
+    history_id = str(uuid.uuid4())
     await db.backup_history.insert_one({
+        "id": history_id,
         "triggered_by": current_user.get("id"),
         "triggered_by_email": current_user.get("email"),
         "trigger_type": "manual",
+        "backup_type": "incremental" if request.incremental else "full",
         "started_at": datetime.now(timezone.utc),
         "status": "running"
     })
@@ -92,15 +97,14 @@ async def trigger_backup(
         try:
             result = await full_backup_workflow(
                 upload_to_cloud=request.upload_to_cloud,
-                cleanup_after=request.cleanup_after
+                cleanup_after=request.cleanup_after,
+                incremental=request.incremental,
+                history_id=history_id
             )
             
             # Actualizar registo
             await db.backup_history.update_one(
-                {
-                    "triggered_by": current_user.get("id"),
-                    "status": "running"
-                },
+                {"id": history_id},
                 {"$set": {
                     "status": "completed" if result["success"] else "failed",
                     "result": result,
@@ -109,10 +113,7 @@ async def trigger_backup(
             )
         except Exception as e:
             await db.backup_history.update_one(
-                {
-                    "triggered_by": current_user.get("id"),
-                    "status": "running"
-                },
+                {"id": history_id},
                 {"$set": {
                     "status": "failed",
                     "error": str(e),
@@ -125,6 +126,7 @@ async def trigger_backup(
     return {
         "success": True,
         "message": "Backup iniciado em background",
+        "history_id": history_id,
         "check_status_at": "/api/backup/statistics"
     }
 
@@ -140,7 +142,7 @@ async def get_history(
     history = await db.backup_history.find(
         {},
         {"_id": 0}
-    ).sort("created_at", -1).limit(limit).to_list(limit)
+    ).sort("started_at", -1).limit(limit).to_list(limit)
     
     return {
         "success": True,
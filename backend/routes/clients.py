@@ -6,6 +6,8 @@ Um cliente pode ter múltiplos processos de compra/financiamento.
 """
 
 import uuid
+import json
+import base64
 import logging
 from typing import List, Optional
 from datetime import datetime, timezone
@@ -18,12 +20,127 @@ from models.client import (
     find_or_create_client_key
 )
 from services.auth import get_current_user, require_roles
+from services.search_index import match_process_ids, index_document, remove_process_entries, ENTITY_PROCESS
+from services.process_service import (
+    CLIENT_KEY_EXPR, INACTIVE_PROCESS_STATUSES, sync_client_key, get_next_process_number
+)
 from models.auth import UserRole
 
 router = APIRouter(prefix="/clients", tags=["Clients"])
 logger = logging.getLogger(__name__)
 
 
+def _encode_cursor(sort_name: str, key: str) -> str:
+    """Cursor opaco para paginação keyset (nome normalizado + chave do cliente)."""
+    raw = json.dumps([sort_name, key]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        sort_name, key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(sort_name), str(key)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido")
+
+
+async def _aggregate_clients(
+    process_query: dict,
+    has_active_process: Optional[bool],
+    limit: int,
+    skip: int,
+    after: Optional[str],
+    virtual_id_prefix: str
+) -> dict:
+    """
+    Agrupar processos em clientes no servidor ($group por `client_key`,
+    mantido em todos os caminhos que escrevem client_name/client_id).
+
+    O total é calculado sobre todos os clientes (não apenas a página) e
+    o filtro `has_active_process` é aplicado antes da paginação.
+    """
+    group_stage = {
+        "$group": {
+            "_id": {"$ifNull": ["$client_key", CLIENT_KEY_EXPR]},
+            "client_id": {"$first": "$client_id"},
+            "first_process_id": {"$first": "$id"},
+            "nome": {"$first": "$client_name"},
+            "email": {"$first": "$client_email"},
+            "telefone": {"$first": "$client_phone"},
+            "dados_pessoais": {"$first": "$personal_data"},
+            "process_ids": {"$push": "$id"},
+            "active_processes_count": {
+                "$sum": {"$cond": [{"$in": ["$status", INACTIVE_PROCESS_STATUSES]}, 0, 1]}
+            }
+        }
+    }
+
+    pipeline = [
+        {"$match": process_query},
+        # Sort servido por idx_client_key (sem sort em memória dos processos);
+        # dentro de cada cliente, o processo mais antigo define nome/contactos
+        {"$sort": {"client_key": 1, "created_at": 1}},
+        group_stage,
+        {"$match": {"_id": {"$ne": ""}}},
+    ]
+
+    if has_active_process is not None:
+        pipeline.append({"$match": {
+            "active_processes_count": {"$gt": 0} if has_active_process else 0
+        }})
+
+    pipeline += [
+        {"$addFields": {"sort_name": {"$toLower": {"$ifNull": ["$nome", ""]}}}},
+        {"$sort": {"sort_name": 1, "_id": 1}},
+    ]
+
+    page_stages = []
+    if after:
+        sort_name, key = _decode_cursor(after)
+        page_stages.append({"$match": {"$or": [
+            {"sort_name": {"$gt": sort_name}},
+            {"sort_name": sort_name, "_id": {"$gt": key}}
+        ]}})
+    elif skip:
+        page_stages.append({"$skip": skip})
+    page_stages.append({"$limit": limit})
+
+    pipeline.append({"$facet": {
+        "clients": page_stages,
+        "total": [{"$count": "count"}]
+    }})
+
+    result = await db.processes.aggregate(pipeline, allowDiskUse=True).to_list(1)
+    facet = result[0] if result else {"clients": [], "total": []}
+
+    clients = []
+    for group in facet["clients"]:
+        dados_pessoais = group.get("dados_pessoais") or {}
+        clients.append({
+            "id": group.get("client_id") or f"{virtual_id_prefix}{group.get('first_process_id')}",
+            "nome": group.get("nome"),
+            "contacto": {
+                "email": group.get("email"),
+                "telefone": group.get("telefone")
+            },
+            "dados_pessoais": dados_pessoais,
+            "nif": dados_pessoais.get("nif"),
+            "process_ids": group.get("process_ids", []),
+            "active_processes_count": group.get("active_processes_count", 0)
+        })
+
+    next_cursor = None
+    if len(facet["clients"]) == limit:
+        last = facet["clients"][-1]
+        next_cursor = _encode_cursor(last["sort_name"], last["_id"])
+
+    return {
+        "clients": clients,
+        "total": facet["total"][0]["count"] if facet["total"] else 0,
+        "next_cursor": next_cursor
+    }
+
+
 @router.get("")
 async def list_clients(
     search: Optional[str] = Query(None, description="Pesquisar por nome, email ou NIF"),
@@ -31,6 +148,7 @@ async def list_clients(
     show_all: bool = Query(True, description="Se True, mostra todos os clientes da empresa. Se False, apenas os do utilizador"),
     limit: int = Query(100, le=500),
     skip: int = Query(0),
+    after: Optional[str] = Query(None, description="Cursor devolvido em next_cursor (paginação keyset)"),
     user: dict = Depends(get_current_user)
 ):
     """
@@ -38,6 +156,10 @@ async def list_clients(
     - show_all=True: Todos os utilizadores vêem todos os clientes da empresa
     - show_all=False: Utilizadores vêem apenas os seus clientes (atribuídos)
     
+    Os processos são agrupados em clientes no servidor; `total` conta
+    todos os clientes que passam os filtros. Para páginas seguintes,
+    usar `after=<next_cursor>` (ou `skip`, mantido por compatibilidade).
+    
     Nota: Todos podem ver a lista de clientes para referência,
     mas apenas têm acesso total a processos que lhes estão atribuídos.
     """
@@ -46,140 +168,41 @@ async def list_clients(
     user_email = user.get("email", "")
     
     # Se show_all=True OU é admin/ceo/diretor, mostrar todos
-    if show_all or user_role in ["admin", "ceo", "diretor"]:
-        # Mostrar todos os clientes da empresa
-        process_query = {}
-        
-        if search:
-            process_query = {
-                "$or": [
-                    {"client_name": {"$regex": search, "$options": "i"}},
-                    {"client_email": {"$regex": search, "$options": "i"}},
-                    {"personal_data.nif": {"$regex": search, "$options": "i"}}
-                ]
-            }
-        
-        # Buscar todos os processos (clientes únicos)
-        processes = await db.processes.find(
-            process_query,
-            {"_id": 0, "id": 1, "client_name": 1, "client_email": 1, "client_phone": 1, 
-             "personal_data": 1, "status": 1, "process_number": 1, "client_id": 1,
-             "assigned_consultor_id": 1, "assigned_mediador_id": 1}
-        ).skip(skip).limit(limit).to_list(length=limit)
-        
-        # Agrupar por cliente
-        clients_map = {}
-        for proc in processes:
-            key = proc.get("client_id") or proc.get("client_name", "").lower().strip()
-            if not key:
-                continue
-            
-            if key not in clients_map:
-                clients_map[key] = {
-                    "id": proc.get("client_id") or proc.get("id"),
-                    "nome": proc.get("client_name"),
-                    "contacto": {
-                        "email": proc.get("client_email"),
-                        "telefone": proc.get("client_phone")
-                    },
-                    "dados_pessoais": proc.get("personal_data", {}),
-                    "nif": proc.get("personal_data", {}).get("nif"),
-                    "process_ids": [],
-                    "active_processes_count": 0
-                }
-            
-            clients_map[key]["process_ids"].append(proc.get("id"))
-            
-            if proc.get("status") not in ["arquivado", "perdido", "concluido"]:
-                clients_map[key]["active_processes_count"] += 1
-        
-        clients = list(clients_map.values())
-        
-        # Filtrar por ter processo activo
-        if has_active_process is not None:
-            clients = [c for c in clients if (c["active_processes_count"] > 0) == has_active_process]
-        
-        return {
-            "clients": clients,
-            "total": len(clients),
-            "showing_all": True
-        }
+    showing_all = show_all or user_role in ["admin", "ceo", "diretor"]
     
-    # show_all=False - Mostrar apenas clientes do utilizador
-    # Construir query baseada no papel do utilizador
-    if user_role == "consultor":
-        role_query = {
+    if showing_all:
+        process_query = {}
+    elif user_role == "consultor":
+        process_query = {
             "$or": [
                 {"assigned_consultor_id": user_id},
                 {"created_by": user_email}
             ]
         }
     elif user_role in ["mediador", "intermediario"]:
-        role_query = {
+        process_query = {
             "$or": [
                 {"assigned_mediador_id": user_id},
                 {"created_by": user_email}
             ]
         }
     else:
-        role_query = {"created_by": user_email}
-    
-    process_query = role_query
+        process_query = {"created_by": user_email}
     
     if search:
-        search_filter = {
-            "$or": [
-                {"client_name": {"$regex": search, "$options": "i"}},
-                {"client_email": {"$regex": search, "$options": "i"}},
-                {"personal_data.nif": {"$regex": search, "$options": "i"}}
-            ]
-        }
-        process_query = {"$and": [process_query, search_filter]}
+        search_filter = {"id": {"$in": await match_process_ids(search)}}
+        process_query = {"$and": [process_query, search_filter]} if process_query else search_filter
     
-    # Buscar processos e transformar em "clientes"
-    processes = await db.processes.find(
+    result = await _aggregate_clients(
         process_query,
-        {"_id": 0, "id": 1, "client_name": 1, "client_email": 1, "client_phone": 1, 
-         "personal_data": 1, "status": 1, "process_number": 1, "client_id": 1}
-    ).skip(skip).limit(limit).to_list(length=limit)
-    
-    # Agrupar por cliente (usando client_id ou client_name como chave)
-    clients_map = {}
-    for proc in processes:
-        key = proc.get("client_id") or proc.get("client_name", "").lower().strip()
-        if not key:
-            continue
-        
-        if key not in clients_map:
-            clients_map[key] = {
-                "id": proc.get("client_id") or f"process_{proc.get('id')}",
-                "nome": proc.get("client_name"),
-                "contacto": {
-                    "email": proc.get("client_email"),
-                    "telefone": proc.get("client_phone")
-                },
-                "dados_pessoais": proc.get("personal_data", {}),
-                "nif": proc.get("personal_data", {}).get("nif"),
-                "process_ids": [],
-                "active_processes_count": 0
-            }
-        
-        clients_map[key]["process_ids"].append(proc.get("id"))
-        
-        if proc.get("status") not in ["arquivado", "perdido", "concluido"]:
-            clients_map[key]["active_processes_count"] += 1
-    
-    clients = list(clients_map.values())
-    
-    # Filtrar por ter processo activo
-    if has_active_process is not None:
-        clients = [c for c in clients if (c["active_processes_count"] > 0) == has_active_process]
-    
-    return {
-        "clients": clients,
-        "total": len(clients),
-        "showing_all": False
-    }
+        has_active_process,
+        limit=limit,
+        skip=skip,
+        after=after,
+        virtual_id_prefix="" if showing_all else "process_"
+    )
+    result["showing_all"] = showing_all
+    return result
 
 
 @router.get("/{client_id}")
@@ -336,6 +359,7 @@ async def link_process_to_client(
             }
         }
     )
+    await sync_client_key(process_id)
     
     logger.info(f"Processo {process_id} vinculado ao cliente {client_id} por {user.get('email')}")
     
@@ -375,6 +399,7 @@ async def unlink_process_from_client(
             "$set": {"updated_at": now}
         }
     )
+    await sync_client_key(process_id)
     
     logger.info(f"Processo {process_id} desvinculado do cliente {client_id} por {user.get('email')}")
     
@@ -428,12 +453,7 @@ async def create_process_for_client(
         }
     
     # Obter próximo número de processo
-    last_process = await db.processes.find_one(
-        {},
-        sort=[("process_number", -1)],
-        projection={"process_number": 1}
-    )
-    next_number = (last_process.get("process_number", 0) if last_process else 0) + 1
+    next_number = await get_next_process_number()
     
     now = datetime.now(timezone.utc).isoformat()
     process_id = str(uuid.uuid4())
@@ -465,6 +485,8 @@ async def create_process_for_client(
     }
     
     await db.processes.insert_one(new_process)
+    await sync_client_key(new_process["id"])
+    await index_document(ENTITY_PROCESS, new_process)
     
     # Se temos um cliente real, atualizar a lista de processos
     if not source_process:
@@ -636,6 +658,7 @@ async def delete_client(
         
         # Eliminar o processo
         await db.processes.delete_one({"id": client_id})
+        await remove_process_entries(client_id)
         
         logger.info(f"Processo/Cliente {client_id} ({process.get('client_name')}) eliminado por {user.get('email')}")
         
@@ -16,18 +16,18 @@ import unicodedata
 import asyncio
 from datetime import datetime, timezone, timedelta
 from typing import List, Optional, Dict
-from io import BytesIO
 
 # Adicionados UploadFile, File, Form para o S3
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks
 
 from database import db
 from models.auth import UserRole
-from models.document import DocumentExpiryCreate, DocumentExpiryUpdate, DocumentExpiryResponse
+from models.document import DocumentExpiryCreate, DocumentExpiryUpdate, DocumentExpiryResponse, PresignBatchRequest
 from services.auth import get_current_user, require_roles
 
 # Importar o novo serviço S3
-from services.s3_storage import s3_service
+from services.s3_storage import async_s3_service
+from services.s3_manifest import s3_manifest
 
 # Importar serviço de processamento de documentos (conversão imagem → PDF)
 from services.document_processor import convert_image_to_pdf, IMG2PDF_AVAILABLE
@@ -45,11 +45,14 @@ async def auto_categorize_document_background(
     client_name: str,
     s3_path: str,
     filename: str,
-    file_content: bytes
+    file_content: Optional[bytes] = None,
+    file_size: Optional[int] = None
 ):
     """
     Categoriza um documento automaticamente em background após upload.
     Esta função é chamada de forma assíncrona para não bloquear o upload.
+    Se o upload foi feito em streaming (`file_content` None), os PDFs são
+    lidos do S3 para extrair o texto.
     """
     from services.document_categorization import extract_text_from_pdf, categorize_document_with_ai
     
@@ -62,7 +65,10 @@ async def auto_categorize_document_background(
         # Extrair texto do documento
         extracted_text = ""
         if filename.lower().endswith('.pdf'):
-            extracted_text = extract_text_from_pdf(file_content)
+            if file_content is None:
+                file_content = await async_s3_service.get_file_content(s3_path)
+            if file_content:
+                extracted_text = await asyncio.to_thread(extract_text_from_pdf, file_content)
         
         # Se não conseguir extrair texto, usar apenas o nome do ficheiro
         text_for_analysis = extracted_text if extracted_text else f"Ficheiro: {filename}"
@@ -100,7 +106,7 @@ async def auto_categorize_document_background(
             "expiry_date": result.get("expiry_date"),  # Nova: data de validade
             "expiry_alert_sent": False,  # Nova: flag de alerta
             "extracted_text": extracted_text[:5000] if extracted_text else None,
-            "file_size": len(file_content),
+            "file_size": file_size if file_size is not None else len(file_content or b""),
             "mime_type": "application/pdf" if filename.lower().endswith('.pdf') else None,
             "is_categorized": True,
             "categorized_at": now,
@@ -118,6 +124,8 @@ async def auto_categorize_document_background(
             await db.document_metadata.insert_one(metadata)
             logger.info(f"[AUTO-CAT] Metadados criados para: {filename}")
         
+        await index_document_text(metadata)
+        
         logger.info(f"[AUTO-CAT] Categorização concluída: {filename} -> {result.get('category')}/{result.get('subcategory')}, expiry: {result.get('expiry_date')}")
         
     except Exception as e:
@@ -193,12 +201,27 @@ def is_image_file(filename: str, content_type: str = None) -> bool:
 # PARTE 1: GESTÃO DE FICHEIROS (S3 STORAGE) - NOVO
 # ====================================================================
 
+async def attach_download_urls(items: List[dict], path_field: str = "path"):
+    """Acrescentar `url` e `url_expires_at` (epoch) a cada item com caminho S3."""
+    signed = await async_s3_service.presign_many(
+        [item[path_field] for item in items if item.get(path_field)]
+    )
+    for item in items:
+        url = signed.get(item.get(path_field))
+        if url:
+            item["url"], item["url_expires_at"] = url[0], int(url[1])
+
+
 @router.get("/client/{client_id}/files")
 async def list_client_files(
     client_id: str, 
+    include_urls: bool = False,
     user: dict = Depends(get_current_user)
 ):
-    """Lista todos os ficheiros do cliente no S3 organizados por pastas."""
+    """
+    Lista todos os ficheiros do cliente no S3 organizados por pastas.
+    Com `include_urls`, cada ficheiro inclui o link de download.
+    """
     process = await db.processes.find_one({"id": client_id})
     if not process:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
@@ -208,8 +231,10 @@ async def list_client_files(
     second_client_name = process.get("second_client_name") or \
                          process.get("titular2_data", {}).get("nome")
     
-    # Chama o serviço S3
-    files = s3_service.list_files(client_id, client_name, second_client_name)
+    # Listagem servida pelo manifesto (sem pedidos ao S3 após a primeira leitura)
+    files = await s3_manifest.list_files(client_id, client_name, second_client_name)
+    if include_urls and files.get("files"):
+        await attach_download_urls([f for file_list in files["files"].values() for f in file_list])
     return files
 
 @router.post("/client/{client_id}/upload")
@@ -236,16 +261,16 @@ async def upload_file_s3(
     second_client_name = process.get("second_client_name") or \
                          process.get("titular2_data", {}).get("nome")
     
-    # Ler o conteúdo do ficheiro
-    file_content = await file.read()
     original_filename = file.filename
     content_type = file.content_type
+    file_content = None
     
     # Verificar se é uma imagem e converter para PDF
     converted_to_pdf = False
     if is_image_file(original_filename, content_type) and IMG2PDF_AVAILABLE:
         try:
             logger.info(f"A converter imagem para PDF: {original_filename}")
+            file_content = await file.read()
             pdf_bytes, new_filename = await convert_image_to_pdf(file_content, original_filename)
             
             if new_filename != original_filename:
@@ -262,31 +287,34 @@ async def upload_file_s3(
     normalized_filename = normalize_filename(original_filename, category)
     logger.info(f"Nome normalizado: {file.filename} -> {normalized_filename}")
     
-    # Criar BytesIO para o upload
-    file_buffer = BytesIO(file_content)
-    
-    # Upload para o S3
-    s3_path = s3_service.upload_file(
-        file_buffer,
-        client_id,
-        client_name,
-        category,
-        normalized_filename,
-        content_type,
-        second_client_name=second_client_name
+    object_name = async_s3_service.sync.build_object_name(
+        client_id, client_name, category, normalized_filename, second_client_name
     )
     
+    # Upload para o S3: imagens convertidas já estão em memória; os restantes
+    # ficheiros seguem em streaming do UploadFile (multipart se forem grandes)
+    if file_content is not None:
+        s3_path = await async_s3_service.upload_bytes(file_content, object_name, content_type)
+    else:
+        await file.seek(0)
+        s3_path = await async_s3_service.upload_stream(file, object_name, content_type)
+    
     if not s3_path:
         raise HTTPException(status_code=500, detail="Erro ao enviar ficheiro para o armazenamento S3")
     
-    # Agendar categorização automática em background (não bloqueia o response)
+    file_size = len(file_content) if file_content is not None else file.size
+    await s3_manifest.record_upload(s3_path, file_size)
+    
+    # Agendar categorização automática em background (não bloqueia o response);
+    # sem o conteúdo em memória, é lido do S3 pela própria tarefa
     background_tasks.add_task(
         auto_categorize_document_background,
         process_id=client_id,
         client_name=client_name,
         s3_path=s3_path,
         filename=normalized_filename,
-        file_content=file_content
+        file_content=file_content,
+        file_size=file_size
     )
     
     return {
@@ -310,7 +338,7 @@ async def initialize_folders(client_id: str, user: dict = Depends(get_current_us
     second_client_name = process.get("second_client_name") or \
                          process.get("titular2_data", {}).get("nome")
     
-    success = s3_service.initialize_client_folders(
+    success = await async_s3_service.initialize_client_folders(
         client_id, 
         client_name,
         second_client_name=second_client_name
@@ -335,13 +363,41 @@ async def get_download_url(
     if not file_path.startswith(expected_prefix):
         raise HTTPException(status_code=403, detail="Acesso não autorizado a este ficheiro")
     
-    url = s3_service.get_presigned_url(file_path)
+    url = await async_s3_service.get_presigned_url(file_path)
     if not url:
         raise HTTPException(status_code=500, detail="Erro ao gerar link de download")
     
     return {"success": True, "url": url}
 
 
+@router.post("/client/{client_id}/presign")
+async def presign_download_urls(
+    client_id: str,
+    request: PresignBatchRequest,
+    user: dict = Depends(get_current_user)
+):
+    """
+    Gera links temporários para vários ficheiros num único pedido
+    (galerias e listas de documentos).
+    """
+    process = await db.processes.find_one({"id": client_id}, {"_id": 0, "id": 1})
+    if not process:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    
+    # Verificar se os ficheiros pertencem ao cliente (segurança)
+    expected_prefix = f"clientes/{client_id}_"
+    if any(not path.startswith(expected_prefix) for path in request.paths):
+        raise HTTPException(status_code=403, detail="Acesso não autorizado a este ficheiro")
+    
+    signed = await async_s3_service.presign_many(request.paths, request.expiration)
+    return {
+        "success": True,
+        "urls": {path: url for path, (url, _) in signed.items()},
+        "expires_at": {path: int(expires_at) for path, (_, expires_at) in signed.items()},
+        "failed": [path for path in request.paths if path not in signed]
+    }
+
+
 @router.delete("/client/{client_id}/file")
 async def delete_file_s3(
     client_id: str,
@@ -359,9 +415,15 @@ async def delete_file_s3(
     if not file_path.startswith(expected_prefix):
         raise HTTPException(status_code=403, detail="Acesso não autorizado a este ficheiro")
     
-    success = s3_service.delete_file(file_path)
+    success = await async_s3_service.delete_file(file_path)
     if not success:
         raise HTTPException(status_code=500, detail="Erro ao eliminar ficheiro")
+    await s3_manifest.record_delete(file_path)
+    
+    # Metadados e postings do ficheiro eliminado deixam de aparecer na pesquisa
+    async for meta in db.document_metadata.find({"s3_path": file_path}, {"_id": 0, "id": 1}):
+        await remove_document_text(meta["id"])
+    await db.document_metadata.delete_many({"s3_path": file_path})
     
     return {"success": True, "message": "Ficheiro eliminado"}
 
@@ -497,9 +559,11 @@ async def get_document_types(user: dict = Depends(get_current_user)):
 from services.document_categorization import (
     extract_text_from_pdf,
     categorize_document_with_ai,
-    search_documents_by_content,
     get_unique_categories
 )
+from services.document_search import (
+    index_document_text, remove_document_text, search_documents as search_document_index
+)
 from models.document import (
     DocumentMetadata, 
     DocumentMetadataCreate,
@@ -537,7 +601,7 @@ async def categorize_document(
     
     # Obter o ficheiro do S3
     try:
-        file_content = s3_service.get_file_content(s3_path)
+        file_content = await async_s3_service.get_file_content(s3_path)
         if not file_content:
             raise HTTPException(status_code=404, detail="Ficheiro não encontrado no S3")
     except Exception as e:
@@ -547,7 +611,7 @@ async def categorize_document(
     # Extrair texto do documento
     extracted_text = ""
     if filename.lower().endswith('.pdf'):
-        extracted_text = extract_text_from_pdf(file_content)
+        extracted_text = await asyncio.to_thread(extract_text_from_pdf, file_content)
     
     # Se não conseguir extrair texto, usar apenas o nome do ficheiro
     text_for_analysis = extracted_text if extracted_text else f"Ficheiro: {filename}"
@@ -601,6 +665,8 @@ async def categorize_document(
         metadata["created_at"] = now
         await db.document_metadata.insert_one(metadata)
     
+    await index_document_text(metadata)
+    
     return {
         "success": True,
         "id": doc_id,
@@ -620,145 +686,45 @@ async def categorize_all_documents(
 ):
     """
     Categorizar TODOS os documentos de um cliente/processo.
-    Processa documentos que ainda não foram categorizados.
+    Processa documentos que ainda não foram categorizados, em background:
+    devolve o `job_id` para acompanhar o progresso em
+    GET /documents/categorize-all/jobs/{job_id}. Um job interrompido para
+    o mesmo processo é retomado.
     """
-    process = await db.processes.find_one({"id": process_id}, {"_id": 0})
+    from services.document_categorization_jobs import start_categorize_all
+    
+    process = await db.processes.find_one({"id": process_id}, {"_id": 0, "id": 1})
     if not process:
         raise HTTPException(status_code=404, detail="Processo não encontrado")
     
-    client_name = process.get("client_name", "Cliente")
-    second_client_name = process.get("second_client_name") or \
-                         process.get("titular2_data", {}).get("nome")
-    
-    # Listar ficheiros do S3
-    files_data = s3_service.list_files(process_id, client_name, second_client_name)
-    files = files_data.get("files", {})
-    
-    results = {
-        "total": 0,
-        "categorized": 0,
-        "skipped": 0,
-        "errors": 0,
-        "documents": []
-    }
+    return await start_categorize_all(process_id, user)
+
+
+@router.get("/categorize-all/jobs/{job_id}")
+async def get_categorize_all_job(
+    job_id: str,
+    user: dict = Depends(get_current_user)
+):
+    """Consultar o progresso (e o resultado) de uma categorização em lote."""
+    from services.background_jobs import background_jobs, JobType
     
-    # Obter categorias existentes
-    existing_categories = await db.document_metadata.distinct("ai_category")
-    now = datetime.now(timezone.utc).isoformat()
+    job = await background_jobs.get_job(job_id)
+    if not job or job.get("type") != JobType.DOCUMENT_CATEGORIZATION.value:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
     
-    # Processar cada categoria de ficheiros
-    for category, file_list in files.items():
-        for file_info in file_list:
-            results["total"] += 1
-            
-            s3_path = file_info.get("path")
-            filename = file_info.get("name")
-            
-            if not s3_path or not filename:
-                continue
-            
-            # Verificar se já foi categorizado
-            existing = await db.document_metadata.find_one(
-                {"s3_path": s3_path, "is_categorized": True},
-                {"_id": 0}
-            )
-            
-            if existing:
-                results["skipped"] += 1
-                results["documents"].append({
-                    "filename": filename,
-                    "status": "skipped",
-                    "category": existing.get("ai_category")
-                })
-                continue
-            
-            try:
-                # Obter ficheiro do S3
-                file_content = s3_service.get_file_content(s3_path)
-                if not file_content:
-                    results["errors"] += 1
-                    continue
-                
-                # Extrair texto
-                extracted_text = ""
-                if filename.lower().endswith('.pdf'):
-                    extracted_text = extract_text_from_pdf(file_content)
-                
-                text_for_analysis = extracted_text if extracted_text else f"Ficheiro: {filename}"
-                
-                # Categorizar
-                result = await categorize_document_with_ai(
-                    text_content=text_for_analysis,
-                    filename=filename,
-                    existing_categories=existing_categories
-                )
-                
-                if result.get("success"):
-                    # Guardar metadados
-                    doc_id = str(uuid.uuid4())
-                    metadata = {
-                        "id": doc_id,
-                        "process_id": process_id,
-                        "client_name": client_name,
-                        "s3_path": s3_path,
-                        "filename": filename,
-                        "ai_category": result.get("category"),
-                        "ai_subcategory": result.get("subcategory"),
-                        "ai_confidence": result.get("confidence"),
-                        "ai_tags": result.get("tags", []),
-                        "ai_summary": result.get("summary"),
-                        "expiry_date": result.get("expiry_date"),  # Nova: data de validade
-                        "expiry_alert_sent": False,  # Nova: flag de alerta
-                        "extracted_text": extracted_text[:5000] if extracted_text else None,
-                        "file_size": len(file_content),
-                        "is_categorized": True,
-                        "categorized_at": now,
-                        "created_at": now,
-                        "updated_at": now
-                    }
-                    
-                    await db.document_metadata.insert_one(metadata)
-                    
-                    # Actualizar lista de categorias
-                    if result.get("category") and result["category"] not in existing_categories:
-                        existing_categories.append(result["category"])
-                    
-                    results["categorized"] += 1
-                    results["documents"].append({
-                        "filename": filename,
-                        "status": "categorized",
-                        "category": result.get("category"),
-                        "subcategory": result.get("subcategory"),
-                        "expiry_date": result.get("expiry_date")
-                    })
-                else:
-                    results["errors"] += 1
-                    results["documents"].append({
-                        "filename": filename,
-                        "status": "error",
-                        "error": result.get("error")
-                    })
-                    
-            except Exception as e:
-                logger.error(f"Erro ao categorizar {filename}: {e}")
-                results["errors"] += 1
-                results["documents"].append({
-                    "filename": filename,
-                    "status": "error",
-                    "error": str(e)
-                })
-    
-    return results
+    return job
 
 
 @router.get("/metadata/{process_id}")
 async def get_document_metadata(
     process_id: str,
+    include_urls: bool = False,
     user: dict = Depends(get_current_user)
 ):
     """
     Obter metadados de todos os documentos de um processo.
-    Inclui categorização IA se disponível.
+    Inclui categorização IA se disponível e, com `include_urls`, o link
+    de download de cada documento.
     """
     process = await db.processes.find_one({"id": process_id}, {"_id": 0})
     if not process:
@@ -776,6 +742,9 @@ async def get_document_metadata(
         {"process_id": process_id, "ai_category": {"$ne": None}}
     )
     
+    if include_urls:
+        await attach_download_urls(metadata_list, path_field="s3_path")
+    
     return {
         "process_id": process_id,
         "client_name": process.get("client_name"),
@@ -800,25 +769,14 @@ async def search_documents(
     - Tags
     - Resumo
     - Texto extraído
-    """
-    query = {"is_categorized": True}
-    
-    # Filtrar por processo se especificado
-    if request.process_id:
-        query["process_id"] = request.process_id
     
-    # Filtrar por categorias se especificado
-    if request.categories:
-        query["ai_category"] = {"$in": request.categories}
-    
-    # Obter documentos
-    documents = await db.document_metadata.find(query, {"_id": 0}).to_list(1000)
-    
-    # Pesquisar
-    results = await search_documents_by_content(
+    Ranking BM25 sobre o índice invertido construído na categorização;
+    o texto extraído não é carregado, apenas o excerto de cada resultado.
+    """
+    results = await search_document_index(
         query=request.query,
         process_id=request.process_id,
-        documents=documents,
+        categories=request.categories,
         limit=request.limit
     )
     
@@ -21,6 +21,7 @@ from database import db
 from models.email import EmailCreate, EmailUpdate, EmailResponse, EmailDirection, EmailStatus
 from services.auth import get_current_user
 from services.email_service import sync_emails_for_process, send_email, test_email_connection, get_email_accounts
+from services.enrichment import enrich_emails, get_process_names
 
 logger = logging.getLogger(__name__)
 
@@ -29,25 +30,7 @@ router = APIRouter(prefix="/emails", tags=["Emails"])
 
 async def enrich_email(email: dict) -> dict:
     """Adicionar nomes ao email."""
-    # Nome do processo/cliente
-    if email.get("process_id"):
-        process = await db.processes.find_one(
-            {"id": email["process_id"]},
-            {"_id": 0, "client_name": 1}
-        )
-        if process:
-            email["client_name"] = process.get("client_name", "")
-    
-    # Nome de quem criou
-    if email.get("created_by"):
-        user = await db.users.find_one(
-            {"id": email["created_by"]},
-            {"_id": 0, "name": 1}
-        )
-        if user:
-            email["created_by_name"] = user.get("name", "")
-    
-    return email
+    return (await enrich_emails([email]))[0]
 
 
 # ==== ROTAS ESPECÍFICAS (devem vir antes das genéricas) ====
@@ -117,12 +100,7 @@ async def get_process_emails(
     
     emails = await db.emails.find(query, {"_id": 0}).sort("sent_at", -1).to_list(500)
     
-    enriched_emails = []
-    for email in emails:
-        enriched = await enrich_email(email)
-        enriched_emails.append(EmailResponse(**enriched))
-    
-    return enriched_emails
+    return [EmailResponse(**email) for email in await enrich_emails(emails)]
 
 
 @router.get("/stats/{process_id}")
@@ -261,15 +239,11 @@ async def search_emails(
         {"_id": 0, "id": 1, "subject": 1, "from_email": 1, "to_emails": 1, "sent_at": 1, "process_id": 1}
     ).sort("sent_at", -1).limit(limit).to_list(limit)
     
-    # Enriquecer com nome do cliente se associado
+    # Enriquecer com nome do cliente se associado (uma query para todos)
+    process_names = await get_process_names(e.get("process_id") for e in emails)
     for email in emails:
-        if email.get("process_id"):
-            process = await db.processes.find_one(
-                {"id": email["process_id"]},
-                {"_id": 0, "client_name": 1}
-            )
-            if process:
-                email["client_name"] = process.get("client_name")
+        if email.get("process_id") in process_names:
+            email["client_name"] = process_names[email["process_id"]]
     
     return {"emails": emails, "total": len(emails)}
 
@@ -10,7 +10,7 @@ Endpoints:
 - GET  /api/gdpr/statistics     - Estatísticas de conformidade
 - POST /api/gdpr/anonymize      - Anonimizar processo específico
 - POST /api/gdpr/batch          - Executar anonimização em lote
-- GET  /api/gdpr/export/{id}    - Exportar dados pessoais
+- GET  /api/gdpr/export/{id}    - Exportar dados pessoais (json, ndjson ou zip em streaming)
 - GET  /api/gdpr/audit          - Consultar log de auditoria
 ====================================================================
 """
@@ -18,6 +18,7 @@ import logging
 from datetime import datetime, timezone, timedelta
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 from database import db
@@ -28,6 +29,9 @@ from services.gdpr import (
     anonymize_user_data,
     run_anonymization_batch,
     export_personal_data,
+    stream_personal_data_ndjson,
+    stream_personal_data_zip,
+    process_exists,
     get_gdpr_statistics,
     find_processes_for_anonymization,
     gdpr_config
@@ -53,6 +57,7 @@ class BatchAnonymizeRequest(BaseModel):
     retention_days: Optional[int] = None
     batch_size: int = 100
     dry_run: bool = True  # Default: dry run por segurança
+    resume: bool = True  # Retomar execução interrompida (checkpoint em gdpr_runs)
 
 
 # ====================================================================
@@ -170,7 +175,8 @@ async def anonymize_batch(
     result = await run_anonymization_batch(
         retention_days=request.retention_days,
         dry_run=request.dry_run,
-        batch_size=request.batch_size
+        batch_size=request.batch_size,
+        resume=request.resume
     )
     
     # Log de auditoria
@@ -181,6 +187,7 @@ async def anonymize_batch(
         "retention_days": request.retention_days or gdpr_config.retention_period_days,
         "processed": result.get("processed", 0),
         "succeeded": result.get("succeeded", 0),
+        "run_id": result.get("run_id"),
         "performed_by": current_user.get("id"),
         "performed_by_email": current_user.get("email"),
         "timestamp": datetime.now(timezone.utc)
@@ -195,6 +202,8 @@ async def anonymize_batch(
 @router.get("/export/{process_id}")
 async def export_data(
     process_id: str,
+    format: str = Query(default="json", pattern="^(json|ndjson|zip)$"),
+    include_files: bool = Query(default=False, description="Incluir ficheiros do S3 (apenas zip)"),
     current_user: dict = Depends(require_roles([UserRole.ADMIN, UserRole.CEO]))
 ):
     """
@@ -202,17 +211,40 @@ async def export_data(
     
     Implementa o direito à portabilidade (RGPD Artigo 20).
     
-    Retorna todos os dados pessoais em formato JSON estruturado.
+    Formatos:
+    - json: dados do processo em JSON estruturado
+    - ndjson: exportação completa (processo, histórico, emails, tarefas,
+      documentos, histórico de extracções IA) em streaming, uma linha por registo
+    - zip: a mesma exportação, um ficheiro por secção; com include_files=true
+      inclui os documentos do S3
     """
-    data = await export_personal_data(process_id=process_id)
+    if format == "json":
+        data = await export_personal_data(process_id=process_id)
+        
+        if not data.get("data"):
+            raise HTTPException(404, "Processo não encontrado")
+        
+        return {
+            "success": True,
+            **data
+        }
     
-    if not data.get("data"):
+    if not await process_exists(process_id):
         raise HTTPException(404, "Processo não encontrado")
     
-    return {
-        "success": True,
-        **data
-    }
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_personal_data_ndjson(process_id),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": f'attachment; filename="export_{process_id}_{stamp}.ndjson"'}
+        )
+    
+    return StreamingResponse(
+        stream_personal_data_zip(process_id, include_files=include_files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="export_{process_id}_{stamp}.zip"'}
+    )
 
 
 @router.get("/audit")
@@ -259,6 +291,8 @@ async def get_gdpr_config(
             "retention_period_days": gdpr_config.retention_period_days,
             "eligible_statuses": gdpr_config.eligible_statuses,
             "batch_size": gdpr_config.batch_size,
+            "chunk_size": gdpr_config.chunk_size,
+            "concurrency": gdpr_config.concurrency,
             "dry_run_mode": gdpr_config.dry_run
         }
     }
@@ -37,17 +37,14 @@ async def _log_system_error(
         severity: Nível (info, warning, error, critical)
     """
     try:
-        error_log = {
-            "id": str(uuid.uuid4()),
-            "type": error_type,
-            "message": message,
-            "details": details or {},
-            "severity": severity,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "read": False,
-            "resolved": False
-        }
-        await db.system_error_logs.insert_one(error_log)
+        from services.system_error_logger import system_error_logger
+        await system_error_logger.log_error(
+            error_type=error_type,
+            message=message,
+            component="leads",
+            details=details,
+            severity=severity
+        )
     except Exception as e:
         logger.error(f"Falha ao registar erro no sistema: {e}")
 
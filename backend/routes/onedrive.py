@@ -240,7 +240,7 @@ async def get_client_files_by_name(
     
     Este endpoint mantém compatibilidade com o frontend que usa o nome do cliente.
     """
-    from services.s3_storage import s3_service
+    from services.s3_manifest import s3_manifest
     
     # Procurar processo pelo nome do cliente
     process = await db.processes.find_one(
@@ -264,7 +264,7 @@ async def get_client_files_by_name(
                          process.get("titular2_data", {}).get("nome")
     
     # Obter ficheiros do S3
-    files_data = s3_service.list_files(client_id, real_client_name, second_client_name)
+    files_data = await s3_manifest.list_files(client_id, real_client_name, second_client_name)
     
     return files_data
 
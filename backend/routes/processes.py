@@ -34,7 +34,7 @@ from services.notification_service import (
     send_new_process_notification,
     send_to_admins
 )
-from services.history import log_history, log_data_changes
+from services.history import log_history, log_sections_changes
 from services.alerts import (
     get_process_alerts,
     check_property_documents,
@@ -43,7 +43,8 @@ from services.alerts import (
     notify_cpcv_or_deed_document_check
 )
 from services.realtime_notifications import notify_process_status_change
-from services.trello import trello_service, status_to_trello_list, build_card_description
+from services.trello_push import trello_push_queue
+from services.search_index import ENTITY_PROCESS, index_document
 
 # Importar serviços refatorados
 from services.process_service import (
@@ -55,7 +56,8 @@ from services.process_service import (
     update_process_document,
     get_process_by_id,
     get_processes_for_user,
-    get_user_name
+    get_user_name,
+    sync_client_key
 )
 from services.process_assignment import (
     assign_both_to_process,
@@ -74,22 +76,13 @@ logger = logging.getLogger(__name__)
 
 
 async def sync_process_to_trello(process: dict):
-    """Sincronizar processo com o Trello (nome e descrição do card)."""
-    if not process.get("trello_card_id") or not trello_service.api_key:
-        return False
-    
-    try:
-        description = build_card_description(process)
-        await trello_service.update_card(
-            process["trello_card_id"],
-            name=process.get("client_name", "Sem nome"),
-            desc=description
-        )
-        logger.info(f"Card {process['trello_card_id']} atualizado no Trello: {process.get('client_name')}")
-        return True
-    except Exception as e:
-        logger.error(f"Erro ao sincronizar com Trello: {e}")
+    """
+    Agendar a sincronização do card do processo no Trello (nome, descrição
+    e lista). O envio é feito em background e só com os campos alterados.
+    """
+    if not process.get("trello_card_id"):
         return False
+    return trello_push_queue.enqueue(process["id"])
 
 
 # ====================================================================
@@ -157,6 +150,8 @@ async def create_process(data: ProcessCreate, user: dict = Depends(get_current_u
     
     # Inserir na base de dados
     await db.processes.insert_one(process_doc)
+    await sync_client_key(process_id)
+    await index_document(ENTITY_PROCESS, process_doc)
     
     # Registar no histórico
     await log_history(process_id, user, "Criou processo")
@@ -242,6 +237,8 @@ async def create_client_process(data: ProcessCreate, user: dict = Depends(get_cu
     
     # Inserir na base de dados
     await db.processes.insert_one(process_doc)
+    await sync_client_key(process_id)
+    await index_document(ENTITY_PROCESS, process_doc)
     
     # Registar no histórico
     await log_history(process_id, user, f"Criou processo para cliente {client_name}")
@@ -668,19 +665,8 @@ async def move_process_kanban(
         changed_by=user
     )
     
-    # === SINCRONIZAR COM TRELLO ===
-    if process.get("trello_card_id") and trello_service.api_key:
-        try:
-            trello_list_name = status_to_trello_list(new_status)
-            if trello_list_name:
-                # Encontrar a lista do Trello pelo nome
-                trello_list = await trello_service.get_list_by_name(trello_list_name)
-                if trello_list:
-                    await trello_service.move_card(process["trello_card_id"], trello_list["id"])
-                    logger.info(f"Card {process['trello_card_id']} movido para {trello_list_name} no Trello")
-        except Exception as e:
-            logger.error(f"Erro ao sincronizar com Trello: {e}")
-            # Não falhar a operação por erro no Trello
+    # === SINCRONIZAR COM TRELLO (mover card, em background) ===
+    await sync_process_to_trello(process)
     
     return {
         "message": "Processo movido com sucesso", 
@@ -749,32 +735,35 @@ async def update_process(process_id: str, data: ProcessUpdate, user: dict = Depe
     can_update_credit = UserRole.can_act_as_mediador(role)
     can_update_status = role in [UserRole.ADMIN, UserRole.CEO, UserRole.CONSULTOR, UserRole.MEDIADOR, UserRole.DIRETOR, UserRole.ADMINISTRATIVO]
     
+    # Alterações de secções acumuladas e gravadas no histórico numa só escrita
+    section_changes = []
+    
     if role == UserRole.CLIENTE:
         if process.get("client_id") != user["id"]:
             raise HTTPException(status_code=403, detail="Acesso negado")
         if data.personal_data:
-            await log_data_changes(process_id, user, process.get("personal_data"), data.personal_data.model_dump(), "dados pessoais")
             update_data["personal_data"] = data.personal_data.model_dump()
+            section_changes.append((process.get("personal_data"), update_data["personal_data"], "dados pessoais"))
         if data.financial_data:
-            await log_data_changes(process_id, user, process.get("financial_data"), data.financial_data.model_dump(), "dados financeiros")
             update_data["financial_data"] = data.financial_data.model_dump()
+            section_changes.append((process.get("financial_data"), update_data["financial_data"], "dados financeiros"))
     else:
         # Staff updates
         if data.personal_data and can_update_personal:
-            await log_data_changes(process_id, user, process.get("personal_data"), data.personal_data.model_dump(), "dados pessoais")
             update_data["personal_data"] = data.personal_data.model_dump()
+            section_changes.append((process.get("personal_data"), update_data["personal_data"], "dados pessoais"))
         
         if data.financial_data and can_update_financial:
-            await log_data_changes(process_id, user, process.get("financial_data"), data.financial_data.model_dump(), "dados financeiros")
             update_data["financial_data"] = data.financial_data.model_dump()
+            section_changes.append((process.get("financial_data"), update_data["financial_data"], "dados financeiros"))
         
         if data.real_estate_data and can_update_real_estate:
-            await log_data_changes(process_id, user, process.get("real_estate_data"), data.real_estate_data.model_dump(), "dados imobiliários")
             update_data["real_estate_data"] = data.real_estate_data.model_dump()
+            section_changes.append((process.get("real_estate_data"), update_data["real_estate_data"], "dados imobiliários"))
         
         if data.credit_data and can_update_credit:
-            await log_data_changes(process_id, user, process.get("credit_data"), data.credit_data.model_dump(), "dados de crédito")
             update_data["credit_data"] = data.credit_data.model_dump()
+            section_changes.append((process.get("credit_data"), update_data["credit_data"], "dados de crédito"))
         
         # Atualizar email e telefone do cliente
         if data.client_email is not None:
@@ -805,8 +794,10 @@ async def update_process(process_id: str, data: ProcessUpdate, user: dict = Depe
                     notification_type="status_change"
                 )
     
+    await log_sections_changes(process_id, user, section_changes)
     await db.processes.update_one({"id": process_id}, {"$set": update_data})
     updated = await db.processes.find_one({"id": process_id}, {"_id": 0})
+    await index_document(ENTITY_PROCESS, updated)
     
     # Sincronizar com Trello (nome e descrição do card)
     await sync_process_to_trello(updated)
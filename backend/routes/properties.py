@@ -8,6 +8,7 @@ import asyncio
 from typing import List, Optional
 from datetime import datetime, timezone
 from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks, UploadFile, File
+from pymongo.errors import DuplicateKeyError
 
 from database import db
 from models.property import (
@@ -17,25 +18,21 @@ from models.property import (
 from services.auth import get_current_user, require_roles
 from services.alerts import check_and_notify_matches_for_new_property
 from services.background_jobs import background_jobs, JobType, JobStatus
+from services.sequences import (
+    next_property_reference, register_manual_property_reference, discard_property_reference_block
+)
 from models.auth import UserRole
 
 router = APIRouter(prefix="/properties", tags=["Properties"])
 logger = logging.getLogger(__name__)
 
+# Máximo de erros de linha incluídos no registo agregado da importação
+MAX_LOGGED_ROW_ERRORS = 100
+
 
 async def get_next_reference() -> str:
     """Gera próxima referência interna (IMO-001, IMO-002...)"""
-    last = await db.properties.find_one(
-        {"internal_reference": {"$regex": "^IMO-"}},
-        sort=[("internal_reference", -1)]
-    )
-    if last and last.get("internal_reference"):
-        try:
-            num = int(last["internal_reference"].split("-")[1])
-            return f"IMO-{num + 1:03d}"
-        except (ValueError, IndexError):
-            pass
-    return "IMO-001"
+    return await next_property_reference()
 
 
 @router.get("", response_model=List[PropertyListItem])
@@ -138,7 +135,11 @@ async def create_property(
     now = datetime.now(timezone.utc).isoformat()
     
     # Gerar referência se não fornecida
-    internal_ref = data.internal_reference or await get_next_reference()
+    if data.internal_reference:
+        internal_ref = data.internal_reference
+        await register_manual_property_reference(internal_ref)
+    else:
+        internal_ref = await get_next_reference()
     
     # Obter nome do agente se atribuído
     agent_name = None
@@ -179,7 +180,19 @@ async def create_property(
         created_by=user.get("email")
     )
     
-    await db.properties.insert_one(property_doc.model_dump())
+    try:
+        await db.properties.insert_one(property_doc.model_dump())
+    except DuplicateKeyError:
+        if data.internal_reference:
+            raise HTTPException(status_code=409, detail=f"Referência {internal_ref} já existe")
+        # Valor de um bloco obsoleto (ex.: após reset noutro worker): reservar de novo uma vez
+        discard_property_reference_block()
+        internal_ref = await get_next_reference()
+        property_doc.internal_reference = internal_ref
+        try:
+            await db.properties.insert_one(property_doc.model_dump())
+        except DuplicateKeyError:
+            raise HTTPException(status_code=409, detail=f"Referência {internal_ref} já existe")
     
     logger.info(f"Imóvel criado: {property_doc.id} ({internal_ref}) por {user.get('email')}")
     
@@ -535,333 +548,34 @@ async def import_properties_from_excel(
 async def _process_excel_import(job_id: str, df, filename: str, user: dict):
     """
     Processa a importação Excel em background.
+    A normalização e validação são vectorizadas e as inserções feitas
+    em lote (ver services/property_import.py).
     """
-    import pandas as pd
-    
+    from services.property_import import run_property_import
+    from services.system_error_logger import system_error_logger
+
     await background_jobs.set_status(job_id, JobStatus.PROCESSING)
-    
+
     try:
-        # Normalizar nomes das colunas (lowercase, sem espaços)
-        df.columns = df.columns.str.lower().str.strip().str.replace(' ', '_')
-        
-        # Mapear colunas alternativas (para formatos HCPro, CRM externo, etc.)
-        column_aliases = {
-            # Título
-            'título': 'titulo',
-            # Preço
-            'preço': 'preco',
-            # Localização
-            'freguesia': 'localidade',
-            'rua': 'morada',
-            'código_postal': 'codigo_postal',
-            # Áreas
-            'área_útil': 'area_util',
-            'área_terreno': 'area_terreno',
-            'área_bruta': 'area_bruta',
-            # Características
-            'tipologia': 'quartos_raw',  # T1, T2, T3...
-            'ano_de_construção': 'ano_construcao',
-            'certificado_energético': 'certificado_energetico',
-            # Proprietário (formato HCPro)
-            'proprietário': 'proprietario_nome',
-            'proprietário,_email': 'proprietario_email',
-            'proprietário,_telemóvel': 'proprietario_telefone',
-            'proprietário,_telefone': 'proprietario_telefone2',
-            # Descrição
-            'descrição_pt': 'descricao',
-            'descrição': 'descricao',
-            # Referência
-            'referência': 'referencia_externa',
-            # Agência
-            'agência': 'agencia',
-            'agencia_responsável': 'agencia',
-            # Outros
-            'observações': 'notas',
-            'responsável': 'responsavel',
-        }
-        
-        # Aplicar aliases
-        df = df.rename(columns=column_aliases)
-        
-        # Mapear tipos de imóvel
-        tipo_map = {
-            'apartamento': 'apartamento',
-            'moradia': 'moradia',
-            'moradia_isolada': 'moradia',
-            'moradia_geminada': 'moradia',
-            'moradia_em_banda': 'moradia',
-            'terreno': 'terreno',
-            'loja': 'loja',
-            'escritorio': 'escritorio',
-            'escritório': 'escritorio',
-            'armazem': 'armazem',
-            'armazém': 'armazem',
-            'garagem': 'garagem',
-            'outro': 'outro',
-            't0': 'apartamento',
-            't1': 'apartamento',
-            't2': 'apartamento',
-            't3': 'apartamento',
-            't4': 'apartamento',
-            't5': 'apartamento',
-        }
-        
-        # Mapear estados
-        estado_map = {
-            'novo': 'novo',
-            'como_novo': 'como_novo',
-            'como novo': 'como_novo',
-            'bom': 'bom',
-            'para_recuperar': 'para_recuperar',
-            'para recuperar': 'para_recuperar',
-            'em_construcao': 'em_construcao',
-            'em construção': 'em_construcao',
-            'em construcao': 'em_construcao'
-        }
-        
-        results = {
-            "total": len(df),
-            "importados": 0,
-            "erros": [],
-            "ids_criados": []
-        }
-        
-        now = datetime.now(timezone.utc).isoformat()
-        total_rows = len(df)
-        
-        for idx, row in df.iterrows():
-            linha = idx + 2  # +2 porque idx começa em 0 e Excel tem cabeçalho
-            
-            # Atualizar progresso a cada 5 linhas para não sobrecarregar
-            if idx % 5 == 0:
-                await background_jobs.update_progress(
-                    job_id,
-                    current=idx,
-                    total=total_rows,
-                    message=f"A processar linha {linha} de {total_rows + 1}..."
-                )
-            
-            try:
-                # Helper function para obter valor da linha de forma segura
-                def get_value(keys, default=''):
-                    if isinstance(keys, str):
-                        keys = [keys]
-                    for key in keys:
-                        if key not in row.index:
-                            continue
-                        val = row[key]
-                        # Se é uma Series (colunas duplicadas), pegar o primeiro valor
-                        if hasattr(val, 'iloc'):
-                            val = val.iloc[0] if len(val) > 0 else None
-                        if val is not None and not pd.isna(val) and str(val).strip() not in ('nan', '', 'NaN'):
-                            return str(val).strip()
-                    return default
-                
-                # Helper para converter preço (remove € e espaços, trata formato europeu)
-                def parse_price(price_str):
-                    if price_str is None:
-                        return None
-                    # Se é uma Series, pegar o primeiro valor
-                    if hasattr(price_str, 'iloc'):
-                        price_str = price_str.iloc[0] if len(price_str) > 0 else None
-                    if price_str is None or pd.isna(price_str):
-                        return None
-                    price_str = str(price_str).replace('€', '').strip()
-                    # Se tem "/" provavelmente é venda/arrendamento, pegar o primeiro
-                    if '/' in price_str:
-                        price_str = price_str.split('/')[0].strip()
-                    # Formato europeu: 700.000 = 700000, 700,00 = 700.00
-                    # Se tem ponto e vírgula, é formato europeu
-                    if '.' in price_str and ',' in price_str:
-                        # 700.000,00 -> 700000.00
-                        price_str = price_str.replace('.', '').replace(',', '.')
-                    elif '.' in price_str:
-                        # Pode ser 700.000 (europeu) ou 700.00 (americano)
-                        # Se tem mais de 2 dígitos após o ponto, é europeu (separador de milhares)
-                        parts = price_str.split('.')
-                        if len(parts[-1]) == 3 and len(parts) > 1:
-                            # 700.000 -> 700000
-                            price_str = price_str.replace('.', '')
-                    elif ',' in price_str:
-                        # 700,00 -> 700.00
-                        price_str = price_str.replace(',', '.')
-                    try:
-                        return float(price_str)
-                    except ValueError:
-                        return None
-                
-                # Helper para extrair quartos de tipologia (T0, T1, T2, etc.)
-                def parse_tipologia(tipologia):
-                    if pd.isna(tipologia):
-                        return None
-                    tip = str(tipologia).upper().strip()
-                    if tip.startswith('T') and len(tip) >= 2:
-                        try:
-                            return int(tip[1])
-                        except ValueError:
-                            pass
-                    return None
-                
-                # Campos obrigatórios - com múltiplas fontes
-                titulo = get_value(['titulo', 'título'])
-                if not titulo:
-                    results["erros"].append({"linha": linha, "erro": "Título em falta"})
-                    continue
-                
-                preco = parse_price(row.get('preco', row.get('preço')))
-                if preco is None:
-                    results["erros"].append({"linha": linha, "erro": "Preço em falta ou inválido"})
-                    continue
-                
-                distrito = get_value(['distrito'])
-                if not distrito:
-                    results["erros"].append({"linha": linha, "erro": "Distrito em falta"})
-                    continue
-                
-                concelho = get_value(['concelho'])
-                if not concelho:
-                    results["erros"].append({"linha": linha, "erro": "Concelho em falta"})
-                    continue
-                
-                # Proprietário - pode estar em várias colunas
-                proprietario_nome = get_value(['proprietario_nome', 'proprietário', 'proprietário_nome'])
-                if not proprietario_nome:
-                    # Tentar usar agência como fallback
-                    proprietario_nome = get_value(['agencia', 'agencia_responsável'], 'Não informado')
-                
-                # Campos opcionais
-                tipo_raw = get_value(['tipo'], 'apartamento').lower()
-                tipologia = get_value(['quartos_raw', 'tipologia'])
-                
-                # Extrair quartos da tipologia se disponível
-                quartos = parse_tipologia(tipologia)
-                
-                # Mapear tipo de imóvel
-                if tipologia:
-                    # Se tem tipologia, usar título para determinar tipo
-                    if 'moradia' in titulo.lower() or 'moradia' in tipo_raw:
-                        tipo = 'moradia'
-                    elif 'armazém' in titulo.lower() or 'armazem' in tipo_raw:
-                        tipo = 'armazem'
-                    elif 'loja' in titulo.lower():
-                        tipo = 'loja'
-                    else:
-                        tipo = 'apartamento'
-                else:
-                    tipo = tipo_map.get(tipo_raw, 'apartamento')
-                
-                estado_raw = get_value(['estado'], 'bom').lower()
-                estado = estado_map.get(estado_raw, 'bom')
-                # Mapear estados adicionais
-                if 'em construção' in estado_raw or 'em construcao' in estado_raw:
-                    estado = 'em_construcao'
-                elif 'recupera' in estado_raw:
-                    estado = 'para_recuperar'
-                elif 'execução' in estado_raw:
-                    estado = 'em_construcao'
-                
-                # Criar documento
-                internal_ref = await get_next_reference()
-                
-                # Extrair áreas com helper
-                def parse_float(val):
-                    if pd.isna(val):
-                        return None
-                    try:
-                        return float(str(val).replace(',', '.').strip())
-                    except (ValueError, TypeError):
-                        return None
-                
-                def parse_int(val):
-                    if pd.isna(val):
-                        return None
-                    try:
-                        return int(float(str(val).replace(',', '.').strip()))
-                    except (ValueError, TypeError):
-                        return None
-                
-                property_doc = {
-                    "id": str(uuid.uuid4()),
-                    "internal_reference": internal_ref,
-                    "external_reference": get_value(['referencia_externa']) or None,
-                    "property_type": tipo,
-                    "title": titulo,
-                    "description": get_value(['descricao']) or None,
-                    "address": {
-                        "street": get_value(['morada', 'rua']) or None,
-                        "postal_code": get_value(['codigo_postal']) or None,
-                        "locality": get_value(['localidade', 'freguesia']) or None,
-                        "municipality": concelho,
-                        "district": distrito
-                    },
-                    "features": {
-                        "bedrooms": quartos or parse_int(row.get('quartos')),
-                        "bathrooms": parse_int(row.get('casas_banho')),
-                        "useful_area": parse_float(row.get('area_util')),
-                        "gross_area": parse_float(row.get('area_bruta')),
-                        "land_area": parse_float(row.get('area_terreno')),
-                        "construction_year": parse_int(row.get('ano_construcao')),
-                        "energy_certificate": get_value(['certificado_energetico']).upper() if get_value(['certificado_energetico']) else None,
-                        "extra_features": []
-                    },
-                    "condition": estado,
-                    "financials": {
-                        "asking_price": preco
-                    },
-                    "owner": {
-                        "name": proprietario_nome,
-                        "phone": get_value(['proprietario_telefone']) or None,
-                        "email": get_value(['proprietario_email']) or None
-                    },
-                    "agency": get_value(['agencia']) or None,
-                    "photos": [],
-                    "documents": [],
-                    "status": "em_analise",
-                    "notes": get_value(['notas', 'observações']) or None,
-                    "history": [{
-                        "timestamp": now,
-                        "event": "Importado via Excel",
-                        "user": user.get("email")
-                    }],
-                    "created_at": now,
-                    "updated_at": now,
-                    "created_by": user.get("email"),
-                    "view_count": 0,
-                    "inquiry_count": 0,
-                    "visit_count": 0,
-                    "interested_clients": []
-                }
-                
-                await db.properties.insert_one(property_doc)
-                results["importados"] += 1
-                results["ids_criados"].append(property_doc["id"])
-                
-                logger.info(f"Imóvel importado: {internal_ref} - {titulo}")
-                
-            except Exception as e:
-                logger.error(f"Erro na linha {linha}: {e}")
-                results["erros"].append({"linha": linha, "erro": str(e)})
-        
-        # Log de erros para análise usando o logger centralizado
+        results = await run_property_import(job_id, df, user, background_jobs)
+
+        # Log de erros para análise (um único registo agregado por importação)
         if results["erros"]:
-            from services.system_error_logger import system_error_logger
-            for err in results["erros"]:
-                await system_error_logger.log_error(
-                    error_type="excel_import_error",
-                    message=f"Erro ao importar linha {err['linha']}: {err['erro']}",
-                    component="properties",
-                    details={
-                        "linha": err["linha"],
-                        "erro": err["erro"],
-                        "ficheiro": filename
-                    },
-                    severity="warning",
-                    user_id=user.get("id")
-                )
-        
+            await system_error_logger.log_error(
+                error_type="excel_import_error",
+                message=f"Importação Excel com {len(results['erros'])} linhas rejeitadas",
+                component="properties",
+                details={
+                    "erros": results["erros"][:MAX_LOGGED_ROW_ERRORS],
+                    "total_erros": len(results["erros"]),
+                    "ficheiro": filename
+                },
+                severity="warning",
+                user_id=user.get("id")
+            )
+
         # Log de sucesso
         if results["importados"] > 0:
-            from services.system_error_logger import system_error_logger
             await system_error_logger.log_error(
                 error_type="excel_import_success",
                 message=f"Importação Excel concluída: {results['importados']}/{results['total']} imóveis",
@@ -876,11 +590,11 @@ async def _process_excel_import(job_id: str, df, filename: str, user: dict):
                 severity="info",
                 user_id=user.get("id")
             )
-        
+
         # Finalizar job com resultado
         await background_jobs.set_result(job_id, results)
         logger.info(f"Job {job_id} concluído: {results['importados']}/{results['total']} importados")
-    
+
     except Exception as e:
         logger.error(f"Job {job_id} falhou: {e}")
         await background_jobs.set_error(job_id, str(e))
@@ -28,6 +28,8 @@ from models.auth import UserRole
 from models.process import PublicClientRegistration
 from services.email import send_registration_confirmation, send_new_client_notification
 from services.alerts import notify_new_client_registration
+from services.search_index import ENTITY_PROCESS, index_document
+from services.process_service import sync_client_key
 from middleware.rate_limit import limiter
 
 limiter = Limiter(key_func=get_remote_address)
@@ -181,6 +183,8 @@ async def public_client_registration(request: Request, data: PublicClientRegistr
     }
     
     await db.processes.insert_one(process_doc)
+    await sync_client_key(process_doc["id"])
+    await index_document(ENTITY_PROCESS, process_doc)
     
     # Registar no histórico
     await db.history.insert_one({
@@ -8,7 +8,11 @@ from fastapi import APIRouter, Depends, Query
 import re
 
 from database import db
-from services.auth import get_current_user
+from models.auth import UserRole
+from services.auth import get_current_user, require_roles
+from services.search_index import (
+    ENTITY_PROCESS, ENTITY_TASK, search_entities, refresh_search_index
+)
 
 logger = logging.getLogger(__name__)
 
@@ -35,9 +39,6 @@ async def global_search(
     """
     search_term = q.strip()
     
-    # Criar regex para pesquisa case-insensitive
-    regex_pattern = {"$regex": search_term, "$options": "i"}
-    
     results = {
         "processes": [],
         "clients": [],
@@ -45,58 +46,22 @@ async def global_search(
     }
     
     try:
-        # Pesquisar processos
-        process_query = {
-            "$or": [
-                {"client_name": regex_pattern},
-                {"personal_data.nif": regex_pattern},
-                {"personal_data.email": regex_pattern},
-                {"process_type": regex_pattern},
-            ]
-        }
-        
-        processes = await db.processes.find(
-            process_query,
-            {
-                "_id": 0,
-                "id": 1,
-                "client_name": 1,
-                "process_type": 1,
-                "status": 1,
-                "personal_data.nif": 1
-            }
-        ).limit(limit).to_list(limit)
-        
-        results["processes"] = processes
+        # Pesquisar processos (índice de pesquisa: NIF/email exactos ou prefixos)
+        process_entries = await search_entities(ENTITY_PROCESS, search_term, limit=limit)
+        results["processes"] = [e["payload"] for e in process_entries]
         
         # Pesquisar tarefas
-        task_query = {
-            "$or": [
-                {"title": regex_pattern},
-                {"description": regex_pattern},
-                {"client_name": regex_pattern},
-            ]
-        }
-        
-        tasks = await db.tasks.find(
-            task_query,
-            {
-                "_id": 0,
-                "id": 1,
-                "title": 1,
-                "status": 1,
-                "priority": 1,
-                "client_name": 1
-            }
-        ).limit(limit).to_list(limit)
-        
-        results["tasks"] = tasks
+        task_entries = await search_entities(ENTITY_TASK, search_term, limit=limit)
+        results["tasks"] = [e["payload"] for e in task_entries]
         
         # Clientes são os mesmos processos mas com filtro diferente
         # (mantemos separado para compatibilidade com o frontend)
         results["clients"] = []
         
-        logger.info(f"Pesquisa global '{search_term}': {len(processes)} processos, {len(tasks)} tarefas")
+        logger.info(
+            f"Pesquisa global '{search_term}': {len(results['processes'])} processos, "
+            f"{len(results['tasks'])} tarefas"
+        )
         
     except Exception as e:
         logger.error(f"Erro na pesquisa global: {e}")
@@ -121,30 +86,25 @@ async def search_processes(
         process_type: Filtrar por tipo de processo
         limit: Limite de resultados
     """
-    search_term = q.strip()
-    regex_pattern = {"$regex": search_term, "$options": "i"}
-    
-    query = {
-        "$or": [
-            {"client_name": regex_pattern},
-            {"personal_data.nif": regex_pattern},
-            {"personal_data.email": regex_pattern},
-            {"personal_data.telefone": regex_pattern},
-        ]
-    }
-    
+    filters = {}
     if status:
-        query["status"] = status
-    
+        filters["status"] = status
     if process_type:
-        query["process_type"] = process_type
+        filters["process_type"] = process_type
     
-    processes = await db.processes.find(
-        query,
+    entries = await search_entities(ENTITY_PROCESS, q.strip(), limit=limit, filters=filters)
+    if not entries:
+        return []
+    
+    # Carregar documentos completos mantendo a ordem de relevância
+    ids = [e["entity_id"] for e in entries]
+    docs = await db.processes.find(
+        {"id": {"$in": ids}},
         {"_id": 0}
-    ).sort("updated_at", -1).limit(limit).to_list(limit)
+    ).to_list(len(ids))
+    by_id = {d["id"]: d for d in docs}
     
-    return processes
+    return [by_id[i] for i in ids if i in by_id]
 
 
 @router.get("/suggestions")
@@ -155,7 +115,7 @@ async def get_search_suggestions(
     """
     Obter sugestões de pesquisa baseadas no histórico e dados existentes.
     """
-    search_term = q.strip().lower()
+    search_term = re.escape(q.strip().lower())
     suggestions = set()
     
     # Buscar nomes de clientes que começam com o termo
@@ -177,3 +137,15 @@ async def get_search_suggestions(
         suggestions.add(task.get("title", ""))
     
     return list(suggestions)[:10]
+
+
+@router.post("/reindex")
+async def reindex_search(
+    full: bool = Query(False, description="Reconstruir todo o índice (remove entradas órfãs)"),
+    user: dict = Depends(require_roles([UserRole.ADMIN]))
+) -> Dict[str, Any]:
+    """
+    Reconciliar o índice de pesquisa com processos e tarefas.
+    Apenas admin.
+    """
+    return await refresh_search_index(full=full)
@@ -17,6 +17,8 @@ from database import db
 from models.task import TaskCreate, TaskUpdate, TaskResponse
 from services.auth import get_current_user
 from services.realtime_notifications import send_realtime_notification
+from services.search_index import ENTITY_TASK, index_document, remove_entity
+from services.enrichment import user_name_cache, enrich_tasks
 
 logger = logging.getLogger(__name__)
 
@@ -24,51 +26,13 @@ router = APIRouter(prefix="/tasks", tags=["Tasks"])
 
 
 async def get_user_names(user_ids: List[str]) -> dict:
-    """Obter nomes dos utilizadores por ID."""
-    users = await db.users.find(
-        {"id": {"$in": user_ids}},
-        {"_id": 0, "id": 1, "name": 1}
-    ).to_list(100)
-    return {u["id"]: u["name"] for u in users}
+    """Obter nomes dos utilizadores por ID (cache partilhada)."""
+    return await user_name_cache.get_names(user_ids)
 
 
 async def enrich_task(task: dict) -> dict:
     """Adicionar nomes de utilizadores, processo e info de prazo à tarefa."""
-    # Obter nomes dos utilizadores atribuídos
-    if task.get("assigned_to"):
-        user_names = await get_user_names(task["assigned_to"])
-        task["assigned_to_names"] = [user_names.get(uid, "Desconhecido") for uid in task["assigned_to"]]
-    
-    # Obter nome do criador
-    if task.get("created_by"):
-        creator_names = await get_user_names([task["created_by"]])
-        task["created_by_name"] = creator_names.get(task["created_by"], "Desconhecido")
-    
-    # Obter nome do processo/cliente
-    if task.get("process_id"):
-        process = await db.processes.find_one(
-            {"id": task["process_id"]},
-            {"_id": 0, "client_name": 1}
-        )
-        if process:
-            task["process_name"] = process.get("client_name", "")
-    
-    # Calcular se está atrasada e dias até vencer
-    if task.get("due_date") and not task.get("completed"):
-        try:
-            due = datetime.fromisoformat(task["due_date"].replace("Z", "+00:00"))
-            now = datetime.now(timezone.utc)
-            days_diff = (due - now).days
-            task["days_until_due"] = days_diff
-            task["is_overdue"] = days_diff < 0
-        except (ValueError, TypeError):
-            task["days_until_due"] = None
-            task["is_overdue"] = None
-    else:
-        task["days_until_due"] = None
-        task["is_overdue"] = None
-    
-    return task
+    return (await enrich_tasks([task]))[0]
 
 
 @router.post("", response_model=TaskResponse)
@@ -114,6 +78,7 @@ async def create_task(
     }
     
     await db.tasks.insert_one(task)
+    await index_document(ENTITY_TASK, task)
     logger.info(f"Tarefa criada: {task_id} por {current_user['name']}")
     
     # Enviar notificações para os utilizadores atribuídos
@@ -206,13 +171,8 @@ async def get_tasks(
     
     tasks = await db.tasks.find(query, {"_id": 0}).sort("created_at", -1).to_list(500)
     
-    # Enriquecer tarefas com nomes
-    enriched_tasks = []
-    for task in tasks:
-        enriched = await enrich_task(task)
-        enriched_tasks.append(TaskResponse(**enriched))
-    
-    return enriched_tasks
+    # Enriquecer tarefas com nomes (em lote)
+    return [TaskResponse(**task) for task in await enrich_tasks(tasks)]
 
 
 @router.get("/my-tasks", response_model=List[TaskResponse])
@@ -232,12 +192,7 @@ async def get_my_tasks(
     
     tasks = await db.tasks.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
     
-    enriched_tasks = []
-    for task in tasks:
-        enriched = await enrich_task(task)
-        enriched_tasks.append(TaskResponse(**enriched))
-    
-    return enriched_tasks
+    return [TaskResponse(**task) for task in await enrich_tasks(tasks)]
 
 
 @router.get("/{task_id}", response_model=TaskResponse)
@@ -291,6 +246,7 @@ async def update_task(
     await db.tasks.update_one({"id": task_id}, {"$set": update_data})
     
     updated_task = await db.tasks.find_one({"id": task_id}, {"_id": 0})
+    await index_document(ENTITY_TASK, updated_task)
     enriched = await enrich_task(updated_task)
     return TaskResponse(**enriched)
 
@@ -378,6 +334,7 @@ async def delete_task(
         raise HTTPException(status_code=403, detail="Sem permissão para eliminar esta tarefa")
     
     await db.tasks.delete_one({"id": task_id})
+    await remove_entity(ENTITY_TASK, task_id)
     logger.info(f"Tarefa {task_id} eliminada por {current_user['name']}")
     
     return {"success": True, "message": "Tarefa eliminada"}
@@ -16,12 +16,20 @@ from pydantic import BaseModel
 from database import db
 from models.auth import UserRole
 from services.auth import get_current_user, require_roles
+from services.sequences import sequences, PROCESS_NUMBER
+from services.search_index import ENTITY_PROCESS, ENTITY_TASK, clear_entities
+from services.process_service import refresh_client_keys
 from services.trello import (
     trello_service, TrelloService,
     trello_list_to_status, status_to_trello_list,
     build_card_description, parse_card_description,
     clean_email, clean_markdown_emails_in_text, TRELLO_TO_STATUS
 )
+from services.trello_sync import (
+    trello_sync_engine, load_member_matcher, MemberMatcher, CARD_ACTION_TYPES as WEBHOOK_ACTION_TYPES
+)
+from services.trello_webhooks import trello_webhook_processor
+from services.trello_push import trello_push_queue
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/trello", tags=["Trello Integration"])
@@ -49,98 +57,13 @@ async def find_matching_user(trello_members: list) -> dict:
     2. Username do Trello corresponde à parte local do email
     3. Nome exacto (case-insensitive)
     
-    Retorna dict com assigned_consultor_id e/ou assigned_mediador_id
+    Retorna dict com assigned_consultor_id e/ou assigned_mediador_id.
+    Para vários cards, carregar o matcher uma vez com `load_member_matcher()`.
     """
-    result = {
-        "assigned_consultor_id": None,
-        "assigned_mediador_id": None,
-        "consultor_name": None,
-        "mediador_name": None,
-        "matched_members": []
-    }
-    
     if not trello_members:
-        return result
-    
-    # Obter mapeamentos manuais
-    manual_mappings = await db.trello_member_mappings.find({}, {"_id": 0}).to_list(100)
-    manual_map = {m["trello_username"].lower(): m["user_id"] for m in manual_mappings}
-    
-    # Obter todos os utilizadores ativos da aplicação
-    users = await db.users.find(
-        {"is_active": {"$ne": False}},
-        {"_id": 0, "id": 1, "name": 1, "email": 1, "role": 1}
-    ).to_list(500)
-    
-    users_by_id = {u["id"]: u for u in users}
-    users_by_email = {u.get("email", "").lower().strip(): u for u in users if u.get("email")}
-    users_by_name = {u["name"].lower().strip(): u for u in users}
-    users_by_email_local = {}
-    for u in users:
-        if u.get("email") and "@" in u["email"]:
-            local_part = u["email"].split("@")[0].lower().strip()
-            users_by_email_local[local_part] = u
-    
-    for member in trello_members:
-        member_name = member.get("fullName", "").lower().strip()
-        member_username = member.get("username", "").lower().strip()
-        member_email = member.get("email", "").lower().strip()
-        
-        matched_user = None
-        match_method = None
-        
-        # 1. PRIORIDADE MÁXIMA: Mapeamento manual
-        if member_username in manual_map:
-            user_id = manual_map[member_username]
-            if user_id in users_by_id:
-                matched_user = users_by_id[user_id]
-                match_method = "manual"
-        
-        # 2. Username do Trello corresponde à parte local do email
-        if not matched_user and member_username:
-            for local_part, user in users_by_email_local.items():
-                username_clean = ''.join(c for c in member_username if not c.isdigit())
-                if member_username.startswith(local_part) or local_part.startswith(username_clean):
-                    matched_user = user
-                    match_method = "email_local"
-                    break
-        
-        # 3. Email exacto do Trello
-        if not matched_user and member_email and member_email in users_by_email:
-            matched_user = users_by_email[member_email]
-            match_method = "email_exact"
-        
-        # 4. Fallback: Nome exacto
-        if not matched_user and member_name and member_name in users_by_name:
-            matched_user = users_by_name[member_name]
-            match_method = "name"
-        
-        if matched_user:
-            result["matched_members"].append({
-                "trello_member": member.get("fullName"),
-                "trello_email": member_email or member_username,
-                "matched_user": matched_user["name"],
-                "matched_email": matched_user.get("email"),
-                "role": matched_user["role"],
-                "match_method": match_method
-            })
-            
-            # Atribuir baseado no papel do utilizador
-            role = matched_user["role"]
-            
-            # Papéis que podem ser consultores
-            if role in ["consultor", "diretor", "admin", "ceo"]:
-                if not result["assigned_consultor_id"]:
-                    result["assigned_consultor_id"] = matched_user["id"]
-                    result["consultor_name"] = matched_user["name"]
-            
-            # Papéis que podem ser intermediários
-            if role in ["mediador", "intermediario", "intermediario_credito", "diretor"]:
-                if not result["assigned_mediador_id"]:
-                    result["assigned_mediador_id"] = matched_user["id"]
-                    result["mediador_name"] = matched_user["name"]
-    
-    return result
+        return MemberMatcher([], []).match([])
+    matcher = await load_member_matcher()
+    return matcher.match(trello_members)
 
 
 class TrelloConfig(BaseModel):
@@ -388,12 +311,14 @@ async def reset_and_sync_from_trello(
         # Apagar processos e dados relacionados
         del_processes = await db.processes.delete_many({})
         result["deleted"]["processes"] = del_processes.deleted_count
+        await sequences.reset(PROCESS_NUMBER)
         
         del_deadlines = await db.deadlines.delete_many({})
         result["deleted"]["deadlines"] = del_deadlines.deleted_count
         
         del_tasks = await db.tasks.delete_many({})
         result["deleted"]["tasks"] = del_tasks.deleted_count
+        await clear_entities(ENTITY_PROCESS, ENTITY_TASK)
         
         del_activities = await db.activities.delete_many({})
         result["deleted"]["activities"] = del_activities.deleted_count
@@ -417,6 +342,7 @@ async def reset_and_sync_from_trello(
         logger.info("A importar do Trello...")
         lists = await trello_service.get_lists(force_refresh=True)
         all_cards = await trello_service.get_cards_with_details()
+        member_matcher = await load_member_matcher()
         
         logger.info(f"Encontrados {len(all_cards)} cards no Trello")
         
@@ -441,7 +367,7 @@ async def reset_and_sync_from_trello(
                 
                 # Gerar ID e número do processo
                 process_id = str(uuid.uuid4())
-                process_number = result["imported"]["processes"] + 1
+                process_number = await sequences.next_value(PROCESS_NUMBER)
                 
                 # Extrair labels do Trello
                 trello_labels = [l.get("name") for l in card.get("labels", []) if l.get("name")]
@@ -458,7 +384,7 @@ async def reset_and_sync_from_trello(
                 assigned_member_ids = card.get("idMembers", [])
                 
                 # ATRIBUIÇÃO AUTOMÁTICA: Encontrar utilizadores correspondentes
-                assignment = await find_matching_user(trello_members)
+                assignment = member_matcher.match(trello_members)
                 
                 # Criar novo processo com todos os dados do Trello
                 new_process = {
@@ -539,6 +465,8 @@ async def reset_and_sync_from_trello(
             except Exception as e:
                 result["imported"]["errors"].append(f"Erro no card {card.get('name', 'N/A')}: {str(e)}")
         
+        await refresh_client_keys()
+        
         result["message"] = f"Reset completo! Apagados {result['deleted']['processes']} processos. Importados {result['imported']['processes']} do Trello com {result['imported']['activities']} atividades e {result['imported']['assignments']} atribuições automáticas."
         logger.info(result["message"])
         
@@ -565,119 +493,28 @@ async def reset_and_sync_from_trello(
 @router.post("/sync/from-trello", response_model=SyncResult)
 async def sync_from_trello(
     background_tasks: BackgroundTasks,
-    user: dict = Depends(require_roles([UserRole.ADMIN, UserRole.CEO]))
+    user: dict = Depends(require_roles([UserRole.ADMIN, UserRole.CEO])),
+    full: bool = False
 ):
-    """Importar/sincronizar cards do Trello para o sistema com atribuição automática."""
+    """
+    Importar/sincronizar cards do Trello para o sistema com atribuição automática.
+    
+    Por omissão é incremental (ações do board desde a última sincronização);
+    `full=true` força a reconciliação completa de todos os cards.
+    """
     result = SyncResult(success=True, message="")
-    assignments_made = 0
     
     try:
-        lists = await trello_service.get_lists()
-        # Usar get_cards_with_details para obter membros
-        all_cards = await trello_service.get_cards_with_details()
-        
-        for card in all_cards:
-            try:
-                # Encontrar a lista do card
-                list_info = next((l for l in lists if l["id"] == card["idList"]), None)
-                if not list_info:
-                    continue
-                
-                # Converter para status do sistema
-                status = trello_list_to_status(list_info["name"])
-                if not status:
-                    result.errors.append(f"Lista não mapeada: {list_info['name']}")
-                    continue
-                
-                # Obter membros do card para atribuição automática
-                trello_members = card.get("members", [])
-                assignment = await find_matching_user(trello_members)
-                
-                # Verificar se já existe (pelo trello_card_id ou nome)
-                existing = await db.processes.find_one({
-                    "$or": [
-                        {"trello_card_id": card["id"]},
-                        {"client_name": card["name"]}
-                    ]
-                })
-                
-                if existing:
-                    # Atualizar processo existente
-                    update_data = {"status": status, "trello_card_id": card["id"]}
-                    
-                    # Atribuir utilizadores se não estiverem já atribuídos
-                    if assignment["assigned_consultor_id"] and not existing.get("assigned_consultor_id"):
-                        update_data["assigned_consultor_id"] = assignment["assigned_consultor_id"]
-                        update_data["consultor_name"] = assignment["consultor_name"]
-                        assignments_made += 1
-                    
-                    if assignment["assigned_mediador_id"] and not existing.get("assigned_mediador_id"):
-                        update_data["assigned_mediador_id"] = assignment["assigned_mediador_id"]
-                        update_data["mediador_name"] = assignment["mediador_name"]
-                        assignments_made += 1
-                    
-                    # Guardar membros do Trello para referência
-                    if trello_members:
-                        update_data["trello_members"] = [m.get("fullName") for m in trello_members if m.get("fullName")]
-                    
-                    # Só atualizar se há mudanças
-                    if existing.get("status") != status or len(update_data) > 2:
-                        update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
-                        await db.processes.update_one(
-                            {"id": existing["id"]},
-                            {"$set": update_data}
-                        )
-                        result.updated += 1
-                else:
-                    # Criar novo processo
-                    card_data = parse_card_description(card.get("desc", ""))
-                    
-                    new_process = {
-                        "id": str(uuid.uuid4()),
-                        "client_name": card["name"],
-                        "client_email": clean_email(card_data.get("email", "")),
-                        "client_phone": card_data.get("telefone", ""),
-                        "status": status,
-                        "trello_card_id": card["id"],
-                        "trello_list_id": card["idList"],
-                        "created_at": datetime.now(timezone.utc).isoformat(),
-                        "updated_at": datetime.now(timezone.utc).isoformat(),
-                        "source": "trello_import",
-                        "personal_data": {},
-                        "financial_data": {},
-                        "real_estate_data": {},
-                        "credit_data": {},
-                        # Atribuição automática
-                        "assigned_consultor_id": assignment["assigned_consultor_id"],
-                        "assigned_mediador_id": assignment["assigned_mediador_id"],
-                        "consultor_name": assignment["consultor_name"],
-                        "mediador_name": assignment["mediador_name"],
-                        # Guardar membros do Trello para referência
-                        "trello_members": [m.get("fullName") for m in trello_members if m.get("fullName")],
-                    }
-                    
-                    if assignment["assigned_consultor_id"] or assignment["assigned_mediador_id"]:
-                        assignments_made += 1
-                    
-                    await db.processes.insert_one(new_process)
-                    result.created += 1
-                    
-            except Exception as e:
-                result.errors.append(f"Erro no card {card.get('name', 'N/A')}: {str(e)}")
-        
-        # Guardar timestamp da última sincronização
-        await db.settings.update_one(
-            {"key": "trello_last_sync"},
-            {"$set": {
-                "key": "trello_last_sync",
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "by": user["name"]
-            }},
-            upsert=True
+        stats = await trello_sync_engine.sync(full=full, by=user["name"])
+        result.created = stats["created"]
+        result.updated = stats["updated"]
+        result.errors = stats["errors"]
+        mode = "completa" if stats["mode"] == "full" else "incremental"
+        result.message = (
+            f"Sincronização {mode} concluída: {result.created} criados, {result.updated} atualizados, "
+            f"{stats['assignments']} atribuições automáticas"
         )
         
-        result.message = f"Sincronização concluída: {result.created} criados, {result.updated} atualizados, {assignments_made} atribuições automáticas"
-        
     except Exception as e:
         logger.error(f"Erro na sincronização: {e}")
         result.success = False
@@ -721,6 +558,7 @@ async def assign_existing_processes(
         # Obter cards do Trello para obter membros atualizados
         all_cards = await trello_service.get_cards_with_details()
         cards_by_id = {c["id"]: c for c in all_cards}
+        member_matcher = await load_member_matcher()
         
         for process in processes:
             try:
@@ -739,7 +577,7 @@ async def assign_existing_processes(
                     continue
                 
                 # Encontrar correspondência
-                assignment = await find_matching_user(trello_members)
+                assignment = member_matcher.match(trello_members)
                 
                 update_data = {}
                 
@@ -778,80 +616,23 @@ async def assign_existing_processes(
 async def sync_to_trello(
     user: dict = Depends(require_roles([UserRole.ADMIN, UserRole.CEO]))
 ):
-    """Exportar/sincronizar processos do sistema para o Trello."""
+    """
+    Exportar/sincronizar processos do sistema para o Trello.
+    Só envia cards com alterações desde o último envio; cria os que faltam.
+    """
     result = SyncResult(success=True, message="")
     
     try:
-        # Obter listas do Trello
-        lists = await trello_service.get_lists()
-        list_map = {l["name"].lower().strip(): l["id"] for l in lists}
-        
-        # Obter todos os processos
-        processes = await db.processes.find({}, {"_id": 0}).to_list(1000)
-        
-        for process in processes:
-            try:
-                # Determinar lista de destino
-                status = process.get("status", "clientes_espera")
-                trello_list_name = status_to_trello_list(status)
-                
-                if not trello_list_name:
-                    result.errors.append(f"Status não mapeado: {status}")
-                    continue
-                
-                list_id = list_map.get(trello_list_name.lower())
-                if not list_id:
-                    result.errors.append(f"Lista não encontrada no Trello: {trello_list_name}")
-                    continue
-                
-                # Construir descrição do card
-                description = build_card_description(process)
-                
-                if process.get("trello_card_id"):
-                    # Atualizar card existente
-                    try:
-                        await trello_service.update_card(
-                            process["trello_card_id"],
-                            name=process["client_name"],
-                            desc=description,
-                            idList=list_id
-                        )
-                        result.updated += 1
-                    except Exception as e:
-                        # Card pode ter sido eliminado no Trello
-                        if "404" in str(e):
-                            # Criar novo card
-                            card = await trello_service.create_card(
-                                list_id=list_id,
-                                name=process["client_name"],
-                                desc=description
-                            )
-                            await db.processes.update_one(
-                                {"id": process["id"]},
-                                {"$set": {"trello_card_id": card["id"], "trello_list_id": list_id}}
-                            )
-                            result.created += 1
-                        else:
-                            raise
-                else:
-                    # Criar novo card
-                    card = await trello_service.create_card(
-                        list_id=list_id,
-                        name=process["client_name"],
-                        desc=description
-                    )
-                    
-                    # Guardar referência
-                    await db.processes.update_one(
-                        {"id": process["id"]},
-                        {"$set": {"trello_card_id": card["id"], "trello_list_id": list_id}}
-                    )
-                    result.created += 1
-                    
-            except Exception as e:
-                result.errors.append(f"Erro no processo {process.get('client_name', 'N/A')}: {str(e)}")
-        
-        result.message = f"Sincronização concluída: {result.created} criados, {result.updated} atualizados"
+        processes = await db.processes.find({}, {"_id": 0}).to_list(None)
+        stats = await trello_push_queue.push_processes(processes, create_missing=True)
+        
+        result.created = stats["created"]
+        result.updated = stats["updated"]
+        result.errors = stats["errors"]
+        result.message = (
+            f"Sincronização concluída: {result.created} criados, {result.updated} atualizados, "
+            f"{stats['unchanged']} sem alterações"
+        )
         
     except Exception as e:
         logger.error(f"Erro na sincronização: {e}")
@@ -863,11 +644,12 @@ async def sync_to_trello(
 
 @router.post("/sync/full", response_model=SyncResult)
 async def full_sync(
-    user: dict = Depends(require_roles([UserRole.ADMIN, UserRole.CEO]))
+    user: dict = Depends(require_roles([UserRole.ADMIN, UserRole.CEO])),
+    full: bool = False
 ):
-    """Sincronização completa bidirecional."""
+    """Sincronização bidirecional (importação incremental salvo `full=true`)."""
     # Primeiro importar do Trello
-    from_result = await sync_from_trello(BackgroundTasks(), user)
+    from_result = await sync_from_trello(BackgroundTasks(), user, full=full)
     
     # Depois exportar para o Trello
     to_result = await sync_to_trello(user)
@@ -1016,12 +798,13 @@ async def get_trello_card_comments(
         raise HTTPException(status_code=500, detail=f"Erro ao obter comentários: {str(e)}")
 
 @router.post("/webhook")
-async def trello_webhook(request: Request, background_tasks: BackgroundTasks):
+async def trello_webhook(request: Request):
     """
     Endpoint para receber webhooks do Trello.
     O Trello envia notificações quando há alterações no board.
     
-    Eventos processados:
+    As ações são gravadas e processadas por card após uma janela de
+    debounce (ver services/trello_webhooks.py). Eventos aplicados:
     - createCard: Cartão criado
     - updateCard: Cartão atualizado/movido
     - deleteCard: Cartão eliminado
@@ -1032,23 +815,11 @@ async def trello_webhook(request: Request, background_tasks: BackgroundTasks):
     try:
         body = await request.json()
         action = body.get("action", {})
-        action_type = action.get("type", "")
         
-        logger.info(f"Trello webhook: {action_type}")
+        logger.info(f"Trello webhook: {action.get('type', '')}")
         
-        # Processar diferentes tipos de ações
-        if action_type == "createCard":
-            await handle_card_created(action)
-        elif action_type == "updateCard":
-            await handle_card_updated(action)
-        elif action_type == "deleteCard":
-            await handle_card_deleted(action)
-        elif action_type == "moveCardToBoard":
-            await handle_card_moved(action)
-        elif action_type == "addMemberToCard":
-            await handle_member_added_to_card(action)
-        elif action_type == "removeMemberFromCard":
-            await handle_member_removed_from_card(action)
+        if action.get("type") in WEBHOOK_ACTION_TYPES:
+            await trello_webhook_processor.ingest(action)
         
         return {"status": "ok"}
         
@@ -1063,225 +834,6 @@ async def trello_webhook_verify():
     return {"status": "ok"}
 
 
-async def handle_card_created(action: dict):
-    """Processar criação de card no Trello."""
-    card = action.get("data", {}).get("card", {})
-    list_info = action.get("data", {}).get("list", {})
-    
-    if not card.get("id"):
-        return
-    
-    # Verificar se já existe
-    existing = await db.processes.find_one({"trello_card_id": card["id"]})
-    if existing:
-        return
-    
-    # Converter status
-    status = trello_list_to_status(list_info.get("name", ""))
-    if not status:
-        status = "clientes_espera"
-    
-    # Criar processo
-    new_process = {
-        "id": str(uuid.uuid4()),
-        "client_name": card.get("name", "Sem nome"),
-        "status": status,
-        "trello_card_id": card["id"],
-        "trello_list_id": list_info.get("id"),
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat(),
-        "source": "trello_webhook",
-        "personal_data": {},
-        "financial_data": {},
-        "real_estate_data": {},
-        "credit_data": {},
-    }
-    
-    await db.processes.insert_one(new_process)
-    logger.info(f"Processo criado via Trello: {card.get('name')}")
-
-
-async def handle_card_updated(action: dict):
-    """Processar atualização de card no Trello."""
-    card = action.get("data", {}).get("card", {})
-    list_after = action.get("data", {}).get("listAfter", {})
-    old_data = action.get("data", {}).get("old", {})
-    
-    if not card.get("id"):
-        return
-    
-    # Encontrar processo
-    process = await db.processes.find_one({"trello_card_id": card["id"]})
-    if not process:
-        # Se não existe, criar novo processo
-        await handle_card_created(action)
-        return
-    
-    update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
-    
-    # Atualizar nome se mudou
-    if card.get("name") and card["name"] != process.get("client_name"):
-        update_data["client_name"] = card["name"]
-        logger.info(f"Nome atualizado via Trello: {process.get('client_name')} -> {card['name']}")
-    
-    # Atualizar descrição se mudou (extrair dados)
-    if "desc" in old_data or card.get("desc"):
-        desc = card.get("desc", "")
-        parsed = parse_card_description(desc)
-        
-        if parsed.get("email"):
-            update_data["client_email"] = clean_email(parsed["email"])
-        if parsed.get("telefone") or parsed.get("phone"):
-            update_data["client_phone"] = parsed.get("telefone") or parsed.get("phone")
-        if parsed.get("nif"):
-            update_data["client_nif"] = parsed["nif"]
-    
-    # Atualizar status se mudou de lista
-    if list_after.get("name"):
-        new_status = trello_list_to_status(list_after["name"])
-        if new_status and new_status != process.get("status"):
-            update_data["status"] = new_status
-            update_data["trello_list_id"] = list_after.get("id")
-            logger.info(f"Processo movido via Trello: {process['client_name']} -> {new_status}")
-    
-    if len(update_data) > 1:  # Mais do que apenas updated_at
-        await db.processes.update_one({"id": process["id"]}, {"$set": update_data})
-        logger.info(f"Processo atualizado via webhook Trello: {process['client_name']}")
-
-
-async def handle_card_deleted(action: dict):
-    """Processar eliminação de card no Trello."""
-    card = action.get("data", {}).get("card", {})
-    
-    if not card.get("id"):
-        return
-    
-    # Encontrar e marcar como eliminado (não eliminamos dados)
-    await db.processes.update_one(
-        {"trello_card_id": card["id"]},
-        {"$set": {
-            "trello_deleted": True,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    logger.info(f"Card eliminado no Trello: {card.get('id')}")
-
-
-async def handle_card_moved(action: dict):
-    """Processar movimentação de card entre listas."""
-    await handle_card_updated(action)
-
-
-async def handle_member_added_to_card(action: dict):
-    """
-    Processar adição de membro ao cartão.
-    Tenta atribuir como consultor ou mediador baseado no mapeamento.
-    """
-    card = action.get("data", {}).get("card", {})
-    member = action.get("member", {})
-    
-    if not card.get("id") or not member.get("username"):
-        return
-    
-    trello_username = member.get("username", "").lower()
-    
-    # Encontrar processo
-    process = await db.processes.find_one(
-        {"trello_card_id": card["id"]},
-        {"_id": 0}
-    )
-    
-    if not process:
-        logger.warning(f"Processo não encontrado para card {card['id']}")
-        return
-    
-    # Procurar mapeamento de utilizador
-    mapping = await db.trello_member_mappings.find_one(
-        {"trello_username": trello_username},
-        {"_id": 0}
-    )
-    
-    if not mapping:
-        logger.info(f"Membro @{trello_username} não mapeado")
-        return
-    
-    user_id = mapping.get("user_id")
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    
-    if not user:
-        return
-    
-    # Determinar se é consultor ou mediador
-    update_fields = {"updated_at": datetime.now(timezone.utc).isoformat()}
-    
-    if user.get("role") in ["consultor", "admin", "ceo", "diretor"]:
-        update_fields["assigned_consultor_id"] = user_id
-        update_fields["consultor_name"] = user.get("name")
-        logger.info(f"Consultor {user['name']} atribuído a {process['client_name']} via Trello")
-    elif user.get("role") == "mediador":
-        update_fields["assigned_mediador_id"] = user_id
-        update_fields["mediador_name"] = user.get("name")
-        logger.info(f"Mediador {user['name']} atribuído a {process['client_name']} via Trello")
-    
-    if len(update_fields) > 1:
-        await db.processes.update_one(
-            {"id": process["id"]},
-            {"$set": update_fields}
-        )
-
-
-async def handle_member_removed_from_card(action: dict):
-    """
-    Processar remoção de membro do cartão.
-    """
-    card = action.get("data", {}).get("card", {})
-    member = action.get("member", {})
-    
-    if not card.get("id") or not member.get("username"):
-        return
-    
-    trello_username = member.get("username", "").lower()
-    
-    # Encontrar processo
-    process = await db.processes.find_one(
-        {"trello_card_id": card["id"]},
-        {"_id": 0}
-    )
-    
-    if not process:
-        return
-    
-    # Procurar mapeamento
-    mapping = await db.trello_member_mappings.find_one(
-        {"trello_username": trello_username},
-        {"_id": 0}
-    )
-    
-    if not mapping:
-        return
-    
-    user_id = mapping.get("user_id")
-    
-    # Verificar se era o consultor ou mediador atribuído
-    update_fields = {"updated_at": datetime.now(timezone.utc).isoformat()}
-    
-    if process.get("assigned_consultor_id") == user_id:
-        update_fields["assigned_consultor_id"] = None
-        update_fields["consultor_name"] = None
-        logger.info(f"Consultor removido de {process['client_name']} via Trello")
-    
-    if process.get("assigned_mediador_id") == user_id:
-        update_fields["assigned_mediador_id"] = None
-        update_fields["mediador_name"] = None
-        logger.info(f"Mediador removido de {process['client_name']} via Trello")
-    
-    if len(update_fields) > 1:
-        await db.processes.update_one(
-            {"id": process["id"]},
-            {"$set": update_fields}
-        )
-
-
 # === Gestão de Webhooks ===
 
 @router.post("/webhook/setup")
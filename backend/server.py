@@ -1,6 +1,7 @@
 import os
 import subprocess
 import logging
+import traceback
 from datetime import datetime, timezone
 
 # Garantir que libmagic está instalado (necessário para python-magic)
@@ -43,6 +44,8 @@ from config import (
 )
 from database import db, client
 from middleware.rate_limit import limiter
+from middleware.metrics import metrics_authorized, metrics_enabled, metrics_middleware, render_metrics
+from middleware.loop_watchdog import loop_watchdog
 from routes import (
     auth_router, processes_router, admin_router, users_router,
     deadlines_router, activities_router,
@@ -155,6 +158,13 @@ async def add_security_headers(request, call_next):
     return response
 
 
+# ====================================================================
+# MÉTRICAS (latência por rota, pedidos em curso, Server-Timing)
+# Ver middleware/metrics.py; expostas em /metrics
+# ====================================================================
+app.middleware("http")(metrics_middleware)
+
+
 # CONFIGURAÇÃO DE RATE LIMIT
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
@@ -168,7 +178,7 @@ if os.getenv("TESTING") == "true":
 # EXCEPTION HANDLER GLOBAL - Registar erros no sistema de logs
 # ====================================================================
 from fastapi import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.exceptions import HTTPException
 
 @app.exception_handler(HTTPException)
@@ -236,7 +246,8 @@ async def general_exception_handler(request: Request, exc: Exception):
                 "exception_type": type(exc).__name__,
             },
             severity="critical",
-            request_path=str(request.url.path)
+            request_path=str(request.url.path),
+            stack="".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
         )
     except Exception as log_error:
         logger.error(f"Erro ao registar excepção: {log_error}")
@@ -283,6 +294,15 @@ app.include_router(search_router, prefix="/api")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Métricas internas em formato Prometheus (só com METRICS_TOKEN)."""
+    if not metrics_enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not metrics_authorized(request.headers.get("authorization")):
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=CORS_ALLOW_CREDENTIALS,
@@ -306,6 +326,23 @@ async def startup():
     except Exception as e:
         logger.warning(f"⚠️ Erro ao criar índices (não fatal): {e}")
     
+    # Preparar índice de pesquisa e chaves de cliente em background (não bloqueia arranque)
+    try:
+        import asyncio
+        from services.search_index import ensure_search_index_populated
+        from services.document_search import ensure_document_search_index
+        from services.document_categorization_jobs import resume_interrupted_categorizations
+        from services.process_service import refresh_client_keys
+        from services.ai_usage_tracker import ai_usage_tracker
+        asyncio.create_task(ensure_search_index_populated())
+        asyncio.create_task(ensure_document_search_index())
+        asyncio.create_task(resume_interrupted_categorizations())
+        asyncio.create_task(refresh_client_keys())
+        asyncio.create_task(ai_usage_tracker.ensure_rollups())
+        loop_watchdog.start()
+    except Exception as e:
+        logger.warning(f"⚠️ Erro ao preparar índice de pesquisa (não fatal): {e}")
+    
     # Tenta conectar Redis sem falhar a app se não existir
     try:
         from services.task_queue import task_queue
@@ -315,6 +352,27 @@ async def startup():
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    loop_watchdog.stop()
+    
+    # Gravar histórico pendente em buffer antes de fechar a ligação
+    try:
+        from services.history import history_recorder
+        await history_recorder.flush()
+    except Exception as e:
+        logger.warning(f"Erro ao gravar histórico pendente: {e}")
+    
+    try:
+        from services.ai_usage_tracker import ai_usage_tracker
+        await ai_usage_tracker.flush()
+    except Exception as e:
+        logger.warning(f"Erro ao gravar uso de IA pendente: {e}")
+    
+    try:
+        from services.system_error_logger import system_error_logger
+        await system_error_logger.flush()
+    except Exception as e:
+        logger.warning(f"Erro ao gravar erros do sistema pendentes: {e}")
+    
     # CORREÇÃO CRÍTICA: Não fechar a conexão DB se estivermos a correr testes!
     # O pytest reutiliza a conexão global, se a fecharmos aqui, o próximo teste falha.
     if os.getenv("TESTING") == "true":
@@ -39,6 +39,8 @@ from tenacity import (
     before_sleep_log
 )
 
+from middleware.metrics import track_call
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -411,7 +413,8 @@ async def call_openai_api(payload: dict, timeout: float = 60.0) -> dict:
         
         # Enviar mensagem
         user_message = UserMessage(text=user_text)
-        response = await chat.send_message(user_message)
+        with track_call("llm", "ai_document_text"):
+            response = await chat.send_message(user_message)
         
         # Formatar resposta no formato esperado
         return {
@@ -554,7 +557,8 @@ async def analyze_with_vision(base64_content: str, mime_type: str, document_type
         )
         
         # Enviar mensagem e obter resposta
-        ai_response = await chat.send_message(user_message)
+        with track_call("llm", "ai_document_vision"):
+            ai_response = await chat.send_message(user_message)
         extracted_data = parse_ai_response(ai_response, document_type)
         
         return {
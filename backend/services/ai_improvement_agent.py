@@ -14,6 +14,7 @@ import logging
 from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional, Any
 from database import db
+from middleware.metrics import track_call
 
 logger = logging.getLogger(__name__)
 
@@ -279,7 +280,8 @@ class AIImprovementAgent:
             ).with_model("openai", "gpt-4o-mini")
             
             user_message = UserMessage(text=context)
-            response = await chat.send_message(user_message)
+            with track_call("llm", "improvement_agent"):
+                response = await chat.send_message(user_message)
             
             if response:
                 return {
@@ -22,6 +22,7 @@ logger = logging.getLogger(__name__)
 
 # Importar configurações
 from config import GEMINI_API_KEY, EMERGENT_LLM_KEY, AI_CONFIG_DEFAULTS, AI_MODELS
+from middleware.metrics import track_call
 
 
 async def get_ai_config() -> Dict[str, Any]:
@@ -132,7 +133,8 @@ async def _call_gemini(content: str, task_type: str, context: str, model: str) -
             gemini_model = model.replace("gemini-", "gemini-")
         
         model_instance = genai.GenerativeModel(gemini_model)
-        response = model_instance.generate_content(prompt)
+        with track_call("llm", "page_analyzer_gemini"):
+            response = model_instance.generate_content(prompt)
         
         result_text = response.text.strip()
         
@@ -172,7 +174,8 @@ async def _call_openai(content: str, task_type: str, context: str, model: str) -
             system_message="Responde sempre em formato JSON estruturado. Usa português de Portugal."
         ).with_model("openai", model)
         
-        response = await chat.send_message(UserMessage(text=prompt))
+        with track_call("llm", "page_analyzer_openai"):
+            response = await chat.send_message(UserMessage(text=prompt))
         
         # Limpar markdown
         result_text = response.strip()
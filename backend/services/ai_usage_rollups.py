@@ -0,0 +1,202 @@
+"""
+====================================================================
+ROLLUPS DE USO DE IA - CREDITOIMO
+====================================================================
+Agregados pré-calculados de `ai_usage_logs` por hora, dia e mês,
+mantidos pelo flush do `AIUsageTracker` (um `bulk_write` de `$inc`).
+
+Colecção:
+    ai_usage_rollups  {rollup_id, granularity, bucket, task, model,
+                       provider, <contadores>, latency: {"b<i>": n}}
+
+Buckets (UTC): hora "2026-10-18T10", dia "2026-10-18", mês "2026-10".
+
+Tempos de resposta: histograma logarítmico (bin i cobre
+(γ^(i-1), γ^i] ms, γ = SKETCH_GAMMA). É fundível por soma (`$inc`),
+pelo que p50/p95 de qualquer intervalo saem dos buckets sem reler os
+logs, com erro relativo ≈ (γ-1)/(γ+1).
+
+Um intervalo arbitrário é decomposto em meses, dias e horas completos
+(`plan_buckets`): no máximo ~100 documentos por tarefa/modelo,
+independentemente do tamanho do intervalo.
+====================================================================
+"""
+import math
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+SKETCH_GAMMA = 1.1
+_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+ROLLUP_COUNTERS = (
+    "call_count", "success_count", "error_count", "total_input_tokens",
+    "total_output_tokens", "total_tokens", "total_cost_eur", "total_response_time_ms"
+)
+
+
+def sketch_bin(value_ms: float) -> str:
+    """Chave do bin do histograma para um tempo de resposta."""
+    if value_ms <= 1:
+        return "b0"
+    return f"b{math.ceil(math.log(value_ms) / _LOG_GAMMA)}"
+
+
+def sketch_quantile(sketch: Dict[str, int], q: float) -> float:
+    """Quantil aproximado (0 <= q <= 1) de um histograma; 0 se vazio."""
+    bins = sorted((int(key[1:]), count) for key, count in sketch.items() if count > 0)
+    total = sum(count for _, count in bins)
+    if not total:
+        return 0.0
+    rank = q * (total - 1)
+    seen = 0
+    for index, count in bins:
+        seen += count
+        if seen > rank:
+            break
+    if index == 0:
+        return 1.0
+    # Ponto do bin com o menor erro relativo
+    return round(2 * SKETCH_GAMMA ** index / (SKETCH_GAMMA + 1), 1)
+
+
+def bucket_keys(created_at: str) -> Dict[str, str]:
+    """Buckets (hora, dia, mês) de um timestamp ISO em UTC."""
+    return {"hour": created_at[:13], "day": created_at[:10], "month": created_at[:7]}
+
+
+def build_rollup_increments(entries: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Pré-agregar um lote de registos de uso nos três níveis de rollup.
+
+    Devolve {rollup_id: {"inc": {...}, "set": {...}}}, com um único
+    conjunto de `$inc` por bucket/tarefa/modelo.
+    """
+    rollups: Dict[str, Dict[str, Any]] = {}
+    for entry in entries:
+        for granularity, bucket in bucket_keys(entry["created_at"]).items():
+            rollup_id = f"{granularity}_{bucket}_{entry['task']}_{entry['model']}"
+            rollup = rollups.get(rollup_id)
+            if rollup is None:
+                rollup = rollups[rollup_id] = {
+                    "inc": dict.fromkeys(ROLLUP_COUNTERS, 0),
+                    "set": {
+                        "granularity": granularity,
+                        "bucket": bucket,
+                        "task": entry["task"],
+                        "model": entry["model"],
+                        "provider": entry["provider"],
+                    }
+                }
+            inc = rollup["inc"]
+            inc["call_count"] += 1
+            inc["success_count"] += 1 if entry["success"] else 0
+            inc["error_count"] += 0 if entry["success"] else 1
+            inc["total_input_tokens"] += entry["input_tokens"]
+            inc["total_output_tokens"] += entry["output_tokens"]
+            inc["total_tokens"] += entry["total_tokens"]
+            inc["total_cost_eur"] += entry["cost_eur"]
+            inc["total_response_time_ms"] += entry["response_time_ms"]
+            # Chamadas sem tempo medido (ex.: quota excedida) ficam fora dos percentis
+            if entry["response_time_ms"] > 0:
+                key = f"latency.{sketch_bin(entry['response_time_ms'])}"
+                inc[key] = inc.get(key, 0) + 1
+            rollup["set"]["updated_at"] = entry["created_at"]
+    return rollups
+
+
+def rollup_update(rollup_id: str, rollup: Dict[str, Any],
+                  batch_id: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    (filtro, update) do upsert de um rollup.
+
+    Com `batch_id` a aplicação é idempotente: o id do lote fica em
+    `applied_batches` e o filtro exclui documentos que já o têm (o
+    upsert repetido falha no índice único de `rollup_id` e é ignorado).
+    """
+    query: Dict[str, Any] = {"rollup_id": rollup_id}
+    update: Dict[str, Any] = {"$inc": rollup["inc"], "$set": rollup["set"]}
+    if batch_id:
+        query["applied_batches"] = {"$ne": batch_id}
+        update["$addToSet"] = {"applied_batches": batch_id}
+    return query, update
+
+
+def _next_month(moment: datetime) -> datetime:
+    return (moment.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def plan_buckets(start: datetime, end: datetime) -> List[Tuple[str, str]]:
+    """
+    Decompor [start, end) nos buckets completos mais largos possíveis.
+
+    Os limites são alargados à hora (início arredondado para baixo, fim
+    para cima). Devolve [(granularity, bucket)] por ordem cronológica.
+    """
+    cursor = start.replace(minute=0, second=0, microsecond=0)
+    if end.minute or end.second or end.microsecond:
+        end = end.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+    buckets = []
+    while cursor < end:
+        if cursor.day == 1 and cursor.hour == 0 and _next_month(cursor) <= end:
+            buckets.append(("month", cursor.strftime("%Y-%m")))
+            cursor = _next_month(cursor)
+        elif cursor.hour == 0 and cursor + timedelta(days=1) <= end:
+            buckets.append(("day", cursor.strftime("%Y-%m-%d")))
+            cursor += timedelta(days=1)
+        else:
+            buckets.append(("hour", cursor.strftime("%Y-%m-%dT%H")))
+            cursor += timedelta(hours=1)
+    return buckets
+
+
+def buckets_query(buckets: Iterable[Tuple[str, str]]) -> Dict[str, Any]:
+    """Filtro MongoDB para uma lista de buckets."""
+    by_granularity: Dict[str, List[str]] = {}
+    for granularity, bucket in buckets:
+        by_granularity.setdefault(granularity, []).append(bucket)
+    clauses = [
+        {"granularity": granularity, "bucket": {"$in": keys}}
+        for granularity, keys in by_granularity.items()
+    ]
+    if not clauses:
+        # Intervalo vazio: não corresponde a nenhum documento
+        return {"granularity": {"$in": []}}
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def empty_rollup() -> Dict[str, Any]:
+    """Grupo sem utilizações (contadores a zero, histograma vazio)."""
+    return {**dict.fromkeys(ROLLUP_COUNTERS, 0), "latency": {}}
+
+
+def merge_rollups(docs: Iterable[Dict[str, Any]],
+                  key: Callable[[Dict[str, Any]], Hashable]) -> Dict[Hashable, Dict[str, Any]]:
+    """Somar contadores e histogramas dos documentos com a mesma chave."""
+    merged: Dict[Hashable, Dict[str, Any]] = {}
+    for doc in docs:
+        group = merged.setdefault(key(doc), empty_rollup())
+        for counter in ROLLUP_COUNTERS:
+            group[counter] += doc.get(counter, 0)
+        latency = group["latency"]
+        for bin_key, count in (doc.get("latency") or {}).items():
+            latency[bin_key] = latency.get(bin_key, 0) + count
+    return merged
+
+
+def rollup_stats(group: Dict[str, Any]) -> Dict[str, Any]:
+    """Métricas derivadas de um grupo fundido."""
+    calls = group["call_count"]
+    return {
+        "total_calls": calls,
+        "total_success": group["success_count"],
+        "total_errors": group["error_count"],
+        "total_input_tokens": group["total_input_tokens"],
+        "total_output_tokens": group["total_output_tokens"],
+        "total_tokens": group["total_tokens"],
+        "total_cost_eur": round(group["total_cost_eur"], 6),
+        "success_rate": round(group["success_count"] / calls * 100, 1) if calls else 0,
+        "avg_response_time_ms": round(group["total_response_time_ms"] / calls) if calls else 0,
+        "p50_response_time_ms": sketch_quantile(group["latency"], 0.5),
+        "p95_response_time_ms": sketch_quantile(group["latency"], 0.95),
+    }
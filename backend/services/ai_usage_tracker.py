@@ -7,28 +7,88 @@ modelo e período.
 
 Colecções:
 - ai_usage_logs: Regista cada chamada à IA
-- ai_usage_summary: Resumos diários/mensais
+- ai_usage_rollups: Agregados por hora/dia/mês (ver services/ai_usage_rollups.py)
+- ai_usage_summary: Resumos diários (histórico anterior aos rollups)
+
+Escritas em background: os registos ficam numa fila em memória e são
+gravados em lote (ver AIUsageTracker); o shutdown chama `flush()`.
+Os dashboards lêem apenas buckets pré-calculados.
 
 Métricas rastreadas:
 - Número de chamadas por tarefa/modelo
 - Tokens consumidos (input + output)
 - Custo estimado em EUR
-- Tempo de resposta médio
+- Tempo de resposta médio e percentis (p50/p95)
 ====================================================================
 """
 
+import os
+import asyncio
 import logging
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from services.ai_usage_rollups import (
+    build_rollup_increments, buckets_query, empty_rollup, merge_rollups, plan_buckets,
+    rollup_stats, rollup_update
+)
 
 logger = logging.getLogger(__name__)
 
+AI_USAGE_FLUSH_INTERVAL = float(os.environ.get("AI_USAGE_FLUSH_INTERVAL", "2.0"))
+AI_USAGE_BATCH_SIZE = int(os.environ.get("AI_USAGE_BATCH_SIZE", "200"))
+AI_USAGE_MAX_QUEUE = int(os.environ.get("AI_USAGE_MAX_QUEUE", "5000"))
+
+BACKFILL_CHUNK_SIZE = 1000
+BACKFILL_STALE_SECONDS = 600
+
+ROLLUP_PROJECTION = {"_id": 0, "rollup_id": 0, "granularity": 0, "updated_at": 0, "applied_batches": 0}
+LOG_DEFAULTS = {
+    "provider": None, "input_tokens": 0, "output_tokens": 0, "total_tokens": 0,
+    "cost_eur": 0.0, "response_time_ms": 0, "success": True
+}
+
+
+def period_range(period: str, now: datetime) -> Optional[Tuple[datetime, datetime]]:
+    """Intervalo [início, fim) de um período do dashboard; None para "all"."""
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    tomorrow = midnight + timedelta(days=1)
+    if period == "today":
+        return midnight, tomorrow
+    if period == "week":
+        return midnight - timedelta(days=7), tomorrow
+    if period == "month":
+        month_start = midnight.replace(day=1)
+        return month_start, (month_start + timedelta(days=32)).replace(day=1)
+    return None
+
 
 class AIUsageTracker:
-    """Tracker de uso de IA."""
+    """
+    Tracker de uso de IA.
+
+    `log_usage` não escreve na BD: os registos vão para uma fila em
+    memória (limitada a AI_USAGE_MAX_QUEUE) gravada em background a cada
+    AI_USAGE_FLUSH_INTERVAL segundos ou AI_USAGE_BATCH_SIZE registos,
+    com um `insert_many` dos logs e um único `bulk_write` de `$inc`
+    nos rollups por hora, dia e mês.
+    """
     
-    def __init__(self):
+    def __init__(self, flush_interval: float = AI_USAGE_FLUSH_INTERVAL,
+                 batch_size: int = AI_USAGE_BATCH_SIZE,
+                 max_queue: int = AI_USAGE_MAX_QUEUE):
         self._db = None
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self._buffer: List[Dict[str, Any]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._batch_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.dropped = 0
     
     async def _get_db(self):
         """Lazy load database connection."""
@@ -51,7 +111,7 @@ class AIUsageTracker:
         metadata: Optional[Dict[str, Any]] = None
     ) -> str:
         """
-        Regista uma utilização de IA.
+        Regista uma utilização de IA (gravação em background).
         
         Args:
             task: Nome da tarefa (scraper_extraction, document_analysis, etc.)
@@ -66,10 +126,8 @@ class AIUsageTracker:
             metadata: Dados adicionais
             
         Returns:
-            ID do registo criado
+            ID do registo ("" se a fila estiver cheia)
         """
-        db = await self._get_db()
-        
         now = datetime.now(timezone.utc)
         
         log_entry = {
@@ -90,63 +148,198 @@ class AIUsageTracker:
             "month": now.strftime("%Y-%m")
         }
         
+        if len(self._buffer) >= self.max_queue:
+            # BD lenta ou indisponível: descartar em vez de crescer sem limite
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning(f"Fila de uso de IA cheia: {self.dropped} registos descartados")
+            return ""
+        
+        self._buffer.append(log_entry)
+        if len(self._buffer) >= self.batch_size:
+            # Lote cheio: gravar já, sem esperar pelo intervalo
+            if self._batch_task is None or self._batch_task.done():
+                self._batch_task = asyncio.create_task(self.flush())
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+        
+        logger.debug(f"AI usage logged: {task}/{model} - {input_tokens + output_tokens} tokens, €{cost:.6f}")
+        return log_entry["id"]
+    
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+    
+    async def flush(self):
+        """Gravar imediatamente os registos em fila (também chamado no shutdown)."""
+        async with self._flush_lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                await self._write_batch(batch)
+    
+    async def _write_batch(self, batch: List[Dict[str, Any]]):
+        """
+        Um `bulk_write` de `$inc` dos rollups e um `insert_many` dos logs,
+        marcados com `rolled_up` para o preenchimento nunca os contar
+        duas vezes (em qualquer processo, antes ou depois de arrancar).
+        """
+        db = await self._get_db()
+        rolled_up = True
+        try:
+            await self._apply_rollups(batch)
+        except Exception as e:
+            rolled_up = False
+            logger.error(f"Erro ao actualizar rollups de uso de IA: {e}")
+        for entry in batch:
+            entry["rolled_up"] = rolled_up
         try:
-            await db.ai_usage_logs.insert_one(log_entry)
+            await db.ai_usage_logs.insert_many(batch, ordered=False)
+        except Exception as e:
+            logger.error(f"Erro ao registar {len(batch)} usos de IA: {e}")
+        if not rolled_up:
+            # Registos por agregar: o próximo arranque volta a correr o preenchimento
+            try:
+                await db.ai_usage_rollup_state.update_one(
+                    {"id": "backfill", "status": "done"}, {"$set": {"status": "pending"}}
+                )
+            except Exception:
+                pass
+    
+    async def _apply_rollups(self, entries: List[Dict[str, Any]], batch_id: Optional[str] = None):
+        """`$inc` dos rollups; com `batch_id`, repetir o mesmo lote não conta duas vezes."""
+        db = await self._get_db()
+        ops = [
+            UpdateOne(*rollup_update(rollup_id, rollup, batch_id), upsert=True)
+            for rollup_id, rollup in build_rollup_increments(entries).items()
+        ]
+        if not ops:
+            return
+        try:
+            await db.ai_usage_rollups.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # Lote já aplicado a um rollup existente: o upsert colide com rollup_id
+            errors = e.details.get("writeErrors", [])
+            if not batch_id or any(err.get("code") != 11000 for err in errors):
+                raise
+    
+    async def ensure_rollups(self):
+        """
+        Preencher os rollups a partir de `ai_usage_logs` ainda não agregados
+        (sem `rolled_up`, ex.: anteriores aos rollups). Retomável e idempotente:
+        cada bloco é aplicado com um id de lote, os seus logs são marcados e o
+        ponto de retoma é o `_id` (único) do último log do bloco.
+        """
+        db = await self._get_db()
+        now = datetime.now(timezone.utc)
+        try:
+            state = await db.ai_usage_rollup_state.find_one_and_update(
+                {"id": "backfill"},
+                {"$setOnInsert": {"id": "backfill", "status": "pending"}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            if state.get("status") == "done":
+                return
+            stale = (now - timedelta(seconds=BACKFILL_STALE_SECONDS)).isoformat()
+            claimed = await db.ai_usage_rollup_state.update_one(
+                {"id": "backfill", "$or": [
+                    {"status": "pending"},
+                    {"status": "running", "heartbeat_at": {"$lt": stale}}
+                ]},
+                {"$set": {"status": "running", "heartbeat_at": now.isoformat()}}
+            )
+            if not claimed.modified_count:
+                return
             
-            # Actualizar resumo diário
-            await self._update_daily_summary(task, model, provider, log_entry, now)
+            if state.get("rollups_since"):
+                await self._migrate_legacy_state(state)
             
-            logger.debug(f"AI usage logged: {task}/{model} - {input_tokens + output_tokens} tokens, €{cost:.6f}")
+            query: Dict[str, Any] = {"rolled_up": {"$ne": True}}
+            if state.get("backfilled_until_id"):
+                query["_id"] = {"$gt": state["backfilled_until_id"]}
+            cursor = db.ai_usage_logs.find(
+                query, {"metadata": 0, "error_message": 0}
+            ).sort("_id", 1)
             
-            return log_entry["id"]
+            total = 0
+            chunk: List[Dict[str, Any]] = []
+            async for log in cursor:
+                chunk.append({**LOG_DEFAULTS, **log})
+                if len(chunk) >= BACKFILL_CHUNK_SIZE:
+                    total += await self._backfill_chunk(chunk)
+            total += await self._backfill_chunk(chunk)
             
+            await db.ai_usage_rollup_state.update_one(
+                {"id": "backfill"}, {"$set": {"status": "done"}}
+            )
+            logger.info(f"Rollups de uso de IA preenchidos com {total} registos anteriores")
         except Exception as e:
-            logger.error(f"Erro ao registar uso de IA: {e}")
-            return ""
+            logger.warning(f"Erro ao preencher rollups de uso de IA: {e}")
     
-    async def _update_daily_summary(
-        self,
-        task: str,
-        model: str,
-        provider: str,
-        log_entry: Dict[str, Any],
-        now: datetime
-    ):
-        """Actualiza o resumo diário de uso."""
+    async def _migrate_legacy_state(self, state: Dict[str, Any]):
+        """
+        Estado da versão anterior (corte por `rollups_since`/`backfilled_until`):
+        marcar como agregados os logs que essa versão já contou, uma vez.
+        """
         db = await self._get_db()
-        
-        date_str = now.strftime("%Y-%m-%d")
-        summary_id = f"daily_{date_str}_{task}_{model}"
-        
-        await db.ai_usage_summary.update_one(
-            {"summary_id": summary_id},
-            {
-                "$inc": {
-                    "call_count": 1,
-                    "success_count": 1 if log_entry["success"] else 0,
-                    "error_count": 0 if log_entry["success"] else 1,
-                    "total_input_tokens": log_entry["input_tokens"],
-                    "total_output_tokens": log_entry["output_tokens"],
-                    "total_tokens": log_entry["total_tokens"],
-                    "total_cost_eur": log_entry["cost_eur"],
-                    "total_response_time_ms": log_entry["response_time_ms"]
-                },
-                "$set": {
-                    "task": task,
-                    "model": model,
-                    "provider": provider,
-                    "date": date_str,
-                    "month": now.strftime("%Y-%m"),
-                    "type": "daily",
-                    "updated_at": now.isoformat()
-                },
-                "$setOnInsert": {
-                    "created_at": now.isoformat()
-                }
-            },
-            upsert=True
+        counted = [{"created_at": {"$gte": state["rollups_since"]}}]
+        if state.get("backfilled_until"):
+            counted.append({"created_at": {"$lte": state["backfilled_until"]}})
+        await db.ai_usage_logs.update_many(
+            {"rolled_up": {"$exists": False}, "$or": counted},
+            {"$set": {"rolled_up": True}}
+        )
+        await db.ai_usage_rollup_state.update_one(
+            {"id": "backfill"}, {"$unset": {"rollups_since": "", "backfilled_until": ""}}
         )
     
+    async def _backfill_chunk(self, chunk: List[Dict[str, Any]]) -> int:
+        """
+        Aplicar um bloco do preenchimento, marcar os seus logs e gravar o
+        ponto de retoma. Um crash entre passos repete o mesmo bloco (mesmo
+        primeiro `_id`), que o id de lote torna inofensivo.
+        """
+        if not chunk:
+            return 0
+        db = await self._get_db()
+        count = len(chunk)
+        ids = [log["_id"] for log in chunk]
+        await self._apply_rollups(chunk, batch_id=f"backfill_{ids[0]}")
+        await db.ai_usage_logs.update_many({"_id": {"$in": ids}}, {"$set": {"rolled_up": True}})
+        await db.ai_usage_rollup_state.update_one(
+            {"id": "backfill"},
+            {"$set": {
+                "backfilled_until_id": ids[-1],
+                "heartbeat_at": datetime.now(timezone.utc).isoformat()
+            }}
+        )
+        chunk.clear()
+        return count
+    
+    async def _load_rollups(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        db = await self._get_db()
+        return await db.ai_usage_rollups.find(query, ROLLUP_PROJECTION).to_list(None)
+    
+    async def _load_period(self, period: str, **filters) -> List[Dict[str, Any]]:
+        """Rollups que cobrem um período do dashboard."""
+        span = period_range(period, datetime.now(timezone.utc))
+        query = buckets_query(plan_buckets(*span)) if span else {"granularity": "month"}
+        return await self._load_rollups({**query, **{k: v for k, v in filters.items() if v}})
+    
+    async def get_usage_between(self, start: datetime, end: datetime) -> Dict[str, Any]:
+        """Uso total e por tarefa num intervalo arbitrário [start, end)."""
+        docs = await self._load_rollups(buckets_query(plan_buckets(start, end)))
+        total = merge_rollups(docs, lambda d: None)
+        by_task = merge_rollups(docs, lambda d: d["task"])
+        summary = rollup_stats(total.get(None) or empty_rollup())
+        summary["by_task"] = sorted(
+            ({"task": task, **rollup_stats(group)} for task, group in by_task.items()),
+            key=lambda r: r["total_cost_eur"],
+            reverse=True
+        )
+        return summary
+    
     async def get_usage_summary(
         self,
         period: str = "today",
@@ -164,192 +357,46 @@ class AIUsageTracker:
         Returns:
             Resumo com métricas agregadas
         """
-        db = await self._get_db()
-        
-        # Definir filtro de data
-        now = datetime.now(timezone.utc)
-        date_filter = {}
-        
-        if period == "today":
-            date_filter["date"] = now.strftime("%Y-%m-%d")
-        elif period == "week":
-            week_ago = now - timedelta(days=7)
-            date_filter["date"] = {"$gte": week_ago.strftime("%Y-%m-%d")}
-        elif period == "month":
-            date_filter["month"] = now.strftime("%Y-%m")
-        # "all" não tem filtro de data
-        
-        # Adicionar filtros opcionais
-        query = {**date_filter, "type": "daily"}
-        if task:
-            query["task"] = task
-        if model:
-            query["model"] = model
-        
-        # Agregar dados
-        pipeline = [
-            {"$match": query},
-            {
-                "$group": {
-                    "_id": None,
-                    "total_calls": {"$sum": "$call_count"},
-                    "total_success": {"$sum": "$success_count"},
-                    "total_errors": {"$sum": "$error_count"},
-                    "total_input_tokens": {"$sum": "$total_input_tokens"},
-                    "total_output_tokens": {"$sum": "$total_output_tokens"},
-                    "total_tokens": {"$sum": "$total_tokens"},
-                    "total_cost_eur": {"$sum": "$total_cost_eur"},
-                    "avg_response_time_ms": {"$avg": "$total_response_time_ms"}
-                }
-            }
-        ]
-        
-        result = await db.ai_usage_summary.aggregate(pipeline).to_list(1)
-        
-        if result:
-            summary = result[0]
-            del summary["_id"]
-            summary["period"] = period
-            summary["success_rate"] = (
-                (summary["total_success"] / summary["total_calls"] * 100)
-                if summary["total_calls"] > 0 else 0
-            )
-            return summary
-        
-        return {
-            "period": period,
-            "total_calls": 0,
-            "total_success": 0,
-            "total_errors": 0,
-            "total_input_tokens": 0,
-            "total_output_tokens": 0,
-            "total_tokens": 0,
-            "total_cost_eur": 0.0,
-            "avg_response_time_ms": 0,
-            "success_rate": 0
-        }
+        docs = await self._load_period(period, task=task, model=model)
+        merged = merge_rollups(docs, lambda d: None)
+        summary = rollup_stats(merged.get(None) or empty_rollup())
+        summary["period"] = period
+        return summary
     
     async def get_usage_by_task(self, period: str = "month") -> List[Dict[str, Any]]:
         """Obtém uso agregado por tarefa."""
-        db = await self._get_db()
-        
-        now = datetime.now(timezone.utc)
-        date_filter = {}
-        
-        if period == "today":
-            date_filter["date"] = now.strftime("%Y-%m-%d")
-        elif period == "week":
-            week_ago = now - timedelta(days=7)
-            date_filter["date"] = {"$gte": week_ago.strftime("%Y-%m-%d")}
-        elif period == "month":
-            date_filter["month"] = now.strftime("%Y-%m")
-        
-        pipeline = [
-            {"$match": {**date_filter, "type": "daily"}},
-            {
-                "$group": {
-                    "_id": "$task",
-                    "total_calls": {"$sum": "$call_count"},
-                    "total_tokens": {"$sum": "$total_tokens"},
-                    "total_cost_eur": {"$sum": "$total_cost_eur"},
-                    "success_rate": {
-                        "$avg": {
-                            "$cond": [
-                                {"$eq": ["$call_count", 0]},
-                                0,
-                                {"$divide": ["$success_count", "$call_count"]}
-                            ]
-                        }
-                    }
-                }
-            },
-            {"$sort": {"total_cost_eur": -1}}
-        ]
-        
-        results = await db.ai_usage_summary.aggregate(pipeline).to_list(100)
-        
-        return [
-            {
-                "task": r["_id"],
-                "total_calls": r["total_calls"],
-                "total_tokens": r["total_tokens"],
-                "total_cost_eur": round(r["total_cost_eur"], 6),
-                "success_rate": round(r["success_rate"] * 100, 1)
-            }
-            for r in results
+        docs = await self._load_period(period)
+        results = [
+            {"task": task, **rollup_stats(group)}
+            for task, group in merge_rollups(docs, lambda d: d["task"]).items()
         ]
+        results.sort(key=lambda r: r["total_cost_eur"], reverse=True)
+        return results
     
     async def get_usage_by_model(self, period: str = "month") -> List[Dict[str, Any]]:
         """Obtém uso agregado por modelo."""
-        db = await self._get_db()
-        
-        now = datetime.now(timezone.utc)
-        date_filter = {}
-        
-        if period == "today":
-            date_filter["date"] = now.strftime("%Y-%m-%d")
-        elif period == "week":
-            week_ago = now - timedelta(days=7)
-            date_filter["date"] = {"$gte": week_ago.strftime("%Y-%m-%d")}
-        elif period == "month":
-            date_filter["month"] = now.strftime("%Y-%m")
-        
-        pipeline = [
-            {"$match": {**date_filter, "type": "daily"}},
-            {
-                "$group": {
-                    "_id": {"model": "$model", "provider": "$provider"},
-                    "total_calls": {"$sum": "$call_count"},
-                    "total_tokens": {"$sum": "$total_tokens"},
-                    "total_cost_eur": {"$sum": "$total_cost_eur"}
-                }
-            },
-            {"$sort": {"total_cost_eur": -1}}
-        ]
-        
-        results = await db.ai_usage_summary.aggregate(pipeline).to_list(100)
-        
-        return [
-            {
-                "model": r["_id"]["model"],
-                "provider": r["_id"]["provider"],
-                "total_calls": r["total_calls"],
-                "total_tokens": r["total_tokens"],
-                "total_cost_eur": round(r["total_cost_eur"], 6)
-            }
-            for r in results
+        docs = await self._load_period(period)
+        results = [
+            {"model": model, "provider": provider, **rollup_stats(group)}
+            for (model, provider), group in merge_rollups(
+                docs, lambda d: (d["model"], d.get("provider"))
+            ).items()
         ]
+        results.sort(key=lambda r: r["total_cost_eur"], reverse=True)
+        return results
     
     async def get_daily_trend(self, days: int = 30) -> List[Dict[str, Any]]:
-        """Obtém tendência diária de uso."""
-        db = await self._get_db()
-        
-        now = datetime.now(timezone.utc)
-        start_date = (now - timedelta(days=days)).strftime("%Y-%m-%d")
-        
-        pipeline = [
-            {"$match": {"type": "daily", "date": {"$gte": start_date}}},
-            {
-                "$group": {
-                    "_id": "$date",
-                    "total_calls": {"$sum": "$call_count"},
-                    "total_tokens": {"$sum": "$total_tokens"},
-                    "total_cost_eur": {"$sum": "$total_cost_eur"}
-                }
-            },
-            {"$sort": {"_id": 1}}
+        """Obtém tendência diária de uso (um bucket diário por dia)."""
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        buckets = [
+            ("day", (today - timedelta(days=offset)).strftime("%Y-%m-%d"))
+            for offset in range(days, -1, -1)
         ]
-        
-        results = await db.ai_usage_summary.aggregate(pipeline).to_list(100)
-        
+        docs = await self._load_rollups(buckets_query(buckets))
+        merged = merge_rollups(docs, lambda d: d["bucket"])
         return [
-            {
-                "date": r["_id"],
-                "total_calls": r["total_calls"],
-                "total_tokens": r["total_tokens"],
-                "total_cost_eur": round(r["total_cost_eur"], 6)
-            }
-            for r in results
+            {"date": date, **rollup_stats(merged[date])}
+            for date in sorted(merged)
         ]
     
     async def get_recent_logs(self, limit: int = 50, task: Optional[str] = None) -> List[Dict[str, Any]]:
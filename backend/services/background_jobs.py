@@ -27,6 +27,7 @@ class JobType(str, Enum):
     EXCEL_IMPORT = "excel_import"
     BULK_ANALYSIS = "bulk_analysis"
     DATA_EXPORT = "data_export"
+    DOCUMENT_CATEGORIZATION = "document_categorization"
 
 
 class BackgroundJobService:
@@ -92,7 +93,8 @@ class BackgroundJobService:
             "$set": {
                 "progress.current": current,
                 "progress.total": total,
-                "progress.percentage": percentage
+                "progress.percentage": percentage,
+                "heartbeat_at": datetime.now(timezone.utc).isoformat()
             }
         }
         
@@ -111,6 +113,7 @@ class BackgroundJobService:
         
         if status == JobStatus.PROCESSING:
             update["$set"]["started_at"] = now
+            update["$set"]["heartbeat_at"] = now
         elif status in [JobStatus.COMPLETED, JobStatus.FAILED]:
             update["$set"]["completed_at"] = now
         
@@ -176,6 +179,46 @@ class BackgroundJobService:
         
         return jobs
     
+    async def find_stale_jobs(self, job_type: JobType, stale_seconds: int) -> List[Dict[str, Any]]:
+        """
+        Jobs por terminar sem sinal de vida há mais de `stale_seconds`
+        (ex.: interrompidos por um reinício do servidor).
+        """
+        from datetime import timedelta
+        
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)).isoformat()
+        return await db.background_jobs.find(
+            {
+                "type": job_type.value,
+                "status": {"$in": [JobStatus.PENDING.value, JobStatus.PROCESSING.value]},
+                "$or": [{"heartbeat_at": {"$lt": cutoff}}, {"heartbeat_at": None}]
+            },
+            {"_id": 0}
+        ).to_list(100)
+    
+    async def claim_stale_job(self, job_id: str, stale_seconds: int) -> bool:
+        """
+        Reclamar um job interrompido para o retomar. Atómico: só uma
+        instância do servidor o consegue reclamar.
+        """
+        from datetime import timedelta
+        
+        now = datetime.now(timezone.utc)
+        cutoff = (now - timedelta(seconds=stale_seconds)).isoformat()
+        result = await db.background_jobs.update_one(
+            {
+                "id": job_id,
+                "status": {"$in": [JobStatus.PENDING.value, JobStatus.PROCESSING.value]},
+                "$or": [{"heartbeat_at": {"$lt": cutoff}}, {"heartbeat_at": None}]
+            },
+            {"$set": {"heartbeat_at": now.isoformat()}, "$inc": {"attempts": 1}}
+        )
+        return result.modified_count == 1
+    
+    def is_running(self, job_id: str) -> bool:
+        task = self._running_jobs.get(job_id)
+        return bool(task and not task.done())
+    
     async def cleanup_old_jobs(self, days: int = 7) -> int:
         """
         Remove jobs antigos.
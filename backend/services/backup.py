@@ -1,6 +1,5 @@
 import os
 import logging
-import shutil
 import asyncio
 import tempfile
 import zipfile
@@ -25,52 +24,178 @@ config = BackupConfig()
 
 
 class BackupService:
+    """
+    Motor de backup em streaming.
+
+    Cada colecção é lida com um cursor em lotes e escrita como NDJSON
+    (Extended JSON canónico) directamente numa entrada comprimida do ZIP,
+    pelo que a memória usada não depende do tamanho dos dados.
+
+    Backups incrementais exportam apenas documentos com `_id` ou
+    `updated_at` posteriores às watermarks do último backup.
+    """
     BACKUP_DIR = config.BACKUP_DIR
+    BATCH_SIZE = int(os.environ.get("BACKUP_BATCH_SIZE", "1000"))
+    STATE_ID = "backup_watermarks"
 
     def __init__(self):
         self.BACKUP_DIR.mkdir(parents=True, exist_ok=True)
 
-    async def create_backup(self):
-        """Cria um backup completo da base de dados em JSON."""
+    async def create_backup(self, incremental: bool = False, history_id: str = None):
+        """
+        Cria um backup da base de dados (completo ou incremental).
+
+        Args:
+            incremental: Exportar apenas alterações desde o último backup
+            history_id: Registo em `backup_history` a actualizar com as estatísticas
+
+        Returns:
+            Caminho do ZIP criado, ou None em caso de erro
+        """
+        from bson import json_util
+
         timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-        backup_path = self.BACKUP_DIR / f"backup_{timestamp}"
-        backup_path.mkdir(exist_ok=True)
-        
-        logger.info(f"Iniciando backup em: {backup_path}")
-        
+        kind = "incremental" if incremental else "full"
+        zip_path = self.BACKUP_DIR / f"backup_{timestamp}_{kind}.zip"
+
+        logger.info(f"Iniciando backup {kind} em: {zip_path}")
+
         client = AsyncIOMotorClient(MONGO_URL)
         db = client[DB_NAME]
-        
+        loop = asyncio.get_running_loop()
+
         try:
-            collections = await db.list_collection_names()
-            count = 0
-            
-            for col_name in collections:
-                cursor = db[col_name].find({})
-                docs = await cursor.to_list(length=None)
-                
-                from bson import json_util
-                
-                file_path = backup_path / f"{col_name}.json"
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(json_util.dumps(docs, indent=2))
-                
-                count += len(docs)
-            
-            shutil.make_archive(str(backup_path), 'zip', backup_path)
-            zip_path = str(backup_path) + ".zip"
-            
-            shutil.rmtree(backup_path)
-            
-            logger.info(f"Backup concluído: {zip_path} ({count} documentos)")
-            return zip_path
-            
+            state = await db.backup_state.find_one({"id": self.STATE_ID}) or {}
+            previous = state.get("collections", {}) if incremental else {}
+            watermarks = dict(state.get("collections", {}))
+            collection_stats = {}
+
+            collections = [
+                name for name in await db.list_collection_names()
+                if not name.startswith("system.")
+            ]
+
+            with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+                for col_name in sorted(collections):
+                    query = self._incremental_query(previous.get(col_name))
+                    stats, marks = await self._export_collection(
+                        db[col_name], col_name, query, zf, loop, json_util
+                    )
+                    collection_stats[col_name] = stats
+                    watermarks[col_name] = self._merge_watermarks(watermarks.get(col_name), marks)
+
+                manifest = {
+                    "type": kind,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "base_backup": state.get("last_backup") if incremental else None,
+                    "format": "ndjson/extended-json-canonical",
+                    "collections": collection_stats,
+                }
+                zf.writestr("manifest.json", json_util.dumps(manifest, indent=2))
+
+            await db.backup_state.update_one(
+                {"id": self.STATE_ID},
+                {"$set": {
+                    "collections": watermarks,
+                    "last_backup": zip_path.name,
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                }},
+                upsert=True
+            )
+
+            total_docs = sum(s["documents"] for s in collection_stats.values())
+            total_bytes = sum(s["bytes"] for s in collection_stats.values())
+
+            if history_id:
+                await db.backup_history.update_one(
+                    {"id": history_id},
+                    {"$set": {
+                        "backup_type": kind,
+                        "backup_file": zip_path.name,
+                        "collections": collection_stats,
+                        "total_documents": total_docs,
+                        "total_bytes": total_bytes,
+                        "compressed_bytes": zip_path.stat().st_size
+                    }}
+                )
+
+            logger.info(f"Backup concluído: {zip_path} ({total_docs} documentos, {total_bytes} bytes)")
+            return str(zip_path)
+
         except Exception as e:
             logger.error(f"Erro no backup: {e}")
+            try:
+                zip_path.unlink()
+            except Exception:
+                pass
             return None
         finally:
             client.close()
 
+    async def _export_collection(self, collection, col_name, query, zf, loop, json_util):
+        """
+        Exportar uma colecção para `collections/<nome>.ndjson` no ZIP.
+        As escritas (compressão) correm no executor para não bloquear o loop.
+        """
+        docs = 0
+        size = 0
+        marks = {"last_id": None, "last_updated_at": None}
+        options = json_util.CANONICAL_JSON_OPTIONS
+
+        with zf.open(f"collections/{col_name}.ndjson", "w", force_zip64=True) as entry:
+            batch = []
+            cursor = collection.find(query).sort("_id", 1).batch_size(self.BATCH_SIZE)
+            async for doc in cursor:
+                batch.append(json_util.dumps(doc, json_options=options))
+                docs += 1
+                marks["last_id"] = doc["_id"]
+                marks["last_updated_at"] = self._max_value(marks["last_updated_at"], doc.get("updated_at"))
+
+                if len(batch) >= self.BATCH_SIZE:
+                    chunk = ("\n".join(batch) + "\n").encode("utf-8")
+                    size += len(chunk)
+                    await loop.run_in_executor(None, entry.write, chunk)
+                    batch = []
+
+            if batch:
+                chunk = ("\n".join(batch) + "\n").encode("utf-8")
+                size += len(chunk)
+                await loop.run_in_executor(None, entry.write, chunk)
+
+        return {"documents": docs, "bytes": size}, marks
+
+    @staticmethod
+    def _incremental_query(marks: dict) -> dict:
+        """Query para documentos novos (`_id`) ou alterados (`updated_at`)."""
+        if not marks:
+            return {}
+        conditions = []
+        if marks.get("last_id") is not None:
+            conditions.append({"_id": {"$gt": marks["last_id"]}})
+        if marks.get("last_updated_at") is not None:
+            conditions.append({"updated_at": {"$gt": marks["last_updated_at"]}})
+        return {"$or": conditions} if conditions else {}
+
+    @classmethod
+    def _merge_watermarks(cls, old: dict, new: dict) -> dict:
+        old = old or {}
+        return {
+            "last_id": cls._max_value(old.get("last_id"), new.get("last_id")),
+            "last_updated_at": cls._max_value(old.get("last_updated_at"), new.get("last_updated_at")),
+        }
+
+    @staticmethod
+    def _max_value(current, candidate):
+        """Máximo entre dois valores, ignorando tipos não comparáveis."""
+        if candidate is None:
+            return current
+        if current is None:
+            return candidate
+        try:
+            return candidate if candidate > current else current
+        except TypeError:
+            return current
+
 
 backup_service = BackupService()
 
@@ -114,11 +239,16 @@ async def get_backup_statistics() -> dict:
     return stats
 
 
-async def full_backup_workflow(upload_to_cloud: bool = True, cleanup_after: bool = True) -> dict:
+async def full_backup_workflow(
+    upload_to_cloud: bool = True,
+    cleanup_after: bool = True,
+    incremental: bool = False,
+    history_id: str = None
+) -> dict:
     """
     Executa o workflow completo de backup.
     
-    1. Cria backup local
+    1. Cria backup local (completo ou incremental)
     2. (Opcional) Upload para cloud
     3. (Opcional) Limpa backups antigos
     
@@ -136,7 +266,7 @@ async def full_backup_workflow(upload_to_cloud: bool = True, cleanup_after: bool
     
     try:
         # 1. Criar backup
-        zip_path = await backup_service.create_backup()
+        zip_path = await backup_service.create_backup(incremental=incremental, history_id=history_id)
         
         if not zip_path:
             result["error"] = "Falha ao criar backup"
@@ -0,0 +1,328 @@
+"""
+====================================================================
+AGENDADOR CRON DISTRIBUÍDO - CREDITOIMO
+====================================================================
+Agendador de jobs periódicos para o worker, seguro com várias réplicas.
+
+- Cada job tem uma expressão cron (5 campos: min hora dia mês dia-semana),
+  avaliada em UTC.
+- O estado (última/próxima execução, duração, resultado) fica persistido
+  na colecção `scheduler_jobs`: reiniciar o worker não re-executa tudo.
+- Antes de executar, a réplica obtém um lease atómico no documento do job
+  (`find_one_and_update`), por isso só uma réplica executa cada ocorrência.
+- Jitter aleatório na próxima execução evita picos simultâneos.
+- Cada job tem timeout próprio; jobs independentes correm em paralelo.
+- Cada execução é registada em `scheduler_runs` com a duração.
+
+Uso:
+    from services.cron_scheduler import cron_scheduler
+
+    cron_scheduler.register("limpeza", "0 3 * * *", cleanup, timeout=600)
+    await cron_scheduler.run(shutdown_event)
+====================================================================
+"""
+import os
+import uuid
+import socket
+import random
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+SCHEDULER_POLL_SECONDS = int(os.environ.get("SCHEDULER_POLL_SECONDS", "30"))
+LEASE_MARGIN_SECONDS = 60
+RUN_HISTORY_LIMIT_CHARS = 500
+
+
+# ====================================================================
+# EXPRESSÕES CRON
+# ====================================================================
+
+class CronExpression:
+    """
+    Expressão cron standard de 5 campos.
+    Suporta `*`, listas (`1,15`), intervalos (`1-5`) e passos (`*/10`, `0-30/5`).
+    Dia da semana: 0-6 (domingo = 0, 7 também é domingo).
+    """
+
+    # Dia da semana aceita 0-7 na leitura (7 é normalizado para 0)
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Expressão cron inválida (esperados 5 campos): {expression!r}")
+        self.expression = expression
+        fields = [
+            self._parse_field(part, low, high)
+            for part, (low, high) in zip(parts, self.FIELD_RANGES)
+        ]
+        self.minutes, self.hours, self.days, self.months, weekdays = fields
+        self.weekdays = {d % 7 for d in weekdays}
+        self._dom_any = parts[2] == "*"
+        self._dow_any = parts[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values = set()
+        for item in field.split(","):
+            step = 1
+            if "/" in item:
+                item, step_str = item.split("/", 1)
+                step = int(step_str)
+                if step <= 0:
+                    raise ValueError(f"Passo inválido no campo cron: {field!r}")
+            if item == "*":
+                start, end = low, high
+            elif "-" in item:
+                start, end = (int(v) for v in item.split("-", 1))
+            else:
+                start = int(item)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end:
+                raise ValueError(f"Valor fora do intervalo no campo cron: {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, day: datetime) -> bool:
+        if day.month not in self.months:
+            return False
+        dom = day.day in self.days
+        dow = (day.isoweekday() % 7) in self.weekdays
+        # Semântica cron: com ambos os campos restritos, basta um coincidir
+        if self._dom_any and self._dow_any:
+            return True
+        if self._dom_any:
+            return dow
+        if self._dow_any:
+            return dom
+        return dom or dow
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Próximo instante (ao minuto) estritamente depois de `moment`."""
+        start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"Expressão cron sem ocorrências: {self.expression!r}")
+
+
+# ====================================================================
+# JOBS
+# ====================================================================
+
+@dataclass
+class ScheduledJob:
+    """Definição de um job agendado."""
+
+    name: str
+    cron: CronExpression
+    func: Callable[[], Awaitable]
+    timeout: int = 600
+    jitter: int = 30
+
+    def next_run(self, after: datetime) -> datetime:
+        jitter = random.uniform(0, self.jitter) if self.jitter else 0
+        return self.cron.next_after(after) + timedelta(seconds=jitter)
+
+
+class CronScheduler:
+    """
+    Executa jobs registados de acordo com o seu cron, com estado e
+    lease persistidos em MongoDB para coordenar várias réplicas.
+    """
+
+    def __init__(self, poll_interval: int = SCHEDULER_POLL_SECONDS):
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+
+    def register(self, name: str, cron: str, func: Callable[[], Awaitable],
+                 timeout: int = 600, jitter: int = 30):
+        """Registar um job (a expressão é validada imediatamente)."""
+        self.jobs[name] = ScheduledJob(name, CronExpression(cron), func, timeout, jitter)
+
+    async def sync_state(self):
+        """
+        Criar o estado persistido dos jobs registados. Jobs existentes
+        mantêm a próxima execução, excepto se a expressão cron mudou.
+        """
+        now = datetime.now(timezone.utc)
+        for job in self.jobs.values():
+            state = await db.scheduler_jobs.find_one({"name": job.name}, {"_id": 0, "cron": 1})
+            if state and state.get("cron") == job.cron.expression:
+                continue
+            await db.scheduler_jobs.update_one(
+                {"name": job.name},
+                {
+                    "$set": {
+                        "cron": job.cron.expression,
+                        "next_run_at": job.next_run(now).isoformat()
+                    },
+                    "$setOnInsert": {
+                        "lease_owner": None,
+                        "lease_until": None,
+                        "last_run_at": None
+                    }
+                },
+                upsert=True
+            )
+
+    async def _claim(self, job: ScheduledJob, now: datetime) -> Optional[dict]:
+        """Obter o lease do job se estiver vencido e livre (atómico)."""
+        now_iso = now.isoformat()
+        lease_until = now + timedelta(seconds=job.timeout + LEASE_MARGIN_SECONDS)
+        return await db.scheduler_jobs.find_one_and_update(
+            {
+                "name": job.name,
+                "next_run_at": {"$lte": now_iso},
+                "$or": [{"lease_until": None}, {"lease_until": {"$lt": now_iso}}]
+            },
+            {"$set": {"lease_owner": self.owner, "lease_until": lease_until.isoformat()}},
+            projection={"_id": 0}
+        )
+
+    async def _execute(self, job: ScheduledJob, scheduled_for: str):
+        started = datetime.now(timezone.utc)
+        status, error, result = "success", None, None
+        try:
+            result = await asyncio.wait_for(job.func(), timeout=job.timeout)
+        except asyncio.TimeoutError:
+            status, error = "timeout", f"Excedeu {job.timeout}s"
+            logger.error(f"[SCHEDULER] Job {job.name} excedeu o timeout de {job.timeout}s")
+        except asyncio.CancelledError:
+            status, error = "cancelled", "Worker a terminar"
+            raise
+        except Exception as e:
+            status, error = "error", str(e)
+            logger.error(f"[SCHEDULER] Erro no job {job.name}: {e}", exc_info=True)
+        finally:
+            finished = datetime.now(timezone.utc)
+            duration_ms = int((finished - started).total_seconds() * 1000)
+            await self._record(job, scheduled_for, started, finished, duration_ms, status, error, result)
+
+    async def _record(self, job: ScheduledJob, scheduled_for: str, started: datetime,
+                      finished: datetime, duration_ms: int, status: str,
+                      error: Optional[str], result):
+        """Persistir resultado, próxima execução e libertar o lease."""
+        state = {
+            "last_run_at": started.isoformat(),
+            "last_finished_at": finished.isoformat(),
+            "last_duration_ms": duration_ms,
+            "last_status": status,
+            "last_error": error,
+            "lease_owner": None,
+            "lease_until": None
+        }
+        # Execução interrompida: manter next_run_at para outra réplica retomar
+        if status != "cancelled":
+            state["next_run_at"] = job.next_run(finished).isoformat()
+        try:
+            await db.scheduler_jobs.update_one(
+                {"name": job.name, "lease_owner": self.owner},
+                {"$set": state}
+            )
+            await db.scheduler_runs.insert_one({
+                "id": str(uuid.uuid4()),
+                "job": job.name,
+                "owner": self.owner,
+                "scheduled_for": scheduled_for,
+                "started_at": started.isoformat(),
+                "finished_at": finished.isoformat(),
+                "duration_ms": duration_ms,
+                "status": status,
+                "error": error,
+                "result": str(result)[:RUN_HISTORY_LIMIT_CHARS] if result is not None else None
+            })
+            logger.info(f"[SCHEDULER] Job {job.name}: {status} em {duration_ms}ms")
+        except Exception as e:
+            logger.error(f"[SCHEDULER] Erro ao gravar estado do job {job.name}: {e}")
+
+    async def tick(self) -> List[str]:
+        """Lançar (em paralelo) todos os jobs vencidos que esta réplica conseguir reclamar."""
+        now = datetime.now(timezone.utc)
+        due = await db.scheduler_jobs.find(
+            {"name": {"$in": list(self.jobs)}, "next_run_at": {"$lte": now.isoformat()}},
+            {"_id": 0, "name": 1}
+        ).to_list(len(self.jobs))
+
+        started = []
+        for state in due:
+            name = state["name"]
+            running = self._running.get(name)
+            if running and not running.done():
+                continue
+            claimed = await self._claim(self.jobs[name], now)
+            if not claimed:
+                continue
+            self._running[name] = asyncio.create_task(
+                self._execute(self.jobs[name], claimed.get("next_run_at"))
+            )
+            started.append(name)
+        return started
+
+    async def _seconds_until_next(self) -> float:
+        state = await db.scheduler_jobs.find_one(
+            {"name": {"$in": list(self.jobs)}},
+            {"_id": 0, "next_run_at": 1},
+            sort=[("next_run_at", 1)]
+        )
+        if not state or not state.get("next_run_at"):
+            return self.poll_interval
+        next_run = datetime.fromisoformat(state["next_run_at"])
+        wait = (next_run - datetime.now(timezone.utc)).total_seconds()
+        return min(max(wait, 1.0), self.poll_interval)
+
+    async def run(self, shutdown_event: asyncio.Event):
+        """Loop do agendador até `shutdown_event` ser activado."""
+        await self.sync_state()
+        logger.info(f"[SCHEDULER] Agendador iniciado ({len(self.jobs)} jobs, réplica {self.owner})")
+
+        while not shutdown_event.is_set():
+            try:
+                await self.tick()
+                wait = await self._seconds_until_next()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"[SCHEDULER] Erro no agendador: {e}")
+                wait = self.poll_interval
+            try:
+                await asyncio.wait_for(shutdown_event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+        await self.stop()
+
+    async def stop(self):
+        """Cancelar jobs em curso (o lease expira e outra réplica retoma)."""
+        running = [t for t in self._running.values() if not t.done()]
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    async def get_status(self, recent_runs: int = 50) -> dict:
+        """Estado persistido de todos os jobs e as últimas execuções (para monitorização)."""
+        jobs = await db.scheduler_jobs.find({}, {"_id": 0}).sort("name", 1).to_list(None)
+        runs = await db.scheduler_runs.find(
+            {}, {"_id": 0}
+        ).sort("started_at", -1).to_list(recent_runs)
+        return {"jobs": jobs, "recent_runs": runs}
+
+
+cron_scheduler = CronScheduler()
@@ -19,6 +19,9 @@ DEPRECATED_INDEXES = {
     "properties": [
         "idx_internal_ref",  # Nome antigo incorreto - campo era internal_ref
         "idx_location",  # Índice antigo com campos incorretos (distrito, concelho) - deve ser (address.district, address.municipality)
+    ],
+    "system_error_logs": [
+        "idx_id",  # Não único - substituído por idx_id_unique (upserts concorrentes por fingerprint)
     ]
 }
 
@@ -106,6 +109,12 @@ async def create_indexes(db) -> dict:
         # Índice no tipo de processo
         {"keys": [("process_type", 1)], "name": "idx_process_type"},
         
+        # Card do Trello - pré-carregamento em bulk na sincronização
+        {"keys": [("trello_card_id", 1)], "name": "idx_trello_card_id", "sparse": True},
+        
+        # Chave de cliente materializada - agrupamento em /clients
+        {"keys": [("client_key", 1), ("created_at", 1)], "name": "idx_client_key"},
+        
         # Índice de texto para pesquisa full-text
         {
             "keys": [
@@ -187,6 +196,10 @@ async def create_indexes(db) -> dict:
         
         # TTL index - auto-delete logs após 90 dias
         {"keys": [("timestamp", 1)], "name": "idx_ttl", "expireAfterSeconds": 7776000},
+        
+        # Upserts por fingerprint (id do grupo de erros) - único para que flushes
+        # concorrentes (API e worker) não criem grupos duplicados
+        {"keys": [("id", 1)], "name": "idx_id_unique", "unique": True},
     ]
     
     for idx in log_indexes:
@@ -197,6 +210,8 @@ async def create_indexes(db) -> dict:
             }
             if "expireAfterSeconds" in idx:
                 create_options["expireAfterSeconds"] = idx["expireAfterSeconds"]
+            if idx.get("unique"):
+                create_options["unique"] = True
             
             await db.system_error_logs.create_index(idx["keys"], **create_options)
             results["created"].append(f"system_error_logs.{idx['name']}")
@@ -264,6 +279,301 @@ async def create_indexes(db) -> dict:
                 results["errors"].append(f"tasks.{idx['name']}: {str(e)}")
                 logger.error(f"Erro ao criar índice tasks.{idx['name']}: {e}")
     
+    # ====================================================================
+    # ÍNDICES PARA COLECÇÃO 'history' (Histórico de alterações)
+    # ====================================================================
+    history_indexes = [
+        # Timeline de um processo (ordenada por data)
+        {"keys": [("process_id", 1), ("created_at", -1)], "name": "idx_history_process_created"},
+    ]
+    
+    for idx in history_indexes:
+        try:
+            await db.history.create_index(
+                idx["keys"],
+                name=idx["name"],
+                background=True
+            )
+            results["created"].append(f"history.{idx['name']}")
+            logger.info(f"Índice criado: history.{idx['name']}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                results["skipped"].append(f"history.{idx['name']}")
+            else:
+                results["errors"].append(f"history.{idx['name']}: {str(e)}")
+                logger.error(f"Erro ao criar índice history.{idx['name']}: {e}")
+    
+    # ====================================================================
+    # ÍNDICES PARA COLECÇÃO 'search_index' (Pesquisa global)
+    # ====================================================================
+    search_indexes = [
+        # Pesquisa por prefixo (edge n-grams) - multikey
+        {"keys": [("entity_type", 1), ("prefixes", 1)], "name": "idx_search_prefixes"},
+
+        # Upsert por entidade
+        {"keys": [("entity_type", 1), ("entity_id", 1)], "name": "idx_search_entity", "unique": True},
+
+        # Fast paths exactos
+        {"keys": [("entity_type", 1), ("nif", 1)], "name": "idx_search_nif"},
+        {"keys": [("entity_type", 1), ("email", 1)], "name": "idx_search_email"},
+
+        # Full-text com stemming (fallback e ranking)
+        {
+            "keys": [("name", "text"), ("text", "text")],
+            "name": "idx_search_fulltext",
+            "weights": {"name": 10, "text": 1},
+            "default_language": "portuguese"
+        },
+    ]
+
+    for idx in search_indexes:
+        try:
+            create_options = {
+                "name": idx["name"],
+                "unique": idx.get("unique", False),
+                "sparse": idx.get("sparse", False),
+                "background": True
+            }
+            for option in ("weights", "default_language"):
+                if option in idx:
+                    create_options[option] = idx[option]
+
+            await db.search_index.create_index(idx["keys"], **create_options)
+            results["created"].append(f"search_index.{idx['name']}")
+            logger.info(f"Índice criado: search_index.{idx['name']}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                results["skipped"].append(f"search_index.{idx['name']}")
+            else:
+                results["errors"].append(f"search_index.{idx['name']}: {str(e)}")
+                logger.error(f"Erro ao criar índice search_index.{idx['name']}: {e}")
+
+    # ====================================================================
+    # ÍNDICES PARA COLECÇÃO 'counters' (Sequências atómicas)
+    # ====================================================================
+    counter_indexes = [
+        # Um documento por sequência (upserts concorrentes não duplicam)
+        {"keys": [("id", 1)], "name": "idx_counter_id", "unique": True},
+    ]
+
+    for idx in counter_indexes:
+        try:
+            await db.counters.create_index(
+                idx["keys"],
+                name=idx["name"],
+                unique=idx.get("unique", False),
+                background=True
+            )
+            results["created"].append(f"counters.{idx['name']}")
+            logger.info(f"Índice criado: counters.{idx['name']}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                results["skipped"].append(f"counters.{idx['name']}")
+            else:
+                results["errors"].append(f"counters.{idx['name']}: {str(e)}")
+                logger.error(f"Erro ao criar índice counters.{idx['name']}: {e}")
+
+    # ====================================================================
+    # ÍNDICES PARA COLECÇÃO 'notifications'
+    # ====================================================================
+    notification_indexes = [
+        # Deduplicação das notificações agendadas (só estas têm dedup_key)
+        {"keys": [("dedup_key", 1)], "name": "idx_notification_dedup", "unique": True, "sparse": True},
+    ]
+
+    for idx in notification_indexes:
+        try:
+            await db.notifications.create_index(
+                idx["keys"],
+                name=idx["name"],
+                unique=idx.get("unique", False),
+                sparse=idx.get("sparse", False),
+                background=True
+            )
+            results["created"].append(f"notifications.{idx['name']}")
+            logger.info(f"Índice criado: notifications.{idx['name']}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                results["skipped"].append(f"notifications.{idx['name']}")
+            else:
+                results["errors"].append(f"notifications.{idx['name']}: {str(e)}")
+                logger.error(f"Erro ao criar índice notifications.{idx['name']}: {e}")
+
+    # ====================================================================
+    # ÍNDICES PARA COLECÇÕES DO AGENDADOR ('scheduler_jobs', 'scheduler_runs')
+    # ====================================================================
+    scheduler_indexes = [
+        ("scheduler_jobs", {"keys": [("name", 1)], "name": "idx_scheduler_job_name", "unique": True}),
+        ("scheduler_jobs", {"keys": [("next_run_at", 1)], "name": "idx_scheduler_next_run"}),
+        ("scheduler_runs", {"keys": [("job", 1), ("started_at", -1)], "name": "idx_scheduler_runs_job"}),
+    ]
+
+    for collection, idx in scheduler_indexes:
+        try:
+            await getattr(db, collection).create_index(
+                idx["keys"],
+                name=idx["name"],
+                unique=idx.get("unique", False),
+                background=True
+            )
+            results["created"].append(f"{collection}.{idx['name']}")
+            logger.info(f"Índice criado: {collection}.{idx['name']}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                results["skipped"].append(f"{collection}.{idx['name']}")
+            else:
+                results["errors"].append(f"{collection}.{idx['name']}: {str(e)}")
+                logger.error(f"Erro ao criar índice {collection}.{idx['name']}: {e}")
+
+    # ====================================================================
+    # ÍNDICES PARA COLECÇÃO 'trello_webhook_actions'
+    # ====================================================================
+    trello_webhook_indexes = [
+        # Idempotência: cada ação do Trello é gravada uma única vez
+        {"keys": [("action_id", 1)], "name": "idx_trello_action_id", "unique": True},
+        # Reclamação das ações pendentes de um card
+        {"keys": [("card_id", 1), ("status", 1)], "name": "idx_trello_action_card_status"},
+        {"keys": [("batch_id", 1)], "name": "idx_trello_action_batch", "sparse": True},
+        # Retoma de pendentes e limpeza
+        {"keys": [("status", 1), ("received_at", 1)], "name": "idx_trello_action_status_received"},
+    ]
+
+    for idx in trello_webhook_indexes:
+        try:
+            await db.trello_webhook_actions.create_index(
+                idx["keys"],
+                name=idx["name"],
+                unique=idx.get("unique", False),
+                sparse=idx.get("sparse", False),
+                background=True
+            )
+            results["created"].append(f"trello_webhook_actions.{idx['name']}")
+            logger.info(f"Índice criado: trello_webhook_actions.{idx['name']}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                results["skipped"].append(f"trello_webhook_actions.{idx['name']}")
+            else:
+                results["errors"].append(f"trello_webhook_actions.{idx['name']}: {str(e)}")
+                logger.error(f"Erro ao criar índice trello_webhook_actions.{idx['name']}: {e}")
+
+    # ====================================================================
+    # ÍNDICES PARA A PESQUISA DE DOCUMENTOS ('document_postings', 'document_terms',
+    # 'document_search_docs')
+    # ====================================================================
+    document_search_indexes = [
+        # Postings de um termo, as de maior tf primeiro
+        ("document_postings", {"keys": [("term", 1), ("tf", -1)], "name": "idx_postings_term_tf"}),
+        # Pesquisa restrita a um processo
+        ("document_postings", {"keys": [("term", 1), ("process_id", 1), ("tf", -1)], "name": "idx_postings_term_process_tf"}),
+        # Reindexação de um documento
+        ("document_postings", {"keys": [("doc_id", 1)], "name": "idx_postings_doc"}),
+        ("document_terms", {"keys": [("term", 1)], "name": "idx_document_terms_term", "unique": True}),
+        ("document_search_docs", {"keys": [("doc_id", 1)], "name": "idx_document_search_doc", "unique": True}),
+    ]
+
+    for collection, idx in document_search_indexes:
+        try:
+            await getattr(db, collection).create_index(
+                idx["keys"],
+                name=idx["name"],
+                unique=idx.get("unique", False),
+                background=True
+            )
+            results["created"].append(f"{collection}.{idx['name']}")
+            logger.info(f"Índice criado: {collection}.{idx['name']}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                results["skipped"].append(f"{collection}.{idx['name']}")
+            else:
+                results["errors"].append(f"{collection}.{idx['name']}: {str(e)}")
+                logger.error(f"Erro ao criar índice {collection}.{idx['name']}: {e}")
+
+    # ====================================================================
+    # ÍNDICES PARA 'document_metadata' E 'background_jobs' (categorização em lote)
+    # ====================================================================
+    categorization_indexes = [
+        # Verificação em lote ($in) dos documentos já categorizados
+        ("document_metadata", {"keys": [("s3_path", 1)], "name": "idx_document_metadata_s3_path"}),
+        ("document_metadata", {"keys": [("process_id", 1)], "name": "idx_document_metadata_process"}),
+        # Job activo por processo e retoma de jobs interrompidos
+        ("background_jobs", {"keys": [("type", 1), ("metadata.process_id", 1), ("status", 1)], "name": "idx_background_jobs_type_process"}),
+        ("background_jobs", {"keys": [("id", 1)], "name": "idx_background_jobs_id"}),
+    ]
+
+    for collection, idx in categorization_indexes:
+        try:
+            await getattr(db, collection).create_index(
+                idx["keys"],
+                name=idx["name"],
+                unique=idx.get("unique", False),
+                background=True
+            )
+            results["created"].append(f"{collection}.{idx['name']}")
+            logger.info(f"Índice criado: {collection}.{idx['name']}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                results["skipped"].append(f"{collection}.{idx['name']}")
+            else:
+                results["errors"].append(f"{collection}.{idx['name']}: {str(e)}")
+                logger.error(f"Erro ao criar índice {collection}.{idx['name']}: {e}")
+
+    # ====================================================================
+    # ÍNDICES PARA O MANIFESTO S3 ('s3_objects', 's3_manifest_state')
+    # ====================================================================
+    s3_manifest_indexes = [
+        ("s3_objects", {"keys": [("key", 1)], "name": "idx_s3_objects_key", "unique": True}),
+        # Listagem de um cliente (ordenada por caminho)
+        ("s3_objects", {"keys": [("prefix", 1), ("key", 1)], "name": "idx_s3_objects_prefix"}),
+        ("s3_manifest_state", {"keys": [("prefix", 1)], "name": "idx_s3_manifest_prefix", "unique": True}),
+        # Reconciliação dos prefixos mais antigos
+        ("s3_manifest_state", {"keys": [("reconciled_at", 1)], "name": "idx_s3_manifest_reconciled"}),
+    ]
+
+    for collection, idx in s3_manifest_indexes:
+        try:
+            await getattr(db, collection).create_index(
+                idx["keys"],
+                name=idx["name"],
+                unique=idx.get("unique", False),
+                background=True
+            )
+            results["created"].append(f"{collection}.{idx['name']}")
+            logger.info(f"Índice criado: {collection}.{idx['name']}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                results["skipped"].append(f"{collection}.{idx['name']}")
+            else:
+                results["errors"].append(f"{collection}.{idx['name']}: {str(e)}")
+                logger.error(f"Erro ao criar índice {collection}.{idx['name']}: {e}")
+
+    # ====================================================================
+    # ÍNDICES PARA O USO DE IA ('ai_usage_logs', 'ai_usage_rollups')
+    # ====================================================================
+    ai_usage_indexes = [
+        # Upserts em lote dos rollups
+        ("ai_usage_rollups", {"keys": [("rollup_id", 1)], "name": "idx_ai_usage_rollups_id", "unique": True}),
+        # Leitura de buckets pelos dashboards
+        ("ai_usage_rollups", {"keys": [("granularity", 1), ("bucket", 1)], "name": "idx_ai_usage_rollups_bucket"}),
+        ("ai_usage_logs", {"keys": [("created_at", -1)], "name": "idx_ai_usage_logs_created"}),
+    ]
+
+    for collection, idx in ai_usage_indexes:
+        try:
+            await getattr(db, collection).create_index(
+                idx["keys"],
+                name=idx["name"],
+                unique=idx.get("unique", False),
+                background=True
+            )
+            results["created"].append(f"{collection}.{idx['name']}")
+            logger.info(f"Índice criado: {collection}.{idx['name']}")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                results["skipped"].append(f"{collection}.{idx['name']}")
+            else:
+                results["errors"].append(f"{collection}.{idx['name']}: {str(e)}")
+                logger.error(f"Erro ao criar índice {collection}.{idx['name']}: {e}")
+
     # Resumo
     logger.info(
         f"Criação de índices concluída: "
@@ -281,7 +591,7 @@ async def get_index_stats(db) -> dict:
     """
     stats = {}
     
-    collections = ["processes", "users", "system_error_logs", "properties", "tasks"]
+    collections = ["processes", "users", "system_error_logs", "properties", "tasks", "history", "search_index"]
     
     for collection_name in collections:
         try:
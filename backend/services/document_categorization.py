@@ -9,7 +9,8 @@ Funcionalidades:
 - Extracção de texto de PDFs
 - Categorização automática com IA
 - Geração de resumo e tags
-- Pesquisa por conteúdo
+
+A pesquisa por conteúdo está em services/document_search.py.
 
 Autor: CreditoIMO Development Team
 ====================================================================
@@ -21,17 +22,25 @@ import json
 import uuid
 import logging
 import base64
+import asyncio
 from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime, timezone
 
 from dotenv import load_dotenv
 
+from middleware.metrics import track_call
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY', '')
 
+# Limite de chamadas de categorização à IA em simultâneo, partilhado por
+# todos os caminhos (upload, categorização individual e em lote)
+AI_CATEGORIZATION_CONCURRENCY = int(os.environ.get('AI_CATEGORIZATION_CONCURRENCY', '5'))
+_ai_semaphore = asyncio.Semaphore(AI_CATEGORIZATION_CONCURRENCY)
+
 
 def extract_text_from_pdf(pdf_content: bytes, max_chars: int = 10000) -> str:
     """
@@ -175,7 +184,9 @@ Responde APENAS em formato JSON válido:
         ).with_model("openai", "gpt-4o-mini")
         
         user_message = UserMessage(text=user_prompt)
-        response = await chat.send_message(user_message)
+        async with _ai_semaphore:
+            with track_call("llm", "document_categorization"):
+                response = await chat.send_message(user_message)
         
         # Parse da resposta JSON
         result = parse_categorization_response(response)
@@ -245,109 +256,6 @@ def parse_categorization_response(response: str) -> Dict[str, Any]:
         }
 
 
-async def search_documents_by_content(
-    query: str,
-    process_id: Optional[str],
-    documents: List[Dict[str, Any]],
-    limit: int = 20
-) -> List[Dict[str, Any]]:
-    """
-    Pesquisar documentos por conteúdo usando correspondência de texto.
-    
-    Args:
-        query: Termo de pesquisa
-        process_id: ID do processo (opcional)
-        documents: Lista de documentos com metadados
-        limit: Número máximo de resultados
-    
-    Returns:
-        Lista de documentos correspondentes ordenados por relevância
-    """
-    results = []
-    query_lower = query.lower()
-    query_words = set(query_lower.split())
-    
-    for doc in documents:
-        # Filtrar por processo se especificado
-        if process_id and doc.get("process_id") != process_id:
-            continue
-        
-        score = 0.0
-        matched_text = None
-        
-        # Pesquisar no nome do ficheiro
-        filename = (doc.get("filename") or "").lower()
-        if query_lower in filename:
-            score += 5.0
-            matched_text = doc.get("filename")
-        
-        # Pesquisar na categoria
-        category = (doc.get("ai_category") or "").lower()
-        if query_lower in category:
-            score += 3.0
-        
-        # Pesquisar na subcategoria
-        subcategory = (doc.get("ai_subcategory") or "").lower()
-        if query_lower in subcategory:
-            score += 3.0
-        
-        # Pesquisar no resumo
-        summary = (doc.get("ai_summary") or "").lower()
-        if query_lower in summary:
-            score += 2.0
-            matched_text = matched_text or doc.get("ai_summary")
-        
-        # Pesquisar nas tags
-        tags = doc.get("ai_tags") or []
-        for tag in tags:
-            if query_lower in tag.lower():
-                score += 2.0
-                break
-        
-        # Pesquisar no texto extraído
-        extracted_text = (doc.get("extracted_text") or "").lower()
-        if extracted_text:
-            # Contar ocorrências
-            occurrences = extracted_text.count(query_lower)
-            if occurrences > 0:
-                score += min(occurrences * 0.5, 5.0)  # Max 5 pontos por ocorrências
-                
-                # Extrair trecho correspondente
-                if not matched_text:
-                    idx = extracted_text.find(query_lower)
-                    if idx >= 0:
-                        start = max(0, idx - 50)
-                        end = min(len(extracted_text), idx + len(query_lower) + 50)
-                        matched_text = "..." + doc.get("extracted_text", "")[start:end] + "..."
-        
-        # Pesquisa por palavras individuais
-        for word in query_words:
-            if len(word) >= 3:
-                if word in filename:
-                    score += 0.5
-                if word in extracted_text:
-                    score += 0.3
-        
-        if score > 0:
-            results.append({
-                "id": doc.get("id"),
-                "process_id": doc.get("process_id"),
-                "client_name": doc.get("client_name"),
-                "s3_path": doc.get("s3_path"),
-                "filename": doc.get("filename"),
-                "ai_category": doc.get("ai_category"),
-                "ai_subcategory": doc.get("ai_subcategory"),
-                "ai_summary": doc.get("ai_summary"),
-                "relevance_score": round(score, 2),
-                "matched_text": matched_text
-            })
-    
-    # Ordenar por relevância
-    results.sort(key=lambda x: x["relevance_score"], reverse=True)
-    
-    return results[:limit]
-
-
 async def get_unique_categories(documents: List[Dict[str, Any]]) -> List[str]:
     """
     Obter lista de categorias únicas dos documentos.
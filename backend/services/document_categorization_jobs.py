@@ -0,0 +1,300 @@
+"""
+====================================================================
+CATEGORIZAÇÃO EM LOTE DE DOCUMENTOS (JOB EM BACKGROUND) - CREDITOIMO
+====================================================================
+Categoriza todos os documentos S3 de um processo fora do pedido HTTP,
+como job de `services.background_jobs` (progresso em
+`background_jobs.progress`).
+
+Pipeline:
+- Uma única query `$in` sobre `s3_path` decide o que já está categorizado.
+- Downloads S3 (`async_s3_service`) e extracção de texto em threads,
+  com no máximo DOC_CATEGORIZATION_CONCURRENCY ficheiros em curso.
+- Chamadas à IA dentro do limite partilhado de
+  `categorize_document_with_ai` (AI_CATEGORIZATION_CONCURRENCY).
+- Metadados gravados em lote (bulk upsert por `s3_path`) a cada
+  FLUSH_SIZE documentos; cada lote gravado é o ponto de retoma.
+
+Retoma: um job interrompido (sem heartbeat há STALE_JOB_SECONDS) é
+retomado no arranque ou ao pedir de novo a categorização do processo;
+os documentos já gravados são ignorados pela verificação inicial.
+====================================================================
+"""
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from database import db
+from services.background_jobs import background_jobs, JobType, JobStatus
+from services.document_categorization import extract_text_from_pdf, categorize_document_with_ai
+from services.document_search import index_document_text
+from services.s3_storage import async_s3_service
+from services.s3_manifest import s3_manifest
+
+logger = logging.getLogger(__name__)
+
+
+DOC_CATEGORIZATION_CONCURRENCY = int(os.environ.get("DOC_CATEGORIZATION_CONCURRENCY", "4"))
+FLUSH_SIZE = 10
+STALE_JOB_SECONDS = 300
+
+EXISTING_PROJECTION = {"_id": 0, "id": 1, "s3_path": 1, "is_categorized": 1, "ai_category": 1}
+
+
+def plan_categorization(
+    files: Dict[str, List[dict]],
+    existing: Dict[str, dict],
+) -> Tuple[List[Tuple[str, str]], List[dict]]:
+    """
+    Separar os ficheiros do S3 em pendentes [(s3_path, filename)] e
+    já categorizados (entradas de resultado "skipped").
+    """
+    pending = []
+    skipped = []
+    seen = set()
+    for file_list in files.values():
+        for file_info in file_list:
+            s3_path = file_info.get("path")
+            filename = file_info.get("name")
+            if not s3_path or not filename or s3_path in seen:
+                continue
+            seen.add(s3_path)
+            meta = existing.get(s3_path)
+            if meta and meta.get("is_categorized"):
+                skipped.append({
+                    "filename": filename,
+                    "status": "skipped",
+                    "category": meta.get("ai_category")
+                })
+            else:
+                pending.append((s3_path, filename))
+    return pending, skipped
+
+
+def build_categorized_metadata(
+    doc_id: str,
+    process: dict,
+    s3_path: str,
+    filename: str,
+    result: dict,
+    extracted_text: str,
+    file_size: int,
+    now: str,
+) -> dict:
+    """Metadados de um documento categorizado pela IA."""
+    return {
+        "id": doc_id,
+        "process_id": process["id"],
+        "client_name": process.get("client_name", "Cliente"),
+        "s3_path": s3_path,
+        "filename": filename,
+        "ai_category": result.get("category"),
+        "ai_subcategory": result.get("subcategory"),
+        "ai_confidence": result.get("confidence"),
+        "ai_tags": result.get("tags", []),
+        "ai_summary": result.get("summary"),
+        "expiry_date": result.get("expiry_date"),
+        "expiry_alert_sent": False,
+        "extracted_text": extracted_text[:5000] if extracted_text else None,
+        "file_size": file_size,
+        "is_categorized": True,
+        "categorized_at": now,
+        "updated_at": now
+    }
+
+
+async def _load_file(s3_path: str, filename: str) -> Tuple[Optional[bytes], str]:
+    """Download S3 e extracção de texto fora do event loop."""
+    content = await async_s3_service.get_file_content(s3_path)
+    if not content:
+        return None, ""
+    extracted_text = ""
+    if filename.lower().endswith(".pdf"):
+        extracted_text = await asyncio.to_thread(extract_text_from_pdf, content)
+    return content, extracted_text
+
+
+async def _flush(buffer: List[dict]):
+    """Gravar um lote de metadados (upsert por s3_path) e indexá-los para pesquisa."""
+    if not buffer:
+        return
+    batch = list(buffer)
+    buffer.clear()
+    ops = []
+    for metadata in batch:
+        ops.append(UpdateOne(
+            {"s3_path": metadata["s3_path"]},
+            {"$set": metadata, "$setOnInsert": {"created_at": metadata["categorized_at"]}},
+            upsert=True
+        ))
+    await db.document_metadata.bulk_write(ops, ordered=False)
+    for metadata in batch:
+        await index_document_text(metadata)
+
+
+async def run_categorize_all(job_id: str, process_id: str):
+    """Categorizar os documentos de um processo (corpo do job)."""
+    await background_jobs.set_status(job_id, JobStatus.PROCESSING)
+
+    process = await db.processes.find_one(
+        {"id": process_id},
+        {"_id": 0, "id": 1, "client_name": 1, "second_client_name": 1, "titular2_data.nome": 1}
+    )
+    if not process:
+        await background_jobs.set_error(job_id, "Processo não encontrado")
+        return
+
+    client_name = process.get("client_name", "Cliente")
+    second_client_name = process.get("second_client_name") or \
+                         (process.get("titular2_data") or {}).get("nome")
+
+    files_data = await s3_manifest.list_files(process_id, client_name, second_client_name)
+    files = files_data.get("files", {})
+    paths = [f.get("path") for file_list in files.values() for f in file_list if f.get("path")]
+
+    existing = {}
+    if paths:
+        async for meta in db.document_metadata.find({"s3_path": {"$in": paths}}, EXISTING_PROJECTION):
+            existing[meta["s3_path"]] = meta
+
+    pending, skipped = plan_categorization(files, existing)
+    total = len(pending) + len(skipped)
+    results = {
+        "total": total,
+        "categorized": 0,
+        "skipped": len(skipped),
+        "errors": 0,
+        "documents": skipped
+    }
+    done = len(skipped)
+    await background_jobs.update_progress(
+        job_id, done, total, f"{len(pending)} documentos por categorizar"
+    )
+
+    existing_categories = [c for c in await db.document_metadata.distinct("ai_category") if c]
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+    buffer: List[dict] = []
+
+    async def categorize(s3_path: str, filename: str):
+        content, extracted_text = await _load_file(s3_path, filename)
+        if not content:
+            results["errors"] += 1
+            results["documents"].append({
+                "filename": filename,
+                "status": "error",
+                "error": "Ficheiro não encontrado no S3"
+            })
+            return
+
+        result = await categorize_document_with_ai(
+            text_content=extracted_text or f"Ficheiro: {filename}",
+            filename=filename,
+            existing_categories=list(existing_categories)
+        )
+        if not result.get("success"):
+            results["errors"] += 1
+            results["documents"].append({
+                "filename": filename,
+                "status": "error",
+                "error": result.get("error")
+            })
+            return
+
+        now = datetime.now(timezone.utc).isoformat()
+        doc_id = (existing.get(s3_path) or {}).get("id") or str(uuid.uuid4())
+        buffer.append(build_categorized_metadata(
+            doc_id, process, s3_path, filename, result, extracted_text, len(content), now
+        ))
+        if result.get("category") and result["category"] not in existing_categories:
+            existing_categories.append(result["category"])
+
+        results["categorized"] += 1
+        results["documents"].append({
+            "filename": filename,
+            "status": "categorized",
+            "category": result.get("category"),
+            "subcategory": result.get("subcategory"),
+            "expiry_date": result.get("expiry_date")
+        })
+        if len(buffer) >= FLUSH_SIZE:
+            await _flush(buffer)
+
+    async def worker():
+        nonlocal done
+        while not queue.empty():
+            s3_path, filename = queue.get_nowait()
+            try:
+                await categorize(s3_path, filename)
+            except Exception as e:
+                logger.error(f"Erro ao categorizar {filename}: {e}")
+                results["errors"] += 1
+                results["documents"].append({
+                    "filename": filename,
+                    "status": "error",
+                    "error": str(e)
+                })
+            done += 1
+            await background_jobs.update_progress(job_id, done, total, f"A categorizar: {filename}")
+
+    workers = min(DOC_CATEGORIZATION_CONCURRENCY, len(pending))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    await _flush(buffer)
+
+    await background_jobs.set_result(job_id, results)
+    logger.info(
+        f"Categorização em lote {job_id} concluída: {results['categorized']} categorizados, "
+        f"{results['skipped']} ignorados, {results['errors']} erros"
+    )
+
+
+async def start_categorize_all(process_id: str, user: dict) -> dict:
+    """
+    Iniciar (ou retomar) a categorização em lote de um processo.
+    Um job activo para o mesmo processo é devolvido em vez de criar outro.
+    """
+    active = await db.background_jobs.find_one(
+        {
+            "type": JobType.DOCUMENT_CATEGORIZATION.value,
+            "metadata.process_id": process_id,
+            "status": {"$in": [JobStatus.PENDING.value, JobStatus.PROCESSING.value]}
+        },
+        {"_id": 0, "id": 1}
+    )
+    if active:
+        job_id = active["id"]
+        if background_jobs.is_running(job_id) or \
+                not await background_jobs.claim_stale_job(job_id, STALE_JOB_SECONDS):
+            return {"job_id": job_id, "status": "running", "resumed": False}
+        background_jobs.run_in_background(job_id, run_categorize_all(job_id, process_id))
+        logger.info(f"Categorização em lote {job_id} retomada para o processo {process_id}")
+        return {"job_id": job_id, "status": "started", "resumed": True}
+
+    job_id = await background_jobs.create_job(
+        job_type=JobType.DOCUMENT_CATEGORIZATION,
+        user_id=user.get("id"),
+        user_email=user.get("email"),
+        metadata={"process_id": process_id}
+    )
+    background_jobs.run_in_background(job_id, run_categorize_all(job_id, process_id))
+    return {"job_id": job_id, "status": "started", "resumed": False}
+
+
+async def resume_interrupted_categorizations():
+    """Retomar no arranque os jobs interrompidos (ex.: reinício do servidor)."""
+    try:
+        jobs = await background_jobs.find_stale_jobs(JobType.DOCUMENT_CATEGORIZATION, STALE_JOB_SECONDS)
+        for job in jobs:
+            process_id = (job.get("metadata") or {}).get("process_id")
+            if not process_id or not await background_jobs.claim_stale_job(job["id"], STALE_JOB_SECONDS):
+                continue
+            background_jobs.run_in_background(job["id"], run_categorize_all(job["id"], process_id))
+            logger.info(f"Categorização em lote {job['id']} retomada após reinício")
+    except Exception as e:
+        logger.warning(f"Erro ao retomar categorizações em lote: {e}")
@@ -0,0 +1,450 @@
+"""
+====================================================================
+PESQUISA DE DOCUMENTOS (ÍNDICE INVERTIDO + BM25) - CREDITOIMO
+====================================================================
+Índice invertido sobre os metadados de documentos categorizados,
+construído no momento da categorização. A pesquisa lê apenas as
+postings dos termos da query (limitadas por termo) e os metadados dos
+documentos devolvidos, sem carregar o texto extraído completo.
+
+Colecções:
+    document_postings     {term, doc_id, process_id, ai_category,
+                           tf, length, pos}
+    document_terms        {term, df}
+    document_search_docs  {doc_id, process_id, length, terms, indexed_at}
+    search_index_state    {id: "document_search_stats",
+                           doc_count, total_length}
+
+- `tf` é a frequência ponderada por campo (nome do ficheiro vale mais
+  que o texto extraído); `length` é o comprimento ponderado do documento.
+- `pos` é a posição (em code points) da primeira ocorrência do termo em
+  `extracted_text`, usada para recortar o excerto no próprio MongoDB.
+- A normalização (sem acentos, minúsculas) é a de `search_index.fold_text`.
+====================================================================
+"""
+import re
+import math
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from database import db
+from services.search_index import fold_text
+
+logger = logging.getLogger(__name__)
+
+
+# Peso de cada campo na frequência do termo (mesma ordem de relevância
+# da pesquisa anterior por substring)
+FIELD_WEIGHTS = {
+    "filename": 5,
+    "ai_category": 3,
+    "ai_subcategory": 3,
+    "ai_summary": 2,
+    "ai_tags": 2,
+    "extracted_text": 1,
+}
+
+# Parâmetros BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MIN_TERM_LEN = 2
+# Postings lidas por termo (as de maior tf); limita o custo da pesquisa
+MAX_POSTINGS_PER_TERM = 500
+# Expansões por prefixo do último termo da query
+MAX_PREFIX_EXPANSIONS = 10
+
+SNIPPET_BEFORE = 60
+SNIPPET_LENGTH = 200
+
+BULK_CHUNK_SIZE = 500
+STATS_DOC_ID = "document_search_stats"
+
+STOPWORDS = {
+    "de", "da", "do", "das", "dos", "em", "na", "no", "nas", "nos", "para",
+    "por", "com", "que", "os", "as", "um", "uma", "ao", "aos", "se", "ou",
+    "the", "of", "and",
+}
+
+# Palavras sem "_" (nomes de ficheiro como IRS_2025.pdf)
+_WORD_RE = re.compile(r"[^\W_]+")
+
+METADATA_PROJECTION = {
+    "_id": 0, "id": 1, "process_id": 1, "client_name": 1, "s3_path": 1,
+    "filename": 1, "ai_category": 1, "ai_subcategory": 1, "ai_summary": 1,
+}
+
+
+# ====================================================================
+# ANÁLISE DE TEXTO
+# ====================================================================
+
+def analyze(text: Any) -> Dict[str, Tuple[int, int]]:
+    """Termos normalizados de um texto: {termo: (ocorrências, 1ª posição)}."""
+    terms: Dict[str, Tuple[int, int]] = {}
+    if not text:
+        return terms
+    for match in _WORD_RE.finditer(str(text)):
+        for term in fold_text(match.group()).split():
+            if len(term) < MIN_TERM_LEN or term in STOPWORDS:
+                continue
+            count, pos = terms.get(term, (0, match.start()))
+            terms[term] = (count + 1, pos)
+    return terms
+
+
+def query_terms(query: str) -> List[str]:
+    """Termos de uma pesquisa (únicos, ordem preservada)."""
+    terms = []
+    for term in fold_text(query).split():
+        if len(term) >= MIN_TERM_LEN and term not in STOPWORDS and term not in terms:
+            terms.append(term)
+    # Pesquisa só com stopwords: usar os termos tal como estão
+    return terms or [t for t in dict.fromkeys(fold_text(query).split()) if t]
+
+
+def build_postings(meta: dict) -> Tuple[List[dict], int]:
+    """
+    Postings de um documento e o seu comprimento ponderado.
+    Cada posting guarda tf ponderado, comprimento e posição no texto.
+    """
+    tf: Dict[str, int] = defaultdict(int)
+    positions: Dict[str, int] = {}
+    length = 0
+    for field, weight in FIELD_WEIGHTS.items():
+        value = meta.get(field)
+        if isinstance(value, list):
+            value = " ".join(str(v) for v in value)
+        for term, (count, pos) in analyze(value).items():
+            tf[term] += weight * count
+            length += weight * count
+            if field == "extracted_text":
+                positions[term] = pos
+
+    postings = [
+        {
+            "term": term,
+            "doc_id": meta["id"],
+            "process_id": meta.get("process_id"),
+            "ai_category": meta.get("ai_category"),
+            "tf": freq,
+            "length": length,
+            "pos": positions.get(term),
+        }
+        for term, freq in tf.items()
+    ]
+    return postings, length
+
+
+# ====================================================================
+# RANKING
+# ====================================================================
+
+def bm25_idf(df: int, doc_count: int) -> float:
+    return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+
+def rank_postings(
+    postings_by_term: Dict[str, List[dict]],
+    dfs: Dict[str, int],
+    doc_count: int,
+    avg_length: float,
+) -> List[Tuple[str, float, Optional[int]]]:
+    """
+    Pontuar documentos com BM25 a partir das postings dos termos.
+    Devolve [(doc_id, score, posição do 1º termo no texto)] ordenado.
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    positions: Dict[str, Optional[int]] = {}
+    avg_length = avg_length or 1.0
+    for term, postings in postings_by_term.items():
+        idf = bm25_idf(dfs.get(term, len(postings)), max(doc_count, len(postings)))
+        for posting in postings:
+            doc_id = posting["doc_id"]
+            tf = posting["tf"]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * posting.get("length", avg_length) / avg_length)
+            scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+            pos = posting.get("pos")
+            if pos is not None and (positions.get(doc_id) is None or pos < positions[doc_id]):
+                positions[doc_id] = pos
+            positions.setdefault(doc_id, None)
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return [(doc_id, score, positions.get(doc_id)) for doc_id, score in ranked]
+
+
+def highlight_spans(text: str, terms: List[str], prefix: Optional[str] = None) -> List[List[int]]:
+    """Intervalos [início, fim] das palavras do texto que correspondem à pesquisa."""
+    wanted = set(terms)
+    spans = []
+    for match in _WORD_RE.finditer(text or ""):
+        folded = fold_text(match.group())
+        if folded in wanted or (prefix and folded.startswith(prefix)):
+            spans.append([match.start(), match.end()])
+    return spans
+
+
+def build_snippet(source: str, start: int, total_length: Optional[int]) -> Tuple[str, int]:
+    """Excerto com reticências; devolve o texto e o deslocamento do recorte."""
+    snippet = source.strip()
+    offset = len(source) - len(source.lstrip())
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if total_length is None or start + SNIPPET_LENGTH < total_length else ""
+    return prefix + snippet + suffix, len(prefix) - offset
+
+
+# ====================================================================
+# MANUTENÇÃO DO ÍNDICE
+# ====================================================================
+
+async def _apply_df_changes(added: List[str], removed: List[str]):
+    ops = [UpdateOne({"term": t}, {"$inc": {"df": 1}}, upsert=True) for t in added]
+    ops += [UpdateOne({"term": t}, {"$inc": {"df": -1}}) for t in removed]
+    for i in range(0, len(ops), BULK_CHUNK_SIZE):
+        await db.document_terms.bulk_write(ops[i:i + BULK_CHUNK_SIZE], ordered=False)
+
+
+async def index_document_text(meta: dict):
+    """
+    (Re)indexar os metadados de um documento categorizado.
+    Chamado sempre que `document_metadata` é gravado após categorização.
+    Não confundir com `search_index.index_document` (pesquisa global).
+    """
+    doc_id = meta.get("id")
+    if not doc_id:
+        return
+    try:
+        postings, length = build_postings(meta)
+        previous = await db.document_search_docs.find_one(
+            {"doc_id": doc_id}, {"_id": 0, "terms": 1, "length": 1}
+        )
+
+        await db.document_postings.delete_many({"doc_id": doc_id})
+        for i in range(0, len(postings), BULK_CHUNK_SIZE):
+            await db.document_postings.insert_many(postings[i:i + BULK_CHUNK_SIZE], ordered=False)
+
+        terms = [p["term"] for p in postings]
+        old_terms = set(previous.get("terms", [])) if previous else set()
+        new_terms = set(terms)
+        await _apply_df_changes(sorted(new_terms - old_terms), sorted(old_terms - new_terms))
+
+        await db.search_index_state.update_one(
+            {"id": STATS_DOC_ID},
+            {"$inc": {
+                "doc_count": 0 if previous else 1,
+                "total_length": length - (previous.get("length", 0) if previous else 0),
+            }},
+            upsert=True,
+        )
+        await db.document_search_docs.update_one(
+            {"doc_id": doc_id},
+            {"$set": {
+                "doc_id": doc_id,
+                "process_id": meta.get("process_id"),
+                "length": length,
+                "terms": terms,
+                "indexed_at": datetime.now(timezone.utc).isoformat(),
+            }},
+            upsert=True,
+        )
+    except Exception as e:
+        # O índice é reconstruível; não falhar a categorização
+        logger.warning(f"Erro ao indexar documento {doc_id} para pesquisa: {e}")
+
+
+async def remove_document_text(doc_id: str):
+    """Retirar um documento do índice (postings, df e estatísticas)."""
+    if not doc_id:
+        return
+    try:
+        previous = await db.document_search_docs.find_one_and_delete(
+            {"doc_id": doc_id}, {"_id": 0, "terms": 1, "length": 1}
+        )
+        await db.document_postings.delete_many({"doc_id": doc_id})
+        if not previous:
+            return
+        await _apply_df_changes([], sorted(set(previous.get("terms", []))))
+        await db.search_index_state.update_one(
+            {"id": STATS_DOC_ID},
+            {"$inc": {"doc_count": -1, "total_length": -previous.get("length", 0)}}
+        )
+    except Exception as e:
+        # O índice é reconstruível; não falhar a eliminação
+        logger.warning(f"Erro ao retirar documento {doc_id} da pesquisa: {e}")
+
+
+async def rebuild_document_search_index() -> dict:
+    """Reconstruir o índice a partir de todos os documentos categorizados."""
+    await db.document_postings.delete_many({})
+    await db.document_terms.delete_many({})
+    await db.document_search_docs.delete_many({})
+
+    dfs: Dict[str, int] = defaultdict(int)
+    doc_count = 0
+    total_length = 0
+    pending_postings: List[dict] = []
+    pending_docs: List[dict] = []
+    now = datetime.now(timezone.utc).isoformat()
+
+    async def flush():
+        if pending_postings:
+            await db.document_postings.insert_many(list(pending_postings), ordered=False)
+            pending_postings.clear()
+        if pending_docs:
+            await db.document_search_docs.insert_many(list(pending_docs), ordered=False)
+            pending_docs.clear()
+
+    projection = {"_id": 0, "id": 1, "process_id": 1, **{field: 1 for field in FIELD_WEIGHTS}}
+    async for meta in db.document_metadata.find({"is_categorized": True}, projection):
+        if not meta.get("id"):
+            continue
+        postings, length = build_postings(meta)
+        terms = [p["term"] for p in postings]
+        for term in terms:
+            dfs[term] += 1
+        doc_count += 1
+        total_length += length
+        pending_postings.extend(postings)
+        pending_docs.append({
+            "doc_id": meta["id"], "process_id": meta.get("process_id"),
+            "length": length, "terms": terms, "indexed_at": now,
+        })
+        if len(pending_postings) >= BULK_CHUNK_SIZE:
+            await flush()
+    await flush()
+
+    term_docs = [{"term": term, "df": df} for term, df in dfs.items()]
+    for i in range(0, len(term_docs), BULK_CHUNK_SIZE):
+        await db.document_terms.insert_many(term_docs[i:i + BULK_CHUNK_SIZE], ordered=False)
+
+    await db.search_index_state.update_one(
+        {"id": STATS_DOC_ID},
+        {"$set": {"doc_count": doc_count, "total_length": total_length, "rebuilt_at": now}},
+        upsert=True,
+    )
+    result = {"documents": doc_count, "terms": len(term_docs)}
+    logger.info(f"Índice de pesquisa de documentos reconstruído: {result}")
+    return result
+
+
+async def ensure_document_search_index():
+    """Construir o índice no arranque se ainda não existir."""
+    try:
+        if await db.document_search_docs.estimated_document_count() == 0:
+            if await db.document_metadata.count_documents({"is_categorized": True}, limit=1):
+                await rebuild_document_search_index()
+    except Exception as e:
+        logger.warning(f"Erro ao preparar índice de pesquisa de documentos: {e}")
+
+
+# ====================================================================
+# PESQUISA
+# ====================================================================
+
+async def _expand_prefix(term: str) -> List[str]:
+    """Termos do vocabulário que começam pelo último termo escrito."""
+    cursor = db.document_terms.find(
+        {"term": {"$regex": f"^{re.escape(term)}"}, "df": {"$gt": 0}},
+        {"_id": 0, "term": 1},
+    ).limit(MAX_PREFIX_EXPANSIONS)
+    return [t["term"] async for t in cursor]
+
+
+async def _fetch_postings(term: str, process_id: Optional[str], categories: Optional[List[str]]) -> List[dict]:
+    query: Dict[str, Any] = {"term": term}
+    if process_id:
+        query["process_id"] = process_id
+    if categories:
+        query["ai_category"] = {"$in": categories}
+    cursor = db.document_postings.find(
+        query, {"_id": 0, "doc_id": 1, "tf": 1, "length": 1, "pos": 1}
+    ).sort("tf", -1).limit(MAX_POSTINGS_PER_TERM)
+    return await cursor.to_list(MAX_POSTINGS_PER_TERM)
+
+
+async def _load_results(ranked: List[Tuple[str, float, Optional[int]]]) -> Dict[str, dict]:
+    """Metadados dos documentos devolvidos, com o excerto recortado no servidor."""
+    doc_ids = [doc_id for doc_id, _, _ in ranked]
+    starts = [max(0, (pos or 0) - SNIPPET_BEFORE) for _, _, pos in ranked]
+    text = {"$ifNull": ["$extracted_text", ""]}
+    start = {"$arrayElemAt": [starts, {"$indexOfArray": [doc_ids, "$id"]}]}
+    pipeline = [
+        {"$match": {"id": {"$in": doc_ids}}},
+        {"$project": {
+            **METADATA_PROJECTION,
+            "snippet_source": {"$substrCP": [text, start, SNIPPET_LENGTH]},
+            "text_length": {"$strLenCP": text},
+        }},
+    ]
+    docs = await db.document_metadata.aggregate(pipeline).to_list(len(doc_ids))
+    return {doc["id"]: doc for doc in docs}
+
+
+async def search_documents(
+    query: str,
+    process_id: Optional[str] = None,
+    categories: Optional[List[str]] = None,
+    limit: int = 20,
+) -> List[Dict[str, Any]]:
+    """
+    Pesquisar documentos com BM25 sobre o índice invertido.
+    O último termo é também pesquisado por prefixo (pesquisa enquanto se escreve).
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    prefix = terms[-1] if len(terms[-1]) >= 3 else None
+    search_terms = list(terms)
+    if prefix:
+        for term in await _expand_prefix(prefix):
+            if term not in search_terms:
+                search_terms.append(term)
+
+    postings, term_docs, stats = await asyncio.gather(
+        asyncio.gather(*(_fetch_postings(t, process_id, categories) for t in search_terms)),
+        db.document_terms.find({"term": {"$in": search_terms}}, {"_id": 0}).to_list(len(search_terms)),
+        db.search_index_state.find_one({"id": STATS_DOC_ID}, {"_id": 0}),
+    )
+    stats = stats or {}
+    doc_count = stats.get("doc_count", 0)
+    avg_length = stats.get("total_length", 0) / doc_count if doc_count else 0
+    dfs = {t["term"]: t.get("df", 0) for t in term_docs}
+
+    ranked = rank_postings(dict(zip(search_terms, postings)), dfs, doc_count, avg_length)[:limit]
+    if not ranked:
+        return []
+
+    docs = await _load_results(ranked)
+    top_score = ranked[0][1] or 1.0
+    results = []
+    for doc_id, score, pos in ranked:
+        doc = docs.get(doc_id)
+        if not doc:
+            continue
+        if pos is not None and doc.get("snippet_source"):
+            start = max(0, pos - SNIPPET_BEFORE)
+            matched_text, shift = build_snippet(doc["snippet_source"], start, doc.get("text_length"))
+            spans = [[s + shift, e + shift] for s, e in highlight_spans(doc["snippet_source"], terms, prefix)]
+        else:
+            matched_text = doc.get("ai_summary") or doc.get("filename")
+            spans = highlight_spans(matched_text or "", terms, prefix)
+        results.append({
+            "id": doc_id,
+            "process_id": doc.get("process_id"),
+            "client_name": doc.get("client_name"),
+            "s3_path": doc.get("s3_path"),
+            "filename": doc.get("filename"),
+            "ai_category": doc.get("ai_category"),
+            "ai_subcategory": doc.get("ai_subcategory"),
+            "ai_summary": doc.get("ai_summary"),
+            # Escala 0-10 relativa ao melhor resultado (apresentação)
+            "relevance_score": round(10 * score / top_score, 2),
+            "bm25_score": round(score, 4),
+            "matched_text": matched_text,
+            "highlights": spans,
+        })
+    return results
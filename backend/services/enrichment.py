@@ -0,0 +1,158 @@
+"""
+====================================================================
+ENRIQUECIMENTO EM LOTE - CREDITOIMO
+====================================================================
+Resolve nomes de utilizadores e de processos para listagens inteiras
+(tarefas, emails) com uma query `$in` por colecção, em vez de várias
+queries por item.
+
+Os nomes de utilizadores passam por uma cache em memória de TTL curto,
+partilhada por todas as rotas do processo.
+====================================================================
+"""
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+USER_NAME_TTL_SECONDS = 30
+USER_NAME_CACHE_MAX = 5000
+
+
+class UserNameCache:
+    """
+    Cache id -> nome de utilizador com TTL curto.
+    Ids em falta são resolvidos numa única query `$in`.
+    """
+
+    def __init__(self, ttl: int = USER_NAME_TTL_SECONDS, max_size: int = USER_NAME_CACHE_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: Dict[str, tuple] = {}
+
+    async def get_names(self, user_ids: Iterable[str]) -> Dict[str, str]:
+        """Obter nomes para os ids indicados (ids desconhecidos são omitidos)."""
+        now = time.monotonic()
+        names = {}
+        missing = []
+
+        for uid in set(filter(None, user_ids)):
+            entry = self._entries.get(uid)
+            if entry and entry[1] > now:
+                if entry[0] is not None:
+                    names[uid] = entry[0]
+            else:
+                missing.append(uid)
+
+        if missing:
+            users = await db.users.find(
+                {"id": {"$in": missing}},
+                {"_id": 0, "id": 1, "name": 1}
+            ).to_list(len(missing))
+            found = {u["id"]: u.get("name") for u in users}
+
+            if len(self._entries) + len(missing) > self.max_size:
+                self._evict(now)
+
+            expires = now + self.ttl
+            for uid in missing:
+                # Guardar também ids inexistentes para não repetir a query
+                self._entries[uid] = (found.get(uid), expires)
+            names.update({uid: name for uid, name in found.items() if name is not None})
+
+        return names
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Invalidar um utilizador (ou toda a cache)."""
+        if user_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(user_id, None)
+
+    def _evict(self, now: float):
+        self._entries = {k: v for k, v in self._entries.items() if v[1] > now}
+        if len(self._entries) > self.max_size // 2:
+            self._entries.clear()
+
+
+user_name_cache = UserNameCache()
+
+
+async def get_process_names(process_ids: Iterable[str]) -> Dict[str, str]:
+    """Obter client_name por id de processo numa única query."""
+    ids = list(set(filter(None, process_ids)))
+    if not ids:
+        return {}
+    processes = await db.processes.find(
+        {"id": {"$in": ids}},
+        {"_id": 0, "id": 1, "client_name": 1}
+    ).to_list(len(ids))
+    return {p["id"]: p.get("client_name", "") for p in processes}
+
+
+def compute_due_info(due_date: Optional[str], completed: bool, now: datetime) -> dict:
+    """Calcular dias até ao vencimento e se está atrasada."""
+    if not due_date or completed:
+        return {"days_until_due": None, "is_overdue": None}
+    try:
+        due = datetime.fromisoformat(due_date.replace("Z", "+00:00"))
+        days_diff = (due - now).days
+        return {"days_until_due": days_diff, "is_overdue": days_diff < 0}
+    except (ValueError, TypeError, AttributeError):
+        return {"days_until_due": None, "is_overdue": None}
+
+
+async def enrich_tasks(tasks: List[dict]) -> List[dict]:
+    """
+    Adicionar nomes de utilizadores, processo e info de prazo a uma
+    lista de tarefas: 1 query de utilizadores (ou 0 com cache) e
+    1 query de processos, independentemente do número de tarefas.
+    """
+    if not tasks:
+        return tasks
+
+    user_ids = set()
+    process_ids = set()
+    for task in tasks:
+        user_ids.update(task.get("assigned_to") or [])
+        if task.get("created_by"):
+            user_ids.add(task["created_by"])
+        if task.get("process_id"):
+            process_ids.add(task["process_id"])
+
+    user_names = await user_name_cache.get_names(user_ids)
+    process_names = await get_process_names(process_ids)
+    now = datetime.now(timezone.utc)
+
+    for task in tasks:
+        if task.get("assigned_to"):
+            task["assigned_to_names"] = [user_names.get(uid, "Desconhecido") for uid in task["assigned_to"]]
+        if task.get("created_by"):
+            task["created_by_name"] = user_names.get(task["created_by"], "Desconhecido")
+        if task.get("process_id") in process_names:
+            task["process_name"] = process_names[task["process_id"]]
+        task.update(compute_due_info(task.get("due_date"), task.get("completed"), now))
+
+    return tasks
+
+
+async def enrich_emails(emails: List[dict]) -> List[dict]:
+    """Adicionar nome do cliente e de quem criou a uma lista de emails."""
+    if not emails:
+        return emails
+
+    process_names = await get_process_names(e.get("process_id") for e in emails)
+    user_names = await user_name_cache.get_names(e.get("created_by") for e in emails)
+
+    for email in emails:
+        if email.get("process_id") in process_names:
+            email["client_name"] = process_names[email["process_id"]]
+        if email.get("created_by") in user_names:
+            email["created_by_name"] = user_names[email["created_by"]]
+
+    return emails
@@ -18,11 +18,14 @@ from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Optional, List, BinaryIO
 from datetime import datetime, timezone
 
+from middleware.metrics import register_executor
+
 logger = logging.getLogger(__name__)
 
 # ThreadPool para operações de ficheiros
 # max_workers=4 é suficiente para a maioria dos casos
 _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="file_processor_")
+register_executor("file_processor", _executor)
 
 
 def process_excel_sync(
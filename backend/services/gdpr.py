@@ -35,14 +35,21 @@ LEGAL:
 ====================================================================
 """
 import os
+import json
 import uuid
+import asyncio
 import hashlib
+import zipfile
 import logging
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
 from dataclasses import dataclass
 
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
 from database import db
+from services.process_service import sync_client_key
 
 logger = logging.getLogger(__name__)
 
@@ -60,9 +67,13 @@ class GDPRConfig:
     # Estados elegíveis para anonimização
     eligible_statuses: List[str] = None
     
-    # Batch size para processamento
+    # Batch size para processamento (máximo de processos por execução)
     batch_size: int = 100
     
+    # Processos por bulk_write e blocos gravados em paralelo
+    chunk_size: int = int(os.environ.get("GDPR_CHUNK_SIZE", "200"))
+    concurrency: int = int(os.environ.get("GDPR_CONCURRENCY", "4"))
+    
     # Dry run (apenas logar, não anonimizar)
     dry_run: bool = os.environ.get("GDPR_DRY_RUN", "false").lower() == "true"
     
@@ -251,43 +262,13 @@ def _anonymize_array_field(doc: dict, array_path: str, field_name: str, anonymiz
     return doc
 
 
-async def anonymize_process_data(process_id: str, dry_run: bool = None) -> Dict[str, Any]:
+def build_anonymization_update(process: dict, run_id: str = None) -> Tuple[dict, dict, List[str], List[str]]:
     """
-    Anonimiza dados pessoais de um processo.
-    
-    Args:
-        process_id: ID do processo a anonimizar
-        dry_run: Se True, apenas simula (não altera BD)
+    Calcula em memória a anonimização de um processo.
     
     Returns:
-        Dict com resultado da operação
+        ($set, $unset, campos anonimizados, campos removidos)
     """
-    if dry_run is None:
-        dry_run = gdpr_config.dry_run
-    
-    logger.info(f"[GDPR] {'[DRY RUN] ' if dry_run else ''}Iniciando anonimização do processo {process_id}")
-    
-    # Buscar processo
-    process = await db.processes.find_one({"id": process_id})
-    
-    if not process:
-        logger.warning(f"[GDPR] Processo não encontrado: {process_id}")
-        return {
-            "success": False,
-            "process_id": process_id,
-            "error": "Processo não encontrado"
-        }
-    
-    # Verificar se já está anonimizado
-    if process.get("is_anonymized"):
-        logger.info(f"[GDPR] Processo já anonimizado: {process_id}")
-        return {
-            "success": True,
-            "process_id": process_id,
-            "already_anonymized": True
-        }
-    
-    # Contar campos anonimizados
     fields_anonymized = []
     fields_removed = []
     
@@ -322,17 +303,59 @@ async def anonymize_process_data(process_id: str, dry_run: bool = None) -> Dict[
             fields_removed.append(field)
     
     # 3. Adicionar metadados de anonimização
-    anonymization_metadata = {
+    update_data.update({
         "is_anonymized": True,
         "anonymized_at": datetime.now(timezone.utc),
         "anonymization_reason": "GDPR_RETENTION_PERIOD",
         "fields_anonymized": fields_anonymized,
         "fields_removed": fields_removed,
         "retention_days": gdpr_config.retention_period_days
-    }
-    update_data.update(anonymization_metadata)
+    })
+    if run_id:
+        update_data["anonymization_run_id"] = run_id
     
-    # 4. Executar actualização (se não for dry run)
+    return update_data, unset_data, fields_anonymized, fields_removed
+
+
+async def anonymize_process_data(process_id: str, dry_run: bool = None) -> Dict[str, Any]:
+    """
+    Anonimiza dados pessoais de um processo.
+    
+    Args:
+        process_id: ID do processo a anonimizar
+        dry_run: Se True, apenas simula (não altera BD)
+    
+    Returns:
+        Dict com resultado da operação
+    """
+    if dry_run is None:
+        dry_run = gdpr_config.dry_run
+    
+    logger.info(f"[GDPR] {'[DRY RUN] ' if dry_run else ''}Iniciando anonimização do processo {process_id}")
+    
+    # Buscar processo
+    process = await db.processes.find_one({"id": process_id})
+    
+    if not process:
+        logger.warning(f"[GDPR] Processo não encontrado: {process_id}")
+        return {
+            "success": False,
+            "process_id": process_id,
+            "error": "Processo não encontrado"
+        }
+    
+    # Verificar se já está anonimizado
+    if process.get("is_anonymized"):
+        logger.info(f"[GDPR] Processo já anonimizado: {process_id}")
+        return {
+            "success": True,
+            "process_id": process_id,
+            "already_anonymized": True
+        }
+    
+    update_data, unset_data, fields_anonymized, fields_removed = build_anonymization_update(process)
+    
+    # Executar actualização (se não for dry run)
     if not dry_run:
         update_query = {"$set": update_data}
         if unset_data:
@@ -342,6 +365,8 @@ async def anonymize_process_data(process_id: str, dry_run: bool = None) -> Dict[
             {"id": process_id},
             update_query
         )
+        # A chave de cliente deriva do nome: não pode manter o original
+        await sync_client_key(process_id)
         
         if result.modified_count == 0:
             logger.error(f"[GDPR] Falha ao anonimizar processo {process_id}")
@@ -356,7 +381,7 @@ async def anonymize_process_data(process_id: str, dry_run: bool = None) -> Dict[
         f"{len(fields_anonymized)} campos anonimizados, {len(fields_removed)} campos removidos"
     )
     
-    # 5. Registar na auditoria
+    # Registar na auditoria
     if not dry_run:
         await db.gdpr_audit.insert_one({
             "action": "anonymize_process",
@@ -440,6 +465,32 @@ async def anonymize_user_data(user_id: str, dry_run: bool = None) -> Dict[str, A
 # ====================================================================
 # FUNÇÕES DE BUSCA E PROCESSAMENTO EM LOTE
 # ====================================================================
+def _eligible_query(retention_days: int = None) -> Dict[str, Any]:
+    """Query dos processos elegíveis para anonimização."""
+    if retention_days is None:
+        retention_days = gdpr_config.retention_period_days
+    
+    cutoff_date = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    
+    return {
+        "status": {"$in": gdpr_config.eligible_statuses},
+        "updated_at": {"$lt": cutoff_date},
+        "$or": [
+            {"is_anonymized": {"$exists": False}},
+            {"is_anonymized": False}
+        ]
+    }
+
+
+# Campos de topo necessários para calcular a anonimização
+ANONYMIZATION_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    **{path.split(".")[0]: 1 for path in ANONYMIZATION_MAP},
+    **{field: 1 for field in FIELDS_TO_REMOVE},
+}
+
+
 async def find_processes_for_anonymization(
     retention_days: int = None,
     limit: int = None
@@ -455,25 +506,11 @@ async def find_processes_for_anonymization(
     Returns:
         Lista de processos elegíveis
     """
-    if retention_days is None:
-        retention_days = gdpr_config.retention_period_days
-    
     if limit is None:
         limit = gdpr_config.batch_size
     
-    cutoff_date = datetime.now(timezone.utc) - timedelta(days=retention_days)
-    
-    query = {
-        "status": {"$in": gdpr_config.eligible_statuses},
-        "updated_at": {"$lt": cutoff_date},
-        "$or": [
-            {"is_anonymized": {"$exists": False}},
-            {"is_anonymized": False}
-        ]
-    }
-    
     processes = await db.processes.find(
-        query,
+        _eligible_query(retention_days),
         {"_id": 0, "id": 1, "client_name": 1, "status": 1, "updated_at": 1}
     ).limit(limit).to_list(limit)
     
@@ -482,13 +519,98 @@ async def find_processes_for_anonymization(
     return processes
 
 
+async def iter_processes_for_anonymization(
+    retention_days: int = None,
+    after_id: str = None,
+    limit: int = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Percorre (cursor, ordenado por id) os processos elegíveis, com os
+    campos necessários à anonimização. `after_id` retoma um checkpoint.
+    """
+    query = _eligible_query(retention_days)
+    if after_id:
+        query["id"] = {"$gt": after_id}
+    
+    cursor = db.processes.find(query, ANONYMIZATION_PROJECTION).sort("id", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    async for process in cursor.batch_size(gdpr_config.chunk_size):
+        yield process
+
+
+async def _anonymize_chunk(processes: List[dict], run_id: str, dry_run: bool) -> Dict[str, Any]:
+    """Anonimiza um bloco de processos com um único bulk_write."""
+    ops = []
+    audits = []
+    for process in processes:
+        update_data, unset_data, fields_anonymized, fields_removed = build_anonymization_update(
+            process, None if dry_run else run_id
+        )
+        update_query = {"$set": update_data}
+        if unset_data:
+            update_query["$unset"] = unset_data
+        ops.append(UpdateOne({"id": process["id"], "is_anonymized": {"$ne": True}}, update_query))
+        audits.append({
+            "action": "anonymize_process",
+            "process_id": process["id"],
+            "run_id": run_id,
+            "fields_anonymized": fields_anonymized,
+            "fields_removed": fields_removed,
+            "timestamp": datetime.now(timezone.utc),
+            "retention_days": gdpr_config.retention_period_days
+        })
+    
+    ids = [p["id"] for p in processes]
+    if dry_run:
+        return {"succeeded": ids, "failed": []}
+    
+    try:
+        result = await db.processes.bulk_write(ops, ordered=False)
+        modified = result.modified_count
+    except BulkWriteError as e:
+        modified = e.details.get("nModified", 0)
+    
+    if modified == len(ids):
+        succeeded = ids
+    else:
+        # Identificar exactamente os processos escritos por esta execução
+        written = await db.processes.find(
+            {"id": {"$in": ids}, "anonymization_run_id": run_id}, {"_id": 0, "id": 1}
+        ).to_list(None)
+        succeeded_set = {p["id"] for p in written}
+        succeeded = [i for i in ids if i in succeeded_set]
+    
+    await sync_client_key(*succeeded)
+    succeeded_set = set(succeeded)
+    audits = [a for a in audits if a["process_id"] in succeeded_set]
+    if audits:
+        await db.gdpr_audit.insert_many(audits, ordered=False)
+    
+    return {"succeeded": succeeded, "failed": [i for i in ids if i not in succeeded_set]}
+
+
+async def _save_checkpoint(run_id: str, fields: Dict[str, Any]):
+    await db.gdpr_runs.update_one(
+        {"id": run_id},
+        {"$set": {**fields, "updated_at": datetime.now(timezone.utc)}}
+    )
+
+
 async def run_anonymization_batch(
     retention_days: int = None,
     dry_run: bool = None,
-    batch_size: int = None
+    batch_size: int = None,
+    resume: bool = True
 ) -> Dict[str, Any]:
     """
-    Executa anonimização em lote.
+    Executa anonimização em lote (até `batch_size` processos).
+    
+    Os processos elegíveis são lidos com um cursor, anonimizados em
+    memória e gravados em blocos de `chunk_size` com bulk_write, com
+    até `concurrency` blocos em paralelo. Fora do dry run, o progresso
+    fica em `gdpr_runs` (último id concluído): uma execução interrompida
+    é retomada na chamada seguinte.
     
     Returns:
         Estatísticas da execução
@@ -499,22 +621,11 @@ async def run_anonymization_batch(
     if batch_size is None:
         batch_size = gdpr_config.batch_size
     
-    logger.info(f"[GDPR] Iniciando batch de anonimização (dry_run={dry_run})")
-    
-    # Encontrar processos elegíveis
-    processes = await find_processes_for_anonymization(retention_days, batch_size)
+    if retention_days is None:
+        retention_days = gdpr_config.retention_period_days
     
-    if not processes:
-        logger.info("[GDPR] Nenhum processo para anonimizar")
-        return {
-            "success": True,
-            "processed": 0,
-            "succeeded": 0,
-            "failed": 0,
-            "dry_run": dry_run
-        }
+    logger.info(f"[GDPR] Iniciando batch de anonimização (dry_run={dry_run})")
     
-    # Processar cada um
     results = {
         "processed": 0,
         "succeeded": 0,
@@ -522,36 +633,92 @@ async def run_anonymization_batch(
         "errors": []
     }
     
-    for process in processes:
-        try:
-            result = await anonymize_process_data(process["id"], dry_run)
-            results["processed"] += 1
-            
-            if result.get("success"):
-                results["succeeded"] += 1
-            else:
-                results["failed"] += 1
-                results["errors"].append({
-                    "process_id": process["id"],
-                    "error": result.get("error")
-                })
-                
-        except Exception as e:
-            logger.error(f"[GDPR] Erro ao anonimizar {process['id']}: {str(e)}")
-            results["failed"] += 1
-            results["errors"].append({
-                "process_id": process["id"],
-                "error": str(e)
+    # Retomar execução interrompida (apenas execuções reais)
+    run = None
+    if not dry_run and resume:
+        run = await db.gdpr_runs.find_one(
+            {"status": "running", "retention_days": retention_days},
+            {"_id": 0},
+            sort=[("started_at", -1)]
+        )
+    if run:
+        logger.info(f"[GDPR] A retomar execução {run['id']} após {run.get('last_id')}")
+    else:
+        run = {
+            "id": str(uuid.uuid4()),
+            "status": "running",
+            "retention_days": retention_days,
+            "last_id": None,
+            "processed": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "started_at": datetime.now(timezone.utc)
+        }
+        if not dry_run:
+            await db.gdpr_runs.insert_one(dict(run))
+    run_id = run["id"]
+    last_id = run.get("last_id")
+    
+    async def flush(chunks: List[List[dict]]):
+        nonlocal last_id
+        outcomes = await asyncio.gather(
+            *(_anonymize_chunk(chunk, run_id, dry_run) for chunk in chunks),
+            return_exceptions=True
+        )
+        for chunk, outcome in zip(chunks, outcomes):
+            results["processed"] += len(chunk)
+            if isinstance(outcome, Exception):
+                logger.error(f"[GDPR] Erro ao anonimizar bloco: {outcome}")
+                results["failed"] += len(chunk)
+                results["errors"].extend({"process_id": p["id"], "error": str(outcome)} for p in chunk)
+                continue
+            results["succeeded"] += len(outcome["succeeded"])
+            results["failed"] += len(outcome["failed"])
+            results["errors"].extend(
+                {"process_id": pid, "error": "Falha na actualização"} for pid in outcome["failed"]
+            )
+        # Checkpoint só depois de todos os blocos da vaga terminarem
+        last_id = chunks[-1][-1]["id"]
+        if not dry_run:
+            await _save_checkpoint(run_id, {
+                "last_id": last_id,
+                "processed": run["processed"] + results["processed"],
+                "succeeded": run["succeeded"] + results["succeeded"],
+                "failed": run["failed"] + results["failed"],
             })
     
-    logger.info(
-        f"[GDPR] Batch concluído: {results['succeeded']}/{results['processed']} sucesso, "
-        f"{results['failed']} falhas"
-    )
+    chunk: List[dict] = []
+    wave: List[List[dict]] = []
+    async for process in iter_processes_for_anonymization(retention_days, last_id, batch_size):
+        chunk.append(process)
+        if len(chunk) >= gdpr_config.chunk_size:
+            wave.append(chunk)
+            chunk = []
+        if len(wave) >= gdpr_config.concurrency:
+            await flush(wave)
+            wave = []
+    if chunk:
+        wave.append(chunk)
+    if wave:
+        await flush(wave)
+    
+    if not dry_run:
+        # Execução termina quando não restam elegíveis depois do checkpoint
+        finished = results["processed"] < batch_size
+        await _save_checkpoint(run_id, {"status": "completed" if finished else "running"})
+    
+    if not results["processed"]:
+        logger.info("[GDPR] Nenhum processo para anonimizar")
+    else:
+        logger.info(
+            f"[GDPR] Batch concluído: {results['succeeded']}/{results['processed']} sucesso, "
+            f"{results['failed']} falhas"
+        )
     
     return {
         "success": True,
         "dry_run": dry_run,
+        "run_id": None if dry_run else run_id,
         **results
     }
 
@@ -605,6 +772,163 @@ async def export_personal_data(
     return export_data
 
 
+# ====================================================================
+# EXPORTAÇÃO EM STREAMING (NDJSON / ZIP)
+# ====================================================================
+EXPORT_FORMAT_VERSION = "2.0"
+EXPORT_CURSOR_BATCH = 200
+EXPORT_FILE_CHUNK = 1024 * 1024
+
+
+def _export_sections(process_id: str) -> List[Tuple[str, Any]]:
+    """
+    Secções da exportação: (nome, fábrica de cursor). Cada cursor é
+    lido em lotes, nunca carregado por inteiro.
+    """
+    by_process = {"process_id": process_id}
+    return [
+        ("process", lambda: db.processes.find(
+            {"id": process_id}, {"_id": 0, "password": 0, "ai_extraction_history": 0}
+        )),
+        ("history", lambda: db.history.find(by_process, {"_id": 0}).sort("created_at", 1)),
+        ("emails", lambda: db.emails.find(by_process, {"_id": 0}).sort("sent_at", 1)),
+        ("tasks", lambda: db.tasks.find(by_process, {"_id": 0}).sort("created_at", 1)),
+        ("documents", lambda: db.document_metadata.find(by_process, {"_id": 0}).sort("created_at", 1)),
+        ("ai_extraction_history", lambda: db.processes.aggregate([
+            {"$match": {"id": process_id}},
+            {"$project": {"_id": 0, "entry": "$ai_extraction_history"}},
+            {"$unwind": "$entry"},
+            {"$replaceRoot": {"newRoot": "$entry"}},
+        ])),
+    ]
+
+
+def _json_line(record: Any) -> bytes:
+    return (json.dumps(record, default=str, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _iter_section(cursor_factory) -> AsyncIterator[dict]:
+    cursor = cursor_factory()
+    if hasattr(cursor, "batch_size"):
+        cursor = cursor.batch_size(EXPORT_CURSOR_BATCH)
+    async for doc in cursor:
+        yield doc
+
+
+async def _log_export(process_id: str, export_format: str, include_files: bool = False):
+    await db.gdpr_audit.insert_one({
+        "action": "export_data",
+        "process_id": process_id,
+        "user_id": None,
+        "format": export_format,
+        "include_files": include_files,
+        "timestamp": datetime.now(timezone.utc)
+    })
+
+
+async def process_exists(process_id: str) -> bool:
+    return await db.processes.find_one({"id": process_id}, {"_id": 0, "id": 1}) is not None
+
+
+async def stream_personal_data_ndjson(process_id: str) -> AsyncIterator[bytes]:
+    """
+    Exportação em NDJSON: uma linha de cabeçalho e depois uma linha
+    {"section": ..., "data": ...} por registo, secção a secção.
+    """
+    await _log_export(process_id, "ndjson")
+    yield _json_line({
+        "type": "export",
+        "format_version": EXPORT_FORMAT_VERSION,
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "process_id": process_id
+    })
+    for section, cursor_factory in _export_sections(process_id):
+        async for doc in _iter_section(cursor_factory):
+            yield _json_line({"section": section, "data": doc})
+
+
+class _ZipStreamBuffer:
+    """Destino não-seekable do ZipFile; os bytes escritos são drenados por partes."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _iter_s3_file(s3_path: str) -> AsyncIterator[bytes]:
+    """Blocos de um ficheiro S3 (download em streaming)."""
+    from services.s3_storage import async_s3_service
+    
+    return async_s3_service.iter_file(s3_path, EXPORT_FILE_CHUNK)
+
+
+async def stream_personal_data_zip(process_id: str, include_files: bool = False) -> AsyncIterator[bytes]:
+    """
+    Exportação em ZIP: um ficheiro NDJSON por secção e, opcionalmente,
+    os documentos do S3 copiados em blocos para `ficheiros/`.
+    """
+    await _log_export(process_id, "zip", include_files)
+    buffer = _ZipStreamBuffer()
+    s3_paths: List[Tuple[str, str]] = []
+    
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open("export.json", "w") as entry:
+            entry.write(_json_line({
+                "format_version": EXPORT_FORMAT_VERSION,
+                "exported_at": datetime.now(timezone.utc).isoformat(),
+                "process_id": process_id,
+                "sections": [name for name, _ in _export_sections(process_id)]
+            }))
+        
+        for section, cursor_factory in _export_sections(process_id):
+            with archive.open(f"{section}.ndjson", "w", force_zip64=True) as entry:
+                async for doc in _iter_section(cursor_factory):
+                    entry.write(_json_line(doc))
+                    if section == "documents" and include_files and doc.get("s3_path"):
+                        s3_paths.append((doc["s3_path"], doc.get("filename") or doc["s3_path"].rsplit("/", 1)[-1]))
+                    data = buffer.drain()
+                    if data:
+                        yield data
+        
+        for index, (s3_path, filename) in enumerate(s3_paths, start=1):
+            name = f"ficheiros/{index:04d}_{filename}"
+            chunks = _iter_s3_file(s3_path)
+            try:
+                # Primeiro bloco antes de abrir a entrada: ficheiro em falta não deixa entrada vazia
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = b""
+            except Exception as e:
+                logger.error(f"[GDPR] Erro ao exportar ficheiro {s3_path}: {e}")
+                with archive.open(f"{name}.erro.txt", "w") as entry:
+                    entry.write(f"Não foi possível copiar {s3_path}: {e}".encode("utf-8"))
+                continue
+            try:
+                with archive.open(name, "w", force_zip64=True) as entry:
+                    entry.write(first)
+                    async for chunk in chunks:
+                        entry.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            except Exception as e:
+                logger.error(f"[GDPR] Ficheiro {s3_path} exportado incompleto: {e}")
+    
+    # Diretório central do ZIP (escrito ao fechar)
+    yield buffer.drain()
+
+
 # ====================================================================
 # ESTATÍSTICAS GDPR
 # ====================================================================
@@ -618,15 +942,7 @@ async def get_gdpr_statistics() -> Dict[str, Any]:
     anonymized = await db.processes.count_documents({"is_anonymized": True})
     
     # Processos elegíveis para anonimização
-    cutoff = datetime.now(timezone.utc) - timedelta(days=gdpr_config.retention_period_days)
-    eligible = await db.processes.count_documents({
-        "status": {"$in": gdpr_config.eligible_statuses},
-        "updated_at": {"$lt": cutoff},
-        "$or": [
-            {"is_anonymized": {"$exists": False}},
-            {"is_anonymized": False}
-        ]
-    })
+    eligible = await db.processes.count_documents(_eligible_query())
     
     # Acções de auditoria recentes
     recent_audits = await db.gdpr_audit.count_documents({
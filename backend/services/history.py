@@ -1,13 +1,31 @@
+"""
+Histórico de alterações de processos.
+
+As alterações de secções inteiras (dados pessoais, financeiros, ...) são
+comparadas de uma vez e gravadas com um único `insert_many`. Opcionalmente
+(HISTORY_ASYNC_WRITES=true) as escritas são agrupadas em buffer e gravadas
+em background com latência máxima de HISTORY_FLUSH_INTERVAL segundos.
+"""
+import os
 import uuid
+import asyncio
+import logging
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, Iterable, List, Optional, Tuple
 
 from database import db
 
+logger = logging.getLogger(__name__)
 
-async def log_history(process_id: str, user: dict, action: str, field: str = None, old_value: Any = None, new_value: Any = None):
-    """Log a change to process history"""
-    history_doc = {
+HISTORY_ASYNC_WRITES = os.environ.get("HISTORY_ASYNC_WRITES", "false").lower() == "true"
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", "0.5"))
+HISTORY_MAX_BUFFER = int(os.environ.get("HISTORY_MAX_BUFFER", "500"))
+
+
+def build_history_doc(process_id: str, user: dict, action: str, field: str = None,
+                      old_value: Any = None, new_value: Any = None, created_at: str = None) -> dict:
+    """Construir um documento de histórico."""
+    return {
         "id": str(uuid.uuid4()),
         "process_id": process_id,
         "user_id": user["id"],
@@ -16,23 +34,94 @@ async def log_history(process_id: str, user: dict, action: str, field: str = Non
         "field": field,
         "old_value": str(old_value) if old_value is not None else None,
         "new_value": str(new_value) if new_value is not None else None,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": created_at or datetime.now(timezone.utc).isoformat()
     }
-    await db.history.insert_one(history_doc)
 
 
-async def log_data_changes(process_id: str, user: dict, old_data: dict, new_data: dict, section: str):
-    """Compare and log changes between old and new data"""
-    if old_data is None:
-        old_data = {}
+def diff_section(process_id: str, user: dict, old_data: Optional[dict], new_data: Optional[dict],
+                 section: str, created_at: str = None) -> List[dict]:
+    """Comparar uma secção e devolver um documento de histórico por campo alterado."""
     if new_data is None:
-        return
-    
-    for key, new_val in new_data.items():
-        old_val = old_data.get(key)
-        if old_val != new_val and new_val is not None:
-            await log_history(
-                process_id, user, 
-                f"Alterou {section}", 
-                key, old_val, new_val
-            )
+        return []
+    old_data = old_data or {}
+    created_at = created_at or datetime.now(timezone.utc).isoformat()
+    return [
+        build_history_doc(process_id, user, f"Alterou {section}", key, old_data.get(key), new_val, created_at)
+        for key, new_val in new_data.items()
+        if old_data.get(key) != new_val and new_val is not None
+    ]
+
+
+class HistoryRecorder:
+    """
+    Grava documentos de histórico em lote.
+
+    Em modo síncrono cada chamada a `record` faz um único `insert_many`.
+    Em modo assíncrono os documentos vão para um buffer que é gravado
+    quando atinge `max_buffer` ou após `flush_interval` segundos.
+    """
+
+    def __init__(self, async_writes: bool = HISTORY_ASYNC_WRITES,
+                 flush_interval: float = HISTORY_FLUSH_INTERVAL,
+                 max_buffer: int = HISTORY_MAX_BUFFER):
+        self.async_writes = async_writes
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: List[dict] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def record(self, docs: List[dict]):
+        """Gravar (ou colocar em buffer) uma lista de documentos."""
+        if not docs:
+            return
+        if not self.async_writes:
+            await db.history.insert_many(docs, ordered=False)
+            return
+
+        self._buffer.extend(docs)
+        if len(self._buffer) >= self.max_buffer:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Gravar imediatamente o conteúdo do buffer."""
+        if not self._buffer:
+            return
+        docs, self._buffer = self._buffer, []
+        try:
+            await db.history.insert_many(docs, ordered=False)
+        except Exception as e:
+            logger.error(f"Erro ao gravar {len(docs)} registos de histórico: {e}")
+
+
+history_recorder = HistoryRecorder()
+
+
+async def log_history(process_id: str, user: dict, action: str, field: str = None, old_value: Any = None, new_value: Any = None):
+    """Log a change to process history"""
+    await history_recorder.record([
+        build_history_doc(process_id, user, action, field, old_value, new_value)
+    ])
+
+
+async def log_data_changes(process_id: str, user: dict, old_data: dict, new_data: dict, section: str):
+    """Compare and log changes between old and new data (single batched write)"""
+    await history_recorder.record(diff_section(process_id, user, old_data, new_data, section))
+
+
+async def log_sections_changes(process_id: str, user: dict,
+                               sections: Iterable[Tuple[Optional[dict], Optional[dict], str]]):
+    """
+    Comparar várias secções (old_data, new_data, section) de uma só vez
+    e gravar todas as alterações numa única escrita.
+    """
+    created_at = datetime.now(timezone.utc).isoformat()
+    docs = []
+    for old_data, new_data, section in sections:
+        docs.extend(diff_section(process_id, user, old_data, new_data, section, created_at))
+    await history_recorder.record(docs)
@@ -14,6 +14,7 @@ from typing import Optional, Dict, Any, Tuple
 
 from database import db
 from models.process import ProcessCreate, ProcessUpdate
+from services.sequences import sequences, PROCESS_NUMBER
 
 logger = logging.getLogger(__name__)
 
@@ -58,17 +59,10 @@ def sanitize_email(email: str) -> str:
 
 async def get_next_process_number() -> int:
     """
-    Obtém o próximo número de processo baseado no maior existente.
+    Obtém o próximo número de processo (contador atómico).
     Usado para gerar referências como 'PROC-0001'.
     """
-    latest = await db.processes.find_one(
-        {"process_number": {"$exists": True}},
-        sort=[("process_number", -1)],
-        projection={"_id": 0, "process_number": 1}
-    )
-    if latest and latest.get("process_number"):
-        return latest["process_number"] + 1
-    return 1
+    return await sequences.next_value(PROCESS_NUMBER)
 
 
 # ==== FUNÇÕES DE VERIFICAÇÃO DE PERMISSÕES ====
@@ -304,3 +298,48 @@ async def get_user_name(user_id: str) -> str:
         return ""
     user = await db.users.find_one({"id": user_id}, {"_id": 0, "name": 1})
     return user.get("name", "") if user else ""
+
+
+# ==== CHAVE DE CLIENTE (AGRUPAMENTO DE PROCESSOS) ====
+
+# Estados que não contam como processo activo de um cliente
+INACTIVE_PROCESS_STATUSES = ["arquivado", "perdido", "concluido"]
+
+# Expressão de agregação equivalente a `client_id or client_name.lower().strip()`
+CLIENT_KEY_EXPR = {
+    "$cond": [
+        {"$gt": [{"$ifNull": ["$client_id", ""]}, ""]},
+        "$client_id",
+        {"$toLower": {"$trim": {"input": {"$ifNull": ["$client_name", ""]}}}}
+    ]
+}
+
+
+async def sync_client_key(*process_ids: str):
+    """
+    Recalcular o campo materializado `client_key` dos processos indicados.
+    Chamar depois de qualquer escrita de `client_name` ou `client_id`
+    (a chave é calculada no servidor, com as mesmas regras da agregação).
+    """
+    ids = [process_id for process_id in process_ids if process_id]
+    if not ids:
+        return
+    await db.processes.update_many(
+        {"id": {"$in": ids}},
+        [{"$set": {"client_key": CLIENT_KEY_EXPR}}]
+    )
+
+
+async def refresh_client_keys() -> int:
+    """
+    Reconciliar `client_key` em todos os processos desactualizados
+    (nome ou client_id alterados por caminhos sem hook).
+    Uma única operação no servidor, sem transferir documentos.
+    """
+    result = await db.processes.update_many(
+        {"$expr": {"$ne": [{"$ifNull": ["$client_key", None]}, CLIENT_KEY_EXPR]}},
+        [{"$set": {"client_key": CLIENT_KEY_EXPR}}]
+    )
+    if result.modified_count:
+        logger.info(f"client_key actualizado em {result.modified_count} processos")
+    return result.modified_count
@@ -0,0 +1,438 @@
+"""
+====================================================================
+IMPORTAÇÃO DE IMÓVEIS VIA EXCEL - MOTOR VECTORIZADO
+====================================================================
+Normalização de colunas, mapeamento de tipo/estado, parsing de preços
+e áreas e validação são feitos com operações de coluna do pandas.
+As linhas inválidas são marcadas numa máscara de erros; as válidas são
+inseridas em chunks com `insert_many(ordered=False)` e referências
+internas pré-alocadas num único bloco (services/sequences.py).
+====================================================================
+"""
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from pymongo.errors import BulkWriteError
+
+from database import db
+from services.sequences import reserve_property_references
+
+logger = logging.getLogger(__name__)
+
+
+INSERT_CHUNK_SIZE = 500
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+# Mapear colunas alternativas (para formatos HCPro, CRM externo, etc.)
+COLUMN_ALIASES = {
+    # Título
+    'título': 'titulo',
+    # Preço
+    'preço': 'preco',
+    # Localização
+    'freguesia': 'localidade',
+    'rua': 'morada',
+    'código_postal': 'codigo_postal',
+    # Áreas
+    'área_útil': 'area_util',
+    'área_terreno': 'area_terreno',
+    'área_bruta': 'area_bruta',
+    # Características
+    'tipologia': 'quartos_raw',  # T1, T2, T3...
+    'ano_de_construção': 'ano_construcao',
+    'certificado_energético': 'certificado_energetico',
+    # Proprietário (formato HCPro)
+    'proprietário': 'proprietario_nome',
+    'proprietário_nome': 'proprietario_nome',
+    'proprietário,_email': 'proprietario_email',
+    'proprietário,_telemóvel': 'proprietario_telefone',
+    'proprietário,_telefone': 'proprietario_telefone2',
+    # Descrição
+    'descrição_pt': 'descricao',
+    'descrição': 'descricao',
+    # Referência
+    'referência': 'referencia_externa',
+    # Agência
+    'agência': 'agencia',
+    'agencia_responsável': 'agencia',
+    # Outros
+    'observações': 'notas',
+    'responsável': 'responsavel',
+}
+
+# Mapear tipos de imóvel
+TIPO_MAP = {
+    'apartamento': 'apartamento',
+    'moradia': 'moradia',
+    'moradia_isolada': 'moradia',
+    'moradia_geminada': 'moradia',
+    'moradia_em_banda': 'moradia',
+    'terreno': 'terreno',
+    'loja': 'loja',
+    'escritorio': 'escritorio',
+    'escritório': 'escritorio',
+    'armazem': 'armazem',
+    'armazém': 'armazem',
+    'garagem': 'garagem',
+    'outro': 'outro',
+    't0': 'apartamento',
+    't1': 'apartamento',
+    't2': 'apartamento',
+    't3': 'apartamento',
+    't4': 'apartamento',
+    't5': 'apartamento',
+}
+
+# Mapear estados
+ESTADO_MAP = {
+    'novo': 'novo',
+    'como_novo': 'como_novo',
+    'como novo': 'como_novo',
+    'bom': 'bom',
+    'para_recuperar': 'para_recuperar',
+    'para recuperar': 'para_recuperar',
+    'em_construcao': 'em_construcao',
+    'em construção': 'em_construcao',
+    'em construcao': 'em_construcao'
+}
+
+# Validações por ordem de prioridade (primeira que falha é reportada)
+REQUIRED_FIELDS = [
+    ("titulo", "Título em falta"),
+    ("preco", "Preço em falta ou inválido"),
+    ("distrito", "Distrito em falta"),
+    ("concelho", "Concelho em falta"),
+]
+
+
+# ====================================================================
+# OPERAÇÕES DE COLUNA
+# ====================================================================
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalizar nomes de colunas (minúsculas, sem espaços), aplicar
+    aliases e fundir colunas duplicadas (primeiro valor não vazio).
+    """
+    df = df.copy()
+    df.columns = df.columns.astype(str).str.lower().str.strip().str.replace(' ', '_')
+    df = df.rename(columns=COLUMN_ALIASES)
+
+    if df.columns.duplicated().any():
+        merged = {}
+        for name in dict.fromkeys(df.columns):
+            block = df.loc[:, df.columns == name]
+            if block.shape[1] == 1:
+                merged[name] = block.iloc[:, 0]
+            else:
+                merged[name] = clean_text_frame(block).bfill(axis=1).iloc[:, 0]
+        df = pd.DataFrame(merged, index=df.index)
+
+    return df
+
+
+def clean_text(series: pd.Series) -> pd.Series:
+    """Converter para texto limpo; vazios e 'nan' passam a NA."""
+    text = series.astype("string").str.strip()
+    return text.mask(text.isin(["", "nan", "NaN", "None"]))
+
+
+def clean_text_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    return frame.apply(clean_text)
+
+
+def text_column(df: pd.DataFrame, keys: List[str], default: Optional[str] = None) -> pd.Series:
+    """Primeiro valor não vazio entre várias colunas candidatas."""
+    present = [k for k in keys if k in df.columns]
+    if present:
+        result = clean_text_frame(df[present]).bfill(axis=1).iloc[:, 0]
+    else:
+        result = pd.Series(pd.NA, index=df.index, dtype="string")
+    if default is not None:
+        result = result.fillna(default)
+    return result
+
+
+def parse_price(series: pd.Series) -> pd.Series:
+    """
+    Converter preços para float. Valores numéricos do Excel são usados
+    directamente; texto é limpo (€, '/', formato europeu 700.000,00).
+    """
+    numeric = pd.to_numeric(series.where(series.map(lambda v: isinstance(v, (int, float)))), errors="coerce")
+
+    text = series.astype("string").str.replace('€', '', regex=False).str.strip()
+    # Se tem "/" provavelmente é venda/arrendamento, pegar o primeiro
+    text = text.str.split('/').str[0].str.strip()
+
+    has_dot = text.str.contains('.', regex=False).fillna(False)
+    has_comma = text.str.contains(',', regex=False).fillna(False)
+    thousands_dot = text.str.rsplit('.', n=1).str[-1].str.len().eq(3).fillna(False)
+
+    european = text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    no_dots = text.str.replace('.', '', regex=False)
+    comma_decimal = text.str.replace(',', '.', regex=False)
+
+    normalized = text.copy()
+    normalized = normalized.mask(has_dot & has_comma, european)
+    normalized = normalized.mask(has_dot & ~has_comma & thousands_dot, no_dots)
+    normalized = normalized.mask(~has_dot & has_comma, comma_decimal)
+
+    parsed = pd.to_numeric(normalized, errors="coerce")
+    return numeric.fillna(parsed)
+
+
+def parse_float(series: pd.Series) -> pd.Series:
+    text = series.astype("string").str.replace(',', '.', regex=False).str.strip()
+    return pd.to_numeric(text, errors="coerce")
+
+
+def parse_int(series: pd.Series) -> pd.Series:
+    return np.floor(parse_float(series)).astype("Int64")
+
+
+def parse_tipologia(series: pd.Series) -> pd.Series:
+    """Extrair quartos de tipologia (T0, T1, T2...)."""
+    digits = series.astype("string").str.upper().str.strip().str.extract(r'^T(\d)', expand=False)
+    return pd.to_numeric(digits, errors="coerce").astype("Int64")
+
+
+def optional_column(df: pd.DataFrame, key: str) -> pd.Series:
+    if key in df.columns:
+        return df[key]
+    return pd.Series(pd.NA, index=df.index, dtype="object")
+
+
+def prepare_import_frame(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Transformar o DataFrame lido do Excel num DataFrame normalizado
+    com uma coluna `erro` (None para linhas válidas) e `linha` (Excel).
+    Função síncrona e CPU-bound - correr num executor.
+    """
+    df = normalize_columns(raw)
+    out = pd.DataFrame(index=df.index)
+    out["linha"] = np.arange(len(df)) + 2  # +2: índice começa em 0 e Excel tem cabeçalho
+
+    out["titulo"] = text_column(df, ["titulo"])
+    out["preco"] = parse_price(optional_column(df, "preco"))
+    out["distrito"] = text_column(df, ["distrito"])
+    out["concelho"] = text_column(df, ["concelho"])
+
+    # Proprietário - com fallback para a agência
+    out["proprietario_nome"] = text_column(df, ["proprietario_nome"]).fillna(
+        text_column(df, ["agencia"], "Não informado")
+    )
+
+    tipo_raw = text_column(df, ["tipo"], "apartamento").str.lower()
+    tipologia = text_column(df, ["quartos_raw", "tipologia"])
+    titulo_lower = out["titulo"].fillna("").str.lower()
+
+    # Com tipologia, o tipo é inferido do título; sem tipologia, do mapa
+    by_title = np.select(
+        [
+            titulo_lower.str.contains('moradia', regex=False) | tipo_raw.str.contains('moradia', regex=False),
+            titulo_lower.str.contains('armazém', regex=False) | tipo_raw.str.contains('armazem', regex=False),
+            titulo_lower.str.contains('loja', regex=False),
+        ],
+        ['moradia', 'armazem', 'loja'],
+        default='apartamento'
+    )
+    by_map = tipo_raw.map(TIPO_MAP).fillna('apartamento')
+    out["tipo"] = np.where(tipologia.notna(), by_title, by_map)
+
+    estado_raw = text_column(df, ["estado"], "bom").str.lower()
+    out["estado"] = np.select(
+        [
+            estado_raw.str.contains('em construção', regex=False) | estado_raw.str.contains('em construcao', regex=False),
+            estado_raw.str.contains('recupera', regex=False),
+            estado_raw.str.contains('execução', regex=False),
+        ],
+        ['em_construcao', 'para_recuperar', 'em_construcao'],
+        default=estado_raw.map(ESTADO_MAP).fillna('bom')
+    )
+
+    out["quartos"] = parse_tipologia(tipologia).fillna(parse_int(optional_column(df, "quartos")))
+    out["casas_banho"] = parse_int(optional_column(df, "casas_banho"))
+    out["area_util"] = parse_float(optional_column(df, "area_util"))
+    out["area_bruta"] = parse_float(optional_column(df, "area_bruta"))
+    out["area_terreno"] = parse_float(optional_column(df, "area_terreno"))
+    out["ano_construcao"] = parse_int(optional_column(df, "ano_construcao"))
+    out["certificado_energetico"] = text_column(df, ["certificado_energetico"]).str.upper()
+
+    for target, keys in {
+        "referencia_externa": ["referencia_externa"],
+        "descricao": ["descricao"],
+        "morada": ["morada", "rua"],
+        "codigo_postal": ["codigo_postal"],
+        "localidade": ["localidade", "freguesia"],
+        "proprietario_telefone": ["proprietario_telefone"],
+        "proprietario_email": ["proprietario_email"],
+        "agencia": ["agencia"],
+        "notas": ["notas", "observações"],
+    }.items():
+        out[target] = text_column(df, keys)
+
+    # Máscara de erros: primeira validação que falha por linha
+    out["erro"] = np.select(
+        [out[field].isna() for field, _ in REQUIRED_FIELDS],
+        [message for _, message in REQUIRED_FIELDS],
+        default=""
+    )
+    out["erro"] = out["erro"].replace("", None)
+
+    return out
+
+
+def _value(v):
+    """Converter NA/numpy para tipos nativos serializáveis pelo BSON."""
+    if v is None or v is pd.NA or (isinstance(v, float) and np.isnan(v)):
+        return None
+    if isinstance(v, np.integer):
+        return int(v)
+    if isinstance(v, np.floating):
+        return float(v)
+    if isinstance(v, np.str_):
+        return str(v)
+    return v
+
+
+def build_property_doc(row: Dict, internal_ref: str, user: dict, now: str) -> dict:
+    """Construir o documento do imóvel a partir de uma linha normalizada."""
+    v = {k: _value(val) for k, val in row.items()}
+    return {
+        "id": str(uuid.uuid4()),
+        "internal_reference": internal_ref,
+        "external_reference": v["referencia_externa"],
+        "property_type": v["tipo"],
+        "title": v["titulo"],
+        "description": v["descricao"],
+        "address": {
+            "street": v["morada"],
+            "postal_code": v["codigo_postal"],
+            "locality": v["localidade"],
+            "municipality": v["concelho"],
+            "district": v["distrito"]
+        },
+        "features": {
+            "bedrooms": v["quartos"],
+            "bathrooms": v["casas_banho"],
+            "useful_area": v["area_util"],
+            "gross_area": v["area_bruta"],
+            "land_area": v["area_terreno"],
+            "construction_year": v["ano_construcao"],
+            "energy_certificate": v["certificado_energetico"],
+            "extra_features": []
+        },
+        "condition": v["estado"],
+        "financials": {
+            "asking_price": v["preco"]
+        },
+        "owner": {
+            "name": v["proprietario_nome"],
+            "phone": v["proprietario_telefone"],
+            "email": v["proprietario_email"]
+        },
+        "agency": v["agencia"],
+        "photos": [],
+        "documents": [],
+        "status": "em_analise",
+        "notes": v["notas"],
+        "history": [{
+            "timestamp": now,
+            "event": "Importado via Excel",
+            "user": user.get("email")
+        }],
+        "created_at": now,
+        "updated_at": now,
+        "created_by": user.get("email"),
+        "view_count": 0,
+        "inquiry_count": 0,
+        "visit_count": 0,
+        "interested_clients": []
+    }
+
+
+# ====================================================================
+# EXECUÇÃO DO JOB
+# ====================================================================
+
+class _ProgressThrottle:
+    """Limitar escritas de progresso a uma por intervalo de tempo."""
+
+    def __init__(self, job_service, job_id: str, total: int, interval: float = PROGRESS_INTERVAL_SECONDS):
+        self.job_service = job_service
+        self.job_id = job_id
+        self.total = total
+        self.interval = interval
+        self._last = 0.0
+
+    async def update(self, current: int, message: str, force: bool = False):
+        now = time.monotonic()
+        if force or now - self._last >= self.interval:
+            self._last = now
+            await self.job_service.update_progress(self.job_id, current=current, total=self.total, message=message)
+
+
+async def run_property_import(job_id: str, raw_df: pd.DataFrame, user: dict, job_service) -> dict:
+    """
+    Executar a importação: preparar (executor), pré-alocar referências,
+    inserir em chunks e devolver o resultado no formato do job.
+    """
+    total_rows = len(raw_df)
+    progress = _ProgressThrottle(job_service, job_id, total_rows)
+    await progress.update(0, "A validar ficheiro...", force=True)
+
+    loop = asyncio.get_running_loop()
+    frame = await loop.run_in_executor(None, prepare_import_frame, raw_df)
+
+    results = {
+        "total": total_rows,
+        "importados": 0,
+        "erros": [
+            {"linha": int(linha), "erro": erro}
+            for linha, erro in frame.loc[frame["erro"].notna(), ["linha", "erro"]].itertuples(index=False)
+        ],
+        "ids_criados": []
+    }
+
+    valid = frame[frame["erro"].isna()].drop(columns=["erro"])
+    references = await reserve_property_references(len(valid))
+    now = datetime.now(timezone.utc).isoformat()
+
+    records = valid.to_dict("records")
+    processed = 0
+    for start in range(0, len(records), INSERT_CHUNK_SIZE):
+        chunk = records[start:start + INSERT_CHUNK_SIZE]
+        docs = [
+            build_property_doc(row, references[start + i], user, now)
+            for i, row in enumerate(chunk)
+        ]
+
+        failed = {}
+        try:
+            await db.properties.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed[write_error["index"]] = write_error.get("errmsg", "Erro de escrita")
+
+        for i, doc in enumerate(docs):
+            if i in failed:
+                results["erros"].append({"linha": int(chunk[i]["linha"]), "erro": failed[i]})
+            else:
+                results["importados"] += 1
+                results["ids_criados"].append(doc["id"])
+
+        processed += len(chunk)
+        await progress.update(
+            processed,
+            f"A importar: {processed} de {len(records)} linhas válidas..."
+        )
+
+    results["erros"].sort(key=lambda e: e["linha"])
+    logger.info(f"Importação Excel: {results['importados']}/{results['total']} imóveis inseridos")
+    return results
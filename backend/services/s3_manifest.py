@@ -0,0 +1,129 @@
+"""
+====================================================================
+MANIFESTO DE FICHEIROS S3 POR CLIENTE - CREDITOIMO
+====================================================================
+Cópia em MongoDB da listagem S3 de cada cliente, para que a listagem
+de ficheiros seja uma leitura indexada em vez de paginar
+`list_objects_v2` a cada pedido.
+
+Colecções:
+    s3_objects         {key, prefix, size, last_modified}
+    s3_manifest_state  {prefix, client_id, reconciled_at}
+
+- Os uploads e eliminações feitos pela aplicação actualizam o
+  manifesto (`record_upload` / `record_delete`).
+- Um prefixo sem estado é lido do S3 na primeira listagem.
+- `reconcile_stale` (cron do worker) volta a ler do S3 os prefixos
+  mais antigos, apanhando alterações feitas fora da aplicação.
+====================================================================
+"""
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from database import db
+from services.s3_storage import async_s3_service, build_listing
+
+logger = logging.getLogger(__name__)
+
+
+RECONCILE_MAX_AGE_HOURS = 6
+RECONCILE_BATCH = 50
+BULK_CHUNK_SIZE = 500
+
+
+def prefix_for_key(key: str) -> str:
+    """Prefixo do cliente de um caminho "clientes/{id}_{nome}/{categoria}/{ficheiro}"."""
+    return "/".join(key.split("/")[:2]) + "/"
+
+
+class S3Manifest:
+    """Listagem de ficheiros por cliente servida pelo MongoDB."""
+
+    async def list_files(self, client_id: str, client_name: str, second_client_name: str = None) -> Dict:
+        """Mesmo formato de `S3Service.list_files`."""
+        if not async_s3_service.is_configured():
+            return {"error": "S3 não configurado", "files": {}}
+
+        prefix = async_s3_service.sync.client_prefix(client_id, client_name, second_client_name)
+        state = await db.s3_manifest_state.find_one({"prefix": prefix}, {"_id": 0, "prefix": 1})
+        if not state:
+            try:
+                await self.reconcile(prefix, client_id)
+            except Exception as e:
+                logger.error(f"Erro ao listar S3: {e}")
+                return {"error": str(e), "files": {}}
+
+        objects = await db.s3_objects.find(
+            {"prefix": prefix}, {"_id": 0, "key": 1, "size": 1, "last_modified": 1}
+        ).sort("key", 1).to_list(None)
+        return build_listing(prefix, objects)
+
+    async def reconcile(self, prefix: str, client_id: Optional[str] = None) -> dict:
+        """Substituir o manifesto de um prefixo pela listagem actual do S3."""
+        objects = await async_s3_service.list_objects(prefix)
+        keys = [obj["key"] for obj in objects]
+        ops = [
+            UpdateOne({"key": obj["key"]}, {"$set": {**obj, "prefix": prefix}}, upsert=True)
+            for obj in objects
+        ]
+        for i in range(0, len(ops), BULK_CHUNK_SIZE):
+            await db.s3_objects.bulk_write(ops[i:i + BULK_CHUNK_SIZE], ordered=False)
+        removed = await db.s3_objects.delete_many({"prefix": prefix, "key": {"$nin": keys}})
+
+        state = {"prefix": prefix, "reconciled_at": datetime.now(timezone.utc).isoformat()}
+        if client_id:
+            state["client_id"] = client_id
+        await db.s3_manifest_state.update_one({"prefix": prefix}, {"$set": state}, upsert=True)
+        return {"objects": len(objects), "removed": removed.deleted_count}
+
+    async def record_upload(self, key: str, size: Optional[int]):
+        """Registar um ficheiro enviado pela aplicação."""
+        try:
+            await db.s3_objects.update_one(
+                {"key": key},
+                {"$set": {
+                    "key": key,
+                    "prefix": prefix_for_key(key),
+                    "size": size or 0,
+                    "last_modified": datetime.now(timezone.utc).isoformat()
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            # A reconciliação periódica corrige o manifesto
+            logger.warning(f"Erro ao actualizar manifesto S3 ({key}): {e}")
+
+    async def record_delete(self, key: str):
+        """Remover do manifesto um ficheiro eliminado pela aplicação."""
+        try:
+            await db.s3_objects.delete_one({"key": key})
+        except Exception as e:
+            logger.warning(f"Erro ao actualizar manifesto S3 ({key}): {e}")
+
+    async def reconcile_stale(self, max_age_hours: int = RECONCILE_MAX_AGE_HOURS,
+                              limit: int = RECONCILE_BATCH) -> dict:
+        """Reler do S3 os prefixos reconciliados há mais de `max_age_hours`."""
+        if not async_s3_service.is_configured():
+            return {"reconciled": 0}
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=max_age_hours)).isoformat()
+        states = await db.s3_manifest_state.find(
+            {"reconciled_at": {"$lt": cutoff}}, {"_id": 0, "prefix": 1, "client_id": 1}
+        ).sort("reconciled_at", 1).limit(limit).to_list(limit)
+
+        results = {"reconciled": 0, "errors": 0}
+        for state in states:
+            try:
+                await self.reconcile(state["prefix"], state.get("client_id"))
+                results["reconciled"] += 1
+            except Exception as e:
+                results["errors"] += 1
+                logger.error(f"Erro ao reconciliar manifesto S3 {state['prefix']}: {e}")
+        if states:
+            logger.info(f"Manifesto S3 reconciliado: {results}")
+        return results
+
+
+s3_manifest = S3Manifest()
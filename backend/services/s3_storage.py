@@ -1,13 +1,27 @@
 """
 S3 Storage Service - Alternativa Robusta ao OneDrive
 Usa Amazon S3 (ou Cloudflare R2, MinIO, Google Cloud Storage)
+
+`s3_service` é o cliente síncrono (boto3). Em código async usar
+`async_s3_service`: as mesmas operações num executor dedicado que partilha
+o pool de ligações do cliente, com upload em streaming (multipart para
+ficheiros grandes) e download como iterador assíncrono.
 """
 import os
 import re
+import asyncio
 import logging
+import time
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from typing import List, Dict, Optional, BinaryIO
+from typing import List, Dict, Optional, BinaryIO, AsyncIterator
+
+from middleware.metrics import register_executor
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +30,20 @@ AWS_ACCESS_KEY = os.environ.get('AWS_ACCESS_KEY_ID')
 AWS_SECRET_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
 AWS_BUCKET_NAME = os.environ.get('AWS_BUCKET_NAME')
 AWS_REGION = os.environ.get('AWS_REGION', 'eu-west-3')
+# Endpoint alternativo (MinIO, R2, moto server); vazio = AWS
+AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL') or None
+
+# Pedidos S3 em simultâneo (threads do executor = ligações do pool)
+S3_MAX_CONCURRENCY = int(os.environ.get('S3_MAX_CONCURRENCY', '10'))
+# Uploads acima deste tamanho usam multipart, em partes deste tamanho (mín. S3: 5 MB)
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+MULTIPART_CONCURRENCY = 4
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Links pré-assinados reutilizados até faltarem PRESIGN_REFRESH_MARGIN segundos
+# (no máximo metade da validade) para expirarem
+PRESIGN_REFRESH_MARGIN = 300
+PRESIGN_CACHE_SIZE = 5000
 
 # Categorias de documentos padrão
 DEFAULT_CATEGORIES = [
@@ -27,6 +55,74 @@ DEFAULT_CATEGORIES = [
 ]
 
 
+# Pasta S3 normalizada -> categoria (ex.: "documentos_pessoais" -> "Documentos Pessoais")
+CATEGORY_BY_FOLDER = {cat.lower().replace(' ', '_'): cat for cat in DEFAULT_CATEGORIES}
+
+
+def format_size(size_bytes: int) -> str:
+    """Formata tamanho em bytes para formato legível."""
+    if size_bytes < 1024:
+        return f"{size_bytes} B"
+    elif size_bytes < 1024 * 1024:
+        return f"{size_bytes / 1024:.1f} KB"
+    elif size_bytes < 1024 * 1024 * 1024:
+        return f"{size_bytes / (1024 * 1024):.1f} MB"
+    else:
+        return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
+
+
+def build_listing(prefix: str, objects: List[Dict]) -> Dict:
+    """
+    Organizar os objectos de um cliente por categoria.
+
+    Args:
+        prefix: Prefixo do cliente ("clientes/{id}_{nome}/")
+        objects: [{"key", "size", "last_modified" (ISO)}]
+
+    Returns:
+        Dict com ficheiros por categoria, categorias e estatísticas
+    """
+    files_by_category = {cat: [] for cat in DEFAULT_CATEGORIES}
+
+    for obj in objects:
+        key = obj['key']
+
+        # Ignorar ficheiros .keep (marcadores de pasta)
+        if key.endswith('.keep'):
+            continue
+
+        # Extrair categoria do path
+        # Formato: clientes/{id}_{name}/{categoria}/{ficheiro}
+        parts = key[len(prefix):].split('/') if key.startswith(prefix) else key.split('/')
+        if len(parts) < 2:
+            continue
+
+        folder = parts[0].lower().replace(' ', '_')
+        category = CATEGORY_BY_FOLDER.get(folder, "Outros")
+        files_by_category[category].append({
+            "name": parts[-1],
+            "path": key,
+            "size": obj['size'],
+            "size_formatted": format_size(obj['size']),
+            "last_modified": obj['last_modified'],
+            "category": category
+        })
+
+    # Calcular estatísticas
+    total_files = sum(len(files) for files in files_by_category.values())
+    total_size = sum(f['size'] for files in files_by_category.values() for f in files)
+
+    return {
+        "files": files_by_category,
+        "categories": DEFAULT_CATEGORIES,
+        "stats": {
+            "total_files": total_files,
+            "total_size": total_size,
+            "total_size_formatted": format_size(total_size)
+        }
+    }
+
+
 def sanitize_folder_name(name: str) -> str:
     """Remove caracteres especiais do nome da pasta."""
     if not name:
@@ -37,17 +133,57 @@ def sanitize_folder_name(name: str) -> str:
     return name[:50] if name else "cliente"
 
 
+class PresignCache:
+    """
+    Cache LRU de links pré-assinados por (caminho, validade pedida).
+    Partilhada pelas threads do executor S3, daí o lock.
+    """
+
+    def __init__(self, max_size: int = PRESIGN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, object_name: str, expiration: int, now: float) -> Optional[tuple]:
+        """(url, expires_at) se ainda houver validade suficiente."""
+        margin = min(PRESIGN_REFRESH_MARGIN, expiration // 2)
+        with self._lock:
+            entry = self._entries.get((object_name, expiration))
+            if not entry:
+                return None
+            if entry[1] - margin <= now:
+                del self._entries[(object_name, expiration)]
+                return None
+            self._entries.move_to_end((object_name, expiration))
+            return entry
+
+    def put(self, object_name: str, expiration: int, url: str, expires_at: float):
+        with self._lock:
+            self._entries[(object_name, expiration)] = (url, expires_at)
+            self._entries.move_to_end((object_name, expiration))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, object_name: str):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == object_name]:
+                del self._entries[key]
+
+
 class S3Service:
     def __init__(self):
         self.s3_client = None
         self.bucket_name = AWS_BUCKET_NAME
+        self.presign_cache = PresignCache()
         if AWS_ACCESS_KEY and AWS_SECRET_KEY:
             try:
                 self.s3_client = boto3.client(
                     's3',
                     aws_access_key_id=AWS_ACCESS_KEY,
                     aws_secret_access_key=AWS_SECRET_KEY,
-                    region_name=AWS_REGION
+                    region_name=AWS_REGION,
+                    endpoint_url=AWS_S3_ENDPOINT_URL,
+                    config=Config(max_pool_connections=S3_MAX_CONCURRENCY)
                 )
                 logger.info("S3 Service inicializado com sucesso.")
             except Exception as e:
@@ -58,6 +194,18 @@ class S3Service:
     def is_configured(self) -> bool:
         return self.s3_client is not None and bool(self.bucket_name)
 
+    def build_object_name(
+        self,
+        client_id: str,
+        client_name: str,
+        category: str,
+        filename: str,
+        second_client_name: str = None
+    ) -> str:
+        """Caminho S3 de um ficheiro: {base do cliente}/{categoria}/{ficheiro}."""
+        base_path = self._get_client_base_path(client_id, client_name, second_client_name)
+        return f"{base_path}/{sanitize_folder_name(category)}/{filename}"
+
     def _get_client_base_path(
         self, 
         client_id: str, 
@@ -122,9 +270,9 @@ class S3Service:
             logger.error("S3 não configurado")
             return None
 
-        base_path = self._get_client_base_path(client_id, client_name, second_client_name)
-        safe_category = sanitize_folder_name(category)
-        object_name = f"{base_path}/{safe_category}/{filename}"
+        object_name = self.build_object_name(
+            client_id, client_name, category, filename, second_client_name
+        )
 
         extra_args = {}
         if content_type:
@@ -143,6 +291,28 @@ class S3Service:
             logger.error(f"Erro no upload para S3: {e}")
             return None
 
+    def client_prefix(self, client_id: str, client_name: str, second_client_name: str = None) -> str:
+        """Prefixo S3 de todos os ficheiros de um cliente (com "/" final)."""
+        return f"{self._get_client_base_path(client_id, client_name, second_client_name)}/"
+
+    def list_objects(self, prefix: str) -> List[Dict]:
+        """
+        Lista todos os objectos de um prefixo (paginado).
+
+        Returns:
+            [{"key", "size", "last_modified" (ISO)}]
+        """
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        objects = []
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                objects.append({
+                    "key": obj['Key'],
+                    "size": obj['Size'],
+                    "last_modified": obj['LastModified'].isoformat()
+                })
+        return objects
+
     def list_files(
         self, 
         client_id: str, 
@@ -151,6 +321,8 @@ class S3Service:
     ) -> Dict[str, List[Dict]]:
         """
         Lista todos os ficheiros de um cliente organizados por categoria.
+        Lê directamente do S3; as rotas usam o manifesto em
+        services/s3_manifest.py.
         
         Args:
             client_id: ID do processo/cliente
@@ -163,91 +335,14 @@ class S3Service:
         if not self.is_configured():
             return {"error": "S3 não configurado", "files": {}}
 
-        base_path = self._get_client_base_path(client_id, client_name, second_client_name)
-        prefix = f"{base_path}/"
+        prefix = self.client_prefix(client_id, client_name, second_client_name)
         
         try:
-            # Usar paginator para lidar com muitos ficheiros
-            paginator = self.s3_client.get_paginator('list_objects_v2')
-            pages = paginator.paginate(Bucket=self.bucket_name, Prefix=prefix)
-            
-            # Organizar por categoria
-            files_by_category = {cat: [] for cat in DEFAULT_CATEGORIES}
-            
-            for page in pages:
-                if 'Contents' not in page:
-                    continue
-                    
-                for obj in page['Contents']:
-                    key = obj['Key']
-                    
-                    # Ignorar ficheiros .keep (marcadores de pasta)
-                    if key.endswith('.keep'):
-                        continue
-                    
-                    # Extrair categoria do path
-                    # Formato: clientes/{id}_{name}/{categoria}/{ficheiro}
-                    parts = key.replace(prefix, '').split('/')
-                    if len(parts) < 2:
-                        continue
-                    
-                    category = parts[0].replace('_', ' ')
-                    filename = parts[-1]
-                    
-                    # Encontrar categoria correspondente
-                    matched_category = "Outros"
-                    for cat in DEFAULT_CATEGORIES:
-                        if cat.lower().replace(' ', '_') == category.lower().replace(' ', '_'):
-                            matched_category = cat
-                            break
-                    
-                    file_info = {
-                        "name": filename,
-                        "path": key,
-                        "size": obj['Size'],
-                        "size_formatted": self._format_size(obj['Size']),
-                        "last_modified": obj['LastModified'].isoformat(),
-                        "category": matched_category
-                    }
-                    
-                    if matched_category in files_by_category:
-                        files_by_category[matched_category].append(file_info)
-                    else:
-                        files_by_category["Outros"].append(file_info)
-            
-            # Calcular estatísticas
-            total_files = sum(len(files) for files in files_by_category.values())
-            total_size = sum(
-                f['size'] 
-                for files in files_by_category.values() 
-                for f in files
-            )
-            
-            return {
-                "files": files_by_category,
-                "categories": DEFAULT_CATEGORIES,
-                "stats": {
-                    "total_files": total_files,
-                    "total_size": total_size,
-                    "total_size_formatted": self._format_size(total_size)
-                }
-            }
-            
+            return build_listing(prefix, self.list_objects(prefix))
         except ClientError as e:
             logger.error(f"Erro ao listar S3: {e}")
             return {"error": str(e), "files": {}}
 
-    def _format_size(self, size_bytes: int) -> str:
-        """Formata tamanho em bytes para formato legível."""
-        if size_bytes < 1024:
-            return f"{size_bytes} B"
-        elif size_bytes < 1024 * 1024:
-            return f"{size_bytes / 1024:.1f} KB"
-        elif size_bytes < 1024 * 1024 * 1024:
-            return f"{size_bytes / (1024 * 1024):.1f} MB"
-        else:
-            return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
-
     def get_presigned_url(self, object_name: str, expiration: int = 3600) -> Optional[str]:
         """
         Gera um link temporário (1 hora por defeito) para download/visualização.
@@ -259,19 +354,40 @@ class S3Service:
         Returns:
             URL pré-assinado ou None se falhar
         """
+        signed = self.presign_many([object_name], expiration)
+        return signed[object_name][0] if object_name in signed else None
+
+    def presign_many(self, object_names: List[str], expiration: int = 3600) -> Dict[str, tuple]:
+        """
+        Links pré-assinados para vários ficheiros. A assinatura (SigV4) é
+        calculada localmente pelo botocore, sem pedidos ao S3; links ainda
+        válidos vêm da cache.
+        
+        Returns:
+            {caminho: (url, expira_em epoch)} (caminhos que falharem são omitidos)
+        """
         if not self.is_configured():
-            return None
-            
-        try:
-            url = self.s3_client.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': self.bucket_name, 'Key': object_name},
-                ExpiresIn=expiration
-            )
-            return url
-        except ClientError as e:
-            logger.error(f"Erro ao gerar link S3: {e}")
-            return None
+            return {}
+        
+        now = time.time()
+        signed = {}
+        for object_name in dict.fromkeys(object_names):
+            cached = self.presign_cache.get(object_name, expiration, now)
+            if cached:
+                signed[object_name] = cached
+                continue
+            try:
+                url = self.s3_client.generate_presigned_url(
+                    'get_object',
+                    Params={'Bucket': self.bucket_name, 'Key': object_name},
+                    ExpiresIn=expiration
+                )
+            except ClientError as e:
+                logger.error(f"Erro ao gerar link S3: {e}")
+                continue
+            signed[object_name] = (url, now + expiration)
+            self.presign_cache.put(object_name, expiration, url, now + expiration)
+        return signed
 
     def delete_file(self, object_name: str) -> bool:
         """
@@ -288,6 +404,7 @@ class S3Service:
             
         try:
             self.s3_client.delete_object(Bucket=self.bucket_name, Key=object_name)
+            self.presign_cache.invalidate(object_name)
             logger.info(f"Ficheiro eliminado: {object_name}")
             return True
         except ClientError as e:
@@ -358,5 +475,184 @@ class S3Service:
             return None
 
 
-# Instância global
-s3_service = S3Service()
\ No newline at end of file
+class _BytesReader:
+    """Leitor async sobre bytes já em memória (mesma interface do UploadFile)."""
+
+    def __init__(self, data: bytes):
+        self._data = memoryview(data)
+        self._pos = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        end = len(self._data) if size < 0 else self._pos + size
+        chunk = self._data[self._pos:end].tobytes()
+        self._pos += len(chunk)
+        return chunk
+
+
+class AsyncS3Service:
+    """
+    Operações S3 para código async. As chamadas boto3 correm num executor
+    próprio (S3_MAX_CONCURRENCY threads, o mesmo número de ligações do pool
+    do cliente), sem bloquear o event loop nem competir com o executor
+    por defeito.
+    """
+
+    def __init__(self, sync_service: S3Service):
+        self.sync = sync_service
+        self._executor = ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY, thread_name_prefix="s3")
+        register_executor("s3", self._executor)
+
+    def is_configured(self) -> bool:
+        return self.sync.is_configured()
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def list_files(self, client_id: str, client_name: str, second_client_name: str = None) -> Dict:
+        return await self._run(self.sync.list_files, client_id, client_name, second_client_name)
+
+    async def list_objects(self, prefix: str) -> List[Dict]:
+        return await self._run(self.sync.list_objects, prefix)
+
+    async def get_presigned_url(self, object_name: str, expiration: int = 3600) -> Optional[str]:
+        return await self._run(self.sync.get_presigned_url, object_name, expiration)
+
+    async def presign_many(self, object_names: List[str], expiration: int = 3600) -> Dict[str, tuple]:
+        """Assinatura em lote numa única passagem pelo executor."""
+        return await self._run(self.sync.presign_many, object_names, expiration)
+
+    async def delete_file(self, object_name: str) -> bool:
+        return await self._run(self.sync.delete_file, object_name)
+
+    async def get_file_content(self, object_name: str) -> Optional[bytes]:
+        return await self._run(self.sync.get_file_content, object_name)
+
+    async def initialize_client_folders(
+        self,
+        client_id: str,
+        client_name: str,
+        second_client_name: str = None
+    ) -> bool:
+        """Cria os marcadores '.keep' de todas as categorias em paralelo."""
+        if not self.is_configured():
+            return False
+
+        base_path = self.sync._get_client_base_path(client_id, client_name, second_client_name)
+        client = self.sync.s3_client
+        try:
+            await asyncio.gather(*(
+                self._run(
+                    client.put_object,
+                    Bucket=self.sync.bucket_name,
+                    Key=f"{base_path}/{sanitize_folder_name(category)}/.keep",
+                    Body=b''
+                )
+                for category in DEFAULT_CATEGORIES
+            ))
+            logger.info(f"Estrutura de pastas criada para cliente: {client_id}")
+            return True
+        except ClientError as e:
+            logger.error(f"Erro ao criar pastas S3: {e}")
+            return False
+
+    async def upload_stream(self, reader, object_name: str, content_type: str = None) -> Optional[str]:
+        """
+        Upload em streaming a partir de um objecto com `async read(n)`
+        (ex.: `UploadFile`). Ficheiros até MULTIPART_PART_SIZE vão num único
+        PUT; maiores usam multipart com até MULTIPART_CONCURRENCY partes em
+        envio, pelo que a memória usada fica limitada a algumas partes.
+
+        Returns:
+            Caminho S3 do ficheiro ou None se falhar
+        """
+        if not self.is_configured():
+            logger.error("S3 não configurado")
+            return None
+
+        client = self.sync.s3_client
+        bucket = self.sync.bucket_name
+        extra_args = {"ContentType": content_type} if content_type else {}
+
+        try:
+            chunk = await reader.read(MULTIPART_PART_SIZE)
+            if len(chunk) < MULTIPART_PART_SIZE:
+                await self._run(client.put_object, Bucket=bucket, Key=object_name, Body=chunk, **extra_args)
+                logger.info(f"Upload S3 sucesso: {object_name}")
+                return object_name
+
+            upload = await self._run(
+                client.create_multipart_upload, Bucket=bucket, Key=object_name, **extra_args
+            )
+        except ClientError as e:
+            logger.error(f"Erro no upload para S3: {e}")
+            return None
+
+        upload_id = upload["UploadId"]
+
+        async def send_part(part_number: int, body: bytes) -> Dict:
+            response = await self._run(
+                client.upload_part, Bucket=bucket, Key=object_name,
+                UploadId=upload_id, PartNumber=part_number, Body=body
+            )
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+        parts: List[Dict] = []
+        in_flight = set()
+        try:
+            part_number = 0
+            while chunk:
+                part_number += 1
+                in_flight.add(asyncio.ensure_future(send_part(part_number, chunk)))
+                if len(in_flight) >= MULTIPART_CONCURRENCY:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    parts.extend(task.result() for task in done)
+                chunk = await reader.read(MULTIPART_PART_SIZE)
+            parts.extend(await asyncio.gather(*in_flight))
+            in_flight = set()
+
+            parts.sort(key=lambda part: part["PartNumber"])
+            await self._run(
+                client.complete_multipart_upload, Bucket=bucket, Key=object_name,
+                UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+            logger.info(f"Upload S3 (multipart, {len(parts)} partes) sucesso: {object_name}")
+            return object_name
+        except Exception as e:
+            for task in in_flight:
+                task.cancel()
+            logger.error(f"Erro no upload multipart para S3: {e}")
+            try:
+                await self._run(client.abort_multipart_upload, Bucket=bucket, Key=object_name, UploadId=upload_id)
+            except ClientError as abort_error:
+                logger.warning(f"Erro ao cancelar upload multipart {upload_id}: {abort_error}")
+            return None
+
+    async def upload_bytes(self, data: bytes, object_name: str, content_type: str = None) -> Optional[str]:
+        """Upload de conteúdo já em memória (mesmas regras de multipart)."""
+        return await self.upload_stream(_BytesReader(data), object_name, content_type)
+
+    async def iter_file(self, object_name: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """
+        Download em streaming: blocos de `chunk_size` bytes, sem carregar o
+        ficheiro inteiro. Erros do S3 (ex.: ficheiro inexistente) são propagados.
+        """
+        if not self.is_configured():
+            raise RuntimeError("S3 não configurado")
+        response = await self._run(
+            self.sync.s3_client.get_object, Bucket=self.sync.bucket_name, Key=object_name
+        )
+        body = response['Body']
+        try:
+            while True:
+                chunk = await self._run(body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+
+# Instâncias globais
+s3_service = S3Service()
+async_s3_service = AsyncS3Service(s3_service)
\ No newline at end of file
@@ -38,6 +38,7 @@ ROOT_DIR = Path(__file__).parent.parent
 load_dotenv(ROOT_DIR / '.env')
 
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
 
 # Configure logging
 logging.basicConfig(
@@ -47,6 +48,28 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def notification_key(notification_type: str, *parts) -> str:
+    """
+    Chave determinística de uma notificação agendada (índice único
+    `idx_notification_dedup`). A mesma chave nunca gera duas notificações.
+    """
+    return ":".join([notification_type, *(str(p) for p in parts)])
+
+
+def _days_until(date_str: str, today: datetime):
+    """Dias de calendário entre hoje e uma data ISO (None se inválida)."""
+    try:
+        target = datetime.strptime(str(date_str)[:10], "%Y-%m-%d").date()
+    except (ValueError, TypeError):
+        return None
+    return (target - today.date()).days
+
+
+def _process_users(process: dict, fields) -> List[str]:
+    """Utilizadores responsáveis de um processo (sem duplicados, por ordem)."""
+    return list(dict.fromkeys(process[f] for f in fields if process.get(f)))
+
+
 class ScheduledTasksService:
     """Serviço de tarefas agendadas."""
     
@@ -68,16 +91,17 @@ class ScheduledTasksService:
             self.client.close()
             logger.info("Desconectado da base de dados")
     
-    async def create_notification(
+    def build_notification(
         self,
         user_id: str,
         message: str,
         notification_type: str,
         process_id: str = None,
         client_name: str = None,
-        link: str = None
-    ):
-        """Criar uma notificação na base de dados."""
+        link: str = None,
+        dedup_key: str = None
+    ) -> dict:
+        """Construir o documento de uma notificação."""
         notification = {
             "id": str(uuid.uuid4()),
             "user_id": user_id,
@@ -89,72 +113,87 @@ class ScheduledTasksService:
             "read": False,
             "created_at": datetime.now(timezone.utc).isoformat()
         }
-        
+        if dedup_key:
+            notification["dedup_key"] = dedup_key
+        return notification
+    
+    async def create_notification(
+        self,
+        user_id: str,
+        message: str,
+        notification_type: str,
+        process_id: str = None,
+        client_name: str = None,
+        link: str = None
+    ):
+        """Criar uma notificação na base de dados."""
+        notification = self.build_notification(
+            user_id, message, notification_type, process_id, client_name, link
+        )
         await self.db.notifications.insert_one(notification)
         return notification
     
+    async def upsert_notifications(self, notifications: List[dict]) -> int:
+        """
+        Gravar notificações agendadas num único `bulk_write`.
+        Cada notificação tem um `dedup_key` determinístico (índice único):
+        as que já existem não são duplicadas. Devolve o número de criadas.
+        """
+        unique = {n["dedup_key"]: n for n in reversed(notifications)}
+        if not unique:
+            return 0
+        
+        result = await self.db.notifications.bulk_write([
+            UpdateOne({"dedup_key": key}, {"$setOnInsert": notification}, upsert=True)
+            for key, notification in unique.items()
+        ], ordered=False)
+        return result.upserted_count
+    
     async def check_expiring_documents(self) -> int:
         """
         Verificar documentos a expirar nos próximos 7 dias.
-        Criar notificações para os utilizadores responsáveis.
+        Criar notificações para os utilizadores responsáveis
+        (no máximo uma por processo e utilizador por dia).
         """
         logger.info("A verificar documentos a expirar...")
         
         today = datetime.now(timezone.utc)
-        warning_date = today + timedelta(days=7)
-        
-        # Buscar processos com documentos
-        processes = await self.db.processes.find(
-            {"documents": {"$exists": True, "$ne": []}},
-            {"_id": 0}
-        ).to_list(1000)
-        
-        notifications_created = 0
-        
-        for process in processes:
-            documents = process.get("documents", [])
-            
-            for doc in documents:
-                expiry_date_str = doc.get("expiry_date")
-                if not expiry_date_str:
-                    continue
-                
-                try:
-                    expiry_date = datetime.fromisoformat(expiry_date_str.replace('Z', '+00:00'))
-                except (ValueError, TypeError):
-                    continue
-                
-                # Verificar se expira nos próximos 7 dias
-                if today <= expiry_date <= warning_date:
-                    days_until = (expiry_date - today).days
-                    
-                    # Notificar consultor e mediador
-                    users_to_notify = []
-                    if process.get("consultor_id"):
-                        users_to_notify.append(process["consultor_id"])
-                    if process.get("mediador_id"):
-                        users_to_notify.append(process["mediador_id"])
-                    
-                    for user_id in users_to_notify:
-                        # Verificar se já existe notificação similar recente
-                        existing = await self.db.notifications.find_one({
-                            "user_id": user_id,
-                            "process_id": process.get("id"),
-                            "type": "document_expiry",
-                            "created_at": {"$gte": (today - timedelta(days=1)).isoformat()}
-                        })
-                        
-                        if not existing:
-                            await self.create_notification(
-                                user_id=user_id,
-                                message=f"Documento '{doc.get('name', 'Sem nome')}' expira em {days_until} dias",
-                                notification_type="document_expiry",
-                                process_id=process.get("id"),
-                                client_name=process.get("client_name"),
-                                link=f"/process/{process.get('id')}"
-                            )
-                            notifications_created += 1
-        
+        today_str = today.strftime("%Y-%m-%d")
+        warning_str = (today + timedelta(days=7)).strftime("%Y-%m-%d")
+        
+        # Documentos embebidos nos processos, filtrados no servidor
+        rows = await self.db.processes.aggregate([
+            {"$match": {"documents.expiry_date": {"$gte": today_str}}},
+            {"$unwind": "$documents"},
+            {"$project": {
+                "_id": 0,
+                "process_id": "$id",
+                "client_name": 1,
+                "consultor_id": 1,
+                "mediador_id": 1,
+                "doc_name": "$documents.name",
+                "expiry_day": {"$substrCP": [{"$ifNull": ["$documents.expiry_date", ""]}, 0, 10]}
+            }},
+            {"$match": {"expiry_day": {"$gte": today_str, "$lte": warning_str}}}
+        ]).to_list(None)
+        
+        notifications = []
+        for row in rows:
+            days_until = _days_until(row["expiry_day"], today)
+            if days_until is None:
+                continue
+            for user_id in _process_users(row, ("consultor_id", "mediador_id")):
+                notifications.append(self.build_notification(
+                    user_id=user_id,
+                    message=f"Documento '{row.get('doc_name') or 'Sem nome'}' expira em {days_until} dias",
+                    notification_type="document_expiry",
+                    process_id=row["process_id"],
+                    client_name=row.get("client_name"),
+                    link=f"/process/{row['process_id']}",
+                    dedup_key=notification_key("document_expiry", row["process_id"], user_id, today_str)
+                ))
+        
+        notifications_created = await self.upsert_notifications(notifications)
         logger.info(f"Documentos a expirar: {notifications_created} notificações criadas")
         return notifications_created
     
@@ -168,45 +207,42 @@ class ScheduledTasksService:
         today = datetime.now(timezone.utc)
         tomorrow = today + timedelta(days=1)
         
-        # Buscar deadlines próximos
-        deadlines = await self.db.deadlines.find({
-            "date": {
-                "$gte": today.isoformat(),
-                "$lte": tomorrow.isoformat()
-            }
-        }, {"_id": 0}).to_list(500)
-        
-        notifications_created = 0
-        
-        for deadline in deadlines:
-            participants = deadline.get("participants", [])
-            
-            for user_id in participants:
-                # Verificar se já existe notificação similar
-                existing = await self.db.notifications.find_one({
-                    "user_id": user_id,
-                    "type": "deadline_reminder",
-                    "message": {"$regex": deadline.get("title", "")},
-                    "created_at": {"$gte": (today - timedelta(hours=12)).isoformat()}
-                })
-                
-                if not existing:
-                    await self.create_notification(
-                        user_id=user_id,
-                        message=f"Lembrete: {deadline.get('title', 'Evento')} - amanhã",
-                        notification_type="deadline_reminder",
-                        process_id=deadline.get("process_id"),
-                        link="/admin?tab=calendar"
-                    )
-                    notifications_created += 1
+        # Um registo por (prazo, participante)
+        rows = await self.db.deadlines.aggregate([
+            {"$match": {
+                "date": {
+                    "$gte": today.isoformat(),
+                    "$lte": tomorrow.isoformat()
+                },
+                "participants.0": {"$exists": True}
+            }},
+            {"$unwind": "$participants"},
+            {"$project": {
+                "_id": 0, "id": 1, "title": 1, "date": 1,
+                "process_id": 1, "user_id": "$participants"
+            }}
+        ]).to_list(None)
+        
+        notifications = [
+            self.build_notification(
+                user_id=row["user_id"],
+                message=f"Lembrete: {row.get('title', 'Evento')} - amanhã",
+                notification_type="deadline_reminder",
+                process_id=row.get("process_id"),
+                link="/admin?tab=calendar",
+                dedup_key=notification_key("deadline_reminder", row.get("id"), row["user_id"], row.get("date"))
+            )
+            for row in rows
+        ]
         
+        notifications_created = await self.upsert_notifications(notifications)
         logger.info(f"Prazos próximos: {notifications_created} notificações criadas")
         return notifications_created
     
     async def check_tasks_due_soon(self) -> int:
         """
         Verificar tarefas com prazo próximo (3 dias ou menos) ou atrasadas.
-        Enviar alertas para os utilizadores atribuídos.
+        Enviar alertas para os utilizadores atribuídos (um por dia).
         
         Alertas:
         - 3 dias antes: "Tarefa vence em 3 dias"
@@ -217,70 +253,55 @@ class ScheduledTasksService:
         logger.info("A verificar tarefas com prazo próximo...")
         
         today = datetime.now(timezone.utc)
-        
-        # Buscar tarefas não concluídas com due_date
-        tasks = await self.db.tasks.find({
-            "completed": False,
-            "due_date": {"$exists": True, "$ne": None}
-        }, {"_id": 0}).to_list(500)
-        
-        notifications_created = 0
-        
-        for task in tasks:
-            due_date_str = task.get("due_date")
-            if not due_date_str:
+        today_str = today.strftime("%Y-%m-%d")
+        horizon_str = (today + timedelta(days=3)).strftime("%Y-%m-%d")
+        
+        # Tarefas não concluídas com prazo até 3 dias, uma linha por utilizador
+        rows = await self.db.tasks.aggregate([
+            {"$match": {
+                "completed": False,
+                "due_date": {"$exists": True, "$ne": None},
+                "assigned_to.0": {"$exists": True}
+            }},
+            {"$project": {
+                "_id": 0, "id": 1, "title": 1, "process_id": 1, "assigned_to": 1,
+                "due_day": {"$substrCP": ["$due_date", 0, 10]}
+            }},
+            {"$match": {"due_day": {"$lte": horizon_str}}},
+            {"$unwind": "$assigned_to"}
+        ]).to_list(None)
+        
+        notifications = []
+        for row in rows:
+            days_until_due = _days_until(row["due_day"], today)
+            if days_until_due is None:
                 continue
             
-            try:
-                due_date = datetime.fromisoformat(due_date_str.replace('Z', '+00:00'))
-            except (ValueError, TypeError):
-                continue
-            
-            days_until_due = (due_date.date() - today.date()).days
-            
-            # Definir mensagem baseada nos dias
+            title = row.get("title", "Sem título")
             if days_until_due < 0:
-                # Atrasada
-                message = f"🚨 TAREFA ATRASADA ({abs(days_until_due)} dias): {task.get('title', 'Sem título')}"
+                message = f"🚨 TAREFA ATRASADA ({abs(days_until_due)} dias): {title}"
                 notification_type = "task_overdue"
             elif days_until_due == 0:
-                # Vence hoje
-                message = f"⚠️ Tarefa vence HOJE: {task.get('title', 'Sem título')}"
+                message = f"⚠️ Tarefa vence HOJE: {title}"
                 notification_type = "task_due_today"
             elif days_until_due == 1:
-                # Vence amanhã
-                message = f"📅 Tarefa vence amanhã: {task.get('title', 'Sem título')}"
+                message = f"📅 Tarefa vence amanhã: {title}"
                 notification_type = "task_due_tomorrow"
-            elif days_until_due <= 3:
-                # Vence em 3 dias ou menos
-                message = f"📋 Tarefa vence em {days_until_due} dias: {task.get('title', 'Sem título')}"
-                notification_type = "task_due_soon"
             else:
-                # Ainda não está perto do prazo
-                continue
+                message = f"📋 Tarefa vence em {days_until_due} dias: {title}"
+                notification_type = "task_due_soon"
             
-            # Notificar todos os utilizadores atribuídos
-            for user_id in task.get("assigned_to", []):
-                # Verificar se já existe notificação similar nas últimas 12 horas
-                existing = await self.db.notifications.find_one({
-                    "user_id": user_id,
-                    "type": notification_type,
-                    "message": {"$regex": task.get("id", "")},
-                    "created_at": {"$gte": (today - timedelta(hours=12)).isoformat()}
-                })
-                
-                if not existing:
-                    link = f"/process/{task['process_id']}" if task.get("process_id") else "/staff?tab=tasks"
-                    
-                    await self.create_notification(
-                        user_id=user_id,
-                        message=message,
-                        notification_type=notification_type,
-                        process_id=task.get("process_id"),
-                        link=link
-                    )
-                    notifications_created += 1
-        
+            user_id = row["assigned_to"]
+            notifications.append(self.build_notification(
+                user_id=user_id,
+                message=message,
+                notification_type=notification_type,
+                process_id=row.get("process_id"),
+                link=f"/process/{row['process_id']}" if row.get("process_id") else "/staff?tab=tasks",
+                dedup_key=notification_key(notification_type, row.get("id"), user_id, today_str)
+            ))
+        
+        notifications_created = await self.upsert_notifications(notifications)
         logger.info(f"Tarefas com prazo próximo: {notifications_created} notificações criadas")
         return notifications_created
     
@@ -293,54 +314,42 @@ class ScheduledTasksService:
         
         today = datetime.now(timezone.utc)
         alert_days = [30, 15, 7, 3]
-        
-        # Buscar processos com data de pré-aprovação
-        processes = await self.db.processes.find({
-            "credit_data.bank_approval_date": {"$exists": True, "$ne": None}
-        }, {"_id": 0}).to_list(1000)
-        
-        notifications_created = 0
-        
-        for process in processes:
-            approval_date_str = process.get("credit_data", {}).get("bank_approval_date")
-            if not approval_date_str:
-                continue
-            
-            try:
-                approval_date = datetime.fromisoformat(approval_date_str.replace('Z', '+00:00'))
-            except (ValueError, TypeError):
-                continue
-            
-            # Calcular dias restantes (90 dias desde aprovação)
-            expiry_date = approval_date + timedelta(days=90)
-            days_remaining = (expiry_date - today).days
-            
-            if days_remaining in alert_days:
-                users_to_notify = []
-                if process.get("consultor_id"):
-                    users_to_notify.append(process["consultor_id"])
-                if process.get("mediador_id"):
-                    users_to_notify.append(process["mediador_id"])
-                
-                for user_id in users_to_notify:
-                    existing = await self.db.notifications.find_one({
-                        "user_id": user_id,
-                        "process_id": process.get("id"),
-                        "type": "pre_approval_countdown",
-                        "created_at": {"$gte": (today - timedelta(days=1)).isoformat()}
-                    })
-                    
-                    if not existing:
-                        await self.create_notification(
-                            user_id=user_id,
-                            message=f"⏰ Pré-aprovação expira em {days_remaining} dias!",
-                            notification_type="pre_approval_countdown",
-                            process_id=process.get("id"),
-                            client_name=process.get("client_name"),
-                            link=f"/process/{process.get('id')}"
-                        )
-                        notifications_created += 1
-        
+        day_ms = 24 * 3600 * 1000
+        
+        # Dias restantes calculados no servidor (90 dias desde aprovação)
+        rows = await self.db.processes.aggregate([
+            {"$match": {"credit_data.bank_approval_date": {"$exists": True, "$nin": [None, ""]}}},
+            {"$project": {
+                "_id": 0, "id": 1, "client_name": 1, "consultor_id": 1, "mediador_id": 1,
+                "approval": {"$dateFromString": {
+                    "dateString": "$credit_data.bank_approval_date",
+                    "onError": None, "onNull": None
+                }}
+            }},
+            {"$match": {"approval": {"$ne": None}}},
+            {"$addFields": {"days_remaining": {"$floor": {"$divide": [
+                {"$subtract": [{"$add": ["$approval", 90 * day_ms]}, today]},
+                day_ms
+            ]}}}},
+            {"$match": {"days_remaining": {"$in": alert_days}}}
+        ]).to_list(None)
+        
+        today_str = today.strftime("%Y-%m-%d")
+        notifications = []
+        for row in rows:
+            days_remaining = int(row["days_remaining"])
+            for user_id in _process_users(row, ("consultor_id", "mediador_id")):
+                notifications.append(self.build_notification(
+                    user_id=user_id,
+                    message=f"⏰ Pré-aprovação expira em {days_remaining} dias!",
+                    notification_type="pre_approval_countdown",
+                    process_id=row.get("id"),
+                    client_name=row.get("client_name"),
+                    link=f"/process/{row.get('id')}",
+                    dedup_key=notification_key("pre_approval_countdown", row.get("id"), user_id, today_str)
+                ))
+        
+        notifications_created = await self.upsert_notifications(notifications)
         logger.info(f"Countdown pré-aprovação: {notifications_created} notificações criadas")
         return notifications_created
     
@@ -370,13 +379,13 @@ class ScheduledTasksService:
         today = datetime.now(timezone.utc)
         cutoff_date = (today - timedelta(days=days)).isoformat()
         
-        # Buscar processos em estado "clientes_espera" há muito tempo
-        processes = await self.db.processes.find({
+        # Contar processos em estado "clientes_espera" há muito tempo
+        waiting_count = await self.db.processes.count_documents({
             "status": "clientes_espera",
             "created_at": {"$lte": cutoff_date}
-        }, {"_id": 0}).to_list(500)
+        })
         
-        if not processes:
+        if not waiting_count:
             logger.info("Nenhum cliente em espera há muito tempo")
             return 0
         
@@ -386,26 +395,19 @@ class ScheduledTasksService:
             "is_active": {"$ne": False}
         }, {"_id": 0, "id": 1, "name": 1}).to_list(50)
         
-        notifications_created = 0
+        today_str = today.strftime("%Y-%m-%d")
+        notifications_created = await self.upsert_notifications([
+            self.build_notification(
+                user_id=manager["id"],
+                message=f"⚠️ {waiting_count} cliente(s) em espera há mais de {days} dias. Requer atenção!",
+                notification_type="clients_waiting",
+                link="/admin?tab=overview",
+                dedup_key=notification_key("clients_waiting", manager["id"], today_str)
+            )
+            for manager in managers
+        ])
         
-        for manager in managers:
-            # Verificar se já enviou notificação hoje
-            existing = await self.db.notifications.find_one({
-                "user_id": manager["id"],
-                "type": "clients_waiting",
-                "created_at": {"$gte": (today - timedelta(hours=24)).isoformat()}
-            })
-            
-            if not existing:
-                await self.create_notification(
-                    user_id=manager["id"],
-                    message=f"⚠️ {len(processes)} cliente(s) em espera há mais de {days} dias. Requer atenção!",
-                    notification_type="clients_waiting",
-                    link="/admin?tab=overview"
-                )
-                notifications_created += 1
-        
-        logger.info(f"Clientes em espera: {notifications_created} notificações criadas para {len(processes)} clientes")
+        logger.info(f"Clientes em espera: {notifications_created} notificações criadas para {waiting_count} clientes")
         return notifications_created
     
     async def check_document_expirations_watchdog(self, days_ahead: int = 60) -> int:
@@ -431,90 +433,77 @@ class ScheduledTasksService:
         today = datetime.now(timezone.utc)
         future_date = today + timedelta(days=days_ahead)
         
-        # Buscar documentos com data de expiração dentro do período
-        # Que ainda não tiveram alerta enviado
-        expiring_docs = await self.db.document_metadata.find({
-            "expiry_date": {
-                "$ne": None,
-                "$gte": today.strftime("%Y-%m-%d"),
-                "$lte": future_date.strftime("%Y-%m-%d")
-            },
-            "expiry_alert_sent": {"$ne": True}
-        }, {"_id": 0}).to_list(500)
+        # Documentos a expirar (ainda sem alerta) com os responsáveis do processo
+        expiring_docs = await self.db.document_metadata.aggregate([
+            {"$match": {
+                "expiry_date": {
+                    "$ne": None,
+                    "$gte": today.strftime("%Y-%m-%d"),
+                    "$lte": future_date.strftime("%Y-%m-%d")
+                },
+                "expiry_alert_sent": {"$ne": True}
+            }},
+            {"$lookup": {
+                "from": "processes",
+                "localField": "process_id",
+                "foreignField": "id",
+                "as": "process"
+            }},
+            {"$unwind": "$process"},
+            {"$project": {
+                "_id": 0, "id": 1, "process_id": 1, "expiry_date": 1,
+                "client_name": 1, "ai_category": 1, "ai_subcategory": 1,
+                "process.client_name": 1,
+                "process.assigned_consultor_id": 1, "process.consultor_id": 1,
+                "process.assigned_mediador_id": 1, "process.mediador_id": 1
+            }}
+        ]).to_list(None)
         
         logger.info(f"[WATCHDOG] Encontrados {len(expiring_docs)} documentos a expirar")
         
-        notifications_created = 0
-        
+        notifications = []
         for doc in expiring_docs:
-            try:
-                expiry_date = datetime.strptime(doc["expiry_date"], "%Y-%m-%d")
-                days_until = (expiry_date - today).days
-                
-                # Determinar urgência visual
-                if days_until < 7:
-                    urgency_emoji = "🔴"
-                elif days_until < 30:
-                    urgency_emoji = "🟠"
-                else:
-                    urgency_emoji = "🟡"
-                
-                # Obter o processo para identificar os responsáveis
-                process = await self.db.processes.find_one(
-                    {"id": doc["process_id"]},
-                    {"_id": 0, "client_name": 1, "assigned_consultor_id": 1, 
-                     "consultor_id": 1, "assigned_mediador_id": 1, "mediador_id": 1}
-                )
-                
-                if not process:
-                    continue
-                
-                client_name = doc.get("client_name") or process.get("client_name", "Cliente")
-                doc_category = doc.get("ai_category") or doc.get("ai_subcategory") or "Documento"
-                
-                # Identificar utilizadores a notificar
-                users_to_notify = set()
-                if process.get("assigned_consultor_id"):
-                    users_to_notify.add(process["assigned_consultor_id"])
-                if process.get("consultor_id"):
-                    users_to_notify.add(process["consultor_id"])
-                if process.get("assigned_mediador_id"):
-                    users_to_notify.add(process["assigned_mediador_id"])
-                if process.get("mediador_id"):
-                    users_to_notify.add(process["mediador_id"])
-                
-                # Notificar cada utilizador
-                for user_id in users_to_notify:
-                    # Verificar se já existe notificação recente para este documento
-                    existing = await self.db.notifications.find_one({
-                        "user_id": user_id,
-                        "type": "document_expiry_watchdog",
-                        "message": {"$regex": doc.get("id", "")},
-                        "created_at": {"$gte": (today - timedelta(days=1)).isoformat()}
-                    })
-                    
-                    if not existing:
-                        message = f"{urgency_emoji} {doc_category} de {client_name} expira em {days_until} dias ({expiry_date.strftime('%d/%m/%Y')})"
-                        
-                        await self.create_notification(
-                            user_id=user_id,
-                            message=message,
-                            notification_type="document_expiry_watchdog",
-                            process_id=doc["process_id"],
-                            client_name=client_name,
-                            link=f"/process/{doc['process_id']}"
-                        )
-                        notifications_created += 1
-                
-                # Marcar documento como alerta enviado
-                await self.db.document_metadata.update_one(
-                    {"id": doc["id"]},
-                    {"$set": {"expiry_alert_sent": True, "expiry_alert_sent_at": today.isoformat()}}
-                )
-                
-            except Exception as e:
-                logger.error(f"[WATCHDOG] Erro ao processar documento {doc.get('id')}: {e}")
+            days_until = _days_until(doc["expiry_date"], today)
+            if days_until is None:
+                logger.error(f"[WATCHDOG] Data de expiração inválida no documento {doc.get('id')}")
                 continue
+            
+            # Determinar urgência visual
+            if days_until < 7:
+                urgency_emoji = "🔴"
+            elif days_until < 30:
+                urgency_emoji = "🟠"
+            else:
+                urgency_emoji = "🟡"
+            
+            process = doc["process"]
+            client_name = doc.get("client_name") or process.get("client_name", "Cliente")
+            doc_category = doc.get("ai_category") or doc.get("ai_subcategory") or "Documento"
+            expiry_label = datetime.strptime(doc["expiry_date"][:10], "%Y-%m-%d").strftime('%d/%m/%Y')
+            message = f"{urgency_emoji} {doc_category} de {client_name} expira em {days_until} dias ({expiry_label})"
+            
+            users_to_notify = _process_users(process, (
+                "assigned_consultor_id", "consultor_id", "assigned_mediador_id", "mediador_id"
+            ))
+            for user_id in users_to_notify:
+                notifications.append(self.build_notification(
+                    user_id=user_id,
+                    message=message,
+                    notification_type="document_expiry_watchdog",
+                    process_id=doc["process_id"],
+                    client_name=client_name,
+                    link=f"/process/{doc['process_id']}",
+                    dedup_key=notification_key("document_expiry_watchdog", doc.get("id"), user_id)
+                ))
+        
+        notifications_created = await self.upsert_notifications(notifications)
+        
+        # Marcar documentos como alerta enviado
+        if expiring_docs:
+            await self.db.document_metadata.update_many(
+                {"id": {"$in": [doc["id"] for doc in expiring_docs]}},
+                {"$set": {"expiry_alert_sent": True, "expiry_alert_sent_at": today.isoformat()}}
+            )
         
         logger.info(f"[WATCHDOG] Documentos a expirar: {notifications_created} notificações criadas")
         return notifications_created
@@ -561,7 +550,8 @@ class ScheduledTasksService:
             "status": {"$in": active_statuses}
         }, {"_id": 0}).to_list(1000)
         
-        notifications_created = 0
+        month_key = today.strftime("%Y-%m")
+        notifications = []
         
         for process in processes:
             users_to_notify = []
@@ -581,15 +571,15 @@ class ScheduledTasksService:
             client_name = process.get("client_name", "Cliente")
             
             for user_id in set(users_to_notify):
-                await self.create_notification(
+                notifications.append(self.build_notification(
                     user_id=user_id,
                     message=f"📄 Pedir recibo de vencimento e extrato bancário de {prev_month_name} ao cliente {client_name}",
                     notification_type="monthly_document_reminder",
                     process_id=process.get("id"),
                     client_name=client_name,
-                    link=f"/process/{process.get('id')}"
-                )
-                notifications_created += 1
+                    link=f"/process/{process.get('id')}",
+                    dedup_key=notification_key("monthly_document_reminder", process.get("id"), user_id, month_key)
+                ))
             
             # Enviar email ao cliente
             client_email = process.get("client_email")
@@ -604,6 +594,7 @@ class ScheduledTasksService:
                 except Exception as e:
                     logger.error(f"Erro ao enviar email para {client_email}: {e}")
         
+        notifications_created = await self.upsert_notifications(notifications)
         logger.info(f"Lembretes mensais: {notifications_created} notificações criadas")
         return notifications_created
     
@@ -1109,14 +1100,24 @@ class ScheduledTasksService:
         try:
             await self.connect()
             
-            # Executar tarefas
-            docs_count = await self.check_expiring_documents()
-            deadlines_count = await self.check_upcoming_deadlines()
-            tasks_count = await self.check_tasks_due_soon()
-            countdown_count = await self.check_pre_approval_countdown()
-            waiting_count = await self.check_clients_waiting_too_long()
-            watchdog_count = await self.check_document_expirations_watchdog()  # NOVA TAREFA
-            monthly_count = await self.send_monthly_document_reminder()
+            # Verificações independentes correm em paralelo
+            checks = [
+                self.check_expiring_documents(),
+                self.check_upcoming_deadlines(),
+                self.check_tasks_due_soon(),
+                self.check_pre_approval_countdown(),
+                self.check_clients_waiting_too_long(),
+                self.check_document_expirations_watchdog(),
+                self.send_monthly_document_reminder(),
+            ]
+            counts = []
+            for result in await asyncio.gather(*checks, return_exceptions=True):
+                if isinstance(result, Exception):
+                    logger.error(f"Erro numa verificação agendada: {result}")
+                    result = 0
+                counts.append(result)
+            (docs_count, deadlines_count, tasks_count, countdown_count,
+             waiting_count, watchdog_count, monthly_count) = counts
             cleanup_count = await self.cleanup_old_notifications()
             temp_files_count = await self.cleanup_temp_files()
             cache_count = await self.cleanup_scraper_cache()
@@ -1129,7 +1130,7 @@ class ScheduledTasksService:
             logger.info(f"- Alertas de tarefas: {tasks_count}")
             logger.info(f"- Alertas de countdown: {countdown_count}")
             logger.info(f"- Alertas clientes em espera: {waiting_count}")
-            logger.info(f"- Watchdog expiração docs: {watchdog_count}")  # NOVA LINHA
+            logger.info(f"- Watchdog expiração docs: {watchdog_count}")
             logger.info(f"- Lembretes mensais: {monthly_count}")
             logger.info(f"- Notificações limpas: {cleanup_count}")
             logger.info(f"- Ficheiros temp. limpos: {temp_files_count}")
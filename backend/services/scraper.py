@@ -40,6 +40,7 @@ import os
 from datetime import datetime, timezone, timedelta
 
 from config import GEMINI_API_KEY
+from middleware.metrics import track_call
 
 logger = logging.getLogger(__name__)
 
@@ -616,7 +617,9 @@ class PropertyScraper:
                     logger.debug(f"Usando proxy: {proxy[:30]}...")
                 
                 async with httpx.AsyncClient(**client_kwargs) as client:
-                    response = await client.get(url, headers=self._get_headers())
+                    with track_call("scraper", "direct") as call:
+                        response = await client.get(url, headers=self._get_headers())
+                        call.outcome = str(response.status_code)
                     
                     if response.status_code == 200:
                         return response.text
@@ -811,7 +814,8 @@ Conteúdo:
             
             # Usar Gemini 2.0 Flash
             model = genai.GenerativeModel("gemini-2.0-flash")
-            response = model.generate_content(prompt)
+            with track_call("llm", "scraper_gemini"):
+                response = model.generate_content(prompt)
             
             result_text = response.text.strip()
             
@@ -988,7 +992,8 @@ Conteúdo:
                 system_message="Extrais dados de páginas imobiliárias. Respondes sempre em JSON válido."
             ).with_model("openai", model)
             
-            response = await chat.send_message(UserMessage(text=prompt))
+            with track_call("llm", "scraper_openai"):
+                response = await chat.send_message(UserMessage(text=prompt))
             
             result_text = response.strip()
             if result_text.startswith("```json"):
@@ -1047,7 +1052,9 @@ Conteúdo:
             logger.info(f"[SCRAPER] Usando ScraperAPI (ultra_premium) para: {url}")
             
             async with httpx.AsyncClient(timeout=90.0) as client:
-                response = await client.get(scraper_url)
+                with track_call("scraper", "scraperapi") as call:
+                    response = await client.get(scraper_url)
+                    call.outcome = str(response.status_code)
                 
                 if response.status_code == 200:
                     logger.info(f"[SCRAPER] ScraperAPI sucesso para {url}")
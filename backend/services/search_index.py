@@ -0,0 +1,514 @@
+"""
+====================================================================
+ÍNDICE DE PESQUISA - CREDITOIMO
+====================================================================
+Mantém um documento de pesquisa por entidade (processo, tarefa) na
+colecção `search_index`, com texto normalizado (sem acentos, minúsculas)
+e tokens edge-n-gram para pesquisa por prefixo servida por índice.
+
+Estrutura de cada documento:
+    {
+        "entity_type": "process" | "task",
+        "entity_id": "<id da entidade>",
+        "name": "<nome normalizado>",
+        "text": "<texto normalizado completo>",
+        "prefixes": ["jo", "joa", "joao", ...],
+        "nif": "123456789",          # fast path exacto (processos)
+        "email": "a@b.pt",           # fast path exacto (processos)
+        "status": "...", "process_type": "...",
+        "payload": {...},            # campos de apresentação
+        "indexed_at": "..."
+    }
+
+A pesquisa por teclado (Ctrl+K) usa apenas o índice multikey
+(entity_type, prefixes); o índice de texto serve como fallback com
+stemming quando a pesquisa por prefixo não devolve resultados.
+
+O índice é actualizado nos caminhos de escrita principais e
+reconciliado periodicamente por `refresh_search_index` (watermark
+em `updated_at`).
+====================================================================
+"""
+import re
+import logging
+import unicodedata
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+ENTITY_PROCESS = "process"
+ENTITY_TASK = "task"
+
+# Limites dos tokens edge-n-gram
+MIN_PREFIX_LEN = 2
+MAX_PREFIX_LEN = 15
+
+# Máximo de candidatos lidos do índice antes do ranking (pré-ordenados
+# no MongoDB por `candidate_pipeline`)
+MAX_CANDIDATES = 200
+
+# Máximo de ids devolvidos para filtros noutras colecções (ex.: /clients)
+MAX_MATCH_IDS = 5000
+
+BULK_CHUNK_SIZE = 500
+
+STATE_DOC_ID = "search_index_state"
+
+_NIF_RE = re.compile(r"^\d{9}$")
+
+PROCESS_PROJECTION = {
+    "_id": 0, "id": 1, "client_name": 1, "client_email": 1, "client_phone": 1,
+    "process_type": 1, "status": 1, "process_number": 1,
+    "personal_data.nif": 1, "personal_data.email": 1, "personal_data.telefone": 1,
+    "updated_at": 1,
+}
+
+TASK_PROJECTION = {
+    "_id": 0, "id": 1, "title": 1, "description": 1, "client_name": 1,
+    "status": 1, "priority": 1, "completed": 1, "process_id": 1, "updated_at": 1,
+}
+
+
+# ====================================================================
+# NORMALIZAÇÃO E TOKENIZAÇÃO
+# ====================================================================
+
+def fold_text(text: Any) -> str:
+    """
+    Normaliza texto para indexação: remove acentos, converte para
+    minúsculas e substitui pontuação por espaços.
+    """
+    if text is None:
+        return ""
+    text = unicodedata.normalize("NFD", str(text))
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+def tokenize(text: Any) -> List[str]:
+    """Dividir texto normalizado em tokens únicos (ordem preservada)."""
+    seen = []
+    for token in fold_text(text).split():
+        if token not in seen:
+            seen.append(token)
+    return seen
+
+
+def edge_ngrams(tokens: Iterable[str]) -> List[str]:
+    """
+    Gerar prefixos (edge n-grams) de cada token, entre MIN_PREFIX_LEN
+    e MAX_PREFIX_LEN caracteres. Tokens curtos são incluídos inteiros.
+    """
+    grams = set()
+    for token in tokens:
+        if len(token) < MIN_PREFIX_LEN:
+            grams.add(token)
+            continue
+        upper = min(len(token), MAX_PREFIX_LEN)
+        for i in range(MIN_PREFIX_LEN, upper + 1):
+            grams.add(token[:i])
+    return sorted(grams)
+
+
+def query_terms(q: str) -> List[str]:
+    """Tokens de uma pesquisa, truncados ao tamanho máximo de prefixo."""
+    return [t[:MAX_PREFIX_LEN] for t in tokenize(q)]
+
+
+# ====================================================================
+# CONSTRUÇÃO DOS DOCUMENTOS DE PESQUISA
+# ====================================================================
+
+def build_process_entry(process: dict) -> dict:
+    """Construir o documento de pesquisa de um processo."""
+    personal = process.get("personal_data") or {}
+    nif = str(personal.get("nif") or "").strip()
+    email = (personal.get("email") or process.get("client_email") or "").strip().lower()
+
+    name_tokens = tokenize(process.get("client_name"))
+    other_tokens = tokenize(" ".join(str(v) for v in [
+        process.get("client_email"),
+        personal.get("email"),
+        nif,
+        personal.get("telefone") or process.get("client_phone"),
+        process.get("process_number"),
+        process.get("process_type"),
+    ] if v))
+
+    return {
+        "entity_type": ENTITY_PROCESS,
+        "entity_id": process.get("id"),
+        "name": " ".join(name_tokens),
+        "text": " ".join(name_tokens + [t for t in other_tokens if t not in name_tokens]),
+        "prefixes": edge_ngrams(name_tokens + other_tokens),
+        "nif": nif or None,
+        "email": email or None,
+        "status": process.get("status"),
+        "process_type": process.get("process_type"),
+        "payload": {
+            "id": process.get("id"),
+            "client_name": process.get("client_name"),
+            "process_type": process.get("process_type"),
+            "status": process.get("status"),
+            "process_number": process.get("process_number"),
+            "personal_data": {"nif": personal.get("nif")},
+        },
+        "source_updated_at": process.get("updated_at"),
+    }
+
+
+def build_task_entry(task: dict) -> dict:
+    """Construir o documento de pesquisa de uma tarefa."""
+    name_tokens = tokenize(task.get("title"))
+    other_tokens = tokenize(" ".join(str(v) for v in [
+        task.get("client_name"),
+        task.get("description"),
+    ] if v))
+
+    return {
+        "entity_type": ENTITY_TASK,
+        "entity_id": task.get("id"),
+        "name": " ".join(name_tokens),
+        "text": " ".join(name_tokens + [t for t in other_tokens if t not in name_tokens]),
+        "prefixes": edge_ngrams(name_tokens + other_tokens),
+        "status": task.get("status"),
+        "process_id": task.get("process_id"),
+        "payload": {
+            "id": task.get("id"),
+            "title": task.get("title"),
+            "status": task.get("status"),
+            "priority": task.get("priority"),
+            "client_name": task.get("client_name"),
+            "completed": task.get("completed"),
+        },
+        "source_updated_at": task.get("updated_at"),
+    }
+
+
+_BUILDERS = {
+    ENTITY_PROCESS: build_process_entry,
+    ENTITY_TASK: build_task_entry,
+}
+
+
+def _upsert_op(entry: dict, stamp: str, rebuild_id: Optional[str] = None) -> UpdateOne:
+    doc = dict(entry, indexed_at=stamp)
+    if rebuild_id:
+        doc["rebuild_id"] = rebuild_id
+    return UpdateOne(
+        {"entity_type": entry["entity_type"], "entity_id": entry["entity_id"]},
+        {"$set": doc},
+        upsert=True,
+    )
+
+
+# ====================================================================
+# MANUTENÇÃO DO ÍNDICE
+# ====================================================================
+
+async def index_entity(entity_type: str, entity_id: str) -> bool:
+    """
+    (Re)indexar uma entidade a partir da sua colecção de origem.
+    Nunca lança excepções - a pesquisa não deve bloquear escritas.
+    """
+    try:
+        collection, projection = _source(entity_type)
+        doc = await collection.find_one({"id": entity_id}, projection)
+        if not doc:
+            await remove_entity(entity_type, entity_id)
+            return False
+        return await index_document(entity_type, doc)
+    except Exception as e:
+        logger.warning(f"Erro ao indexar {entity_type} {entity_id}: {e}")
+        return False
+
+
+async def index_document(entity_type: str, doc: dict) -> bool:
+    """Indexar um documento já carregado (evita nova leitura)."""
+    try:
+        entry = _BUILDERS[entity_type](doc)
+        if not entry["entity_id"]:
+            return False
+        stamp = datetime.now(timezone.utc).isoformat()
+        await db.search_index.bulk_write([_upsert_op(entry, stamp)], ordered=False)
+        return True
+    except Exception as e:
+        logger.warning(f"Erro ao indexar {entity_type}: {e}")
+        return False
+
+
+async def remove_entity(entity_type: str, entity_id: str):
+    """Remover uma entidade do índice."""
+    try:
+        await db.search_index.delete_one({"entity_type": entity_type, "entity_id": entity_id})
+    except Exception as e:
+        logger.warning(f"Erro ao remover {entity_type} {entity_id} do índice: {e}")
+
+
+async def remove_process_entries(process_id: str):
+    """Remover do índice um processo e as tarefas associadas."""
+    try:
+        await db.search_index.delete_many({"$or": [
+            {"entity_type": ENTITY_PROCESS, "entity_id": process_id},
+            {"entity_type": ENTITY_TASK, "process_id": process_id},
+        ]})
+    except Exception as e:
+        logger.warning(f"Erro ao remover processo {process_id} do índice: {e}")
+
+
+async def clear_entities(*entity_types: str):
+    """Esvaziar o índice dos tipos indicados (ex.: após apagar todos os dados)."""
+    try:
+        await db.search_index.delete_many({"entity_type": {"$in": list(entity_types)}})
+    except Exception as e:
+        logger.warning(f"Erro ao limpar o índice de pesquisa: {e}")
+
+
+def _source(entity_type: str):
+    if entity_type == ENTITY_PROCESS:
+        return db.processes, PROCESS_PROJECTION
+    if entity_type == ENTITY_TASK:
+        return db.tasks, TASK_PROJECTION
+    raise ValueError(f"Tipo de entidade desconhecido: {entity_type}")
+
+
+async def _index_cursor(entity_type: str, query: dict, stamp: str, rebuild_id: str = None) -> dict:
+    """Indexar todos os documentos de um cursor em chunks de bulk_write."""
+    collection, projection = _source(entity_type)
+    builder = _BUILDERS[entity_type]
+    ops = []
+    count = 0
+    max_updated = None
+
+    async for doc in collection.find(query, projection).batch_size(BULK_CHUNK_SIZE):
+        if not doc.get("id"):
+            continue
+        ops.append(_upsert_op(builder(doc), stamp, rebuild_id))
+        count += 1
+        updated = doc.get("updated_at")
+        if isinstance(updated, str) and (max_updated is None or updated > max_updated):
+            max_updated = updated
+        if len(ops) >= BULK_CHUNK_SIZE:
+            await db.search_index.bulk_write(ops, ordered=False)
+            ops = []
+
+    if ops:
+        await db.search_index.bulk_write(ops, ordered=False)
+
+    return {"indexed": count, "max_updated_at": max_updated}
+
+
+async def refresh_search_index(full: bool = False) -> dict:
+    """
+    Reconciliar o índice com as colecções de origem.
+
+    - Incremental (por defeito): apenas entidades com `updated_at`
+      posterior à última watermark guardada.
+    - Completo (`full=True`): reindexa tudo e remove entradas órfãs
+      (entidades apagadas por caminhos sem hook). Entradas escritas por
+      `index_document` durante a reconstrução têm `indexed_at` posterior
+      ao início e são preservadas.
+    """
+    stamp = datetime.now(timezone.utc).isoformat()
+    state = await db.search_index_state.find_one({"id": STATE_DOC_ID}) or {}
+    watermarks = {} if full else state.get("watermarks", {})
+    rebuild_id = stamp if full else None
+
+    results = {"full": full}
+    for entity_type in (ENTITY_PROCESS, ENTITY_TASK):
+        since = watermarks.get(entity_type)
+        query = {"updated_at": {"$gt": since}} if since else {}
+        outcome = await _index_cursor(entity_type, query, stamp, rebuild_id)
+        if outcome["max_updated_at"]:
+            watermarks[entity_type] = outcome["max_updated_at"]
+        results[entity_type] = outcome["indexed"]
+
+    if full:
+        removed = await db.search_index.delete_many({
+            "rebuild_id": {"$ne": rebuild_id},
+            "indexed_at": {"$lt": stamp},
+        })
+        results["removed"] = removed.deleted_count
+
+    await db.search_index_state.update_one(
+        {"id": STATE_DOC_ID},
+        {"$set": {"watermarks": watermarks, "last_refresh": stamp}},
+        upsert=True,
+    )
+    logger.info(f"Índice de pesquisa actualizado: {results}")
+    return results
+
+
+async def ensure_search_index_populated():
+    """Construir o índice no arranque se ainda estiver vazio."""
+    try:
+        if await db.search_index.estimated_document_count() == 0:
+            await refresh_search_index(full=True)
+        else:
+            await refresh_search_index()
+    except Exception as e:
+        logger.warning(f"Erro ao preparar índice de pesquisa: {e}")
+
+
+# ====================================================================
+# PESQUISA
+# ====================================================================
+
+def _rank(entry: dict, terms: List[str], folded_query: str) -> float:
+    """
+    Relevância de uma entrada: tokens do nome valem mais que os do
+    resto do texto; match exacto vale mais que prefixo.
+    """
+    name = entry.get("name", "")
+    name_tokens = name.split()
+    text_tokens = entry.get("text", "").split()
+    score = 0.0
+    for term in terms:
+        if term in name_tokens:
+            score += 4
+        elif any(t.startswith(term) for t in name_tokens):
+            score += 3
+        elif term in text_tokens:
+            score += 2
+        else:
+            score += 1
+    if folded_query and name.startswith(folded_query):
+        score += 5
+    return score
+
+
+def _name_prefix_hit(term: str) -> dict:
+    """Expressão: 1 se algum token do nome começa por `term`, senão 0."""
+    return {"$cond": [
+        {"$anyElementTrue": [{"$map": {
+            "input": {"$split": ["$name", " "]},
+            "as": "token",
+            "in": {"$eq": [{"$substrCP": ["$$token", 0, len(term)]}, term]},
+        }}]},
+        1, 0
+    ]}
+
+
+def candidate_pipeline(match: dict, terms: List[str], folded_query: str,
+                       projection: dict, limit: int = MAX_CANDIDATES) -> List[dict]:
+    """
+    Agregação que ordena os candidatos por uma aproximação da relevância
+    antes de limitar: nome começa pela pesquisa, número de termos que
+    são prefixo de um token do nome e, por fim, os mais recentes. Assim
+    um prefixo curto/comum não deixa os melhores fora dos candidatos.
+    """
+    return [
+        {"$match": match},
+        {"$addFields": {
+            "_name_starts": {"$cond": [
+                {"$eq": [{"$indexOfCP": ["$name", folded_query]}, 0]}, 1, 0
+            ]},
+            "_name_hits": {"$add": [_name_prefix_hit(term) for term in terms]},
+        }},
+        {"$sort": {"_name_starts": -1, "_name_hits": -1, "source_updated_at": -1}},
+        {"$limit": limit},
+        {"$project": projection},
+    ]
+
+
+def _exact_filter(entity_type: str, q: str) -> Optional[dict]:
+    """Fast path: NIF (9 dígitos) ou email completo."""
+    if entity_type != ENTITY_PROCESS:
+        return None
+    raw = q.strip()
+    if _NIF_RE.match(raw):
+        return {"nif": raw}
+    if "@" in raw and "." in raw.split("@")[-1]:
+        return {"email": raw.lower()}
+    return None
+
+
+async def search_entities(
+    entity_type: str,
+    q: str,
+    limit: int = 10,
+    filters: Optional[Dict[str, Any]] = None,
+) -> List[dict]:
+    """
+    Pesquisar entidades no índice e devolver as entradas ordenadas
+    por relevância (cada uma com `payload` e `score`).
+    """
+    base = {"entity_type": entity_type}
+    if filters:
+        base.update(filters)
+    projection = {"_id": 0, "entity_id": 1, "name": 1, "text": 1, "payload": 1}
+
+    exact = _exact_filter(entity_type, q)
+    if exact:
+        entries = await db.search_index.find({**base, **exact}, projection).limit(limit).to_list(limit)
+        if entries:
+            for entry in entries:
+                entry["score"] = 100.0
+            return entries
+
+    terms = query_terms(q)
+    if not terms:
+        return []
+
+    folded = fold_text(q)
+    entries = await db.search_index.aggregate(
+        candidate_pipeline({**base, "prefixes": {"$all": terms}}, terms, folded, projection)
+    ).to_list(MAX_CANDIDATES)
+
+    if not entries:
+        return await _text_fallback(base, q, limit)
+
+    for entry in entries:
+        entry["score"] = _rank(entry, terms, folded)
+    entries.sort(key=lambda e: (-e["score"], e.get("name", "")))
+    return entries[:limit]
+
+
+async def _text_fallback(base: dict, q: str, limit: int) -> List[dict]:
+    """Pesquisa full-text com stemming (índice de texto) ordenada por score."""
+    folded = fold_text(q)
+    if not folded:
+        return []
+    try:
+        return await db.search_index.find(
+            {**base, "$text": {"$search": folded}},
+            {"_id": 0, "entity_id": 1, "name": 1, "payload": 1, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).limit(limit).to_list(limit)
+    except Exception as e:
+        logger.debug(f"Fallback de texto indisponível: {e}")
+        return []
+
+
+async def match_process_ids(q: str, limit: int = MAX_MATCH_IDS) -> List[str]:
+    """
+    Ids de processos que correspondem à pesquisa, para filtrar outras
+    queries com `{"id": {"$in": ids}}` em vez de `$regex`.
+
+    Sem resultados por prefixo, procura a pesquisa como substring do
+    texto normalizado (comportamento anterior de /clients, ex.: parte
+    de um email ou NIF), na colecção do índice e com o input escapado.
+    """
+    base = {"entity_type": ENTITY_PROCESS}
+    exact = _exact_filter(ENTITY_PROCESS, q)
+    if exact:
+        query = {**base, **exact}
+    else:
+        terms = query_terms(q)
+        if not terms:
+            return []
+        query = {**base, "prefixes": {"$all": terms}}
+
+    projection = {"_id": 0, "entity_id": 1}
+    entries = await db.search_index.find(query, projection).limit(limit).to_list(limit)
+    if not entries and not exact:
+        entries = await db.search_index.find(
+            {**base, "text": {"$regex": re.escape(fold_text(q))}}, projection
+        ).limit(limit).to_list(limit)
+    return [e["entity_id"] for e in entries]
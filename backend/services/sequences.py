@@ -0,0 +1,189 @@
+"""
+====================================================================
+SEQUÊNCIAS ATÓMICAS - CREDITOIMO
+====================================================================
+Geração de números sequenciais (referências IMO-NNN, números de
+processo) a partir de um documento por sequência na colecção
+`counters`: {"id": <nome>, "value": <último valor atribuído>}.
+
+- `reserve(name, n)` reserva um bloco contíguo de N valores com um
+  único `find_one_and_update` + `$inc` (sem retries nem duplicados).
+- `next_value(name)` serve valores de um bloco reservado localmente
+  por worker; só vai à base de dados quando o bloco se esgota.
+  Referências manuais avançam o contador (`advance`); a colisão rara
+  com um valor de um bloco obsoleto (ex.: após `reset` noutro worker)
+  é apanhada pelo índice único no insert, que descarta o bloco
+  (`discard_block`, realinha o contador) e volta a reservar uma vez.
+- Na primeira utilização por processo, o contador é alinhado com o
+  maior valor já existente nos dados (`$max`, idempotente).
+====================================================================
+"""
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+PROPERTY_REFERENCE = "property_reference"
+PROCESS_NUMBER = "process_number"
+
+# Tamanho do bloco reservado por worker para referências de imóveis.
+# Números de processo usam blocos de 1 para manter a numeração contígua.
+PROPERTY_REFERENCE_BLOCK = int(os.environ.get("PROPERTY_REFERENCE_BLOCK", "10"))
+
+
+class SequenceService:
+    """
+    Contadores atómicos com reserva em bloco e cache local por worker.
+    """
+
+    def __init__(self):
+        self._seeders: Dict[str, Callable[[], Awaitable[int]]] = {}
+        self._block_sizes: Dict[str, int] = {}
+        self._seeded: set = set()
+        self._blocks: Dict[str, List[int]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def register(self, name: str, seeder: Optional[Callable[[], Awaitable[int]]] = None, block_size: int = 1):
+        """Registar uma sequência com a função que devolve o maior valor existente."""
+        if seeder:
+            self._seeders[name] = seeder
+        self._block_sizes[name] = max(1, block_size)
+
+    async def _ensure_seeded(self, name: str):
+        if name in self._seeded:
+            return
+        seeder = self._seeders.get(name)
+        current_max = await seeder() if seeder else 0
+        await db.counters.update_one(
+            {"id": name},
+            {"$max": {"value": int(current_max or 0)}},
+            upsert=True
+        )
+        self._seeded.add(name)
+
+    async def reserve(self, name: str, count: int) -> range:
+        """
+        Reservar `count` valores consecutivos numa única operação atómica.
+        Devolve um range com os valores reservados.
+        """
+        if count <= 0:
+            return range(0)
+        await self._ensure_seeded(name)
+        counter = await db.counters.find_one_and_update(
+            {"id": name},
+            {"$inc": {"value": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        last = counter["value"]
+        return range(last - count + 1, last + 1)
+
+    async def next_value(self, name: str) -> int:
+        """Próximo valor, servido do bloco local do worker quando disponível."""
+        block_size = self._block_sizes.get(name, 1)
+        if block_size == 1:
+            return (await self.reserve(name, 1))[0]
+
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            block = self._blocks.get(name)
+            if not block:
+                block = list(await self.reserve(name, block_size))
+                self._blocks[name] = block
+            return block.pop(0)
+
+    def discard_block(self, name: str):
+        """
+        Descartar o bloco local após um valor servido colidir no índice
+        único; a próxima reserva volta a alinhar o contador com os dados.
+        """
+        self._blocks.pop(name, None)
+        self._seeded.discard(name)
+
+    async def advance(self, name: str, value: int):
+        """Garantir que o contador nunca volta a atribuir `value` (valores manuais)."""
+        await self._ensure_seeded(name)
+        await db.counters.update_one({"id": name}, {"$max": {"value": value}}, upsert=True)
+        # O valor manual pode estar no bloco local já reservado
+        block = self._blocks.get(name)
+        if block and value in block:
+            block.remove(value)
+
+    async def reset(self, name: str, value: int = 0):
+        """
+        Repor o contador (ex: após apagar e reimportar todos os dados).
+
+        Só o bloco deste worker é descartado; um valor de um bloco noutro
+        worker que colida é tratado no insert (ver `discard_block`).
+        """
+        await db.counters.update_one({"id": name}, {"$set": {"value": value}}, upsert=True)
+        self._blocks.pop(name, None)
+        self._seeded.add(name)
+
+
+sequences = SequenceService()
+
+
+# ====================================================================
+# SEQUÊNCIAS REGISTADAS
+# ====================================================================
+
+async def _max_property_reference() -> int:
+    """Maior número IMO-NNN existente nos imóveis."""
+    pipeline = [
+        {"$match": {"internal_reference": {"$regex": "^IMO-"}}},
+        {"$project": {"num": {"$convert": {
+            "input": {"$arrayElemAt": [{"$split": ["$internal_reference", "-"]}, 1]},
+            "to": "int", "onError": 0, "onNull": 0
+        }}}},
+        {"$group": {"_id": None, "max": {"$max": "$num"}}}
+    ]
+    result = await db.properties.aggregate(pipeline).to_list(1)
+    return result[0]["max"] if result else 0
+
+
+async def _max_process_number() -> int:
+    """Maior process_number existente."""
+    latest = await db.processes.find_one(
+        {"process_number": {"$exists": True, "$ne": None}},
+        sort=[("process_number", -1)],
+        projection={"_id": 0, "process_number": 1}
+    )
+    return latest["process_number"] if latest else 0
+
+
+sequences.register(PROPERTY_REFERENCE, _max_property_reference, block_size=PROPERTY_REFERENCE_BLOCK)
+sequences.register(PROCESS_NUMBER, _max_process_number)
+
+
+def format_property_reference(number: int) -> str:
+    return f"IMO-{number:03d}"
+
+
+async def next_property_reference() -> str:
+    """Próxima referência interna de imóvel (IMO-001, IMO-002...)."""
+    return format_property_reference(await sequences.next_value(PROPERTY_REFERENCE))
+
+
+def discard_property_reference_block():
+    """Descartar o bloco local de referências após uma colisão no insert."""
+    sequences.discard_block(PROPERTY_REFERENCE)
+
+
+async def register_manual_property_reference(reference: str):
+    """Avançar o contador quando é fornecida uma referência IMO-NNN manual."""
+    prefix, _, number = (reference or "").partition("-")
+    if prefix == "IMO" and number.isdigit():
+        await sequences.advance(PROPERTY_REFERENCE, int(number))
+
+
+async def reserve_property_references(count: int) -> List[str]:
+    """Reservar `count` referências de imóvel contíguas."""
+    return [format_property_reference(n) for n in await sequences.reserve(PROPERTY_REFERENCE, count)]
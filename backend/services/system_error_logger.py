@@ -9,22 +9,136 @@ Funcionalidades:
 - Visualizar logs com filtros e paginação
 - Marcar erros como lidos/resolvidos
 - Estatísticas de erros por período
+- Agrupamento por fingerprint (componente, tipo, mensagem normalizada,
+  stack) com contadores e amostras limitadas
 ====================================================================
 """
 
-import uuid
+import os
+import re
+import asyncio
+import hashlib
 import logging
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict, Any, List
 
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
 logger = logging.getLogger(__name__)
 
+ERROR_LOG_FLUSH_INTERVAL = float(os.environ.get("ERROR_LOG_FLUSH_INTERVAL", "1.0"))
+ERROR_LOG_MAX_PENDING = int(os.environ.get("ERROR_LOG_MAX_PENDING", "1000"))
+MAX_SAMPLES_PER_FINGERPRINT = 10
+MAX_STACK_CHARS = 4000
+
+_NORMALIZE_PATTERNS = [
+    (re.compile(r"https?://\S+"), "<url>"),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+"), "<email>"),
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.I), "<uuid>"),
+    (re.compile(r"\b(?=[0-9a-f]*\d)[0-9a-f]{12,}\b", re.I), "<hex>"),
+    (re.compile(r"'[^']*'|\"[^\"]*\""), "<str>"),
+    (re.compile(r"\d+(?:[.,]\d+)*"), "<n>"),
+]
+_FRAME_RE = re.compile(r'File "([^"]+)", line \d+, in (\S+)')
+
+
+def normalize_message(message: str) -> str:
+    """Mensagem sem valores variáveis (ids, números, URLs, strings)."""
+    normalized = (message or "").strip()
+    for pattern, placeholder in _NORMALIZE_PATTERNS:
+        normalized = pattern.sub(placeholder, normalized)
+    return re.sub(r"\s+", " ", normalized)[:500]
+
+
+def stack_signature(stack: Optional[str]) -> str:
+    """Frames (ficheiro, função) de um traceback, sem números de linha."""
+    if not stack:
+        return ""
+    frames = [f"{os.path.basename(path)}:{func}" for path, func in _FRAME_RE.findall(stack)]
+    return "|".join(frames[-10:])
+
+
+def error_fingerprint(component: str, error_type: str, message: str, stack: Optional[str] = None) -> str:
+    """Fingerprint de um erro: (componente, tipo, mensagem normalizada, stack)."""
+    key = "\n".join([component or "", error_type or "", normalize_message(message), stack_signature(stack)])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def daily_counts(doc: Dict[str, Any]) -> Dict[str, int]:
+    """Ocorrências por dia de um grupo (registos antigos, sem contadores, contam 1)."""
+    if doc.get("daily") is not None:
+        return doc["daily"]
+    return {doc.get("date") or doc.get("timestamp", "")[:10]: 1}
+
+
+def occurrences_since(doc: Dict[str, Any], cutoff_date: str) -> int:
+    """Ocorrências de um grupo desde `cutoff_date`."""
+    return sum(count for date, count in daily_counts(doc).items() if date >= cutoff_date)
+
+
+def build_fingerprint_update(fingerprint: str, group: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Update (upsert) de um grupo agregado em memória: contadores via `$inc`,
+    última ocorrência via `$set` (reabre o grupo se estava resolvido, sem
+    mexer em `read`)
+    e amostras limitadas via `$push` com `$slice`.
+    """
+    last = group["last"]
+    inc = {f"daily.{date}": count for date, count in group["daily"].items()}
+    inc["count"] = sum(group["daily"].values())
+    return {
+        "$inc": inc,
+        "$set": {
+            "message": last["message"],
+            "details": last["details"],
+            "severity": group["severity"],
+            "user_id": last["user_id"],
+            "request_path": last["request_path"],
+            "timestamp": last["timestamp"],
+            "last_seen": last["timestamp"],
+            "date": last["timestamp"][:10],
+            "hour": int(last["timestamp"][11:13]),
+            "resolved": False
+        },
+        "$setOnInsert": {
+            "fingerprint": fingerprint,
+            "type": group["type"],
+            "component": group["component"],
+            "normalized_message": group["normalized_message"],
+            "first_seen": group["first_seen"],
+            "read": False,
+            "resolved_at": None,
+            "resolved_by": None,
+            "notes": None
+        },
+        "$push": {
+            "samples": {"$each": group["samples"], "$slice": -MAX_SAMPLES_PER_FINGERPRINT}
+        }
+    }
+
 
 class SystemErrorLogger:
-    """Logger centralizado de erros do sistema."""
+    """
+    Logger centralizado de erros do sistema.
+
+    Erros iguais (mesmo fingerprint) partilham um documento em
+    `system_error_logs` com contadores (`count`, `daily.<data>`),
+    `first_seen`/`last_seen` e no máximo MAX_SAMPLES_PER_FINGERPRINT
+    amostras de detalhes. `log_error` só agrega em memória; a gravação
+    (um `bulk_write` de upserts) corre em background a cada
+    ERROR_LOG_FLUSH_INTERVAL segundos e no shutdown (`flush()`).
+    """
     
-    def __init__(self):
+    def __init__(self, flush_interval: float = ERROR_LOG_FLUSH_INTERVAL,
+                 max_pending: int = ERROR_LOG_MAX_PENDING):
         self._db = None
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.dropped = 0
     
     async def _get_db(self):
         """Lazy load database connection."""
@@ -41,10 +155,11 @@ class SystemErrorLogger:
         details: Dict[str, Any] = None,
         severity: str = "warning",
         user_id: str = None,
-        request_path: str = None
+        request_path: str = None,
+        stack: str = None
     ) -> str:
         """
-        Regista um erro no sistema.
+        Regista um erro no sistema (gravação em background).
         
         Args:
             error_type: Tipo de erro (scraper_error, api_error, validation_error, etc.)
@@ -54,41 +169,82 @@ class SystemErrorLogger:
             severity: Nível (info, warning, error, critical)
             user_id: ID do utilizador afectado (se aplicável)
             request_path: Path do request (se aplicável)
+            stack: Traceback (se aplicável); entra no fingerprint sem números de linha
             
         Returns:
-            ID do erro registado
+            ID do grupo de erros (fingerprint)
         """
-        db = await self._get_db()
-        
-        error_id = str(uuid.uuid4())
+        fingerprint = error_fingerprint(component, error_type, message, stack)
         now = datetime.now(timezone.utc)
+        timestamp = now.isoformat()
         
-        error_log = {
-            "id": error_id,
-            "type": error_type,
+        sample = {
+            "timestamp": timestamp,
             "message": message,
-            "component": component,
             "details": details or {},
-            "severity": severity,
             "user_id": user_id,
             "request_path": request_path,
-            "timestamp": now.isoformat(),
-            "date": now.strftime("%Y-%m-%d"),
-            "hour": now.hour,
-            "read": False,
-            "resolved": False,
-            "resolved_at": None,
-            "resolved_by": None,
-            "notes": None
         }
+        if stack:
+            sample["stack"] = stack[-MAX_STACK_CHARS:]
         
-        try:
-            await db.system_error_logs.insert_one(error_log)
-            logger.debug(f"System error logged: [{severity}] {component}/{error_type}: {message[:100]}")
-            return error_id
-        except Exception as e:
-            logger.error(f"Failed to log system error: {e}")
-            return ""
+        pending = self._pending.get(fingerprint)
+        if pending is None:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                if self.dropped % 100 == 1:
+                    logger.warning(f"Buffer de erros do sistema cheio: {self.dropped} erros descartados")
+                return ""
+            pending = self._pending[fingerprint] = {
+                "type": error_type,
+                "component": component,
+                "normalized_message": normalize_message(message),
+                "first_seen": timestamp,
+                "daily": {},
+                "samples": []
+            }
+        pending["severity"] = severity
+        pending["last"] = sample
+        pending["daily"][now.strftime("%Y-%m-%d")] = pending["daily"].get(now.strftime("%Y-%m-%d"), 0) + 1
+        pending["samples"] = (pending["samples"] + [sample])[-MAX_SAMPLES_PER_FINGERPRINT:]
+        
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+        
+        logger.debug(f"System error logged: [{severity}] {component}/{error_type}: {message[:100]}")
+        return fingerprint
+    
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+    
+    async def flush(self):
+        """Gravar imediatamente os erros agregados em memória."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            db = await self._get_db()
+            ops = [
+                UpdateOne({"id": fp}, build_fingerprint_update(fp, group), upsert=True)
+                for fp, group in pending.items()
+            ]
+            try:
+                await db.system_error_logs.bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                # Upsert concorrente (API/worker) do mesmo fingerprint novo: o
+                # índice único rejeita o segundo insert; repetir como update
+                errors = e.details.get("writeErrors", [])
+                retry = [ops[err["index"]] for err in errors if err.get("code") == 11000]
+                if len(retry) < len(errors):
+                    logger.error(f"Failed to log {len(errors) - len(retry)} system error groups: {e}")
+                if retry:
+                    try:
+                        await db.system_error_logs.bulk_write(retry, ordered=False)
+                    except Exception as retry_error:
+                        logger.error(f"Failed to log {len(retry)} system error groups: {retry_error}")
+            except Exception as e:
+                logger.error(f"Failed to log {len(pending)} system error groups: {e}")
     
     async def get_errors(
         self,
@@ -204,60 +360,56 @@ class SystemErrorLogger:
         return result.modified_count
     
     async def get_stats(self, days: int = 7) -> Dict[str, Any]:
-        """Obtém estatísticas de erros."""
+        """
+        Obtém estatísticas de erros a partir dos grupos (fingerprints)
+        vistos no período, somando os contadores diários.
+        """
         db = await self._get_db()
         
-        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
-        
-        # Total por severidade
-        pipeline_severity = [
-            {"$match": {"timestamp": {"$gte": cutoff}}},
-            {"$group": {"_id": "$severity", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ]
-        severity_stats = await db.system_error_logs.aggregate(pipeline_severity).to_list(10)
-        
-        # Total por componente
-        pipeline_component = [
-            {"$match": {"timestamp": {"$gte": cutoff}}},
-            {"$group": {"_id": "$component", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ]
-        component_stats = await db.system_error_logs.aggregate(pipeline_component).to_list(20)
-        
-        # Total por tipo de erro
-        pipeline_type = [
-            {"$match": {"timestamp": {"$gte": cutoff}}},
-            {"$group": {"_id": "$type", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ]
-        type_stats = await db.system_error_logs.aggregate(pipeline_type).to_list(20)
-        
-        # Por dia
-        pipeline_daily = [
-            {"$match": {"timestamp": {"$gte": cutoff}}},
-            {"$group": {"_id": "$date", "count": {"$sum": 1}}},
-            {"$sort": {"_id": 1}}
-        ]
-        daily_stats = await db.system_error_logs.aggregate(pipeline_daily).to_list(days + 1)
+        now = datetime.now(timezone.utc)
+        cutoff = (now - timedelta(days=days)).isoformat()
+        cutoff_date = cutoff[:10]
         
-        # Contagens gerais
-        total = await db.system_error_logs.count_documents({"timestamp": {"$gte": cutoff}})
-        unread = await db.system_error_logs.count_documents({"timestamp": {"$gte": cutoff}, "read": False})
-        unresolved = await db.system_error_logs.count_documents({"timestamp": {"$gte": cutoff}, "resolved": False})
-        critical = await db.system_error_logs.count_documents({"timestamp": {"$gte": cutoff}, "severity": "critical"})
+        groups = await db.system_error_logs.find(
+            {"timestamp": {"$gte": cutoff}},
+            {"_id": 0, "severity": 1, "component": 1, "type": 1, "read": 1,
+             "resolved": 1, "daily": 1, "date": 1, "timestamp": 1}
+        ).to_list(None)
         
-        return {
+        stats = {
             "period_days": days,
-            "total": total,
-            "unread": unread,
-            "unresolved": unresolved,
-            "critical": critical,
-            "by_severity": {s["_id"]: s["count"] for s in severity_stats},
-            "by_component": {c["_id"]: c["count"] for c in component_stats},
-            "by_type": {t["_id"]: t["count"] for t in type_stats},
-            "daily": [{"date": d["_id"], "count": d["count"]} for d in daily_stats]
+            "total": 0,
+            "fingerprints": len(groups),
+            "unread": 0,
+            "unresolved": 0,
+            "critical": 0,
+            "by_severity": {},
+            "by_component": {},
+            "by_type": {}
         }
+        daily: Dict[str, int] = {}
+        for group in groups:
+            count = occurrences_since(group, cutoff_date)
+            if not count:
+                continue
+            stats["total"] += count
+            if not group.get("read"):
+                stats["unread"] += count
+            if not group.get("resolved"):
+                stats["unresolved"] += count
+            if group.get("severity") == "critical":
+                stats["critical"] += count
+            for field, key in (("by_severity", "severity"), ("by_component", "component"), ("by_type", "type")):
+                value = group.get(key)
+                stats[field][value] = stats[field].get(value, 0) + count
+            for date, date_count in daily_counts(group).items():
+                if date >= cutoff_date:
+                    daily[date] = daily.get(date, 0) + date_count
+        
+        for field in ("by_severity", "by_component", "by_type"):
+            stats[field] = dict(sorted(stats[field].items(), key=lambda item: item[1], reverse=True))
+        stats["daily"] = [{"date": date, "count": daily[date]} for date in sorted(daily)]
+        return stats
     
     async def cleanup_old_errors(self, days: int = 90) -> int:
         """Remove erros antigos (mais de X dias)."""
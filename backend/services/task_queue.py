@@ -20,11 +20,25 @@ Uso:
     # Sincronizar com Trello
     await task_queue.sync_trello(process_id)
 
+As tarefas são guardadas em Redis e consumidas pelo worker
+(services/task_worker.py) com semântica de fila fiável:
+- claim atómico (fila -> lista `processing` + lease com visibility timeout);
+- tarefas de workers que morreram são reentregues quando o lease expira;
+- falhas voltam à fila com atraso exponencial até `max_attempts`,
+  depois vão para uma lista dead-letter;
+- espera bloqueante (BLPOP) em vez de polling;
+- profundidade e latência por tipo em `get_queue_stats()`.
+
 ====================================================================
 """
+import json
+import time
+import uuid
+import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List
 
 from arq import create_pool
 from arq.connections import ArqRedis
@@ -34,6 +48,87 @@ from config import get_redis_settings
 logger = logging.getLogger(__name__)
 
 
+KEY_PREFIX = "creditoimo:tq"
+TASK_TTL_SECONDS = 7 * 24 * 3600
+NOTIFY_MAX_TOKENS = 1000
+DEAD_LETTER_MAX = 1000
+LATENCY_SAMPLES = 500
+RETRY_BASE_DELAY = 10
+
+# Configuração por tipo de tarefa (concorrência no worker, visibility
+# timeout do lease em segundos e número máximo de tentativas).
+# A concorrência pode ser alterada com WORKER_CONCURRENCY_<TIPO>.
+DEFAULT_TASK_CONFIG = {"concurrency": 2, "visibility_timeout": 300, "max_attempts": 3}
+TASK_TYPE_CONFIG = {
+    "scrape_property": {"concurrency": 4, "visibility_timeout": 120},
+    "send_email_task": {"concurrency": 8, "visibility_timeout": 60, "max_attempts": 5},
+    "send_registration_email_task": {"concurrency": 4, "visibility_timeout": 60, "max_attempts": 5},
+    "sync_trello_task": {"concurrency": 1, "visibility_timeout": 900},
+    "process_ai_document_task": {"concurrency": 3, "visibility_timeout": 600},
+    "match_leads": {"concurrency": 1, "visibility_timeout": 600, "max_attempts": 1},
+}
+
+# Fila -> processing + lease, numa única operação atómica
+CLAIM_SCRIPT = """
+local id = redis.call('RPOPLPUSH', KEYS[1], KEYS[2])
+if id then
+    redis.call('ZADD', KEYS[3], ARGV[1], id)
+end
+return id
+"""
+
+# Reentregar uma tarefa apenas se o lease continuar expirado
+REQUEUE_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[2])
+if score and tonumber(score) <= tonumber(ARGV[1]) then
+    redis.call('ZREM', KEYS[1], ARGV[2])
+    redis.call('LREM', KEYS[2], 0, ARGV[2])
+    redis.call('RPUSH', KEYS[3], ARGV[2])
+    redis.call('LPUSH', KEYS[4], 1)
+    return 1
+end
+return 0
+"""
+
+
+def get_task_config(task_type: str) -> Dict[str, int]:
+    """Configuração efectiva de um tipo de tarefa."""
+    config = {**DEFAULT_TASK_CONFIG, **TASK_TYPE_CONFIG.get(task_type, {})}
+    override = os.environ.get(f"WORKER_CONCURRENCY_{task_type.upper()}")
+    if override:
+        config["concurrency"] = int(override)
+    return config
+
+
+def _key(*parts: str) -> str:
+    return ":".join((KEY_PREFIX, *parts))
+
+
+def _task_key(task_id: str) -> str:
+    return _key("task", task_id)
+
+
+def _dump(task: Dict[str, Any]) -> str:
+    return json.dumps(task, default=str)
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _stage_release(pipe, task_type: str, task_id: str):
+    """Retirar a tarefa da lista `processing` e do lease (numa pipeline)."""
+    pipe.lrem(_key("processing", task_type), 0, task_id)
+    pipe.zrem(_key("leases", task_type), task_id)
+
+
+def _percentile(sorted_values: List[int], pct: int) -> Optional[int]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
 class TaskQueueService:
     """
     Serviço de fila de tarefas.
@@ -92,30 +187,272 @@ class TaskQueueService:
         **kwargs
     ) -> Optional[str]:
         """
-        Enfileira uma tarefa genérica.
+        Enfileira uma tarefa genérica (tipo = `function_name`).
+        Os argumentos nomeados formam o payload entregue ao handler.
         
         Returns:
             Job ID se sucesso, None se falhar
         """
+        if args:
+            kwargs.setdefault("args", list(args))
         if not await self._ensure_connected():
             logger.warning(f"Task Queue não disponível, executando {function_name} localmente")
             return None
         
+        task_type = queue_name or function_name
+        now = datetime.now(timezone.utc)
+        run_at = defer_until or (now + defer_by if defer_by else None)
+        task = {
+            "id": str(uuid.uuid4()),
+            "type": task_type,
+            "payload": kwargs,
+            "status": "pending",
+            "attempts": 0,
+            "enqueued_at": now.isoformat(),
+            "run_at": run_at.isoformat() if run_at else None
+        }
+        
         try:
-            job = await self._pool.enqueue_job(
-                function_name,
-                *args,
-                _queue_name=queue_name,
-                _defer_by=defer_by,
-                _defer_until=defer_until,
-                **kwargs
-            )
-            logger.info(f"📤 Tarefa enfileirada: {function_name} (job={job.job_id})")
-            return job.job_id
+            pipe = self._pool.pipeline(transaction=True)
+            pipe.set(_task_key(task["id"]), _dump(task), ex=TASK_TTL_SECONDS)
+            if run_at and run_at > now:
+                pipe.zadd(_key("delayed"), {task["id"]: run_at.timestamp()})
+            else:
+                pipe.lpush(_key("queue", task_type), task["id"])
+                pipe.lpush(_key("notify", task_type), 1)
+                pipe.ltrim(_key("notify", task_type), 0, NOTIFY_MAX_TOKENS - 1)
+            await pipe.execute()
+            logger.info(f"📤 Tarefa enfileirada: {task_type} (job={task['id']})")
+            return task["id"]
         except Exception as e:
             logger.error(f"❌ Erro ao enfileirar {function_name}: {str(e)}")
             return None
     
+    async def add_task(self, task_type: str, payload: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Enfileira uma tarefa com payload em dicionário."""
+        return await self.enqueue(task_type, **(payload or {}))
+    
+    # ================================================================
+    # CONSUMO: CLAIM, LEASE E CONFIRMAÇÃO
+    # ================================================================
+    
+    async def _load_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self._pool.get(_task_key(task_id))
+        return json.loads(raw) if raw else None
+    
+    async def _save_task(self, task: Dict[str, Any]):
+        await self._pool.set(_task_key(task["id"]), _dump(task), ex=TASK_TTL_SECONDS)
+    
+    async def claim(self, task_type: str) -> Optional[Dict[str, Any]]:
+        """
+        Reclamar atomicamente a próxima tarefa de um tipo.
+        A tarefa passa para a lista `processing` com um lease que expira
+        após o visibility timeout; se o worker morrer, é reentregue.
+        """
+        if not await self._ensure_connected():
+            return None
+        
+        config = get_task_config(task_type)
+        deadline = time.time() + config["visibility_timeout"]
+        task_id = await self._pool.eval(
+            CLAIM_SCRIPT, 3,
+            _key("queue", task_type), _key("processing", task_type), _key("leases", task_type),
+            deadline
+        )
+        if not task_id:
+            return None
+        task_id = _decode(task_id)
+        
+        task = await self._load_task(task_id)
+        if not task:
+            # Tarefa expirada ou removida - descartar a entrada órfã
+            await self._release(task_type, task_id)
+            return None
+        
+        now = datetime.now(timezone.utc)
+        task["attempts"] = task.get("attempts", 0) + 1
+        task["status"] = "processing"
+        task["claimed_at"] = now.isoformat()
+        
+        # Entregas a mais (ex: worker morre repetidamente) vão para dead-letter
+        if task["attempts"] > config["max_attempts"]:
+            task["status"] = "dead"
+            task["error"] = task.get("error") or "Número máximo de tentativas excedido"
+            await self._finish(task, dead=True)
+            return None
+        
+        await self._save_task(task)
+        return task
+    
+    async def wait_for_task(self, task_type: str, timeout: int = 5) -> bool:
+        """Esperar (bloqueante, sem polling) por um aviso de nova tarefa."""
+        if not await self._ensure_connected():
+            await asyncio.sleep(timeout)
+            return False
+        result = await self._pool.blpop(_key("notify", task_type), timeout=timeout)
+        return result is not None
+    
+    async def extend_lease(self, task: Dict[str, Any]) -> None:
+        """Renovar o lease de uma tarefa em execução (heartbeat)."""
+        config = get_task_config(task["type"])
+        await self._pool.zadd(
+            _key("leases", task["type"]),
+            {task["id"]: time.time() + config["visibility_timeout"]},
+            xx=True
+        )
+    
+    async def _release(self, task_type: str, task_id: str):
+        pipe = self._pool.pipeline(transaction=True)
+        _stage_release(pipe, task_type, task_id)
+        await pipe.execute()
+    
+    async def _finish(self, task: Dict[str, Any], dead: bool = False):
+        pipe = self._pool.pipeline(transaction=True)
+        _stage_release(pipe, task["type"], task["id"])
+        if dead:
+            pipe.lpush(_key("dead", task["type"]), task["id"])
+            pipe.ltrim(_key("dead", task["type"]), 0, DEAD_LETTER_MAX - 1)
+            pipe.hincrby(_key("stats", task["type"]), "dead", 1)
+        pipe.set(_task_key(task["id"]), _dump(task), ex=TASK_TTL_SECONDS)
+        await pipe.execute()
+    
+    def _stage_latency(self, task: Dict[str, Any], pipe):
+        """Registar tempo em fila e tempo de execução por tipo."""
+        enqueued = datetime.fromisoformat(task.get("run_at") or task["enqueued_at"])
+        claimed = datetime.fromisoformat(task["claimed_at"])
+        finished = datetime.fromisoformat(task["finished_at"])
+        wait_ms = max(0, int((claimed - enqueued).total_seconds() * 1000))
+        run_ms = max(0, int((finished - claimed).total_seconds() * 1000))
+        stats_key = _key("stats", task["type"])
+        pipe.hincrby(stats_key, "wait_ms_total", wait_ms)
+        pipe.hincrby(stats_key, "run_ms_total", run_ms)
+        pipe.lpush(_key("latency", task["type"]), wait_ms)
+        pipe.ltrim(_key("latency", task["type"]), 0, LATENCY_SAMPLES - 1)
+    
+    async def complete_task(self, task_id: str, result: Any = None, task: Optional[Dict[str, Any]] = None) -> None:
+        """Confirmar a conclusão de uma tarefa (remove o lease)."""
+        task = task or await self._load_task(task_id)
+        if not task:
+            return
+        task["status"] = "complete"
+        task["result"] = result
+        task["finished_at"] = datetime.now(timezone.utc).isoformat()
+        
+        pipe = self._pool.pipeline(transaction=True)
+        _stage_release(pipe, task["type"], task_id)
+        pipe.hincrby(_key("stats", task["type"]), "completed", 1)
+        self._stage_latency(task, pipe)
+        pipe.set(_task_key(task_id), _dump(task), ex=TASK_TTL_SECONDS)
+        await pipe.execute()
+    
+    async def fail_task(self, task_id: str, error: str = None, task: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Registar falha: volta à fila (com atraso exponencial) enquanto
+        houver tentativas, depois vai para a lista dead-letter.
+        """
+        task = task or await self._load_task(task_id)
+        if not task:
+            return
+        config = get_task_config(task["type"])
+        task["error"] = error
+        task["finished_at"] = datetime.now(timezone.utc).isoformat()
+        
+        if task.get("attempts", 0) >= config["max_attempts"]:
+            task["status"] = "dead"
+            await self._finish(task, dead=True)
+            logger.error(f"Tarefa {task_id} ({task['type']}) movida para dead-letter: {error}")
+            return
+        
+        retry_at = time.time() + RETRY_BASE_DELAY * (2 ** (task.get("attempts", 1) - 1))
+        task["status"] = "retrying"
+        pipe = self._pool.pipeline(transaction=True)
+        _stage_release(pipe, task["type"], task_id)
+        pipe.hincrby(_key("stats", task["type"]), "failed", 1)
+        pipe.zadd(_key("delayed"), {task_id: retry_at})
+        pipe.set(_task_key(task_id), _dump(task), ex=TASK_TTL_SECONDS)
+        await pipe.execute()
+    
+    async def requeue_expired(self, task_types: List[str]) -> int:
+        """Reentregar tarefas cujo lease expirou (worker morreu ou bloqueou)."""
+        if not await self._ensure_connected():
+            return 0
+        now = time.time()
+        requeued = 0
+        for task_type in task_types:
+            expired = await self._pool.zrangebyscore(_key("leases", task_type), "-inf", now)
+            for task_id in expired:
+                requeued += await self._pool.eval(
+                    REQUEUE_SCRIPT, 4,
+                    _key("leases", task_type), _key("processing", task_type),
+                    _key("queue", task_type), _key("notify", task_type),
+                    now, task_id
+                )
+        if requeued:
+            logger.warning(f"{requeued} tarefas com lease expirado reentregues")
+        return requeued
+    
+    async def promote_delayed(self) -> int:
+        """Mover para a fila as tarefas agendadas/em retry cuja hora chegou."""
+        if not await self._ensure_connected():
+            return 0
+        due = await self._pool.zrangebyscore(_key("delayed"), "-inf", time.time())
+        promoted = 0
+        for task_id in due:
+            # ZREM garante que só um worker promove cada tarefa
+            if not await self._pool.zrem(_key("delayed"), task_id):
+                continue
+            task_id = _decode(task_id)
+            task = await self._load_task(task_id)
+            if not task:
+                continue
+            pipe = self._pool.pipeline(transaction=True)
+            pipe.lpush(_key("queue", task["type"]), task_id)
+            pipe.lpush(_key("notify", task["type"]), 1)
+            pipe.ltrim(_key("notify", task["type"]), 0, NOTIFY_MAX_TOKENS - 1)
+            await pipe.execute()
+            promoted += 1
+        return promoted
+    
+    async def get_queue_stats(self, task_types: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Profundidade, em execução, dead-letter e latência (p50/p95) por tipo."""
+        if not await self._ensure_connected():
+            return {}
+        stats = {}
+        for task_type in task_types or list(TASK_TYPE_CONFIG):
+            pipe = self._pool.pipeline(transaction=False)
+            pipe.llen(_key("queue", task_type))
+            pipe.llen(_key("processing", task_type))
+            pipe.llen(_key("dead", task_type))
+            pipe.hgetall(_key("stats", task_type))
+            pipe.lrange(_key("latency", task_type), 0, -1)
+            pipe.lindex(_key("queue", task_type), -1)
+            depth, in_flight, dead, counters, samples, oldest_id = await pipe.execute()
+            
+            counters = {_decode(k): int(v) for k, v in (counters or {}).items()}
+            waits = sorted(int(v) for v in samples or [])
+            completed = counters.get("completed", 0)
+            
+            oldest_age = None
+            if oldest_id:
+                oldest = await self._load_task(_decode(oldest_id))
+                if oldest:
+                    enqueued = datetime.fromisoformat(oldest.get("run_at") or oldest["enqueued_at"])
+                    oldest_age = round((datetime.now(timezone.utc) - enqueued).total_seconds(), 1)
+            
+            stats[task_type] = {
+                "depth": depth,
+                "in_flight": in_flight,
+                "dead": dead,
+                "completed": completed,
+                "failed": counters.get("failed", 0),
+                "oldest_pending_seconds": oldest_age,
+                "wait_ms_p50": _percentile(waits, 50),
+                "wait_ms_p95": _percentile(waits, 95),
+                "avg_run_ms": round(counters.get("run_ms_total", 0) / completed) if completed else None,
+                "concurrency": get_task_config(task_type)["concurrency"]
+            }
+        return stats
+    
     # ================================================================
     # MÉTODOS DE CONVENIÊNCIA - EMAIL
     # ================================================================
@@ -221,7 +558,8 @@ class TaskQueueService:
                 "redis": True,
                 "redis_version": info.get("redis_version", "unknown"),
                 "connected_clients": info.get("connected_clients", 0),
-                "used_memory": info.get("used_memory_human", "unknown")
+                "used_memory": info.get("used_memory_human", "unknown"),
+                "queues": await self.get_queue_stats()
             }
             
         except Exception as e:
@@ -237,15 +575,16 @@ class TaskQueueService:
             return None
         
         try:
-            from arq.jobs import Job
-            job = Job(job_id, self._pool)
-            status = await job.status()
-            result = await job.result(timeout=0)
-            
+            task = await self._load_task(job_id)
+            if not task:
+                return None
             return {
                 "job_id": job_id,
-                "status": status.name if status else "unknown",
-                "result": result
+                "type": task["type"],
+                "status": task["status"],
+                "attempts": task.get("attempts", 0),
+                "result": task.get("result"),
+                "error": task.get("error")
             }
         except Exception as e:
             logger.error(f"Erro ao obter status do job {job_id}: {str(e)}")
@@ -0,0 +1,123 @@
+"""
+====================================================================
+EXECUTOR DE TAREFAS DA FILA - CREDITOIMO
+====================================================================
+Consome a fila de services/task_queue.py com concorrência configurável
+por tipo de tarefa (ver TASK_TYPE_CONFIG / WORKER_CONCURRENCY_<TIPO>).
+
+Cada consumidor:
+1. reclama atomicamente a próxima tarefa do seu tipo (com lease);
+2. se a fila está vazia, espera de forma bloqueante por novas tarefas;
+3. renova o lease periodicamente enquanto o handler corre;
+4. confirma (complete) ou regista a falha (retry / dead-letter).
+
+Um ciclo de manutenção reentrega tarefas com lease expirado e
+promove tarefas adiadas cuja hora chegou.
+====================================================================
+"""
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+from services.task_queue import task_queue, get_task_config
+
+logger = logging.getLogger(__name__)
+
+
+MAINTENANCE_INTERVAL_SECONDS = 15
+IDLE_WAIT_SECONDS = 5
+
+
+class TaskWorkerPool:
+    """Conjunto de consumidores da fila, agrupados por tipo de tarefa."""
+
+    def __init__(self, queue=task_queue):
+        self.queue = queue
+        self.handlers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def register(self, task_type: str, handler: Callable[..., Awaitable[Any]]):
+        """Registar o handler de um tipo; recebe o payload como kwargs."""
+        self.handlers[task_type] = handler
+
+    async def _heartbeat(self, task: dict):
+        interval = max(1, get_task_config(task["type"])["visibility_timeout"] / 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.queue.extend_lease(task)
+            except Exception as e:
+                logger.warning(f"Erro ao renovar lease da tarefa {task['id']}: {e}")
+
+    async def process(self, task: dict):
+        """Executar uma tarefa reclamada e confirmar o resultado."""
+        task_id = task["id"]
+        handler = self.handlers[task["type"]]
+        logger.info(f"Processando tarefa {task_id} ({task['type']}, tentativa {task['attempts']})")
+
+        heartbeat = asyncio.create_task(self._heartbeat(task))
+        start_time = time.time()
+        try:
+            result = await handler(**task.get("payload", {}))
+        except asyncio.CancelledError:
+            # Worker a terminar: o lease expira e a tarefa é reentregue
+            raise
+        except Exception as e:
+            logger.error(f"Erro ao processar tarefa {task_id}: {e}", exc_info=True)
+            await self.queue.fail_task(task_id, error=str(e), task=task)
+            return
+        finally:
+            heartbeat.cancel()
+
+        await self.queue.complete_task(task_id, result=result, task=task)
+        logger.info(f"Tarefa {task_id} concluída em {time.time() - start_time:.2f}s")
+
+    async def _consumer(self, task_type: str, shutdown_event: asyncio.Event):
+        while not shutdown_event.is_set():
+            try:
+                task = await self.queue.claim(task_type)
+                if task:
+                    await self.process(task)
+                else:
+                    await self.queue.wait_for_task(task_type, timeout=IDLE_WAIT_SECONDS)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Erro no consumidor {task_type}: {e}")
+                await asyncio.sleep(IDLE_WAIT_SECONDS)
+
+    async def _maintenance(self, shutdown_event: asyncio.Event):
+        task_types = list(self.handlers)
+        while not shutdown_event.is_set():
+            try:
+                await self.queue.requeue_expired(task_types)
+                await self.queue.promote_delayed()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Erro na manutenção da fila: {e}")
+            try:
+                await asyncio.wait_for(shutdown_event.wait(), timeout=MAINTENANCE_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, shutdown_event: asyncio.Event):
+        """Arrancar consumidores e manutenção até `shutdown_event`."""
+        for task_type in self.handlers:
+            concurrency = get_task_config(task_type)["concurrency"]
+            for _ in range(concurrency):
+                self._tasks.append(asyncio.create_task(self._consumer(task_type, shutdown_event)))
+            logger.info(f"Consumidores {task_type}: {concurrency}")
+        self._tasks.append(asyncio.create_task(self._maintenance(shutdown_event)))
+
+        try:
+            await shutdown_event.wait()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
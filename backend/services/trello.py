@@ -163,7 +163,44 @@ class TrelloService:
                 card["comments"] = []
         
         return cards
-    
+
+    async def get_cards_with_members(self) -> List[Dict]:
+        """Obter todos os cards abertos do board com membros (sem comentários)."""
+        return await self._request(
+            "GET",
+            f"/boards/{self.board_id}/cards",
+            params={"fields": "all", "members": "true"}
+        )
+
+    async def get_board_actions(self, since: str = None, before: str = None,
+                                filter: str = "all", limit: int = 1000) -> List[Dict]:
+        """
+        Obter ações do board (mais recentes primeiro).
+        `since`/`before` aceitam ID de ação ou data ISO.
+        """
+        params = {"filter": filter, "limit": limit}
+        if since:
+            params["since"] = since
+        if before:
+            params["before"] = before
+        return await self._request("GET", f"/boards/{self.board_id}/actions", params=params)
+
+    async def get_cards_batch(self, card_ids: List[str]) -> List[Dict]:
+        """
+        Obter vários cards (com membros) via /batch, 10 por pedido.
+        Cards inexistentes (eliminados) são omitidos.
+        """
+        cards = []
+        for i in range(0, len(card_ids), 10):
+            chunk = card_ids[i:i + 10]
+            urls = ",".join(f"/cards/{card_id}?members=true" for card_id in chunk)
+            responses = await self._request("GET", "/batch", params={"urls": urls})
+            for response in responses or []:
+                card = response.get("200") if isinstance(response, dict) else None
+                if card:
+                    cards.append(card)
+        return cards
+
     # === Webhooks ===
     
     async def create_webhook(self, callback_url: str, id_model: str = None, 
@@ -0,0 +1,241 @@
+"""
+====================================================================
+EXPORTAÇÃO PARA O TRELLO (EM LOTE) - CREDITOIMO
+====================================================================
+Envio de processos para cards do Trello com:
+
+- Diff por campo: o estado desejado do card (nome, descrição de
+  `build_card_description`, lista) é comparado com os hashes do último
+  envio (`processes.trello_push_hashes`); só os campos alterados são
+  enviados e cards sem alterações não geram pedidos.
+- Orçamento de pedidos (token bucket) partilhado por todos os envios,
+  abaixo do limite do Trello (100 pedidos / 10s por token), com backoff
+  nas respostas 429 (respeita `Retry-After`).
+- Envios concorrentes limitados por TRELLO_PUSH_CONCURRENCY.
+- `trello_push_queue.enqueue(process_id)` agrupa actualizações e envia
+  em background: as rotas de processos respondem de imediato.
+====================================================================
+"""
+import os
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+
+import httpx
+from pymongo import UpdateOne
+
+from database import db
+from services.trello import trello_service, status_to_trello_list, build_card_description
+
+logger = logging.getLogger(__name__)
+
+
+TRELLO_RATE_PER_SECOND = float(os.environ.get("TRELLO_RATE_PER_SECOND", "9"))
+TRELLO_RATE_BURST = int(os.environ.get("TRELLO_RATE_BURST", "10"))
+TRELLO_PUSH_CONCURRENCY = int(os.environ.get("TRELLO_PUSH_CONCURRENCY", "4"))
+FLUSH_DELAY_SECONDS = 1.0
+MAX_RATE_LIMIT_RETRIES = 5
+BACKOFF_BASE_SECONDS = 2.0
+
+CARD_FIELDS = ("name", "desc", "idList")
+
+
+class TokenBucket:
+    """Limitador de pedidos: `rate` por segundo com rajadas até `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Suspender todos os pedidos (após um 429)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+def desired_card_state(process: dict, list_id: Optional[str]) -> Dict[str, str]:
+    """Estado do card que o processo deve ter no Trello."""
+    state = {
+        "name": process.get("client_name") or "Sem nome",
+        "desc": build_card_description(process),
+    }
+    if list_id:
+        state["idList"] = list_id
+    return state
+
+
+def _hash(value: str) -> str:
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+def diff_card_state(state: Dict[str, str], pushed_hashes: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """Campos do estado desejado cujo hash difere do último envio."""
+    pushed_hashes = pushed_hashes or {}
+    return {
+        field: value for field, value in state.items()
+        if pushed_hashes.get(field) != _hash(value)
+    }
+
+
+def state_hashes(state: Dict[str, str]) -> Dict[str, str]:
+    return {field: _hash(value) for field, value in state.items()}
+
+
+class TrelloPushQueue:
+    """Fila de exportação processos → Trello."""
+
+    def __init__(self, service=trello_service):
+        self.service = service
+        self.bucket = TokenBucket(TRELLO_RATE_PER_SECOND, TRELLO_RATE_BURST)
+        self._pending: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def _call(self, func, *args, **kwargs):
+        """Pedido ao Trello dentro do orçamento, com backoff em 429."""
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            await self.bucket.acquire()
+            try:
+                return await func(*args, **kwargs)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                retry_after = e.response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after else BACKOFF_BASE_SECONDS * (2 ** attempt)
+                delay += random.uniform(0, 0.5)
+                logger.warning(f"Trello 429: a aguardar {delay:.1f}s (tentativa {attempt + 1})")
+                self.bucket.pause(delay)
+
+    async def _list_ids(self) -> Dict[str, str]:
+        lists = await self._call(self.service.get_lists)
+        return {l["name"].lower().strip(): l["id"] for l in lists}
+
+    async def _push_one(self, process: dict, list_ids: Dict[str, str],
+                        create_missing: bool, stats: dict) -> Optional[UpdateOne]:
+        status = process.get("status", "clientes_espera")
+        trello_list_name = status_to_trello_list(status)
+        list_id = list_ids.get(trello_list_name.lower()) if trello_list_name else None
+        if create_missing and not trello_list_name:
+            stats["errors"].append(f"Status não mapeado: {status}")
+            return None
+        if create_missing and not list_id:
+            stats["errors"].append(f"Lista não encontrada no Trello: {trello_list_name}")
+            return None
+
+        state = desired_card_state(process, list_id)
+        card_id = process.get("trello_card_id")
+        now = datetime.now(timezone.utc).isoformat()
+
+        if card_id:
+            changes = diff_card_state(state, process.get("trello_push_hashes"))
+            if not changes:
+                stats["unchanged"] += 1
+                return None
+            try:
+                await self._call(self.service.update_card, card_id, **changes)
+                stats["updated"] += 1
+                return UpdateOne(
+                    {"id": process["id"]},
+                    {"$set": {"trello_push_hashes": state_hashes(state), "trello_pushed_at": now}}
+                )
+            except httpx.HTTPStatusError as e:
+                # Card eliminado no Trello: recriar apenas na exportação completa
+                if e.response.status_code != 404 or not create_missing:
+                    raise
+
+        if not create_missing or not list_id:
+            return None
+        card = await self._call(
+            self.service.create_card, list_id=list_id, name=state["name"], desc=state["desc"]
+        )
+        stats["created"] += 1
+        return UpdateOne(
+            {"id": process["id"]},
+            {"$set": {
+                "trello_card_id": card["id"],
+                "trello_list_id": list_id,
+                "trello_push_hashes": state_hashes(state),
+                "trello_pushed_at": now
+            }}
+        )
+
+    async def push_processes(self, processes: List[dict], create_missing: bool = False) -> dict:
+        """
+        Enviar processos para o Trello (concorrente, dentro do orçamento).
+        `create_missing` cria cards para processos sem card (ou com card eliminado).
+        """
+        stats = {"created": 0, "updated": 0, "unchanged": 0, "errors": []}
+        if not processes:
+            return stats
+        list_ids = await self._list_ids()
+        semaphore = asyncio.Semaphore(TRELLO_PUSH_CONCURRENCY)
+
+        async def push(process: dict):
+            async with semaphore:
+                try:
+                    return await self._push_one(process, list_ids, create_missing, stats)
+                except Exception as e:
+                    stats["errors"].append(f"Erro no processo {process.get('client_name', 'N/A')}: {str(e)}")
+                    return None
+
+        ops = [op for op in await asyncio.gather(*(push(p) for p in processes)) if op]
+        if ops:
+            await db.processes.bulk_write(ops, ordered=False)
+        return stats
+
+    def enqueue(self, process_id: str) -> bool:
+        """Agendar o envio de um processo com card; devolve logo."""
+        if not self.service.api_key:
+            return False
+        self._pending.add(process_id)
+        if not self._flush_task or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+        return True
+
+    async def _flush_soon(self):
+        # Pequena espera para agrupar actualizações seguidas do mesmo processo
+        await asyncio.sleep(FLUSH_DELAY_SECONDS)
+        while self._pending:
+            process_ids = list(self._pending)
+            self._pending.clear()
+            try:
+                processes = await db.processes.find(
+                    {"id": {"$in": process_ids}, "trello_card_id": {"$nin": [None, ""]}},
+                    {"_id": 0}
+                ).to_list(None)
+                stats = await self.push_processes(processes)
+                for error in stats["errors"]:
+                    logger.error(f"Erro ao sincronizar com Trello: {error}")
+                if stats["updated"]:
+                    logger.info(f"Trello: {stats['updated']} cards atualizados")
+            except Exception as e:
+                logger.error(f"Erro ao enviar processos para o Trello: {e}")
+
+    async def drain(self):
+        """Aguardar o envio pendente (testes / encerramento)."""
+        if self._flush_task and not self._flush_task.done():
+            await self._flush_task
+
+
+trello_push_queue = TrelloPushQueue()
@@ -0,0 +1,383 @@
+"""
+====================================================================
+SINCRONIZAÇÃO INCREMENTAL TRELLO → CREDITOIMO
+====================================================================
+Motor de importação de cards do Trello para processos.
+
+- Incremental (por omissão): lê as ações do board desde o cursor
+  guardado em `settings.trello_last_sync.action_cursor` (ID da última
+  ação aplicada), obtém só os cards tocados via /batch e aplica o
+  estado actual de cada um.
+- Reconciliação completa: percorre todos os cards do board. Só corre a
+  pedido, quando ainda não existe cursor, ou quando o volume de ações
+  pendentes excede MAX_ACTION_PAGES.
+
+Em ambos os modos os processos existentes e os mapeamentos de membros
+são pré-carregados com uma única query `$in` cada, e as alterações são
+gravadas com `bulk_write`.
+====================================================================
+"""
+import uuid
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import InsertOne, UpdateOne, UpdateMany
+
+from database import db
+from services.trello import (
+    trello_service, trello_list_to_status,
+    parse_card_description, clean_email
+)
+from services.process_service import sync_client_key
+
+logger = logging.getLogger(__name__)
+
+
+CARD_ACTION_TYPES = [
+    "createCard", "updateCard", "deleteCard", "moveCardToBoard",
+    "addMemberToCard", "removeMemberFromCard",
+]
+ACTIONS_PAGE_SIZE = 1000
+MAX_ACTION_PAGES = 10
+BULK_CHUNK_SIZE = 500
+
+CONSULTOR_ROLES = ["consultor", "diretor", "admin", "ceo"]
+MEDIADOR_ROLES = ["mediador", "intermediario", "intermediario_credito", "diretor"]
+
+PROCESS_PROJECTION = {
+    "_id": 0, "id": 1, "client_name": 1, "status": 1, "trello_card_id": 1,
+    "assigned_consultor_id": 1, "assigned_mediador_id": 1,
+}
+
+
+# ====================================================================
+# CORRESPONDÊNCIA DE MEMBROS
+# ====================================================================
+
+class MemberMatcher:
+    """
+    Correspondência membros Trello → utilizadores, com mapeamentos e
+    utilizadores carregados uma única vez.
+
+    Ordem de prioridade:
+    1. Mapeamento manual (`trello_member_mappings`)
+    2. Username do Trello corresponde à parte local do email
+    3. Email exacto
+    4. Nome exacto (case-insensitive)
+    """
+
+    def __init__(self, manual_mappings: List[dict], users: List[dict]):
+        self.manual_map = {m["trello_username"].lower(): m["user_id"] for m in manual_mappings}
+        self.users_by_id = {u["id"]: u for u in users}
+        self.users_by_email = {u.get("email", "").lower().strip(): u for u in users if u.get("email")}
+        self.users_by_name = {u["name"].lower().strip(): u for u in users}
+        self.users_by_email_local = {}
+        for u in users:
+            if u.get("email") and "@" in u["email"]:
+                self.users_by_email_local[u["email"].split("@")[0].lower().strip()] = u
+
+    def _match_member(self, member: dict) -> Tuple[Optional[dict], Optional[str]]:
+        member_name = member.get("fullName", "").lower().strip()
+        member_username = member.get("username", "").lower().strip()
+        member_email = member.get("email", "").lower().strip()
+
+        if member_username in self.manual_map:
+            user = self.users_by_id.get(self.manual_map[member_username])
+            if user:
+                return user, "manual"
+
+        if member_username:
+            username_clean = ''.join(c for c in member_username if not c.isdigit())
+            for local_part, user in self.users_by_email_local.items():
+                if member_username.startswith(local_part) or local_part.startswith(username_clean):
+                    return user, "email_local"
+
+        if member_email and member_email in self.users_by_email:
+            return self.users_by_email[member_email], "email_exact"
+
+        if member_name and member_name in self.users_by_name:
+            return self.users_by_name[member_name], "name"
+
+        return None, None
+
+    def match(self, trello_members: list) -> dict:
+        """Devolve assigned_consultor_id/assigned_mediador_id (e nomes) para os membros."""
+        result = {
+            "assigned_consultor_id": None,
+            "assigned_mediador_id": None,
+            "consultor_name": None,
+            "mediador_name": None,
+            "matched_members": []
+        }
+
+        for member in trello_members or []:
+            matched_user, match_method = self._match_member(member)
+            if not matched_user:
+                continue
+
+            result["matched_members"].append({
+                "trello_member": member.get("fullName"),
+                "trello_email": member.get("email", "").lower().strip() or member.get("username", "").lower().strip(),
+                "matched_user": matched_user["name"],
+                "matched_email": matched_user.get("email"),
+                "role": matched_user["role"],
+                "match_method": match_method
+            })
+
+            role = matched_user["role"]
+            if role in CONSULTOR_ROLES and not result["assigned_consultor_id"]:
+                result["assigned_consultor_id"] = matched_user["id"]
+                result["consultor_name"] = matched_user["name"]
+            if role in MEDIADOR_ROLES and not result["assigned_mediador_id"]:
+                result["assigned_mediador_id"] = matched_user["id"]
+                result["mediador_name"] = matched_user["name"]
+
+        return result
+
+
+async def load_member_matcher() -> MemberMatcher:
+    """Carregar mapeamentos manuais e utilizadores activos."""
+    manual_mappings = await db.trello_member_mappings.find({}, {"_id": 0}).to_list(None)
+    users = await db.users.find(
+        {"is_active": {"$ne": False}},
+        {"_id": 0, "id": 1, "name": 1, "email": 1, "role": 1}
+    ).to_list(None)
+    return MemberMatcher(manual_mappings, users)
+
+
+# ====================================================================
+# PLANEAMENTO DAS ALTERAÇÕES
+# ====================================================================
+
+def _member_names(trello_members: list) -> List[str]:
+    return [m.get("fullName") for m in trello_members if m.get("fullName")]
+
+
+def plan_card_changes(cards: List[dict], list_names: Dict[str, str],
+                      processes: List[dict], matcher: MemberMatcher,
+                      now: str) -> Tuple[List[dict], List[Tuple[str, dict]], dict]:
+    """
+    Calcular as escritas para um conjunto de cards.
+
+    `list_names` mapeia idList → nome da lista; `processes` são os
+    processos já existentes que correspondem aos cards (por
+    trello_card_id ou client_name). Devolve (novos processos,
+    [(process_id, $set)], estatísticas).
+    """
+    stats = {"created": 0, "updated": 0, "assignments": 0, "errors": []}
+    by_card = {p["trello_card_id"]: p for p in processes if p.get("trello_card_id")}
+    by_name = {}
+    for p in processes:
+        by_name.setdefault(p.get("client_name"), p)
+
+    inserts, updates = [], []
+    for card in cards:
+        try:
+            if card.get("closed"):
+                continue
+            list_name = list_names.get(card.get("idList"))
+            if list_name is None:
+                continue
+            status = trello_list_to_status(list_name)
+            if not status:
+                stats["errors"].append(f"Lista não mapeada: {list_name}")
+                continue
+
+            trello_members = card.get("members", [])
+            assignment = matcher.match(trello_members)
+            existing = by_card.get(card["id"]) or by_name.get(card["name"])
+
+            if existing:
+                update_data = {"status": status, "trello_card_id": card["id"]}
+
+                # Atribuir utilizadores só se ainda não houver atribuição
+                if assignment["assigned_consultor_id"] and not existing.get("assigned_consultor_id"):
+                    update_data["assigned_consultor_id"] = assignment["assigned_consultor_id"]
+                    update_data["consultor_name"] = assignment["consultor_name"]
+                    stats["assignments"] += 1
+                if assignment["assigned_mediador_id"] and not existing.get("assigned_mediador_id"):
+                    update_data["assigned_mediador_id"] = assignment["assigned_mediador_id"]
+                    update_data["mediador_name"] = assignment["mediador_name"]
+                    stats["assignments"] += 1
+                if trello_members:
+                    update_data["trello_members"] = _member_names(trello_members)
+
+                if existing.get("status") != status or len(update_data) > 2:
+                    update_data["updated_at"] = now
+                    updates.append((existing["id"], update_data))
+                    existing.update(update_data)
+                    stats["updated"] += 1
+                by_card[card["id"]] = existing
+                continue
+
+            card_data = parse_card_description(card.get("desc", ""))
+            new_process = {
+                "id": str(uuid.uuid4()),
+                "client_name": card["name"],
+                "client_email": clean_email(card_data.get("email", "")),
+                "client_phone": card_data.get("telefone", ""),
+                "status": status,
+                "trello_card_id": card["id"],
+                "trello_list_id": card["idList"],
+                "created_at": now,
+                "updated_at": now,
+                "source": "trello_import",
+                "personal_data": {},
+                "financial_data": {},
+                "real_estate_data": {},
+                "credit_data": {},
+                "assigned_consultor_id": assignment["assigned_consultor_id"],
+                "assigned_mediador_id": assignment["assigned_mediador_id"],
+                "consultor_name": assignment["consultor_name"],
+                "mediador_name": assignment["mediador_name"],
+                "trello_members": _member_names(trello_members),
+            }
+            if assignment["assigned_consultor_id"] or assignment["assigned_mediador_id"]:
+                stats["assignments"] += 1
+            inserts.append(new_process)
+            by_card[card["id"]] = new_process
+            by_name.setdefault(card["name"], new_process)
+            stats["created"] += 1
+
+        except Exception as e:
+            stats["errors"].append(f"Erro no card {card.get('name', 'N/A')}: {str(e)}")
+
+    return inserts, updates, stats
+
+
+def collect_card_changes(actions: List[dict]) -> Tuple[List[str], List[str]]:
+    """
+    Reduzir ações do board aos cards afectados, pela ordem cronológica.
+    Devolve (cards a reler, cards eliminados) — só conta o último estado.
+    """
+    last_state: Dict[str, str] = {}
+    for action in sorted(actions, key=lambda a: a.get("date", "")):
+        card_id = action.get("data", {}).get("card", {}).get("id")
+        if not card_id:
+            continue
+        last_state[card_id] = "deleted" if action.get("type") == "deleteCard" else "changed"
+    changed = [card_id for card_id, state in last_state.items() if state == "changed"]
+    deleted = [card_id for card_id, state in last_state.items() if state == "deleted"]
+    return changed, deleted
+
+
+# ====================================================================
+# MOTOR DE SINCRONIZAÇÃO
+# ====================================================================
+
+class TrelloSyncEngine:
+    """Sincronização Trello → processos, incremental por cursor de ações."""
+
+    def __init__(self, service=trello_service):
+        self.service = service
+
+    async def get_cursor(self) -> Optional[str]:
+        state = await db.settings.find_one({"key": "trello_last_sync"}, {"_id": 0, "action_cursor": 1})
+        return (state or {}).get("action_cursor")
+
+    async def _save_cursor(self, cursor: Optional[str], mode: str, by: str):
+        state = {
+            "key": "trello_last_sync",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "by": by,
+            "type": mode
+        }
+        if cursor:
+            state["action_cursor"] = cursor
+        await db.settings.update_one({"key": "trello_last_sync"}, {"$set": state}, upsert=True)
+
+    async def fetch_actions_since(self, cursor: str) -> Optional[List[dict]]:
+        """
+        Ações de cards posteriores ao cursor (mais recentes primeiro),
+        paginando para trás. None se o volume exceder MAX_ACTION_PAGES.
+        """
+        actions: List[dict] = []
+        before = None
+        for _ in range(MAX_ACTION_PAGES):
+            page = await self.service.get_board_actions(
+                since=cursor, before=before,
+                filter=",".join(CARD_ACTION_TYPES), limit=ACTIONS_PAGE_SIZE
+            ) or []
+            actions.extend(page)
+            if len(page) < ACTIONS_PAGE_SIZE:
+                return actions
+            before = page[-1]["id"]
+        return None
+
+    async def _load_processes(self, cards: List[dict]) -> List[dict]:
+        card_ids = [c["id"] for c in cards]
+        names = [c["name"] for c in cards if c.get("name")]
+        if not card_ids:
+            return []
+        return await db.processes.find(
+            {"$or": [
+                {"trello_card_id": {"$in": card_ids}},
+                {"client_name": {"$in": names}}
+            ]},
+            PROCESS_PROJECTION
+        ).to_list(None)
+
+    async def apply_cards(self, cards: List[dict], deleted_card_ids: List[str] = None) -> dict:
+        """Aplicar o estado actual dos cards (e eliminações) em bulk."""
+        lists = await self.service.get_lists()
+        list_names = {l["id"]: l["name"] for l in lists}
+        matcher = await load_member_matcher()
+        processes = await self._load_processes(cards)
+
+        now = datetime.now(timezone.utc).isoformat()
+        inserts, updates, stats = plan_card_changes(cards, list_names, processes, matcher, now)
+        ops = [InsertOne(doc) for doc in inserts]
+        ops += [UpdateOne({"id": process_id}, {"$set": fields}) for process_id, fields in updates]
+        stats["deleted"] = 0
+        if deleted_card_ids:
+            ops.append(UpdateMany(
+                {"trello_card_id": {"$in": deleted_card_ids}},
+                {"$set": {"trello_deleted": True, "updated_at": now}}
+            ))
+            stats["deleted"] = len(deleted_card_ids)
+
+        for i in range(0, len(ops), BULK_CHUNK_SIZE):
+            await db.processes.bulk_write(ops[i:i + BULK_CHUNK_SIZE], ordered=False)
+        await sync_client_key(*(doc["id"] for doc in inserts))
+        return stats
+
+    async def _latest_action_id(self) -> Optional[str]:
+        latest = await self.service.get_board_actions(limit=1)
+        return latest[0]["id"] if latest else None
+
+    async def full_reconcile(self, by: str) -> dict:
+        """Percorrer todos os cards do board (só a pedido ou sem cursor)."""
+        # Cursor obtido antes da leitura: alterações durante a sync são reaplicadas na próxima
+        cursor = await self._latest_action_id()
+        cards = await self.service.get_cards_with_members()
+        stats = await self.apply_cards(cards)
+        stats.update({"mode": "full", "cards": len(cards)})
+        await self._save_cursor(cursor, "full", by)
+        return stats
+
+    async def sync(self, full: bool = False, by: str = "system") -> dict:
+        """Sincronizar: incremental por omissão, completo se pedido ou necessário."""
+        cursor = None if full else await self.get_cursor()
+        if not cursor:
+            return await self.full_reconcile(by)
+
+        actions = await self.fetch_actions_since(cursor)
+        if actions is None:
+            logger.warning("Demasiadas ações pendentes no Trello, a fazer reconciliação completa")
+            return await self.full_reconcile(by)
+
+        changed, deleted = collect_card_changes(actions)
+        cards = await self.service.get_cards_batch(changed) if changed else []
+        stats = await self.apply_cards(cards, deleted)
+        stats.update({"mode": "incremental", "cards": len(cards), "actions": len(actions)})
+        # Ações vêm da mais recente para a mais antiga
+        await self._save_cursor(actions[0]["id"] if actions else cursor, "incremental", by)
+        logger.info(
+            f"Sync Trello incremental: {len(actions)} ações, {stats['created']} criados, "
+            f"{stats['updated']} atualizados, {stats['deleted']} eliminados"
+        )
+        return stats
+
+
+trello_sync_engine = TrelloSyncEngine()
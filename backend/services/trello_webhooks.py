@@ -0,0 +1,339 @@
+"""
+====================================================================
+PROCESSADOR DE WEBHOOKS TRELLO (COALESCENTE) - CREDITOIMO
+====================================================================
+Ingestão dos webhooks do Trello em duas fases:
+
+1. `ingest(action)` grava a ação em bruto em `trello_webhook_actions`
+   (índice único em `action_id`: reentregas do Trello são ignoradas)
+   e agenda o processamento do card com debounce.
+2. Passada a janela de debounce, `flush_card(card_id)` reclama todas as
+   ações pendentes do card, ordena-as pela data da ação, reduz-as ao
+   estado efectivo final e aplica-o ao processo com uma única escrita.
+
+Ações mais antigas do que a última já aplicada ao processo
+(`trello_last_action_at`) não reescrevem nome/estado/descrição, por isso
+entregas fora de ordem não revertem o card.
+
+O worker corre `process_pending()` a cada minuto para retomar ações de
+réplicas que terminaram antes do debounce expirar.
+====================================================================
+"""
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+from services.trello import trello_list_to_status, parse_card_description, clean_email
+from services.process_service import sync_client_key
+
+logger = logging.getLogger(__name__)
+
+
+TRELLO_WEBHOOK_DEBOUNCE_SECONDS = float(os.environ.get("TRELLO_WEBHOOK_DEBOUNCE_SECONDS", "3"))
+# Um card editado sem parar é processado pelo menos a este intervalo
+MAX_DEBOUNCE_SECONDS = 30
+STALE_CLAIM_SECONDS = 300
+MAX_ATTEMPTS = 5
+
+CONSULTOR_ROLES = ["consultor", "admin", "ceo", "diretor"]
+MEDIADOR_ROLES = ["mediador"]
+
+
+def fold_card_actions(actions: List[dict]) -> dict:
+    """
+    Reduzir as ações de um card (qualquer ordem) ao estado efectivo,
+    aplicando-as pela data da ação.
+    """
+    state = {
+        "created": False,
+        "deleted": False,
+        "name": None,
+        "desc": None,
+        "list": None,
+        "members_added": {},
+        "members_removed": set(),
+        "last_action_at": None,
+    }
+    for action in sorted(actions, key=lambda a: (a.get("date") or "", a.get("id") or "")):
+        action_type = action.get("type")
+        data = action.get("data", {})
+        card = data.get("card", {})
+
+        if action_type == "deleteCard":
+            state["deleted"] = True
+        elif action_type == "createCard":
+            state["created"] = True
+            state["name"] = card.get("name") or state["name"]
+            state["list"] = data.get("list") or state["list"]
+        elif action_type == "updateCard":
+            if card.get("name"):
+                state["name"] = card["name"]
+            if "desc" in data.get("old", {}):
+                state["desc"] = card.get("desc", "")
+            # listAfter em movimentos; list é a lista do card à data da ação
+            if data.get("listAfter") or data.get("list"):
+                state["list"] = data.get("listAfter") or data.get("list")
+        elif action_type == "moveCardToBoard":
+            state["list"] = data.get("list") or state["list"]
+            if card.get("name"):
+                state["name"] = card["name"]
+        elif action_type in ("addMemberToCard", "removeMemberFromCard"):
+            username = action.get("member", {}).get("username", "").lower()
+            if not username:
+                continue
+            if action_type == "addMemberToCard":
+                state["members_added"][username] = action["member"]
+                state["members_removed"].discard(username)
+            else:
+                state["members_removed"].add(username)
+                state["members_added"].pop(username, None)
+
+        if action.get("date"):
+            state["last_action_at"] = max(state["last_action_at"] or "", action["date"])
+    return state
+
+
+def build_card_update(state: dict, process: Optional[dict]) -> dict:
+    """
+    Campos a gravar no processo a partir do estado efectivo do card
+    (sem atribuições de membros). Estado mais antigo do que o último
+    aplicado não altera nome, descrição nem estado.
+    """
+    process = process or {}
+    last_applied = process.get("trello_last_action_at")
+    if last_applied and state["last_action_at"] and state["last_action_at"] <= last_applied:
+        return {}
+
+    update = {}
+    if state["name"] and state["name"] != process.get("client_name"):
+        update["client_name"] = state["name"]
+    if state["desc"] is not None:
+        parsed = parse_card_description(state["desc"])
+        if parsed.get("email"):
+            update["client_email"] = clean_email(parsed["email"])
+        if parsed.get("telefone") or parsed.get("phone"):
+            update["client_phone"] = parsed.get("telefone") or parsed.get("phone")
+        if parsed.get("nif"):
+            update["client_nif"] = parsed["nif"]
+    if state["list"] and state["list"].get("name"):
+        new_status = trello_list_to_status(state["list"]["name"])
+        if new_status and new_status != process.get("status"):
+            update["status"] = new_status
+            update["trello_list_id"] = state["list"].get("id")
+    if state["last_action_at"]:
+        update["trello_last_action_at"] = state["last_action_at"]
+    return update
+
+
+class TrelloWebhookProcessor:
+    """Ingestão persistente e processamento coalescido por card."""
+
+    def __init__(self, debounce_seconds: float = TRELLO_WEBHOOK_DEBOUNCE_SECONDS):
+        self.debounce_seconds = debounce_seconds
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._first_scheduled: Dict[str, float] = {}
+
+    async def ingest(self, action: dict) -> bool:
+        """Gravar a ação e agendar o card. False se ignorada ou repetida."""
+        action_id = action.get("id")
+        card_id = action.get("data", {}).get("card", {}).get("id")
+        if not action_id or not card_id:
+            return False
+
+        try:
+            await db.trello_webhook_actions.insert_one({
+                "action_id": action_id,
+                "card_id": card_id,
+                "type": action.get("type"),
+                "date": action.get("date"),
+                "action": action,
+                "status": "pending",
+                "attempts": 0,
+                "received_at": datetime.now(timezone.utc).isoformat()
+            })
+        except DuplicateKeyError:
+            logger.debug(f"Ação Trello {action_id} já recebida")
+            return False
+
+        self.schedule(card_id)
+        return True
+
+    def schedule(self, card_id: str):
+        """Debounce por card, com espera máxima para cards sempre activos."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        first = self._first_scheduled.setdefault(card_id, now)
+        timer = self._timers.get(card_id)
+        if timer and not timer.done():
+            if now - first >= MAX_DEBOUNCE_SECONDS:
+                return
+            timer.cancel()
+        self._timers[card_id] = asyncio.create_task(self._flush_later(card_id))
+
+    async def _flush_later(self, card_id: str):
+        await asyncio.sleep(self.debounce_seconds)
+        self._timers.pop(card_id, None)
+        self._first_scheduled.pop(card_id, None)
+        try:
+            await self.flush_card(card_id)
+        except Exception as e:
+            logger.error(f"Erro ao processar webhooks do card {card_id}: {e}")
+
+    async def flush_card(self, card_id: str) -> int:
+        """Reclamar e aplicar todas as ações pendentes de um card."""
+        batch_id = str(uuid.uuid4())
+        now = datetime.now(timezone.utc).isoformat()
+        claimed = await db.trello_webhook_actions.update_many(
+            {"card_id": card_id, "status": "pending"},
+            {"$set": {"status": "processing", "batch_id": batch_id, "claimed_at": now}}
+        )
+        if not claimed.modified_count:
+            return 0
+
+        docs = await db.trello_webhook_actions.find(
+            {"batch_id": batch_id}, {"_id": 0, "action": 1}
+        ).to_list(None)
+        try:
+            await self.apply_card_state(card_id, fold_card_actions([d["action"] for d in docs]))
+        except Exception as e:
+            await db.trello_webhook_actions.update_many(
+                {"batch_id": batch_id},
+                {"$set": {"status": "pending", "error": str(e)}, "$inc": {"attempts": 1}}
+            )
+            await db.trello_webhook_actions.update_many(
+                {"batch_id": batch_id, "attempts": {"$gte": MAX_ATTEMPTS}},
+                {"$set": {"status": "error"}}
+            )
+            raise
+
+        await db.trello_webhook_actions.update_many(
+            {"batch_id": batch_id},
+            {"$set": {"status": "done", "processed_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        logger.info(f"Webhooks Trello: {len(docs)} ações aplicadas ao card {card_id}")
+        return len(docs)
+
+    async def _member_users(self, usernames: List[str]) -> Dict[str, dict]:
+        """Utilizadores mapeados para os usernames Trello indicados."""
+        if not usernames:
+            return {}
+        mappings = await db.trello_member_mappings.find(
+            {"trello_username": {"$in": usernames}}, {"_id": 0}
+        ).to_list(None)
+        user_ids = [m["user_id"] for m in mappings]
+        users = await db.users.find(
+            {"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "name": 1, "role": 1}
+        ).to_list(None)
+        users_by_id = {u["id"]: u for u in users}
+        return {
+            m["trello_username"]: users_by_id[m["user_id"]]
+            for m in mappings if m["user_id"] in users_by_id
+        }
+
+    async def apply_card_state(self, card_id: str, state: dict):
+        """Aplicar o estado efectivo de um card ao processo (uma escrita)."""
+        now = datetime.now(timezone.utc).isoformat()
+        process = await db.processes.find_one({"trello_card_id": card_id}, {"_id": 0})
+
+        if state["deleted"]:
+            if process:
+                await db.processes.update_one(
+                    {"id": process["id"]},
+                    {"$set": {"trello_deleted": True, "updated_at": now}}
+                )
+                logger.info(f"Card eliminado no Trello: {card_id}")
+            return
+
+        update = build_card_update(state, process)
+
+        users = await self._member_users(list(state["members_added"]) + list(state["members_removed"]))
+        for username in state["members_removed"]:
+            user = users.get(username)
+            if not user or not process:
+                continue
+            if process.get("assigned_consultor_id") == user["id"]:
+                update.update({"assigned_consultor_id": None, "consultor_name": None})
+            if process.get("assigned_mediador_id") == user["id"]:
+                update.update({"assigned_mediador_id": None, "mediador_name": None})
+        for username in state["members_added"]:
+            user = users.get(username)
+            if not user:
+                continue
+            if user.get("role") in CONSULTOR_ROLES:
+                update.update({"assigned_consultor_id": user["id"], "consultor_name": user.get("name")})
+            elif user.get("role") in MEDIADOR_ROLES:
+                update.update({"assigned_mediador_id": user["id"], "mediador_name": user.get("name")})
+
+        if not process:
+            status = update.get("status") or "clientes_espera"
+            new_process = {
+                "id": str(uuid.uuid4()),
+                "client_name": state["name"] or "Sem nome",
+                "status": status,
+                "trello_card_id": card_id,
+                "trello_list_id": (state["list"] or {}).get("id"),
+                "created_at": now,
+                "updated_at": now,
+                "source": "trello_webhook",
+                "personal_data": {},
+                "financial_data": {},
+                "real_estate_data": {},
+                "credit_data": {},
+            }
+            new_process.update({k: v for k, v in update.items() if k not in new_process})
+            await db.processes.insert_one(new_process)
+            await sync_client_key(new_process["id"])
+            logger.info(f"Processo criado via Trello: {new_process['client_name']}")
+            return
+
+        if set(update) - {"trello_last_action_at"}:
+            update["updated_at"] = now
+            await db.processes.update_one({"id": process["id"]}, {"$set": update})
+            if "client_name" in update:
+                await sync_client_key(process["id"])
+            logger.info(f"Processo atualizado via webhook Trello: {process.get('client_name')}")
+        elif update:
+            await db.processes.update_one({"id": process["id"]}, {"$set": update})
+
+    async def process_pending(self) -> int:
+        """
+        Retomar ações pendentes fora do debounce (réplica reiniciada) e
+        reclamações abandonadas. Devolve o número de cards processados.
+        """
+        now = datetime.now(timezone.utc)
+        await db.trello_webhook_actions.update_many(
+            {
+                "status": "processing",
+                "claimed_at": {"$lt": (now - timedelta(seconds=STALE_CLAIM_SECONDS)).isoformat()}
+            },
+            {"$set": {"status": "pending"}}
+        )
+        cutoff = (now - timedelta(seconds=self.debounce_seconds + MAX_DEBOUNCE_SECONDS)).isoformat()
+        card_ids = await db.trello_webhook_actions.distinct(
+            "card_id", {"status": "pending", "received_at": {"$lt": cutoff}}
+        )
+        processed = 0
+        for card_id in card_ids:
+            try:
+                if await self.flush_card(card_id):
+                    processed += 1
+            except Exception as e:
+                logger.error(f"Erro ao retomar webhooks do card {card_id}: {e}")
+        return processed
+
+    async def purge_processed(self, days: int = 7) -> int:
+        """Apagar ações já aplicadas há mais de `days` dias."""
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+        result = await db.trello_webhook_actions.delete_many(
+            {"status": "done", "processed_at": {"$lt": cutoff}}
+        )
+        return result.deleted_count
+
+
+trello_webhook_processor = TrelloWebhookProcessor()
@@ -0,0 +1,77 @@
+"""
+Testes dos rollups de uso de IA (buckets, histograma de latência e
+decomposição de intervalos).
+"""
+from datetime import datetime, timezone
+
+from services.ai_usage_rollups import (
+    build_rollup_increments, merge_rollups, plan_buckets, rollup_stats, rollup_update, sketch_quantile
+)
+
+
+def _entry(task, model, success=True, tokens=(100, 50), cost=0.01, ms=200, created_at="2026-10-18T10:15:00+00:00"):
+    return {
+        "task": task, "model": model, "provider": "gemini",
+        "input_tokens": tokens[0], "output_tokens": tokens[1], "total_tokens": sum(tokens),
+        "cost_eur": cost, "response_time_ms": ms, "success": success, "created_at": created_at,
+    }
+
+
+def test_build_rollup_increments_one_increment_per_bucket():
+    entries = [
+        _entry("scraper_extraction", "gemini-2.0-flash"),
+        _entry("scraper_extraction", "gemini-2.0-flash", success=False, tokens=(10, 0), ms=0,
+               created_at="2026-10-18T11:05:00+00:00"),
+        _entry("document_analysis", "gpt-4o-mini"),
+    ]
+    rollups = build_rollup_increments(entries)
+
+    day = rollups["day_2026-10-18_scraper_extraction_gemini-2.0-flash"]
+    assert day["inc"]["call_count"] == 2
+    assert day["inc"]["error_count"] == 1
+    assert day["inc"]["total_tokens"] == 160
+    # Chamadas sem tempo medido não entram no histograma
+    assert sum(v for k, v in day["inc"].items() if k.startswith("latency.")) == 1
+    assert day["set"]["updated_at"] == "2026-10-18T11:05:00+00:00"
+    assert rollups["hour_2026-10-18T10_scraper_extraction_gemini-2.0-flash"]["inc"]["call_count"] == 1
+    assert rollups["month_2026-10_document_analysis_gpt-4o-mini"]["set"]["granularity"] == "month"
+    assert len(rollups) == 7
+
+
+def test_sketch_quantiles_survive_merge():
+    fast = build_rollup_increments([_entry("t", "m", ms=100)] * 90)["day_2026-10-18_t_m"]["inc"]
+    slow = build_rollup_increments([_entry("t", "m", ms=2000)] * 10)["day_2026-10-18_t_m"]["inc"]
+
+    def as_doc(inc):
+        doc = {k: v for k, v in inc.items() if not k.startswith("latency.")}
+        doc["latency"] = {k.split(".", 1)[1]: v for k, v in inc.items() if k.startswith("latency.")}
+        return doc
+
+    merged = merge_rollups([as_doc(fast), as_doc(slow)], lambda d: None)[None]
+    stats = rollup_stats(merged)
+    assert stats["total_calls"] == 100
+    assert abs(stats["p50_response_time_ms"] - 100) / 100 < 0.05
+    assert abs(stats["p95_response_time_ms"] - 2000) / 2000 < 0.05
+    assert sketch_quantile({}, 0.5) == 0.0
+
+
+def test_plan_buckets_uses_widest_complete_buckets():
+    start = datetime(2026, 8, 30, 22, 30, tzinfo=timezone.utc)
+    end = datetime(2026, 10, 2, 1, 10, tzinfo=timezone.utc)
+    buckets = plan_buckets(start, end)
+
+    assert buckets[:3] == [("hour", "2026-08-30T22"), ("hour", "2026-08-30T23"), ("day", "2026-08-31")]
+    assert ("month", "2026-09") in buckets
+    assert buckets[-3:] == [("day", "2026-10-01"), ("hour", "2026-10-02T00"), ("hour", "2026-10-02T01")]
+    assert len(buckets) == 7
+
+
+def test_rollup_update_is_idempotent_per_batch():
+    rollup = {"inc": {"calls": 2}, "set": {"granularity": "hour"}}
+    query, update = rollup_update("hour|x", rollup)
+    assert query == {"rollup_id": "hour|x"} and "$addToSet" not in update
+
+    query, update = rollup_update("hour|x", rollup, batch_id="backfill_1")
+    assert query["applied_batches"] == {"$ne": "backfill_1"}
+    assert update["$addToSet"] == {"applied_batches": "backfill_1"}
+    assert update["$inc"] == {"calls": 2}
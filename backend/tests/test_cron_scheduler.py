@@ -0,0 +1,35 @@
+"""
+Testes das expressões cron do agendador do worker.
+"""
+from datetime import datetime, timezone
+
+import pytest
+
+from services.cron_scheduler import CronExpression
+
+
+# Domingo, 18 de Outubro de 2026
+NOW = datetime(2026, 10, 18, 8, 7, 30, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("*/5 * * * *", datetime(2026, 10, 18, 8, 10, tzinfo=timezone.utc)),
+    ("0 3 * * *", datetime(2026, 10, 19, 3, 0, tzinfo=timezone.utc)),
+    ("0 8 * * 1", datetime(2026, 10, 19, 8, 0, tzinfo=timezone.utc)),
+    ("0 8 1 * *", datetime(2026, 11, 1, 8, 0, tzinfo=timezone.utc)),
+    ("0 9 * * 7", datetime(2026, 10, 18, 9, 0, tzinfo=timezone.utc)),
+    ("30 8 13 * 5", datetime(2026, 10, 23, 8, 30, tzinfo=timezone.utc)),
+])
+def test_next_after(expression, expected):
+    assert CronExpression(expression).next_after(NOW) == expected
+
+
+def test_next_after_is_strictly_later():
+    moment = datetime(2026, 10, 18, 8, 10, tzinfo=timezone.utc)
+    assert CronExpression("*/5 * * * *").next_after(moment).minute == 15
+
+
+@pytest.mark.parametrize("expression", ["* * *", "61 * * * *", "*/0 * * * *", "5-1 * * * *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronExpression(expression)
@@ -0,0 +1,38 @@
+"""
+Testes do planeamento da categorização em lote de documentos.
+"""
+from services.document_categorization_jobs import build_categorized_metadata, plan_categorization
+
+
+def test_plan_skips_categorized_and_deduplicates():
+    files = {
+        "Identificação": [
+            {"path": "c/cc.pdf", "name": "cc.pdf"},
+            {"path": "c/cc.pdf", "name": "cc.pdf"},
+            {"path": None, "name": "sem_caminho.pdf"},
+        ],
+        "Rendimentos": [
+            {"path": "c/irs.pdf", "name": "irs.pdf"},
+            {"path": "c/recibo.pdf", "name": "recibo.pdf"},
+        ],
+    }
+    existing = {
+        "c/irs.pdf": {"id": "m1", "s3_path": "c/irs.pdf", "is_categorized": True, "ai_category": "Fiscais"},
+        # Metadados sem categorização (ex.: falha anterior) continuam pendentes
+        "c/recibo.pdf": {"id": "m2", "s3_path": "c/recibo.pdf", "is_categorized": False},
+    }
+    pending, skipped = plan_categorization(files, existing)
+
+    assert pending == [("c/cc.pdf", "cc.pdf"), ("c/recibo.pdf", "recibo.pdf")]
+    assert skipped == [{"filename": "irs.pdf", "status": "skipped", "category": "Fiscais"}]
+
+
+def test_build_metadata_truncates_text():
+    result = {"category": "Fiscais", "subcategory": "IRS", "tags": ["irs"], "confidence": 0.9}
+    meta = build_categorized_metadata(
+        "m1", {"id": "p1", "client_name": "Maria"}, "c/irs.pdf", "irs.pdf",
+        result, "x" * 6000, 1234, "2026-10-18T10:00:00+00:00"
+    )
+    assert meta["process_id"] == "p1" and meta["is_categorized"]
+    assert len(meta["extracted_text"]) == 5000
+    assert meta["ai_subcategory"] == "IRS"
@@ -0,0 +1,48 @@
+"""
+Testes da análise de texto e do ranking BM25 da pesquisa de documentos.
+"""
+from services.document_search import (
+    analyze, build_postings, highlight_spans, query_terms, rank_postings
+)
+
+
+def test_analyze_folds_accents_and_keeps_first_position():
+    terms = analyze("Crédito habitação: o CRÉDITO foi aprovado")
+    assert terms["credito"] == (2, 0)
+    assert terms["habitacao"][1] == len("Crédito ")
+    assert "o" not in terms  # termos curtos
+    assert query_terms("Declaração de IRS") == ["declaracao", "irs"]
+
+
+def test_build_postings_weights_fields():
+    meta = {
+        "id": "d1", "process_id": "p1", "filename": "IRS_2025.pdf",
+        "ai_category": "Fiscais", "ai_tags": ["irs", "rendimentos"],
+        "extracted_text": "Declaração de IRS do ano 2025",
+    }
+    postings, length = build_postings(meta)
+    by_term = {p["term"]: p for p in postings}
+    # nome do ficheiro (5) + tags (2) + texto (1)
+    assert by_term["irs"]["tf"] == 8
+    assert by_term["irs"]["pos"] == len("Declaração de ")
+    assert by_term["fiscais"]["pos"] is None
+    assert all(p["length"] == length for p in postings)
+
+
+def test_rank_postings_prefers_rare_terms_and_short_documents():
+    postings = {
+        "irs": [{"doc_id": "a", "tf": 1, "length": 10, "pos": 40},
+                {"doc_id": "b", "tf": 1, "length": 100, "pos": 5}],
+        "modelo": [{"doc_id": "b", "tf": 1, "length": 100, "pos": 12},
+                   {"doc_id": "c", "tf": 3, "length": 10, "pos": None}],
+    }
+    ranked = rank_postings(postings, {"irs": 2, "modelo": 50}, doc_count=100, avg_length=20)
+    assert [doc_id for doc_id, _, _ in ranked] == ["a", "b", "c"]
+    # Excerto a partir da 1ª ocorrência de qualquer termo
+    assert [pos for _, _, pos in ranked] == [40, 5, None]
+
+
+def test_highlight_spans_match_folded_words_and_prefix():
+    text = "Caderneta predial do imóvel"
+    assert highlight_spans(text, ["imovel"]) == [[21, 27]]
+    assert highlight_spans(text, [], prefix="pred") == [[10, 17]]
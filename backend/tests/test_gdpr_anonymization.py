@@ -0,0 +1,30 @@
+"""
+Testes do cálculo em memória da anonimização RGPD.
+"""
+from services.gdpr import build_anonymization_update
+
+
+def test_build_anonymization_update_covers_nested_arrays_and_removals():
+    process = {
+        "id": "p1",
+        "client_name": "Maria Silva",
+        "client_email": "maria@x.pt",
+        "personal_data": {"nif": "123456789", "profissao": "Engenheira"},
+        "co_buyers": [{"nome": "João", "idade": 40}, {"nif": "987654321"}],
+        "documents": [{"name": "cc.pdf"}],
+        "financial_data": {"rendimento_mensal": 2000},
+    }
+    update, unset, anonymized, removed = build_anonymization_update(process, run_id="run-1")
+
+    assert update["client_name"].startswith("CLIENTE_ANONIMO_")
+    assert update["client_email"].endswith("@anonimo.local")
+    assert update["personal_data.nif"] == "XXXXXXXXX"
+    assert update["co_buyers.0.nome"].startswith("CLIENTE_ANONIMO_")
+    assert update["co_buyers.1.nif"] == "XXXXXXXXX"
+    assert "personal_data.profissao" not in update
+    assert "financial_data.rendimento_mensal" not in update
+    assert update["is_anonymized"] is True
+    assert update["anonymization_run_id"] == "run-1"
+    assert unset == {"documents": ""}
+    assert removed == ["documents"]
+    assert "co_buyers[1].nif" in anonymized
@@ -0,0 +1,144 @@
+"""
+Testes da exportação RGPD em streaming (NDJSON e ZIP) com cursores e S3 simulados.
+"""
+import io
+import json
+import zipfile
+
+import pytest
+
+from services import gdpr
+
+
+class _Cursor:
+    """Cursor assíncrono mínimo (sort/batch_size encadeáveis)."""
+
+    def __init__(self, docs):
+        self.docs = list(docs)
+        self.batch = None
+
+    def sort(self, *_):
+        return self
+
+    def batch_size(self, size):
+        self.batch = size
+        return self
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield doc
+
+
+class _Collection:
+    def __init__(self, docs=(), aggregated=()):
+        self.docs = docs
+        self.aggregated = aggregated
+        self.cursors = []
+        self.inserted = []
+
+    def find(self, *_):
+        cursor = _Cursor(self.docs)
+        self.cursors.append(cursor)
+        return cursor
+
+    def aggregate(self, _):
+        return _Cursor(self.aggregated)
+
+    async def insert_one(self, doc):
+        self.inserted.append(doc)
+
+
+class _Db:
+    def __init__(self):
+        self.processes = _Collection(
+            [{"id": "p1", "client_name": "Maria"}],
+            aggregated=[{"model": "gemini", "fields": 3}]
+        )
+        self.history = _Collection([{"action": "criado"}, {"action": "editado"}])
+        self.emails = _Collection()
+        self.tasks = _Collection([{"title": "Ligar"}])
+        self.document_metadata = _Collection([
+            {"id": "d1", "s3_path": "clientes/p1/cc.pdf", "filename": "cc.pdf"},
+            {"id": "d2", "s3_path": "clientes/p1/irs.pdf"},
+            {"id": "d3", "s3_path": "clientes/p1/vazio.pdf", "filename": "vazio.pdf"},
+        ])
+        self.gdpr_audit = _Collection()
+
+
+S3_FILES = {
+    "clientes/p1/cc.pdf": [b"%PDF-1.4 ", b"conteudo"],
+    "clientes/p1/vazio.pdf": [],
+}
+
+
+async def _fake_s3(s3_path):
+    if s3_path not in S3_FILES:
+        raise FileNotFoundError(s3_path)
+    for chunk in S3_FILES[s3_path]:
+        yield chunk
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = _Db()
+    monkeypatch.setattr(gdpr, "db", db)
+    monkeypatch.setattr(gdpr, "_iter_s3_file", _fake_s3)
+    return db
+
+
+def test_zip_stream_buffer_is_not_seekable():
+    buffer = gdpr._ZipStreamBuffer()
+    assert not hasattr(buffer, "seek") and not hasattr(buffer, "tell")
+    buffer.write(b"ab")
+    buffer.write(memoryview(b"cd"))
+    assert buffer.drain() == b"abcd"
+    assert buffer.drain() == b""
+
+
+@pytest.mark.asyncio
+async def test_ndjson_export_streams_every_section(fake_db):
+    lines = [json.loads(line) async for line in gdpr.stream_personal_data_ndjson("p1")]
+
+    assert lines[0]["type"] == "export" and lines[0]["process_id"] == "p1"
+    sections = [line["section"] for line in lines[1:]]
+    assert sections == ["process", "history", "history", "tasks",
+                        "documents", "documents", "documents", "ai_extraction_history"]
+    assert fake_db.history.cursors[0].batch == gdpr.EXPORT_CURSOR_BATCH
+    assert fake_db.gdpr_audit.inserted[0]["format"] == "ndjson"
+
+
+@pytest.mark.asyncio
+async def test_zip_export_is_readable_and_copies_s3_files(fake_db):
+    parts = [part async for part in gdpr.stream_personal_data_zip("p1", include_files=True)]
+    assert len(parts) > 1
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(parts)))
+    assert archive.testzip() is None
+    assert archive.namelist() == [
+        "export.json",
+        "process.ndjson", "history.ndjson", "emails.ndjson", "tasks.ndjson",
+        "documents.ndjson", "ai_extraction_history.ndjson",
+        "ficheiros/0001_cc.pdf",
+        "ficheiros/0002_irs.pdf.erro.txt",
+        "ficheiros/0003_vazio.pdf",
+    ]
+    header = json.loads(archive.read("export.json"))
+    assert header["sections"][0] == "process"
+    assert archive.read("history.ndjson").decode().splitlines() == [
+        '{"action": "criado"}', '{"action": "editado"}'
+    ]
+    assert archive.read("emails.ndjson") == b""
+    assert archive.read("ficheiros/0001_cc.pdf") == b"%PDF-1.4 conteudo"
+    assert b"clientes/p1/irs.pdf" in archive.read("ficheiros/0002_irs.pdf.erro.txt")
+    assert archive.read("ficheiros/0003_vazio.pdf") == b""
+    assert fake_db.gdpr_audit.inserted[0]["include_files"] is True
+
+
+@pytest.mark.asyncio
+async def test_zip_export_without_files_skips_s3(fake_db):
+    parts = [part async for part in gdpr.stream_personal_data_zip("p1")]
+    names = zipfile.ZipFile(io.BytesIO(b"".join(parts))).namelist()
+    assert not [name for name in names if name.startswith("ficheiros/")]
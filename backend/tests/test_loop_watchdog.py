@@ -0,0 +1,46 @@
+"""
+Testes da atribuição e agregação de bloqueios do event loop.
+"""
+from traceback import FrameSummary
+
+from middleware.loop_watchdog import StallAggregator, offender_location
+
+
+ROOT = "/app/backend"
+
+
+def test_offender_location_prefers_deepest_app_frame():
+    frames = [
+        FrameSummary("/usr/lib/python3.11/asyncio/events.py", 80, "_run"),
+        FrameSummary(ROOT + "/routes/properties.py", 120, "import_properties"),
+        FrameSummary(ROOT + "/venv/lib/site-packages/pandas/io/excel.py", 300, "read_excel"),
+        FrameSummary("/usr/lib/python3.11/zipfile.py", 900, "read"),
+    ]
+    location, blocking_call = offender_location(frames, ROOT)
+    assert location == "routes/properties.py:120 in import_properties"
+    assert blocking_call == "/usr/lib/python3.11/zipfile.py:900 in read"
+
+
+def test_offender_location_without_app_frames():
+    frames = [FrameSummary("/usr/lib/python3.11/ssl.py", 1100, "read")]
+    assert offender_location(frames, ROOT)[0] == "/usr/lib/python3.11/ssl.py:1100 in read"
+    assert offender_location([], ROOT)[0] == "<desconhecido>"
+
+
+def test_stall_aggregator_sorts_by_total_blocked_time():
+    stalls = StallAggregator(max_locations=2)
+    stalls.record("a.py:1 in f", "ssl.py:1 in read", 0.3, [], "t1")
+    stalls.record("a.py:1 in f", "ssl.py:1 in read", 0.5, [], "t2")
+    stalls.record("b.py:2 in g", "zlib", 1.0, [], "t3")
+    stalls.record("c.py:3 in h", "zlib", 0.2, [], "t4")
+
+    offenders = stalls.snapshot()
+    assert [o["location"] for o in offenders] == ["b.py:2 in g", "a.py:1 in f", "<outros>"]
+    assert offenders[1]["count"] == 2
+    assert offenders[1]["total_blocked_ms"] == 800.0
+    assert offenders[1]["max_blocked_ms"] == 500.0
+    assert offenders[1]["first_seen"] == "t1" and offenders[1]["last_seen"] == "t2"
+    assert stalls.total_stalls == 4
+
+    stalls.reset()
+    assert stalls.snapshot() == [] and stalls.total_stalls == 0
@@ -0,0 +1,31 @@
+"""
+Testes das métricas internas (formato Prometheus e Server-Timing).
+"""
+from middleware.metrics import Histogram, metrics_authorized, router_prefix, server_timing_header
+
+
+def test_histogram_renders_cumulative_buckets():
+    hist = Histogram("t_seconds", "Teste.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        hist.observe(value, "/api/x")
+    lines = hist.render()
+
+    assert 't_seconds_bucket{route="/api/x",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{route="/api/x",le="1.0"} 3' in lines
+    assert 't_seconds_bucket{route="/api/x",le="+Inf"} 4' in lines
+    assert 't_seconds_count{route="/api/x"} 4' in lines
+    assert lines[1] == "# TYPE t_seconds histogram"
+
+
+def test_router_prefix_and_server_timing():
+    assert router_prefix("/api/processes/123/documents") == "/api/processes"
+    assert router_prefix("/health") == "/health"
+    header = server_timing_header(0.0125, {"mongo": [0.004, 3]})
+    assert header == 'app;dur=12.5, mongo;dur=4.0;desc="mongo x3"'
+
+
+def test_metrics_authorization_fails_closed():
+    assert not metrics_authorized(None, token="")
+    assert not metrics_authorized("Bearer ", token="")
+    assert not metrics_authorized("Bearer errado", token="segredo")
+    assert metrics_authorized("Bearer segredo", token="segredo")
@@ -0,0 +1,36 @@
+"""
+Testes da preparação vectorizada da importação de imóveis (Excel).
+"""
+import pandas as pd
+
+from services.property_import import prepare_import_frame, parse_price
+
+
+def test_parse_price_formats():
+    prices = parse_price(pd.Series(["700.000 €", "1.250,50", "99,90", "450000 / 1200", 325000, None]))
+    assert prices.tolist()[:5] == [700000.0, 1250.5, 99.9, 450000.0, 325000.0]
+    assert pd.isna(prices.iloc[5])
+
+
+def test_prepare_import_frame_validates_and_maps():
+    raw = pd.DataFrame({
+        "Título": ["Moradia T3 Sintra", "", "Loja centro"],
+        "Preço": ["350.000", "100000", "abc"],
+        "Distrito": ["Lisboa", "Porto", "Faro"],
+        "Concelho": ["Sintra", "Porto", "Faro"],
+        "Tipologia": ["T3", None, None],
+        "Estado": ["Para recuperar", None, None],
+        "Agência": ["Agência X", None, None],
+    })
+    frame = prepare_import_frame(raw)
+
+    assert frame["erro"].isna().tolist() == [True, False, False]
+    assert frame["erro"].tolist()[1:] == ["Título em falta", "Preço em falta ou inválido"]
+    assert frame["linha"].tolist() == [2, 3, 4]
+
+    first = frame.iloc[0]
+    assert first["tipo"] == "moradia"
+    assert first["estado"] == "para_recuperar"
+    assert first["quartos"] == 3
+    assert first["preco"] == 350000.0
+    assert first["proprietario_nome"] == "Agência X"
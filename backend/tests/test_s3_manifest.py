@@ -0,0 +1,29 @@
+"""
+Testes da organização da listagem S3 por categoria (usada pelo manifesto).
+"""
+from services.s3_manifest import prefix_for_key
+from services.s3_storage import build_listing
+
+
+PREFIX = "clientes/p1_Maria_Silva/"
+
+
+def test_build_listing_groups_by_category_and_skips_markers():
+    objects = [
+        {"key": PREFIX + "Documentos_Pessoais/.keep", "size": 0, "last_modified": "2026-10-18T10:00:00"},
+        {"key": PREFIX + "Documentos_Pessoais/cc.pdf", "size": 2048, "last_modified": "2026-10-18T10:00:00"},
+        {"key": PREFIX + "Financeiros/irs.pdf", "size": 1024, "last_modified": "2026-10-18T10:01:00"},
+        {"key": PREFIX + "Pasta_Desconhecida/x.pdf", "size": 10, "last_modified": "2026-10-18T10:02:00"},
+        {"key": PREFIX + "solto.pdf", "size": 5, "last_modified": "2026-10-18T10:03:00"},
+    ]
+    listing = build_listing(PREFIX, objects)
+
+    assert [f["name"] for f in listing["files"]["Documentos Pessoais"]] == ["cc.pdf"]
+    assert [f["name"] for f in listing["files"]["Financeiros"]] == ["irs.pdf"]
+    assert [f["name"] for f in listing["files"]["Outros"]] == ["x.pdf"]
+    assert listing["stats"]["total_files"] == 3
+    assert listing["stats"]["total_size_formatted"] == "3.0 KB"
+
+
+def test_prefix_for_key():
+    assert prefix_for_key(PREFIX + "Financeiros/irs.pdf") == PREFIX
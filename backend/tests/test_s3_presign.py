@@ -0,0 +1,25 @@
+"""
+Testes da cache de links pré-assinados.
+"""
+from services.s3_storage import PresignCache
+
+
+def test_cached_url_is_reused_until_shortly_before_expiry():
+    cache = PresignCache()
+    cache.put("clientes/p1_x/a.pdf", 3600, "https://url", expires_at=1000 + 3600)
+
+    assert cache.get("clientes/p1_x/a.pdf", 3600, now=1000 + 3000) == ("https://url", 4600)
+    # A menos de 5 minutos da expiração é assinado de novo
+    assert cache.get("clientes/p1_x/a.pdf", 3600, now=1000 + 3400) is None
+    # Validade diferente é outra entrada
+    assert cache.get("clientes/p1_x/a.pdf", 600, now=1000) is None
+
+
+def test_cache_is_bounded_and_invalidated_per_key():
+    cache = PresignCache(max_size=2)
+    for name in ("a", "b", "c"):
+        cache.put(name, 3600, f"https://{name}", expires_at=10000)
+    assert cache.get("a", 3600, now=0) is None
+    cache.invalidate("b")
+    assert cache.get("b", 3600, now=0) is None
+    assert cache.get("c", 3600, now=0) == ("https://c", 10000)
@@ -0,0 +1,66 @@
+"""
+Testes do índice de pesquisa global (normalização, n-grams, pesquisa).
+"""
+import pytest
+
+from services.search_index import (
+    fold_text, tokenize, edge_ngrams, query_terms,
+    build_process_entry, candidate_pipeline, MAX_PREFIX_LEN
+)
+
+
+def test_fold_text_removes_accents_and_punctuation():
+    assert fold_text("João  Conceição-Araújo") == "joao conceicao araujo"
+    assert fold_text(None) == ""
+
+
+def test_edge_ngrams_cover_prefixes():
+    grams = edge_ngrams(tokenize("Joana"))
+    assert {"jo", "joa", "joan", "joana"} <= set(grams)
+    assert "j" not in grams
+
+
+def test_query_terms_truncated_to_max_prefix():
+    term = query_terms("a" * 40)[0]
+    assert len(term) == MAX_PREFIX_LEN
+
+
+def test_process_entry_has_exact_fields_and_prefixes():
+    entry = build_process_entry({
+        "id": "p1",
+        "client_name": "Luísa Gonçalves",
+        "client_email": "Luisa@Mail.pt",
+        "personal_data": {"nif": "123456789"},
+        "status": "fase_documental",
+    })
+    assert entry["nif"] == "123456789"
+    assert entry["email"] == "luisa@mail.pt"
+    assert entry["name"] == "luisa goncalves"
+    assert "gon" in entry["prefixes"]
+    assert "1234" in entry["prefixes"]
+
+
+def test_candidate_pipeline_sorts_by_relevance_before_limit():
+    pipeline = candidate_pipeline({"entity_type": "process"}, ["jo", "si"], "jo si", {"_id": 0})
+    stages = [next(iter(stage)) for stage in pipeline]
+    assert stages.index("$sort") < stages.index("$limit")
+    assert pipeline[2]["$sort"] == {"_name_starts": -1, "_name_hits": -1, "source_updated_at": -1}
+    assert len(pipeline[1]["$addFields"]["_name_hits"]["$add"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_global_search_accent_insensitive(client, admin_token):
+    """Pesquisa sem acentos encontra nomes acentuados."""
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    create = await client.post(
+        "/processes/create-client",
+        headers=headers,
+        json={"process_type": "credito", "client_name": "Teste Pesquisa Ãngela"}
+    )
+    assert create.status_code == 200
+
+    response = await client.get("/search/global?q=angela", headers=headers)
+    assert response.status_code == 200
+    names = [p.get("client_name") for p in response.json()["processes"]]
+    assert "Teste Pesquisa Ãngela" in names
+
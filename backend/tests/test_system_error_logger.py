@@ -0,0 +1,53 @@
+"""
+Testes do fingerprint e da agregação de erros do sistema.
+"""
+from services.system_error_logger import (
+    build_fingerprint_update, error_fingerprint, normalize_message, occurrences_since
+)
+
+
+STACK_A = '''Traceback (most recent call last):
+  File "/app/backend/services/scraper.py", line 120, in scrape
+    data = await fetch(url)
+  File "/app/backend/services/http.py", line 33, in fetch
+    raise TimeoutError()
+'''
+
+
+def test_fingerprint_ignores_variable_values():
+    a = "Timeout ao obter https://www.idealista.pt/imovel/123 após 30s (lead 3f2b8c1e-0a4d-4e6f-9b1a-2c3d4e5f6a7b)"
+    b = "Timeout ao obter https://www.imovirtual.com/x/9 após 45s (lead 9a8b7c6d-5e4f-4a3b-8c2d-1e0f9a8b7c6d)"
+    assert normalize_message(a) == normalize_message(b) == "Timeout ao obter <url> após <n>s (lead <uuid>)"
+    assert error_fingerprint("scraper", "scraper_error", a) == error_fingerprint("scraper", "scraper_error", b)
+    assert error_fingerprint("scraper", "scraper_error", a) != error_fingerprint("leads", "scraper_error", a)
+
+
+def test_fingerprint_uses_stack_frames_without_line_numbers():
+    moved = STACK_A.replace("line 120", "line 131")
+    other = STACK_A.replace("in fetch", "in fetch_json")
+    base = error_fingerprint("api", "unhandled_exception", "boom", STACK_A)
+    assert error_fingerprint("api", "unhandled_exception", "boom", moved) == base
+    assert error_fingerprint("api", "unhandled_exception", "boom", other) != base
+
+
+def test_build_fingerprint_update_increments_and_caps_samples():
+    group = {
+        "type": "scraper_error", "component": "scraper", "normalized_message": "x",
+        "severity": "error", "first_seen": "2026-10-17T23:59:00+00:00",
+        "daily": {"2026-10-17": 2, "2026-10-18": 3},
+        "samples": [{"timestamp": "t", "message": "x", "details": {}, "user_id": None, "request_path": None}],
+        "last": {"timestamp": "2026-10-18T09:30:00+00:00", "message": "x", "details": {"url": "u"},
+                 "user_id": None, "request_path": None},
+    }
+    update = build_fingerprint_update("fp1", group)
+    assert update["$inc"] == {"daily.2026-10-17": 2, "daily.2026-10-18": 3, "count": 5}
+    assert update["$set"]["hour"] == 9 and update["$set"]["resolved"] is False
+    # Grupo marcado como lido pelo admin não volta a ficar por ler
+    assert "read" not in update["$set"] and update["$setOnInsert"]["read"] is False
+    assert update["$push"]["samples"]["$slice"] == -10
+    assert update["$setOnInsert"]["first_seen"] == "2026-10-17T23:59:00+00:00"
+
+
+def test_occurrences_since_counts_legacy_documents_once():
+    assert occurrences_since({"daily": {"2026-10-10": 4, "2026-10-15": 2}}, "2026-10-12") == 2
+    assert occurrences_since({"timestamp": "2026-10-15T10:00:00+00:00"}, "2026-10-12") == 1
@@ -0,0 +1,33 @@
+"""
+Testes do diff de estado dos cards e do limitador de pedidos ao Trello.
+"""
+import asyncio
+import time
+
+from services.trello_push import TokenBucket, desired_card_state, diff_card_state, state_hashes
+
+
+PROCESS = {"client_name": "Maria Silva", "client_email": "maria@x.pt", "status": "fase_documental"}
+
+
+def test_diff_only_returns_changed_fields():
+    state = desired_card_state(PROCESS, "list-1")
+    assert set(diff_card_state(state, None)) == {"name", "desc", "idList"}
+
+    pushed = state_hashes(state)
+    assert diff_card_state(state, pushed) == {}
+
+    moved = desired_card_state(PROCESS, "list-2")
+    assert diff_card_state(moved, pushed) == {"idList": "list-2"}
+
+
+def test_token_bucket_limits_rate_after_burst():
+    async def run():
+        bucket = TokenBucket(rate=50, capacity=5)
+        start = time.monotonic()
+        for _ in range(10):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # 5 em rajada + 5 ao ritmo de 50/s ≈ 0.1s
+    assert asyncio.run(run()) >= 0.08
@@ -0,0 +1,66 @@
+"""
+Testes do planeamento da sincronização incremental Trello → processos.
+"""
+from services.trello_sync import MemberMatcher, collect_card_changes, plan_card_changes
+
+
+NOW = "2026-10-18T08:00:00+00:00"
+LISTS = {"l1": "Fase Documental", "l2": "Lista Desconhecida"}
+
+USERS = [
+    {"id": "u1", "name": "Ana Consultora", "email": "ana@creditoimo.pt", "role": "consultor"},
+    {"id": "u2", "name": "Rui Mediador", "email": "rui.m@creditoimo.pt", "role": "mediador"},
+]
+
+
+def test_member_matcher_prefers_manual_mapping():
+    matcher = MemberMatcher([{"trello_username": "RuiTrello", "user_id": "u2"}], USERS)
+    result = matcher.match([{"username": "ruitrello", "fullName": "R"}, {"fullName": "Ana Consultora"}])
+    assert result["assigned_mediador_id"] == "u2"
+    assert result["assigned_consultor_id"] == "u1"
+    assert [m["match_method"] for m in result["matched_members"]] == ["manual", "name"]
+
+
+def test_collect_card_changes_keeps_latest_state_per_card():
+    actions = [
+        {"type": "deleteCard", "date": "2026-10-18T10:00:00Z", "data": {"card": {"id": "c1"}}},
+        {"type": "updateCard", "date": "2026-10-18T09:00:00Z", "data": {"card": {"id": "c1"}}},
+        {"type": "createCard", "date": "2026-10-18T09:30:00Z", "data": {"card": {"id": "c2"}}},
+        {"type": "updateCard", "date": "2026-10-18T09:40:00Z", "data": {"list": {"id": "l1"}}},
+    ]
+    changed, deleted = collect_card_changes(actions)
+    assert changed == ["c2"]
+    assert deleted == ["c1"]
+
+
+def test_plan_card_changes_updates_creates_and_skips():
+    matcher = MemberMatcher([], USERS)
+    processes = [{"id": "p1", "client_name": "Maria", "status": "clientes_espera", "trello_card_id": "c1"}]
+    cards = [
+        {"id": "c1", "name": "Maria", "idList": "l1", "members": [{"fullName": "Ana Consultora"}]},
+        {"id": "c2", "name": "João", "idList": "l1", "desc": "Email: joao@x.pt\nTelefone: 912"},
+        {"id": "c3", "name": "Pedro", "idList": "l2"},
+        {"id": "c4", "name": "Arquivado", "idList": "l1", "closed": True},
+    ]
+    inserts, updates, stats = plan_card_changes(cards, LISTS, processes, matcher, NOW)
+
+    assert (stats["created"], stats["updated"], stats["assignments"]) == (1, 1, 1)
+    assert stats["errors"] == ["Lista não mapeada: Lista Desconhecida"]
+
+    [(process_id, update)] = updates
+    assert process_id == "p1"
+    assert update["status"] == "fase_documental"
+    assert update["assigned_consultor_id"] == "u1"
+    [created] = inserts
+    assert created["client_email"] == "joao@x.pt"
+    assert created["trello_card_id"] == "c2"
+
+
+def test_plan_card_changes_is_noop_when_unchanged():
+    matcher = MemberMatcher([], USERS)
+    processes = [{"id": "p1", "client_name": "Maria", "status": "fase_documental", "trello_card_id": "c1"}]
+    inserts, updates, stats = plan_card_changes(
+        [{"id": "c1", "name": "Maria", "idList": "l1"}], LISTS, processes, matcher, NOW
+    )
+    assert inserts == [] and updates == []
+    assert stats["updated"] == 0
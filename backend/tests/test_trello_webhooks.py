@@ -0,0 +1,50 @@
+"""
+Testes da redução de ações de webhook Trello ao estado efectivo do card.
+"""
+from services.trello_webhooks import fold_card_actions, build_card_update
+
+
+def _action(action_id, action_type, date, **data):
+    member = data.pop("member", None)
+    action = {"id": action_id, "type": action_type, "date": date,
+              "data": {"card": {"id": "c1", **data.pop("card", {})}, **data}}
+    if member:
+        action["member"] = member
+    return action
+
+
+def test_fold_applies_actions_in_date_order():
+    actions = [
+        _action("a3", "updateCard", "2026-10-18T10:03:00Z",
+                card={"name": "Maria"}, listAfter={"id": "l2", "name": "Fase de Escritura"}),
+        _action("a1", "createCard", "2026-10-18T10:01:00Z",
+                card={"name": "Mariaa"}, list={"id": "l1", "name": "Clientes em Espera"}),
+        _action("a2", "updateCard", "2026-10-18T10:02:00Z",
+                card={"name": "Maria", "desc": "Email: maria@x.pt"}, old={"desc": ""}),
+        _action("a4", "addMemberToCard", "2026-10-18T10:04:00Z", member={"username": "Ana"}),
+        _action("a5", "removeMemberFromCard", "2026-10-18T10:05:00Z", member={"username": "ana"}),
+    ]
+    state = fold_card_actions(actions)
+
+    assert state["created"] and not state["deleted"]
+    assert state["name"] == "Maria"
+    assert state["list"]["id"] == "l2"
+    assert state["desc"] == "Email: maria@x.pt"
+    assert state["members_added"] == {}
+    assert state["members_removed"] == {"ana"}
+    assert state["last_action_at"] == "2026-10-18T10:05:00Z"
+
+    update = build_card_update(state, {"client_name": "Mariaa", "status": "clientes_espera"})
+    assert update["client_name"] == "Maria"
+    assert update["client_email"] == "maria@x.pt"
+    assert update["status"] == "fase_escritura"
+
+
+def test_stale_actions_do_not_overwrite_newer_state():
+    state = fold_card_actions([
+        _action("a1", "updateCard", "2026-10-18T09:00:00Z",
+                card={"name": "Nome antigo"}, listAfter={"id": "l1", "name": "Clientes em Espera"}),
+    ])
+    process = {"client_name": "Nome novo", "status": "fase_escritura",
+               "trello_last_action_at": "2026-10-18T10:00:00Z"}
+    assert build_card_update(state, process) == {}
@@ -23,15 +23,17 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 try:
     from database import db
     from services.task_queue import task_queue
-    from services.scheduled_tasks import (
-        check_deadlines,
-        check_document_expiries,
-        cleanup_old_logs
-    )
-    from services.trello import trello_service
-    from services.email_service import email_service
+    from services.task_worker import TaskWorkerPool
+    from services.scheduled_tasks import ScheduledTasksService
+    from services.cron_scheduler import cron_scheduler
+    from services.trello_webhooks import trello_webhook_processor
+    from services.s3_manifest import s3_manifest
+    from services.ai_usage_tracker import ai_usage_tracker
+    from middleware.loop_watchdog import loop_watchdog
     from services.scraper import scrape_property_url
-    from services.client_match import match_leads_to_clients
+    from services.client_match import find_matching_clients_for_lead
+    from services.search_index import refresh_search_index
+    from services.process_service import refresh_client_keys
 except ImportError as e:
     logger.error(f"Erro ao importar módulos: {e}")
     sys.exit(1)
@@ -39,141 +41,190 @@ except ImportError as e:
 # Flag para paragem graciosa
 shutdown_event = asyncio.Event()
 
-async def process_task(task: dict):
+# Utilizador técnico usado por tarefas que reutilizam rotas administrativas
+WORKER_USER = {"id": "worker", "name": "Worker", "email": None, "role": "admin"}
+
+
+# ====================================================================
+# HANDLERS DAS TAREFAS (payload recebido como kwargs)
+# ====================================================================
+
+async def handle_scrape_property(url: str = None, lead_id: str = None, **_):
+    """Scraping de um imóvel; actualiza o lead se indicado."""
+    if not url:
+        return None
+    result = await scrape_property_url(url)
+    if lead_id and result:
+        await db.property_leads.update_one(
+            {"id": lead_id},
+            {"$set": {
+                "title": result.get("titulo"),
+                "price": result.get("preco"),
+                "location": result.get("localizacao"),
+                "scraped_data": result,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }}
+        )
+    return result
+
+
+async def handle_match_leads(**_):
+    """Matching de leads alterados nas últimas 24h com clientes."""
+    since = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+    leads = await db.property_leads.find(
+        {"updated_at": {"$gte": since}},
+        {"_id": 0, "id": 1}
+    ).to_list(500)
+    matches = 0
+    for lead in leads:
+        matches += len(await find_matching_clients_for_lead(lead["id"]))
+    return {"leads": len(leads), "matches": matches}
+
+
+async def handle_send_email(to_email: str, subject: str, body: str, html_body: str = None, **_):
+    """Envio de email assíncrono."""
+    from services.email_v2 import send_email_notification
+    sent = await send_email_notification(to_email, subject, body, html_body)
+    if not sent:
+        raise RuntimeError(f"Falha ao enviar email para {to_email}")
+    return sent
+
+
+async def handle_send_registration_email(client_email: str, client_name: str, **_):
+    """Email de confirmação de registo."""
+    from services.email import send_registration_confirmation
+    return await send_registration_confirmation(client_email, client_name)
+
+
+async def handle_sync_trello(process_id: str = None, action: str = "sync", **_):
     """
-    Processa uma tarefa individual da fila.
+    Sincronização com o Trello de um processo: "sync" importa o card e
+    exporta o processo, "update_card" só exporta e "create_card" exporta
+    criando o card se não existir. Sem `process_id`, sincronização completa.
     """
-    task_id = task.get("id")
-    task_type = task.get("type")
-    payload = task.get("payload", {})
-    
-    logger.info(f"Processando tarefa {task_id} ({task_type})")
-    
-    try:
-        start_time = time.time()
-        result = None
-        
-        if task_type == "scrape_property":
-            url = payload.get("url")
-            if url:
-                result = await scrape_property_url(url)
-                # Se for lead, atualizar dados
-                lead_id = payload.get("lead_id")
-                if lead_id and result:
-                    await db.property_leads.update_one(
-                        {"id": lead_id},
-                        {"$set": {
-                            "title": result.get("titulo"),
-                            "price": result.get("preco"),
-                            "location": result.get("localizacao"),
-                            "scraped_data": result,
-                            "updated_at": datetime.now(timezone.utc).isoformat()
-                        }}
-                    )
-        
-        elif task_type == "match_leads":
-            # Executar matching de leads com clientes
-            result = await match_leads_to_clients()
-            
-        elif task_type == "send_email":
-            # Enviar email assíncrono
-            to_email = payload.get("to")
-            subject = payload.get("subject")
-            content = payload.get("content")
-            if to_email and subject and content:
-                result = await email_service.send_email(to_email, subject, content)
-                
-        elif task_type == "sync_trello":
-            # Sincronização periódica com Trello
-            result = await trello_service.sync_board()
-            
-        else:
-            logger.warning(f"Tipo de tarefa desconhecido: {task_type}")
-            result = {"error": "Unknown task type"}
-            
-        # Marcar como concluída
-        duration = time.time() - start_time
-        await task_queue.complete_task(task_id, result=result)
-        logger.info(f"Tarefa {task_id} concluída em {duration:.2f}s")
-        
-    except Exception as e:
-        logger.error(f"Erro ao processar tarefa {task_id}: {e}", exc_info=True)
-        await task_queue.fail_task(task_id, error=str(e))
+    if not process_id:
+        from routes.trello import full_sync
+        result = await full_sync(user=WORKER_USER)
+        return result.message
+
+    from services.trello import trello_service
+    from services.trello_sync import trello_sync_engine
+    from services.trello_push import trello_push_queue
+
+    process = await db.processes.find_one({"id": process_id}, {"_id": 0})
+    if not process:
+        return f"Processo {process_id} não encontrado"
+
+    imported = {"created": 0, "updated": 0}
+    if action == "sync" and process.get("trello_card_id"):
+        cards = await trello_service.get_cards_batch([process["trello_card_id"]])
+        if cards:
+            imported = await trello_sync_engine.apply_cards(cards)
+            process = await db.processes.find_one({"id": process_id}, {"_id": 0})
+
+    pushed = await trello_push_queue.push_processes([process], create_missing=action == "create_card")
+    if pushed["errors"]:
+        raise RuntimeError("; ".join(pushed["errors"]))
+    return (
+        f"Trello→Sistema: {imported['created']}+{imported['updated']} | "
+        f"Sistema→Trello: {pushed['created']}+{pushed['updated']}"
+    )
+
+
+async def handle_process_ai_document(process_id: str, document_data: dict, user_id: str = None, **_):
+    """Análise de documento com IA (conteúdo em base64 ou URL)."""
+    from services.ai_document import analyze_document_from_base64, analyze_document_from_url
+    document_type = document_data.get("document_type", "outro")
+    if document_data.get("content_base64"):
+        return await analyze_document_from_base64(
+            document_data["content_base64"],
+            document_data.get("mime_type", "application/pdf"),
+            document_type
+        )
+    if document_data.get("url"):
+        return await analyze_document_from_url(document_data["url"], document_type)
+    raise ValueError("document_data sem content_base64 nem url")
+
+
+def build_worker_pool() -> TaskWorkerPool:
+    """Registar os handlers de cada tipo de tarefa."""
+    pool = TaskWorkerPool(task_queue)
+    pool.register("scrape_property", handle_scrape_property)
+    pool.register("match_leads", handle_match_leads)
+    pool.register("send_email_task", handle_send_email)
+    pool.register("send_registration_email_task", handle_send_registration_email)
+    pool.register("sync_trello_task", handle_sync_trello)
+    pool.register("process_ai_document_task", handle_process_ai_document)
+    return pool
+
 
 async def worker_loop():
     """
     Loop principal do worker.
-    Verifica e processa tarefas da fila.
+    Consumidores por tipo de tarefa com claim atómico e leases
+    (ver services/task_worker.py).
     """
     logger.info("Worker iniciado. Aguardando tarefas...")
-    
-    while not shutdown_event.is_set():
-        try:
-            # Buscar próxima tarefa pendente
-            task = await task_queue.get_next_task()
-            
-            if task:
-                await process_task(task)
-            else:
-                # Se não há tarefas, esperar um pouco
-                await asyncio.sleep(2)
-                
-        except asyncio.CancelledError:
-            break
-        except Exception as e:
-            logger.error(f"Erro no loop do worker: {e}")
-            await asyncio.sleep(5) # Esperar antes de tentar novamente
+    await task_queue.connect()
+    await build_worker_pool().run(shutdown_event)
+
+
+async def enqueue_lead_matching():
+    """Enfileirar o matching automático de leads."""
+    await task_queue.add_task("match_leads", {})
+
+
+async def refresh_search_data():
+    """Reconciliar índice de pesquisa e chaves de cliente."""
+    await refresh_search_index()
+    await refresh_client_keys()
+
+
+async def run_cleanup(scheduled: ScheduledTasksService):
+    """Limpeza de notificações antigas, cache e ficheiros temporários."""
+    await scheduled.cleanup_old_notifications()
+    await scheduled.cleanup_scraper_cache()
+    await scheduled.cleanup_temp_files()
+    await cleanup_temp_files()
+    await trello_webhook_processor.purge_processed()
+
+
+def register_scheduled_jobs(scheduled: ScheduledTasksService):
+    """
+    Jobs periódicos do worker (cron em UTC).
+    Jobs independentes correm em paralelo; cada ocorrência é executada
+    por uma única réplica (lease em `scheduler_jobs`).
+    """
+    cron_scheduler.register("deadline_reminders", "0 * * * *", scheduled.check_upcoming_deadlines, timeout=300)
+    cron_scheduler.register("document_expiry", "5 * * * *", scheduled.check_expiring_documents, timeout=300)
+    cron_scheduler.register("document_watchdog", "10 * * * *", scheduled.check_document_expirations_watchdog, timeout=600)
+    cron_scheduler.register("task_due_alerts", "0 8 * * *", scheduled.check_tasks_due_soon, timeout=300)
+    cron_scheduler.register("pre_approval_countdown", "0 8 * * *", scheduled.check_pre_approval_countdown, timeout=300)
+    cron_scheduler.register("clients_waiting", "0 9 * * *", scheduled.check_clients_waiting_too_long, timeout=300)
+    cron_scheduler.register("monthly_document_reminder", "0 8 1 * *", scheduled.send_monthly_document_reminder, timeout=1800)
+    cron_scheduler.register("weekly_ai_report", "0 8 * * 1", scheduled.send_weekly_ai_report, timeout=900)
+    cron_scheduler.register("cleanup", "0 3 * * *", lambda: run_cleanup(scheduled), timeout=1800)
+    cron_scheduler.register("lead_matching", "*/30 * * * *", enqueue_lead_matching, timeout=60)
+    cron_scheduler.register("search_index_refresh", "*/5 * * * *", refresh_search_data, timeout=240, jitter=10)
+    cron_scheduler.register("trello_webhook_pending", "* * * * *", trello_webhook_processor.process_pending, timeout=120, jitter=5)
+    cron_scheduler.register("s3_manifest_reconcile", "20 * * * *", s3_manifest.reconcile_stale, timeout=900, jitter=30)
+
 
 async def scheduler_loop():
     """
     Loop para tarefas agendadas (Cron jobs).
+    Estado e leases persistidos em MongoDB (ver services/cron_scheduler.py).
     """
-    logger.info("Agendador iniciado.")
-    
-    # Horários da última execução
-    last_runs = {
-        "deadlines": 0,
-        "expiries": 0,
-        "cleanup": 0,
-        "matching": 0
-    }
-    
-    while not shutdown_event.is_set():
-        try:
-            now = time.time()
-            
-            # Verificar prazos (a cada 1 hora)
-            if now - last_runs["deadlines"] > 3600:
-                logger.info("Executando verificação de prazos...")
-                await check_deadlines()
-                last_runs["deadlines"] = now
-                
-            # Verificar validade de documentos (a cada 24 horas - simplificado para teste 1h)
-            if now - last_runs["expiries"] > 3600:
-                logger.info("Executando verificação de documentos...")
-                await check_document_expiries()
-                last_runs["expiries"] = now
-                
-            # Limpeza de logs e temporários (a cada 24 horas)
-            if now - last_runs["cleanup"] > 86400:
-                logger.info("Executando limpeza...")
-                await cleanup_old_logs()
-                await cleanup_temp_files()
-                last_runs["cleanup"] = now
-
-            # Matching automático de Leads (a cada 30 minutos)
-            if now - last_runs["matching"] > 1800:
-                logger.info("Executando matching automático...")
-                await task_queue.add_task("match_leads", {})
-                last_runs["matching"] = now
-            
-            await asyncio.sleep(60) # Verificar a cada minuto
-            
-        except asyncio.CancelledError:
-            break
-        except Exception as e:
-            logger.error(f"Erro no agendador: {e}")
-            await asyncio.sleep(60)
+    scheduled = ScheduledTasksService()
+    await scheduled.connect()
+    register_scheduled_jobs(scheduled)
+
+    try:
+        await cron_scheduler.run(shutdown_event)
+    except asyncio.CancelledError:
+        await cron_scheduler.stop()
+    finally:
+        await scheduled.disconnect()
 
 async def cleanup_temp_files():
     """Limpa ficheiros temporários antigos."""
@@ -219,6 +270,9 @@ async def main():
     for sig in (signal.SIGINT, signal.SIGTERM):
         loop.add_signal_handler(sig, lambda: asyncio.create_task(shutdown_async()))
 
+    # Bloqueios do loop no worker ficam no log (LOOP_WATCHDOG_LOG_MS)
+    loop_watchdog.start()
+
     # Iniciar tarefas concorrentes
     worker_task = asyncio.create_task(worker_loop())
     scheduler_task = asyncio.create_task(scheduler_loop())
@@ -233,6 +287,10 @@ async def main():
         await asyncio.gather(worker_task, scheduler_task)
     except asyncio.CancelledError:
         pass
+
+    # Gravar uso de IA ainda em fila (ex.: extracções do scraper)
+    await ai_usage_tracker.flush()
+    loop_watchdog.stop()
         
     logger.info("Worker desligado.")
 
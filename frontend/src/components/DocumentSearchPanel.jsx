@@ -61,6 +61,20 @@ const getCategoryColor = (category) => {
   return CATEGORY_COLORS[category] || CATEGORY_COLORS["Outros"];
 };
 
+// Realçar os intervalos [início, fim] devolvidos pela pesquisa
+const renderHighlighted = (text, highlights = []) => {
+  const parts = [];
+  let cursor = 0;
+  highlights.forEach(([start, end], i) => {
+    if (start < cursor) return;
+    parts.push(text.slice(cursor, start));
+    parts.push(<mark key={i} className="bg-yellow-200 text-inherit rounded-sm">{text.slice(start, end)}</mark>);
+    cursor = end;
+  });
+  parts.push(text.slice(cursor));
+  return parts;
+};
+
 const DocumentSearchPanel = ({ processId, clientName }) => {
   const { token } = useAuth();
   const [searchQuery, setSearchQuery] = useState("");
@@ -142,10 +156,10 @@ const DocumentSearchPanel = ({ processId, clientName }) => {
     }
   };
 
-  // Categorizar todos os documentos
+  // Categorizar todos os documentos (job em background com progresso)
   const handleCategorizeAll = async () => {
     setCategorizing(true);
-    setCategorizationProgress(10);
+    setCategorizationProgress(0);
 
     try {
       const response = await fetch(
@@ -156,18 +170,35 @@ const DocumentSearchPanel = ({ processId, clientName }) => {
         }
       );
 
-      setCategorizationProgress(90);
+      if (!response.ok) {
+        const error = await response.json();
+        toast.error(error.detail || "Erro ao categorizar documentos");
+        return;
+      }
+
+      const { job_id: jobId } = await response.json();
+      let job = null;
+      do {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        const jobResponse = await fetch(
+          `${API_URL}/api/documents/categorize-all/jobs/${jobId}`,
+          {
+            headers: { Authorization: `Bearer ${token}` },
+          }
+        );
+        if (!jobResponse.ok) break;
+        job = await jobResponse.json();
+        setCategorizationProgress(job.progress?.percentage || 0);
+      } while (job && ["pending", "processing"].includes(job.status));
 
-      if (response.ok) {
-        const data = await response.json();
+      if (job?.status === "completed") {
         toast.success(
-          `Categorização concluída: ${data.categorized} documentos categorizados`
+          `Categorização concluída: ${job.result?.categorized || 0} documentos categorizados`
         );
         fetchMetadata();
         setShowCategorizeDialog(false);
       } else {
-        const error = await response.json();
-        toast.error(error.detail || "Erro ao categorizar documentos");
+        toast.error(job?.error || "Erro ao categorizar documentos");
       }
     } catch (error) {
       console.error("Erro ao categorizar:", error);
@@ -393,7 +424,7 @@ const DocumentSearchPanel = ({ processId, clientName }) => {
                     </div>
                     {result.matched_text && (
                       <p className="text-xs text-muted-foreground mt-1 line-clamp-2">
-                        {result.matched_text}
+                        {renderHighlighted(result.matched_text, result.highlights)}
                       </p>
                     )}
                     <div className="flex items-center gap-2 mt-1">
@@ -89,7 +89,7 @@ const S3FileManager = ({ processId, clientName }) => {
     
     try {
       const response = await fetch(
-        `${API_URL}/api/documents/client/${processId}/files`,
+        `${API_URL}/api/documents/client/${processId}/files?include_urls=true`,
         {
           headers: { Authorization: `Bearer ${token}` },
         }
@@ -194,8 +194,12 @@ const S3FileManager = ({ processId, clientName }) => {
     }
   };
 
-  // Download de ficheiro
+  // Download de ficheiro (usa o link devolvido com a listagem enquanto for válido)
   const handleDownload = async (file) => {
+    if (file.url && file.url_expires_at * 1000 > Date.now() + 60000) {
+      window.open(file.url, "_blank");
+      return;
+    }
     try {
       const response = await fetch(
         `${API_URL}/api/documents/client/${processId}/download?file_path=${encodeURIComponent(file.path)}`,
@@ -958,6 +958,9 @@ const AIConfigPage = () => {
                                 <p className="font-medium text-sm">{item.task}</p>
                                 <p className="text-xs text-muted-foreground">
                                   {item.total_calls} chamadas • {item.total_tokens.toLocaleString()} tokens
+                                  {item.p95_response_time_ms > 0 && (
+                                    <> • p50 {Math.round(item.p50_response_time_ms)} ms / p95 {Math.round(item.p95_response_time_ms)} ms</>
+                                  )}
                                 </p>
                               </div>
                               <Badge variant="outline">€{item.total_cost_eur.toFixed(4)}</Badge>
@@ -574,7 +574,12 @@ const SystemLogsTab = ({ token }) => {
                         {log.component || "geral"}
                       </span>
                     </TableCell>
-                    <TableCell className="max-w-md truncate" onClick={() => openDetails(log)}>{log.message}</TableCell>
+                    <TableCell className="max-w-md truncate" onClick={() => openDetails(log)}>
+                      {log.count > 1 && (
+                        <Badge variant="secondary" className="mr-2">×{log.count}</Badge>
+                      )}
+                      {log.message}
+                    </TableCell>
                     <TableCell className="text-sm text-muted-foreground" onClick={() => openDetails(log)}>
                       {formatDate(log.timestamp)}
                     </TableCell>
@@ -649,6 +654,14 @@ const SystemLogsTab = ({ token }) => {
                   <Label className="text-xs text-muted-foreground">Data</Label>
                   <p className="text-sm">{formatDate(selectedLog.timestamp)}</p>
                 </div>
+                {selectedLog.count > 1 && (
+                  <div>
+                    <Label className="text-xs text-muted-foreground">Ocorrências</Label>
+                    <p className="text-sm">
+                      {selectedLog.count} (desde {formatDate(selectedLog.first_seen)})
+                    </p>
+                  </div>
+                )}
               </div>
 
               {selectedLog.details && Object.keys(selectedLog.details).length > 0 && (